@@ -14,6 +14,12 @@ class Settings(BaseSettings):
     telegram_bot_token: str = Field(..., env="TELEGRAM_BOT_TOKEN")
     telegram_webhook_url: str = Field(default="", env="TELEGRAM_WEBHOOK_URL")
     
+    # Webhook (включается, если задан TELEGRAM_WEBHOOK_URL; иначе long polling)
+    telegram_webhook_secret: str = Field(default="", env="TELEGRAM_WEBHOOK_SECRET")
+    webhook_listen: str = Field(default="0.0.0.0", env="WEBHOOK_LISTEN")
+    webhook_port: int = Field(default=8443, env="WEBHOOK_PORT")
+    webhook_max_connections: int = Field(default=40, env="WEBHOOK_MAX_CONNECTIONS")
+    
     # Database
     database_url: str = Field(default="sqlite:///./taxi_zhukovo.db", env="DATABASE_URL")
     
@@ -36,6 +42,52 @@ class Settings(BaseSettings):
     
     # Fixed pricing
     pricing_config_path: str = Field(default="bot/config/pricing.json", env="PRICING_CONFIG_PATH")
+    # Как часто проверять mtime файла тарифов для горячей перезагрузки (0 — при каждом обращении)
+    pricing_reload_interval: float = Field(default=5.0, env="PRICING_RELOAD_INTERVAL")
+    
+    # Queue backend: memory (один процесс) | db (общая очередь для нескольких воркеров)
+    queue_backend: str = Field(default="memory", env="QUEUE_BACKEND")
+    
+    # Queue journal (тёплый рестарт очередей; пустая строка — отключить)
+    queue_journal_path: str = Field(default="./queue_journal.jsonl", env="QUEUE_JOURNAL_PATH")
+    queue_journal_compact_every: int = Field(default=1000, env="QUEUE_JOURNAL_COMPACT_EVERY")
+    
+    # Cascade dispatch: заказ предлагается сразу нескольким первым водителям очереди,
+    # число параллельных предложений растёт на step каждые widen_seconds до max
+    dispatch_cascade_enabled: bool = Field(default=False, env="DISPATCH_CASCADE_ENABLED")
+    dispatch_cascade_initial: int = Field(default=2, env="DISPATCH_CASCADE_INITIAL")
+    dispatch_cascade_step: int = Field(default=1, env="DISPATCH_CASCADE_STEP")
+    dispatch_cascade_max: int = Field(default=5, env="DISPATCH_CASCADE_MAX")
+    dispatch_cascade_widen_seconds: int = Field(default=20, env="DISPATCH_CASCADE_WIDEN_SECONDS")
+    
+    # Таймеры планировщика: изменения копятся столько секунд и пишутся в БД одной транзакцией
+    timer_store_flush_seconds: float = Field(default=0.2, env="TIMER_STORE_FLUSH_SECONDS")
+    
+    # Outbox: лимиты исходящих сообщений (глобально и на один чат)
+    outbox_global_rate: float = Field(default=25.0, env="OUTBOX_GLOBAL_RATE")
+    outbox_chat_rate: float = Field(default=1.0, env="OUTBOX_CHAT_RATE")
+    outbox_chat_burst: float = Field(default=3.0, env="OUTBOX_CHAT_BURST")
+    outbox_max_in_flight: int = Field(default=16, env="OUTBOX_MAX_IN_FLIGHT")
+    # Слоты отправки, которые статусы и меню не занимают: они всегда свободны для предложений заказов
+    outbox_offer_reserved_in_flight: int = Field(default=4, env="OUTBOX_OFFER_RESERVED_IN_FLIGHT")
+    # Сколько отправок одной рассылки (broadcast, межгород) выполняется одновременно
+    fan_out_concurrency: int = Field(default=20, env="FAN_OUT_CONCURRENCY")
+    
+    # Кеш пользователей (роль, бан, телефон) по telegram_id
+    user_cache_max_size: int = Field(default=10000, env="USER_CACHE_MAX_SIZE")
+    user_cache_ttl_seconds: float = Field(default=300.0, env="USER_CACHE_TTL_SECONDS")
+    
+    # Сессия БД на обновление: порог, после которого обновление пишется в лог как тяжёлое
+    db_update_warn_queries: int = Field(default=30, env="DB_UPDATE_WARN_QUERIES")
+    db_update_warn_ms: float = Field(default=500.0, env="DB_UPDATE_WARN_MS")
+    
+    # Архив заказов: завершённые и отменённые старше N дней переносятся в orders_archive
+    # (0 — не архивировать); перенос идёт пачками по batch_size заказов в транзакции
+    order_archive_after_days: int = Field(default=30, env="ORDER_ARCHIVE_AFTER_DAYS")
+    order_archive_batch_size: int = Field(default=500, env="ORDER_ARCHIVE_BATCH_SIZE")
+    
+    # Свёрнутая статистика: сдвиг местного времени от UTC для границ часов и суток (Уфа — UTC+5)
+    stats_utc_offset_hours: int = Field(default=5, env="STATS_UTC_OFFSET_HOURS")
     
     class Config:
         env_file = ".env"
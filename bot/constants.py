@@ -27,6 +27,18 @@ PUBLIC_ZONE_LABELS = {
 # Обратный маппинг (от публичного названия к ключу)
 ZONE_KEY_MAP = {v: k for k, v in PUBLIC_ZONE_LABELS.items()}
 
+# Районы подачи, заказы из которых идут broadcast-рассылкой (названия из pricing.json);
+# сюда же относится всё, что начинается с "Аэропорт"
+BROADCAST_ZONES = [
+    "Уфа-Центр", "Телецентр", "Сипайлово", "Черниковка", "Чесноковка",
+    "Инорс", "Зелёная роща",  # Уфа
+    "Ж/Д вокзал",  # ЖД
+    "Аэропорт",  # Аэропорт с терминалами
+    "Дмитриевка", "Михайловка", "Миловский Парк", "Миловка",
+    "Николаевка", "Юматово", "Алкино", "Кафе Отдых",
+    "Иглино", "Шакша", "Акбердино", "Нагаево", "Чишмы"  # Прочие направления
+]
+
 # Таймауты системы очередей
 DRIVER_RESPONSE_TIMEOUT = 30  # секунд на ответ водителя
 ORDER_GLOBAL_TIMEOUT = 180     # секунд до fallback (3 минуты)
@@ -4,11 +4,12 @@
 import logging
 from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes
-from database.db import SessionLocal
 from bot.services import UserService
 from bot.services.queue_manager import queue_manager
+from bot.services.outbox import outbox
 from bot.models import User, Driver, Order, OrderStatus, UserRole, DriverStatus, DriverZone
-from sqlalchemy import func
+from bot.services.stats_service import StatsService, ZONE_LABELS, day_bucket
+from sqlalchemy import case, func
 
 logger = logging.getLogger(__name__)
 
@@ -18,43 +19,58 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     if not UserService.is_admin(user.id):
-        await update.message.reply_text("У вас нет прав администратора")
+        await outbox.reply_text(update.message, "У вас нет прав администратора")
         return
     
-    db = SessionLocal()
-    try:
-        # Подсчет статистики
-        total_users = db.query(User).count()
-        total_customers = db.query(User).filter(User.role == UserRole.CUSTOMER).count()
-        total_drivers = db.query(Driver).count()
-        verified_drivers = db.query(Driver).filter(Driver.is_verified == True).count()
-        online_drivers = db.query(Driver).filter(Driver.is_online == True).count()
-        
-        total_orders = db.query(Order).count()
-        pending_orders = db.query(Order).filter(Order.status == OrderStatus.PENDING).count()
-        completed_orders = db.query(Order).filter(Order.status == OrderStatus.COMPLETED).count()
-        
-        # Средняя стоимость заказа
-        avg_price = db.query(func.avg(Order.price)).filter(Order.status == OrderStatus.COMPLETED).scalar() or 0
-        
-        stats_text = (
-            "📊 <b>Статистика системы</b>\n\n"
-            "<b>Пользователи:</b>\n"
-            f"👥 Всего: {total_users}\n"
-            f"🙋 Клиенты: {total_customers}\n"
-            f"🚗 Водители: {total_drivers}\n"
-            f"✅ Верифицированные водители: {verified_drivers}\n"
-            f"🟢 Онлайн водители: {online_drivers}\n\n"
-            "<b>Заказы:</b>\n"
-            f"📋 Всего: {total_orders}\n"
-            f"⏳ Ожидают: {pending_orders}\n"
-            f"✅ Завершено: {completed_orders}\n"
-            f"💰 Средний чек: {avg_price:.2f} руб."
-        )
-        
-        await update.message.reply_text(stats_text, parse_mode='HTML')
-    finally:
-        db.close()
+    db = context.db
+    # Пользователи и водители — по одному запросу на таблицу
+    total_users, total_customers = db.query(
+        func.count(User.id),
+        func.coalesce(func.sum(case((User.role == UserRole.CUSTOMER, 1), else_=0)), 0),
+    ).one()
+    total_drivers, verified_drivers, online_drivers = db.query(
+        func.count(Driver.id),
+        func.coalesce(func.sum(case((Driver.is_verified == True, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((Driver.is_online == True, 1), else_=0)), 0),
+    ).one()
+    
+    pending_orders = db.query(Order).filter(Order.status == OrderStatus.PENDING).count()
+    
+    # Заказы — из свёрнутой статистики (включая архив), без обхода истории
+    all_time = StatsService.get_all_time(db)
+    today = StatsService.get_today(db)
+    this_hour = StatsService.get_this_hour(db)
+    zones_today = StatsService.get_zones(db, "day", day_bucket())
+    
+    stats_text = (
+        "📊 <b>Статистика системы</b>\n\n"
+        "<b>Пользователи:</b>\n"
+        f"👥 Всего: {total_users}\n"
+        f"🙋 Клиенты: {total_customers}\n"
+        f"🚗 Водители: {total_drivers}\n"
+        f"✅ Верифицированные водители: {verified_drivers}\n"
+        f"🟢 Онлайн водители: {online_drivers}\n\n"
+        "<b>Заказы:</b>\n"
+        f"📋 Всего: {all_time.orders}\n"
+        f"⏳ Ожидают: {pending_orders}\n"
+        f"✅ Завершено: {all_time.completed}\n"
+        f"❌ Отменено: {all_time.cancelled}, ⏱ истекло: {all_time.expired}\n"
+        f"💰 Средний чек: {all_time.avg_check:.2f} руб.\n\n"
+        "<b>Сегодня:</b>\n"
+        f"📋 Заказов: {today.orders}, ✅ завершено: {today.completed}, ❌ отменено: {today.cancelled}\n"
+        f"💰 Выручка: {today.revenue:.0f} руб., средний чек: {today.avg_check:.0f} руб.\n"
+        f"⏱ За текущий час: {this_hour.orders} заказов, {this_hour.completed} завершено"
+    )
+    
+    if zones_today:
+        stats_text += "\n\n<b>Сегодня по зонам:</b>\n"
+        for row in zones_today:
+            stats_text += (
+                f"📍 {ZONE_LABELS.get(row.key, row.key)}: {row.orders} заказов, ✅ {row.completed}, ❌ {row.cancelled}, "
+                f"💰 {row.revenue:.0f} руб.\n"
+            )
+    
+    await outbox.reply_text(update.message, stats_text, parse_mode='HTML')
 
 
 async def admin_verify_driver(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -62,11 +78,12 @@ async def admin_verify_driver(update: Update, context: ContextTypes.DEFAULT_TYPE
     user = update.effective_user
     
     if not UserService.is_admin(user.id):
-        await update.message.reply_text("У вас нет прав администратора")
+        await outbox.reply_text(update.message, "У вас нет прав администратора")
         return
     
     if not context.args or len(context.args) < 1:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "Использование: /verify_driver <telegram_id>\n"
             "Пример: /verify_driver 123456789"
         )
@@ -75,37 +92,36 @@ async def admin_verify_driver(update: Update, context: ContextTypes.DEFAULT_TYPE
     try:
         driver_telegram_id = int(context.args[0])
     except ValueError:
-        await update.message.reply_text("Неверный формат Telegram ID")
+        await outbox.reply_text(update.message, "Неверный формат Telegram ID")
         return
     
-    db = SessionLocal()
-    try:
-        driver_user = db.query(User).filter(User.telegram_id == driver_telegram_id).first()
-        
-        if not driver_user:
-            await update.message.reply_text("Пользователь не найден")
-            return
-        
-        driver = db.query(Driver).filter(Driver.user_id == driver_user.id).first()
-        
-        if not driver:
-            await update.message.reply_text("Этот пользователь не зарегистрирован как водитель")
-            return
-        
-        driver.is_verified = True
-        db.commit()
-        
-        await update.message.reply_text(
-            f"✅ Водитель {driver_user.full_name} верифицирован"
-        )
-        
-        # Уведомляем водителя
-        await context.bot.send_message(
-            chat_id=driver_telegram_id,
-            text="✅ Ваш профиль водителя верифицирован! Теперь вы можете принимать заказы."
-        )
-    finally:
-        db.close()
+    db = context.db
+    driver_user = db.query(User).filter(User.telegram_id == driver_telegram_id).first()
+    
+    if not driver_user:
+        await outbox.reply_text(update.message, "Пользователь не найден")
+        return
+    
+    driver = db.query(Driver).filter(Driver.user_id == driver_user.id).first()
+    
+    if not driver:
+        await outbox.reply_text(update.message, "Этот пользователь не зарегистрирован как водитель")
+        return
+    
+    driver.is_verified = True
+    db.commit()
+    
+    await outbox.reply_text(
+        update.message,
+        f"✅ Водитель {driver_user.full_name} верифицирован"
+    )
+    
+    # Уведомляем водителя
+    await outbox.send_message(
+        context.bot,
+        chat_id=driver_telegram_id,
+        text="✅ Ваш профиль водителя верифицирован! Теперь вы можете принимать заказы."
+    )
 
 
 async def admin_list_drivers(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -113,33 +129,30 @@ async def admin_list_drivers(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user = update.effective_user
     
     if not UserService.is_admin(user.id):
-        await update.message.reply_text("У вас нет прав администратора")
+        await outbox.reply_text(update.message, "У вас нет прав администратора")
         return
     
-    db = SessionLocal()
-    try:
-        drivers = db.query(Driver).all()
-        
-        if not drivers:
-            await update.message.reply_text("Нет зарегистрированных водителей")
-            return
-        
-        drivers_text = "🚗 <b>Список водителей</b>\n\n"
-        
-        for driver in drivers:
-            status = "🟢" if driver.is_online else "🔴"
-            verified = "✅" if driver.is_verified else "⏳"
-            
-            drivers_text += (
-                f"{status} {verified} <b>{driver.user.full_name}</b>\n"
-                f"ID: {driver.user.telegram_id}\n"
-                f"Авто: {driver.car_model} ({driver.car_number})\n"
-                f"Рейтинг: {driver.rating:.1f} ({driver.total_rides} поездок)\n\n"
-            )
-        
-        await update.message.reply_text(drivers_text, parse_mode='HTML')
-    finally:
-        db.close()
+    db = context.db
+    drivers = db.query(Driver).all()
+    
+    if not drivers:
+        await outbox.reply_text(update.message, "Нет зарегистрированных водителей")
+        return
+    
+    drivers_text = "🚗 <b>Список водителей</b>\n\n"
+    
+    for driver in drivers:
+        status = "🟢" if driver.is_online else "🔴"
+        verified = "✅" if driver.is_verified else "⏳"
+        
+        drivers_text += (
+            f"{status} {verified} <b>{driver.user.full_name}</b>\n"
+            f"ID: {driver.user.telegram_id}\n"
+            f"Авто: {driver.car_model} ({driver.car_number})\n"
+            f"Рейтинг: {driver.rating:.1f} ({driver.total_rides} поездок)\n\n"
+        )
+    
+    await outbox.reply_text(update.message, drivers_text, parse_mode='HTML')
 
 
 async def admin_pending_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -147,25 +160,22 @@ async def admin_pending_orders(update: Update, context: ContextTypes.DEFAULT_TYP
     user = update.effective_user
     
     if not UserService.is_admin(user.id):
-        await update.message.reply_text("У вас нет прав администратора")
+        await outbox.reply_text(update.message, "У вас нет прав администратора")
         return
     
-    db = SessionLocal()
-    try:
-        orders = db.query(Order).filter(Order.status == OrderStatus.PENDING).all()
-        
-        if not orders:
-            await update.message.reply_text("Нет ожидающих заказов")
-            return
-        
-        orders_text = "⏳ <b>Ожидающие заказы</b>\n\n"
-        
-        for order in orders:
-            orders_text += f"{order.display_info}\n\n"
-        
-        await update.message.reply_text(orders_text, parse_mode='HTML')
-    finally:
-        db.close()
+    db = context.db
+    orders = db.query(Order).filter(Order.status == OrderStatus.PENDING).all()
+    
+    if not orders:
+        await outbox.reply_text(update.message, "Нет ожидающих заказов")
+        return
+    
+    orders_text = "⏳ <b>Ожидающие заказы</b>\n\n"
+    
+    for order in orders:
+        orders_text += f"{order.display_info}\n\n"
+    
+    await outbox.reply_text(update.message, orders_text, parse_mode='HTML')
 
 
 async def admin_check_dema_drivers(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -177,10 +187,10 @@ async def admin_check_dema_drivers(update: Update, context: ContextTypes.DEFAULT
     user = update.effective_user
     
     if not UserService.is_admin(user.id):
-        await update.message.reply_text("У вас нет прав администратора")
+        await outbox.reply_text(update.message, "У вас нет прав администратора")
         return
     
-    db = SessionLocal()
+    db = context.db
     try:
         # Находим всех водителей в зоне DEMA
         dema_drivers = db.query(Driver).filter(
@@ -188,7 +198,7 @@ async def admin_check_dema_drivers(update: Update, context: ContextTypes.DEFAULT
         ).all()
         
         if not dema_drivers:
-            await update.message.reply_text("✅ В зоне DEMA нет водителей")
+            await outbox.reply_text(update.message, "✅ В зоне DEMA нет водителей")
             return
         
         from bot.constants import PUBLIC_ZONE_LABELS
@@ -222,22 +232,20 @@ async def admin_check_dema_drivers(update: Update, context: ContextTypes.DEFAULT
             current_part = ""
             for part in parts:
                 if len(current_part + part) > 3500:
-                    await update.message.reply_text(current_part, parse_mode='HTML')
+                    await outbox.reply_text(update.message, current_part, parse_mode='HTML')
                     current_part = part + "\n\n"
                 else:
                     current_part += part + "\n\n"
             if current_part:
-                await update.message.reply_text(current_part, parse_mode='HTML')
+                await outbox.reply_text(update.message, current_part, parse_mode='HTML')
         else:
-            await update.message.reply_text(message, parse_mode='HTML')
+            await outbox.reply_text(update.message, message, parse_mode='HTML')
         
         logger.info(f"Администратор {user.id} проверил водителей в зоне DEMA ({len(dema_drivers)} водителей)")
         
     except Exception as e:
         logger.error(f"Ошибка при проверке водителей в зоне DEMA: {e}", exc_info=True)
-        await update.message.reply_text(f"❌ Произошла ошибка:\n{str(e)}")
-    finally:
-        db.close()
+        await outbox.reply_text(update.message, f"❌ Произошла ошибка:\n{str(e)}")
 
 
 async def admin_reset_drivers(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -255,16 +263,16 @@ async def admin_reset_drivers(update: Update, context: ContextTypes.DEFAULT_TYPE
     user = update.effective_user
     
     if not UserService.is_admin(user.id):
-        await update.message.reply_text("У вас нет прав администратора")
+        await outbox.reply_text(update.message, "У вас нет прав администратора")
         return
     
-    db = SessionLocal()
+    db = context.db
     try:
         # Получаем всех водителей
         drivers = db.query(Driver).all()
         
         if not drivers:
-            await update.message.reply_text("❌ Нет водителей в системе")
+            await outbox.reply_text(update.message, "❌ Нет водителей в системе")
             return
         
         reset_count = 0
@@ -293,14 +301,13 @@ async def admin_reset_drivers(update: Update, context: ContextTypes.DEFAULT_TYPE
         # Сохраняем изменения в БД
         db.commit()
         
-        # Очищаем все очереди в менеджере (используем ZONES вместо keys())
-        from bot.constants import ZONES
-        queue_manager._queues = {zone: [] for zone in ZONES}
-        queue_manager._driver_zones = {}
+        # Очищаем все очереди в менеджере
+        queue_manager.clear()
         
-        logger.info(f"Все очереди очищены. Осталось водителей в очередях: {sum(len(q) for q in queue_manager._queues.values())}")
+        logger.info(f"Все очереди очищены. Осталось водителей в очередях: {sum(info['count'] for info in queue_manager.get_all_queues_info().values())}")
         
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             f"✅ <b>Сброс состояния водителей выполнен</b>\n\n"
             f"Обработано водителей: {reset_count}\n\n"
             f"Все водители переведены в статус OFFLINE.\n"
@@ -314,11 +321,10 @@ async def admin_reset_drivers(update: Update, context: ContextTypes.DEFAULT_TYPE
     except Exception as e:
         logger.error(f"Ошибка при сбросе состояния водителей: {e}", exc_info=True)
         db.rollback()
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             f"❌ Произошла ошибка при сбросе состояния водителей:\n{str(e)}"
         )
-    finally:
-        db.close()
 
 
 async def admin_queue_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -332,10 +338,10 @@ async def admin_queue_status(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user = update.effective_user
     
     if not UserService.is_admin(user.id):
-        await update.message.reply_text("У вас нет прав администратора")
+        await outbox.reply_text(update.message, "У вас нет прав администратора")
         return
     
-    db = SessionLocal()
+    db = context.db
     try:
         from bot.constants import ZONES, PUBLIC_ZONE_LABELS
         
@@ -424,6 +430,40 @@ async def admin_queue_status(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if zones_with_drivers == 0:
             message_parts.append("\n⚠️ Во всех зонах нет водителей в очереди")
         
+        # Таймеры и соединения БД (утечки сессий видны по in_use)
+        from bot.services.scheduler import scheduler
+        from bot.services.user_cache import user_cache
+        from database.db import get_pool_stats
+        timer_stats = scheduler.get_stats()
+        pool_stats = get_pool_stats()
+        message_parts.append(
+            f"⏱ Активных таймеров: водителей {timer_stats['active_driver_timeouts']}, "
+            f"заказов {timer_stats['active_order_timeouts']}"
+        )
+        message_parts.append(
+            f"🔌 Соединений БД на руках: {pool_stats['in_use']} "
+            f"(выдано {pool_stats['checkouts']}, возвращено {pool_stats['checkins']})"
+        )
+        from bot.middlewares.db_session import get_update_db_stats
+        update_db = get_update_db_stats()
+        message_parts.append(
+            f"🗄 Запросов БД на обновление: в среднем {update_db['avg_queries']} "
+            f"({update_db['avg_db_ms']} мс), максимум {update_db['max_queries']}, "
+            f"тяжёлых обновлений {update_db['slow']}"
+        )
+        cache_stats = user_cache.get_stats()
+        message_parts.append(
+            f"👤 Кеш пользователей: {cache_stats['size']} записей, "
+            f"попаданий {cache_stats['hit_rate']:.0%}"
+        )
+        outbox_stats = outbox.get_stats()
+        depth = outbox_stats['depth']
+        message_parts.append(
+            f"📤 Очередь сообщений: предложения {depth['offer']}, статусы {depth['status']}, "
+            f"рассылки {depth['bulk']} (в отправке {outbox_stats['in_flight']}, "
+            f"RetryAfter {outbox_stats['retries']}, ошибок {outbox_stats['failed']})"
+        )
+        
         full_message = "\n".join(message_parts)
         
         # Разбиваем на части, если сообщение слишком длинное
@@ -472,7 +512,8 @@ async def admin_queue_status(update: Update, context: ContextTypes.DEFAULT_TYPE)
             # Отправляем по частям
             for i, part in enumerate(parts, 1):
                 if i < len(parts):
-                    await update.message.reply_text(
+                    await outbox.reply_text(
+                        update.message,
                         part,
                         parse_mode='HTML'
                     )
@@ -480,22 +521,22 @@ async def admin_queue_status(update: Update, context: ContextTypes.DEFAULT_TYPE)
                     # В последней части добавляем итоги
                     part += "\n" + "=" * 50
                     part += f"\n📈 <b>ИТОГО:</b> 🟢 Онлайн: {total_online} | Зон: {zones_with_drivers}/{len(ZONES)}"
-                    await update.message.reply_text(
+                    await outbox.reply_text(
+                        update.message,
                         part,
                         parse_mode='HTML'
                     )
         else:
-            await update.message.reply_text(full_message, parse_mode='HTML')
+            await outbox.reply_text(update.message, full_message, parse_mode='HTML')
         
         logger.info(f"Администратор {user.id} запросил статус очередей (онлайн: {total_online}, зон: {zones_with_drivers})")
         
     except Exception as e:
         logger.error(f"Ошибка при получении статуса очередей: {e}", exc_info=True)
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             f"❌ Произошла ошибка при получении статуса очередей:\n{str(e)}"
         )
-    finally:
-        db.close()
 
 
 def register_admin_handlers(application: Application):
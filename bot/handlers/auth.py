@@ -12,8 +12,8 @@ from telegram.ext import (  # pyright: ignore[reportMissingImports]
     filters,
 )
 
-from database.db import SessionLocal
 from bot.services import UserService
+from bot.services.outbox import outbox, PRIORITY_BULK
 from bot.utils import Keyboards, Validators
 
 logger = logging.getLogger(__name__)
@@ -43,11 +43,13 @@ async def _prompt_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     if message:
-        await message.reply_text(text, reply_markup=Keyboards.request_phone())
+        await outbox.reply_text(message, text, reply_markup=Keyboards.request_phone())
     else:
         chat_id = update.effective_user.id if update.effective_user else None
         if chat_id:
-            await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=Keyboards.request_phone())
+            await outbox.send_message(
+                context.bot, chat_id, text, priority=PRIORITY_BULK, reply_markup=Keyboards.request_phone()
+            )
 
 
 async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -56,33 +58,32 @@ async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not contact:
         return
 
-    db = SessionLocal()
-    try:
-        db_user = UserService.get_user_by_telegram_id(db, update.effective_user.id)
-        if not db_user:
-            return
+    db = context.db
+    db_user = UserService.get_user_by_telegram_id(db, update.effective_user.id)
+    if not db_user:
+        return
 
-        if db_user.phone_number:
-            await update.message.reply_text("✅ Телефон уже подтверждён.")
-            return
+    if db_user.phone_number:
+        await outbox.reply_text(update.message, "✅ Телефон уже подтверждён.")
+        return
 
-        normalized = Validators.normalize_phone(contact.phone_number)
-        UserService.update_phone(db, db_user, normalized)
-        logger.info("user_registered phone=%s telegram_id=%s", normalized, db_user.telegram_id)
+    normalized = Validators.normalize_phone(contact.phone_number)
+    UserService.update_phone(db, db_user, normalized)
+    logger.info("user_registered phone=%s telegram_id=%s", normalized, db_user.telegram_id)
 
-        context.user_data.pop(MANUAL_PHONE_FLAG, None)
-        await update.message.reply_text(
-            "✅ Номер телефона подтверждён.\n\nДобро пожаловать!",
-            reply_markup=Keyboards.main_menu(),
-        )
-    finally:
-        db.close()
+    context.user_data.pop(MANUAL_PHONE_FLAG, None)
+    await outbox.reply_text(
+        update.message,
+        "✅ Номер телефона подтверждён.\n\nДобро пожаловать!",
+        reply_markup=Keyboards.main_menu(),
+    )
 
 
 async def request_manual_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Запросить ручной ввод телефона"""
     context.user_data[MANUAL_PHONE_FLAG] = True
-    await update.message.reply_text(
+    await outbox.reply_text(
+        update.message,
         "✍️ Введите номер телефона в формате +7XXXXXXXXXX или 8XXXXXXXXXX.",
         reply_markup=Keyboards.manual_input_with_cancel("❌ Отмена"),
     )
@@ -97,14 +98,16 @@ async def handle_manual_phone(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     if text == "❌ Отмена":
         context.user_data.pop(MANUAL_PHONE_FLAG, None)
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "Отменено. Нажмите «Поделиться номером» или введите номер снова.",
             reply_markup=Keyboards.request_phone(),
         )
         return
 
     if not Validators.is_valid_phone(text):
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "⚠️ Некорректный номер. Введите формат +7XXXXXXXXXX.",
             reply_markup=Keyboards.manual_input_with_cancel("❌ Отмена"),
         )
@@ -112,24 +115,22 @@ async def handle_manual_phone(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     normalized = Validators.normalize_phone(text)
 
-    db = SessionLocal()
-    try:
-        db_user = UserService.get_user_by_telegram_id(db, update.effective_user.id)
-        if not db_user:
-            return
+    db = context.db
+    db_user = UserService.get_user_by_telegram_id(db, update.effective_user.id)
+    if not db_user:
+        return
 
-        if db_user.phone_number:
-            context.user_data.pop(MANUAL_PHONE_FLAG, None)
-            await update.message.reply_text("✅ Телефон уже подтверждён.", reply_markup=Keyboards.main_menu())
-            return
+    if db_user.phone_number:
+        context.user_data.pop(MANUAL_PHONE_FLAG, None)
+        await outbox.reply_text(update.message, "✅ Телефон уже подтверждён.", reply_markup=Keyboards.main_menu())
+        return
 
-        UserService.update_phone(db, db_user, normalized)
-        logger.info("user_registered phone=%s telegram_id=%s", normalized, db_user.telegram_id)
-    finally:
-        db.close()
+    UserService.update_phone(db, db_user, normalized)
+    logger.info("user_registered phone=%s telegram_id=%s", normalized, db_user.telegram_id)
 
     context.user_data.pop(MANUAL_PHONE_FLAG, None)
-    await update.message.reply_text(
+    await outbox.reply_text(
+        update.message,
         "✅ Номер телефона подтверждён.\n\nВыберите действие в меню:",
         reply_markup=Keyboards.main_menu(),
     )
@@ -3,10 +3,10 @@
 """
 from telegram import Update
 from telegram.ext import ContextTypes, CallbackQueryHandler
-from database.db import SessionLocal
 from bot.models.driver import Driver
 from bot.models.user import User
 from bot.services.broadcast_service import BroadcastService
+from bot.services.outbox import outbox
 
 
 async def broadcast_accept_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -19,40 +19,37 @@ async def broadcast_accept_callback(update: Update, context: ContextTypes.DEFAUL
         _, order_id_str = query.data.split(":")
         order_id = int(order_id_str)
     except (ValueError, IndexError):
-        await query.edit_message_text("❌ Ошибка: неверный формат данных")
+        await outbox.edit_query_text(query, "❌ Ошибка: неверный формат данных")
         return
     
-    db = SessionLocal()
-    try:
-        # Находим водителя
-        user = db.query(User).filter(User.telegram_id == query.from_user.id).first()
-        if not user:
-            await query.edit_message_text("❌ Вы не зарегистрированы в системе")
-            return
-        
-        driver = db.query(Driver).filter(Driver.user_id == user.id).first()
-        if not driver:
-            await query.edit_message_text("❌ Вы не зарегистрированы как водитель")
-            return
-        
-        # Принимаем заказ
-        success, message = await BroadcastService.accept_broadcast_order(
-            db, order_id, driver, context.bot, context
-        )
+    db = context.db
+    # Находим водителя
+    user = db.query(User).filter(User.telegram_id == query.from_user.id).first()
+    if not user:
+        await outbox.edit_query_text(query, "❌ Вы не зарегистрированы в системе")
+        return
+    
+    driver = db.query(Driver).filter(Driver.user_id == user.id).first()
+    if not driver:
+        await outbox.edit_query_text(query, "❌ Вы не зарегистрированы как водитель")
+        return
+    
+    # Принимаем заказ
+    success, message = await BroadcastService.accept_broadcast_order(
+        db, order_id, driver, context.bot, context
+    )
+    
+    if success:
+        # Редактируем старое сообщение (убираем кнопку принятия)
+        try:
+            await outbox.edit_query_text(query, f"✅ {message}")
+        except Exception as e:
+            pass  # Если не удалось отредактировать, не критично
         
-        if success:
-            # Редактируем старое сообщение (убираем кнопку принятия)
-            try:
-                await query.edit_message_text(f"✅ {message}")
-            except Exception as e:
-                pass  # Если не удалось отредактировать, не критично
-            
-            # Новое сообщение с кнопками уже отправлено в BroadcastService.accept_broadcast_order
-        else:
-            await query.edit_message_text(f"⚠️ {message}")
-    
-    finally:
-        db.close()
+        # Новое сообщение с кнопками уже отправлено в BroadcastService.accept_broadcast_order
+    else:
+        await outbox.edit_query_text(query, f"⚠️ {message}")
+
 
 
 async def broadcast_reserve_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -65,34 +62,31 @@ async def broadcast_reserve_callback(update: Update, context: ContextTypes.DEFAU
         _, order_id_str = query.data.split(":")
         order_id = int(order_id_str)
     except (ValueError, IndexError):
-        await query.edit_message_text("❌ Ошибка: неверный формат данных")
+        await outbox.edit_query_text(query, "❌ Ошибка: неверный формат данных")
         return
     
-    db = SessionLocal()
-    try:
-        # Находим водителя
-        user = db.query(User).filter(User.telegram_id == query.from_user.id).first()
-        if not user:
-            await query.edit_message_text("❌ Вы не зарегистрированы в системе")
-            return
-        
-        driver = db.query(Driver).filter(Driver.user_id == user.id).first()
-        if not driver:
-            await query.edit_message_text("❌ Вы не зарегистрированы как водитель")
-            return
-        
-        # Резервируем заказ
-        success, message = await BroadcastService.reserve_broadcast_order(
-            db, order_id, driver, context.bot, context
-        )
-        
-        if success:
-            await query.edit_message_text(f"📌 {message}")
-        else:
-            await query.edit_message_text(f"⚠️ {message}")
+    db = context.db
+    # Находим водителя
+    user = db.query(User).filter(User.telegram_id == query.from_user.id).first()
+    if not user:
+        await outbox.edit_query_text(query, "❌ Вы не зарегистрированы в системе")
+        return
+    
+    driver = db.query(Driver).filter(Driver.user_id == user.id).first()
+    if not driver:
+        await outbox.edit_query_text(query, "❌ Вы не зарегистрированы как водитель")
+        return
     
-    finally:
-        db.close()
+    # Резервируем заказ
+    success, message = await BroadcastService.reserve_broadcast_order(
+        db, order_id, driver, context.bot, context
+    )
+    
+    if success:
+        await outbox.edit_query_text(query, f"📌 {message}")
+    else:
+        await outbox.edit_query_text(query, f"⚠️ {message}")
+
 
 
 async def confirm_reserve_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -105,22 +99,19 @@ async def confirm_reserve_callback(update: Update, context: ContextTypes.DEFAULT
         _, order_id_str = query.data.split(":")
         order_id = int(order_id_str)
     except (ValueError, IndexError):
-        await query.edit_message_text("❌ Ошибка: неверный формат данных")
+        await outbox.edit_query_text(query, "❌ Ошибка: неверный формат данных")
         return
     
-    db = SessionLocal()
-    try:
-        success, message = await BroadcastService.confirm_reserve(
-            db, order_id, context.bot, context
-        )
-        
-        if success:
-            await query.edit_message_text(f"✅ {message}")
-        else:
-            await query.edit_message_text(f"⚠️ {message}")
+    db = context.db
+    success, message = await BroadcastService.confirm_reserve(
+        db, order_id, context.bot, context
+    )
     
-    finally:
-        db.close()
+    if success:
+        await outbox.edit_query_text(query, f"✅ {message}")
+    else:
+        await outbox.edit_query_text(query, f"⚠️ {message}")
+
 
 
 async def decline_reserve_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -133,20 +124,17 @@ async def decline_reserve_callback(update: Update, context: ContextTypes.DEFAULT
         _, order_id_str = query.data.split(":")
         order_id = int(order_id_str)
     except (ValueError, IndexError):
-        await query.edit_message_text("❌ Ошибка: неверный формат данных")
+        await outbox.edit_query_text(query, "❌ Ошибка: неверный формат данных")
         return
     
-    db = SessionLocal()
-    try:
-        success, message = await BroadcastService.decline_reserve(db, order_id)
-        
-        if success:
-            await query.edit_message_text(f"⚠️ {message}")
-        else:
-            await query.edit_message_text(f"❌ {message}")
+    db = context.db
+    success, message = await BroadcastService.decline_reserve(db, order_id)
     
-    finally:
-        db.close()
+    if success:
+        await outbox.edit_query_text(query, f"⚠️ {message}")
+    else:
+        await outbox.edit_query_text(query, f"❌ {message}")
+
 
 
 def register_broadcast_handlers(application):
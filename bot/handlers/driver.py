@@ -5,8 +5,8 @@ import logging
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 from telegram.ext import ContextTypes
-from database.db import SessionLocal
 from bot.services import UserService, OrderService
+from bot.services.outbox import outbox, PRIORITY_BULK
 from bot.utils import Keyboards
 from bot.models import UserRole, Driver, OrderStatus, Order
 from datetime import datetime
@@ -25,151 +25,152 @@ from bot.handlers.driver_intercity import (
 
 async def driver_status_online(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Перевести статус водителя в онлайн - выбор района"""
-    db = SessionLocal()
+    db = context.db
     
-    try:
-        user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
-        
-        if not db_user or db_user.role != UserRole.DRIVER:
-            await update.message.reply_text(
-                "Вы не зарегистрированы как водитель.\n"
-                "Для регистрации обратитесь к администратору."
-            )
-            return
-        
-        driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
-        
-        if not driver:
-            await update.message.reply_text("Профиль водителя не найден")
-            return
-        
-        if not driver.is_verified:
-            await update.message.reply_text(
-                "Ваш профиль еще не верифицирован администратором.\n"
-                "Ожидайте подтверждения."
-            )
-            return
-        
-        # Предлагаем выбрать район
-        await update.message.reply_text(
-            "🏘 <b>Выберите район, в котором вы находитесь:</b>\n\n"
-            "Это поможет получать заказы из вашего района в приоритете!",
-            parse_mode='HTML',
-            reply_markup=Keyboards.driver_select_district()
+    user = update.effective_user
+    identity = UserService.get_identity(user.id, db)
+    
+    if not identity or identity.role != UserRole.DRIVER:
+        await outbox.reply_text(
+            update.message,
+            "Вы не зарегистрированы как водитель.\n"
+            "Для регистрации обратитесь к администратору."
         )
-        
-        # Отправляем список доступных заказов
-        pending_orders = OrderService.get_pending_orders(db)
-        if pending_orders:
-            for order in pending_orders:
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text=f"🚖 <b>Новый заказ!</b>\n\n{order.display_info}",
-                    parse_mode='HTML',
-                    reply_markup=Keyboards.driver_order_action(order.id)
-                )
-    finally:
-        db.close()
+        return
+    
+    driver = db.query(Driver).filter(Driver.user_id == identity.id).first()
+    
+    if not driver:
+        await outbox.reply_text(update.message, "Профиль водителя не найден")
+        return
+    
+    if not driver.is_verified:
+        await outbox.reply_text(
+            update.message,
+            "Ваш профиль еще не верифицирован администратором.\n"
+            "Ожидайте подтверждения."
+        )
+        return
+    
+    # Предлагаем выбрать район
+    await outbox.reply_text(
+        update.message,
+        "🏘 <b>Выберите район, в котором вы находитесь:</b>\n\n"
+        "Это поможет получать заказы из вашего района в приоритете!",
+        parse_mode='HTML',
+        reply_markup=Keyboards.driver_select_district()
+    )
+    
+    # Отправляем список доступных заказов
+    pending_orders = OrderService.get_pending_orders(db)
+    if pending_orders:
+        for order in pending_orders:
+            await outbox.send_message(
+                context.bot,
+                chat_id=update.effective_chat.id,
+                priority=PRIORITY_BULK,
+                text=f"🚖 <b>Новый заказ!</b>\n\n{order.display_info}",
+                parse_mode='HTML',
+                reply_markup=Keyboards.driver_order_action(order.id)
+            )
 
 
 async def driver_select_district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка выбора района водителем"""
-    db = SessionLocal()
+    db = context.db
     
-    try:
-        user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
-        
-        if not db_user or db_user.role != UserRole.DRIVER:
-            return
-        
-        driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
-        if not driver:
-            return
-        
-        # Проверяем, что выбран валидный район
-        districts = ["📍 Новое Жуково", "📍 Старое Жуково", "📍 Мысовцево", "📍 Авдон", "📍 Уптино", "📍 Дёма", "📍 Сергеевка"]
-        
-        if update.message.text == "🔙 Назад":
-            await update.message.reply_text(
-                "Выберите действие:",
-                reply_markup=Keyboards.driver_menu()
-            )
-            return
-        
-        if update.message.text not in districts:
-            return
-        
-        # Удаляем эмодзи из названия района
-        selected_district = update.message.text.replace("📍 ", "")
-        
-        # Обновляем район водителя
-        driver.current_district = selected_district
-        driver.district_updated_at = datetime.utcnow()
-        driver.is_online = True
-        db.commit()
-        
-        await update.message.reply_text(
-            f"🟢 <b>Отлично!</b>\n\n"
-            f"Вы в сети в районе: <b>{selected_district}</b>\n\n"
-            f"Ожидайте заказы из вашего района! 🚖",
-            parse_mode='HTML',
+    user = update.effective_user
+    identity = UserService.get_identity(user.id, db)
+    
+    if not identity or identity.role != UserRole.DRIVER:
+        return
+    
+    driver = db.query(Driver).filter(Driver.user_id == identity.id).first()
+    if not driver:
+        return
+    
+    # Проверяем, что выбран валидный район
+    districts = ["📍 Новое Жуково", "📍 Старое Жуково", "📍 Мысовцево", "📍 Авдон", "📍 Уптино", "📍 Дёма", "📍 Сергеевка"]
+    
+    if update.message.text == "🔙 Назад":
+        await outbox.reply_text(
+            update.message,
+            "Выберите действие:",
             reply_markup=Keyboards.driver_menu()
         )
-        
-        # Отправляем список доступных заказов
-        pending_orders = OrderService.get_pending_orders(db)
-        if pending_orders:
-            for order in pending_orders:
-                order_info = (
-                    f"🚖 <b>Доступный заказ #{order.id}</b>\n\n"
-                    f"{order.display_info}"
-                )
-                await update.message.reply_text(
-                    order_info,
-                    parse_mode='HTML',
-                    reply_markup=Keyboards.driver_order_action(order.id)
-                )
-    finally:
-        db.close()
+        return
+    
+    if update.message.text not in districts:
+        return
+    
+    # Удаляем эмодзи из названия района
+    selected_district = update.message.text.replace("📍 ", "")
+    
+    # Обновляем район водителя
+    driver.current_district = selected_district
+    driver.district_updated_at = datetime.utcnow()
+    driver.is_online = True
+    db.commit()
+    
+    await outbox.reply_text(
+        update.message,
+        f"🟢 <b>Отлично!</b>\n\n"
+        f"Вы в сети в районе: <b>{selected_district}</b>\n\n"
+        f"Ожидайте заказы из вашего района! 🚖",
+        parse_mode='HTML',
+        reply_markup=Keyboards.driver_menu()
+    )
+    
+    # Отправляем список доступных заказов
+    pending_orders = OrderService.get_pending_orders(db)
+    if pending_orders:
+        for order in pending_orders:
+            order_info = (
+                f"🚖 <b>Доступный заказ #{order.id}</b>\n\n"
+                f"{order.display_info}"
+            )
+            await outbox.reply_text(
+                update.message,
+                order_info,
+                parse_mode='HTML',
+                reply_markup=Keyboards.driver_order_action(order.id)
+            )
 
 
 async def driver_status_offline(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Перевести статус водителя в оффлайн"""
-    db = SessionLocal()
+    db = context.db
     
-    try:
-        user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
-        
-        if not db_user or db_user.role != UserRole.DRIVER:
-            await update.message.reply_text("Вы не зарегистрированы как водитель")
-            return
-        
-        driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
-        
-        if not driver:
-            await update.message.reply_text("Профиль водителя не найден")
-            return
-        
-        # Проверяем наличие активных заказов
-        active_order = OrderService.get_active_order_by_driver(db, db_user)
-        if active_order:
-            await update.message.reply_text(
-                "У вас есть активный заказ. Завершите его перед выходом из сети."
-            )
-            return
-        
-        driver.is_online = False
-        db.commit()
-        
-        await update.message.reply_text(
-            "🔴 Вы оффлайн. Заказы не будут приходить.",
-            reply_markup=Keyboards.driver_menu()
+    user = update.effective_user
+    db_user = UserService.get_user_by_telegram_id(db, user.id)
+    
+    if not db_user or db_user.role != UserRole.DRIVER:
+        await outbox.reply_text(update.message, "Вы не зарегистрированы как водитель")
+        return
+    
+    driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
+    
+    if not driver:
+        await outbox.reply_text(update.message, "Профиль водителя не найден")
+        return
+    
+    # Проверяем наличие активных заказов
+    active_order = OrderService.get_active_order_by_driver(db, db_user)
+    if active_order:
+        await outbox.reply_text(
+            update.message,
+            "У вас есть активный заказ. Завершите его перед выходом из сети."
         )
-    finally:
-        db.close()
+        return
+    
+    driver.is_online = False
+    db.commit()
+    
+    await outbox.reply_text(
+        update.message,
+        "🔴 Вы оффлайн. Заказы не будут приходить.",
+        reply_markup=Keyboards.driver_menu()
+    )
 
 
 async def accept_order_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -188,7 +189,7 @@ async def accept_order_callback(update: Update, context: ContextTypes.DEFAULT_TY
         await query.answer("Ошибка обработки запроса", show_alert=True)
         return
     
-    db = SessionLocal()
+    db = context.db
     try:
         user = query.from_user
         print(f"   Пользователь: {user.id} (@{user.username})")
@@ -197,28 +198,28 @@ async def accept_order_callback(update: Update, context: ContextTypes.DEFAULT_TY
         
         if not db_user:
             print(f"❌ Пользователь не найден в БД")
-            await query.edit_message_text("❌ Вы не зарегистрированы в системе")
+            await outbox.edit_query_text(query, "❌ Вы не зарегистрированы в системе")
             return
         
         print(f"   Роль пользователя: {db_user.role}")
         
         if db_user.role != UserRole.DRIVER:
             print(f"❌ Пользователь не водитель")
-            await query.edit_message_text("❌ Вы не зарегистрированы как водитель")
+            await outbox.edit_query_text(query, "❌ Вы не зарегистрированы как водитель")
             return
         
         order = OrderService.get_order_by_id(db, order_id)
         
         if not order:
             print(f"❌ Заказ #{order_id} не найден")
-            await query.edit_message_text("❌ Заказ не найден")
+            await outbox.edit_query_text(query, "❌ Заказ не найден")
             return
         
         print(f"   Статус заказа: {order.status}")
         
         if order.status != OrderStatus.PENDING:
             print(f"❌ Заказ уже не в статусе pending")
-            await query.edit_message_text(f"❌ Заказ уже принят другим водителем или отменен")
+            await outbox.edit_query_text(query, f"❌ Заказ уже принят другим водителем или отменен")
             return
         
         if action == "accept_order":
@@ -237,7 +238,8 @@ async def accept_order_callback(update: Update, context: ContextTypes.DEFAULT_TY
             
             driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
             
-            await query.edit_message_text(
+            await outbox.edit_query_text(
+                query,
                 f"✅ <b>Вы приняли заказ #{order.id}</b>\n\n"
                 f"{order.display_info}\n\n"
                 f"Свяжитесь с клиентом: @{order.customer.username or 'клиент'}",
@@ -247,7 +249,8 @@ async def accept_order_callback(update: Update, context: ContextTypes.DEFAULT_TY
             
             # Уведомляем клиента
             try:
-                await context.bot.send_message(
+                await outbox.send_message(
+                    context.bot,
                     chat_id=order.customer.telegram_id,
                     text=(
                         f"✅ <b>Водитель найден!</b>\n\n"
@@ -262,14 +265,12 @@ async def accept_order_callback(update: Update, context: ContextTypes.DEFAULT_TY
         
         elif action == "decline_order":
             print(f"⚠️ Водитель отклонил заказ #{order_id}")
-            await query.edit_message_text("❌ Вы отклонили заказ")
+            await outbox.edit_query_text(query, "❌ Вы отклонили заказ")
     except Exception as e:
         print(f"❌ ОШИБКА в accept_order_callback: {e}")
         import traceback
         traceback.print_exc()
         await query.answer("Произошла ошибка. Попробуйте еще раз.", show_alert=True)
-    finally:
-        db.close()
 
 
 async def start_order_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -280,30 +281,29 @@ async def start_order_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     _, order_id = query.data.split(':')
     order_id = int(order_id)
     
-    db = SessionLocal()
-    try:
-        order = OrderService.get_order_by_id(db, order_id)
-        
-        if not order or order.status != OrderStatus.ACCEPTED:
-            await query.answer("Заказ недоступен", show_alert=True)
-            return
-        
-        OrderService.start_order(db, order)
-        
-        await query.edit_message_text(
-            f"🚗 <b>Поездка началась</b>\n\n{order.display_info}",
-            parse_mode='HTML',
-            reply_markup=Keyboards.order_status_actions(order.id, "in_progress")
-        )
-        
-        # Уведомляем клиента
-        await context.bot.send_message(
-            chat_id=order.customer.telegram_id,
-            text="🚗 Поездка началась!",
-            parse_mode='HTML'
-        )
-    finally:
-        db.close()
+    db = context.db
+    order = OrderService.get_order_by_id(db, order_id)
+    
+    if not order or order.status != OrderStatus.ACCEPTED:
+        await query.answer("Заказ недоступен", show_alert=True)
+        return
+    
+    OrderService.start_order(db, order)
+    
+    await outbox.edit_query_text(
+        query,
+        f"🚗 <b>Поездка началась</b>\n\n{order.display_info}",
+        parse_mode='HTML',
+        reply_markup=Keyboards.order_status_actions(order.id, "in_progress")
+    )
+    
+    # Уведомляем клиента
+    await outbox.send_message(
+        context.bot,
+        chat_id=order.customer.telegram_id,
+        text="🚗 Поездка началась!",
+        parse_mode='HTML'
+    )
 
 
 async def complete_order_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -314,35 +314,34 @@ async def complete_order_callback(update: Update, context: ContextTypes.DEFAULT_
     _, order_id = query.data.split(':')
     order_id = int(order_id)
     
-    db = SessionLocal()
-    try:
-        order = OrderService.get_order_by_id(db, order_id)
-        
-        if not order or order.status != OrderStatus.IN_PROGRESS:
-            await query.answer("Заказ недоступен", show_alert=True)
-            return
-        
-        OrderService.complete_order(db, order)
-        
-        # Обновляем статистику водителя
-        driver = db.query(Driver).filter(Driver.user_id == order.driver_id).first()
-        if driver:
-            driver.total_rides += 1
-            db.commit()
-        
-        await query.edit_message_text(
-            f"✅ <b>Поездка завершена!</b>\n\n{order.display_info}",
-            parse_mode='HTML'
-        )
-        
-        # Просим клиента оценить поездку
-        await context.bot.send_message(
-            chat_id=order.customer.telegram_id,
-            text="✅ Поездка завершена!\n\nОцените водителя:",
-            reply_markup=Keyboards.rate_driver(order.id)
-        )
-    finally:
-        db.close()
+    db = context.db
+    order = OrderService.get_order_by_id(db, order_id)
+    
+    if not order or order.status != OrderStatus.IN_PROGRESS:
+        await query.answer("Заказ недоступен", show_alert=True)
+        return
+    
+    OrderService.complete_order(db, order)
+    
+    # Обновляем статистику водителя
+    driver = db.query(Driver).filter(Driver.user_id == order.driver_id).first()
+    if driver:
+        driver.total_rides += 1
+        db.commit()
+    
+    await outbox.edit_query_text(
+        query,
+        f"✅ <b>Поездка завершена!</b>\n\n{order.display_info}",
+        parse_mode='HTML'
+    )
+    
+    # Просим клиента оценить поездку
+    await outbox.send_message(
+        context.bot,
+        chat_id=order.customer.telegram_id,
+        text="✅ Поездка завершена!\n\nОцените водителя:",
+        reply_markup=Keyboards.rate_driver(order.id)
+    )
 
 
 async def rate_driver_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -354,36 +353,35 @@ async def rate_driver_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     order_id = int(order_id)
     rating = int(rating)
     
-    db = SessionLocal()
-    try:
-        order = OrderService.get_order_by_id(db, order_id)
-        
-        if not order:
-            await query.answer("Заказ не найден", show_alert=True)
-            return
-        
-        OrderService.rate_order(db, order, rating)
-        
-        await query.edit_message_text(
-            f"⭐ Спасибо за оценку! Вы поставили {rating}/5 звезд.",
-            parse_mode='HTML'
+    db = context.db
+    order = OrderService.get_order_by_id(db, order_id)
+    
+    if not order:
+        await query.answer("Заказ не найден", show_alert=True)
+        return
+    
+    OrderService.rate_order(db, order, rating)
+    
+    await outbox.edit_query_text(
+        query,
+        f"⭐ Спасибо за оценку! Вы поставили {rating}/5 звезд.",
+        parse_mode='HTML'
+    )
+    
+    # Уведомляем водителя
+    if order.driver:
+        await outbox.send_message(
+            context.bot,
+            chat_id=order.driver.telegram_id,
+            text=f"⭐ Клиент оценил вашу поездку на {rating}/5"
         )
-        
-        # Уведомляем водителя
-        if order.driver:
-            await context.bot.send_message(
-                chat_id=order.driver.telegram_id,
-                text=f"⭐ Клиент оценил вашу поездку на {rating}/5"
-            )
-    finally:
-        db.close()
 
 
 async def driver_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать заказы водителя"""
     print(f"📋 driver_orders вызван! Пользователь: {update.effective_user.id}")
     
-    db = SessionLocal()
+    db = context.db
     
     try:
         user = update.effective_user
@@ -391,14 +389,14 @@ async def driver_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if not db_user or db_user.role != UserRole.DRIVER:
             print(f"❌ Пользователь не водитель")
-            await update.message.reply_text("Вы не зарегистрированы как водитель")
+            await outbox.reply_text(update.message, "Вы не зарегистрированы как водитель")
             return
         
         print(f"✓ Водитель: {db_user.full_name} (ID: {db_user.id})")
         
         driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
         if not driver:
-            await update.message.reply_text("❌ Профиль водителя не найден")
+            await outbox.reply_text(update.message, "❌ Профиль водителя не найден")
             return
         
         # Используем новую функцию для получения активного заказа
@@ -460,7 +458,8 @@ async def driver_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 keyboard = None
                 message = f"У вас есть заказ #{active_order.id} в статусе {status}"
             
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 message,
                 parse_mode='HTML',
                 reply_markup=keyboard
@@ -485,7 +484,8 @@ async def driver_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
         print(f"   Из них завершенных: {len(completed_orders)}")
         
         if not history:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "📋 <b>Мои заказы</b>\n\n"
                 "У вас пока нет завершенных поездок.\n\n"
                 "🚖 Нажмите \"🟢 Я на линии\", чтобы начать принимать заказы!",
@@ -505,113 +505,111 @@ async def driver_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 history_text += f"📅 Дата: {order.completed_at.strftime('%d.%m.%Y %H:%M')}\n"
                 history_text += "➖➖➖➖➖➖➖➖➖\n\n"
             
-            await update.message.reply_text(history_text, parse_mode='HTML')
+            await outbox.reply_text(update.message, history_text, parse_mode='HTML')
     except Exception as e:
         print(f"❌ ОШИБКА в driver_orders: {e}")
         import traceback
         traceback.print_exc()
-    finally:
-        db.close()
 
 
 async def driver_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать статистику водителя с использованием новых полей модели Driver"""
-    db = SessionLocal()
+    db = context.db
 
-    try:
-        user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
+    user = update.effective_user
+    identity = UserService.get_identity(user.id, db)
 
-        if not db_user or db_user.role != UserRole.DRIVER:
-            await update.message.reply_text("Вы не зарегистрированы как водитель")
-            return
-
-        driver_profile = db.query(Driver).filter(Driver.user_id == db_user.id).first()
-        if not driver_profile:
-            await update.message.reply_text("Профиль водителя не найден")
-            return
+    if not identity or identity.role != UserRole.DRIVER:
+        await outbox.reply_text(update.message, "Вы не зарегистрированы как водитель")
+        return
 
-        # Используем новые поля из модели Driver
-        total_completed = driver_profile.completed_trips_count or 0
-        avg_rating = driver_profile.rating_avg or 0.0
-        rating_count = driver_profile.rating_count or 0
+    driver_profile = db.query(Driver).filter(Driver.user_id == identity.id).first()
+    if not driver_profile:
+        await outbox.reply_text(update.message, "Профиль водителя не найден")
+        return
 
-        rating_display = f"{avg_rating:.2f} ⭐" if rating_count > 0 else "Нет оценок"
+    # Используем новые поля из модели Driver
+    total_completed = driver_profile.completed_trips_count or 0
+    avg_rating = driver_profile.rating_avg or 0.0
+    rating_count = driver_profile.rating_count or 0
+
+    rating_display = f"{avg_rating:.2f} ⭐" if rating_count > 0 else "Нет оценок"
+
+    # Выручка и отмены — из свёрнутой статистики водителя (две строки по ключу)
+    from bot.services.stats_service import StatsService
+    driver_key = str(driver_profile.id)
+    all_time = StatsService.get_all_time(db, "driver", driver_key)
+    today = StatsService.get_today(db, "driver", driver_key)
+
+    stats_text = (
+        "📊 <b>Моя статистика</b>\n\n"
+        f"🚗 <b>Авто:</b> {driver_profile.car_model} ({driver_profile.car_number})\n"
+        f"⭐ <b>Средний рейтинг:</b> {rating_display} ({rating_count} оценок)\n"
+        f"🛣️ <b>Завершенных поездок:</b> {total_completed}\n"
+        f"💰 <b>Выручка:</b> {all_time.revenue:.0f} ₽, средний чек {all_time.avg_check:.0f} ₽\n"
+        f"❌ <b>Отменённых заказов:</b> {all_time.cancelled}\n"
+        f"📅 <b>Сегодня:</b> {today.completed} поездок, {today.revenue:.0f} ₽\n"
+    )
 
-        stats_text = (
-            "📊 <b>Моя статистика</b>\n\n"
-            f"🚗 <b>Авто:</b> {driver_profile.car_model} ({driver_profile.car_number})\n"
-            f"⭐ <b>Средний рейтинг:</b> {rating_display} ({rating_count} оценок)\n"
-            f"🛣️ <b>Завершенных поездок:</b> {total_completed}\n"
-        )
+    # Последние оценки (используем assigned_driver_id)
+    rated_orders = OrderService.get_recent_rated_orders(db, driver_profile.id, limit=3)
 
-        # Последние оценки (используем assigned_driver_id)
-        rated_orders = db.query(Order).filter(
-            Order.assigned_driver_id == driver_profile.id,
-            Order.rating.isnot(None)
-        ).order_by(Order.finished_at.desc()).limit(3).all()
-
-        if rated_orders:
-            stats_text += "\n📝 <b>Последние оценки:</b>\n"
-            for order in rated_orders:
-                completed_at = (order.finished_at or order.completed_at).strftime('%d.%m.%Y %H:%M') if (order.finished_at or order.completed_at) else "—"
-                stats_text += (
-                    f"• Заказ #{order.id}: {order.rating}/5 ⭐ "
-                    f"({completed_at})\n"
-                )
-        else:
-            stats_text += "\n📝 Клиенты еще не оставили оценок.\n"
-
-        # Последние поездки (используем новый метод)
-        recent_orders = OrderService.get_driver_order_history(db, driver_profile.id, limit=3)
-        if recent_orders:
-            stats_text += "\n📋 <b>Последние поездки:</b>\n"
-            for order in recent_orders:
-                completed_at = (order.finished_at or order.completed_at).strftime('%d.%m.%Y %H:%M') if (order.finished_at or order.completed_at) else "—"
-                price_str = f"{order.price:.0f} ₽" if order.price and order.price > 0 else "—"
-                stats_text += (
-                    f"• #{order.id}: {order.pickup_address[:20]}{'...' if len(order.pickup_address) > 20 else ''} → "
-                    f"{order.dropoff_address[:20]}{'...' if len(order.dropoff_address) > 20 else ''} "
-                    f"({price_str}, {completed_at})\n"
-                )
+    if rated_orders:
+        stats_text += "\n📝 <b>Последние оценки:</b>\n"
+        for order in rated_orders:
+            completed_at = (order.finished_at or order.completed_at).strftime('%d.%m.%Y %H:%M') if (order.finished_at or order.completed_at) else "—"
+            stats_text += (
+                f"• Заказ #{order.id}: {order.rating}/5 ⭐ "
+                f"({completed_at})\n"
+            )
+    else:
+        stats_text += "\n📝 Клиенты еще не оставили оценок.\n"
+
+    # Последние поездки (используем новый метод)
+    recent_orders = OrderService.get_driver_order_history(db, driver_profile.id, limit=3)
+    if recent_orders:
+        stats_text += "\n📋 <b>Последние поездки:</b>\n"
+        for order in recent_orders:
+            completed_at = (order.finished_at or order.completed_at).strftime('%d.%m.%Y %H:%M') if (order.finished_at or order.completed_at) else "—"
+            price_str = f"{order.price:.0f} ₽" if order.price and order.price > 0 else "—"
+            stats_text += (
+                f"• #{order.id}: {order.pickup_address[:20]}{'...' if len(order.pickup_address) > 20 else ''} → "
+                f"{order.dropoff_address[:20]}{'...' if len(order.dropoff_address) > 20 else ''} "
+                f"({price_str}, {completed_at})\n"
+            )
 
-        await update.message.reply_text(stats_text, parse_mode='HTML')
-    finally:
-        db.close()
+    await outbox.reply_text(update.message, stats_text, parse_mode='HTML')
 
 
 async def driver_trip_history_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды '🧾 Мои поездки' для водителя"""
-    db = SessionLocal()
+    db = context.db
     
     try:
         user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
+        identity = UserService.get_identity(user.id, db)
         
-        if not db_user or db_user.role != UserRole.DRIVER:
-            await update.message.reply_text("Вы не зарегистрированы как водитель")
+        if not identity or identity.role != UserRole.DRIVER:
+            await outbox.reply_text(update.message, "Вы не зарегистрированы как водитель")
             return
         
-        driver_profile = db.query(Driver).filter(Driver.user_id == db_user.id).first()
+        driver_profile = db.query(Driver).filter(Driver.user_id == identity.id).first()
         if not driver_profile:
-            await update.message.reply_text("Профиль водителя не найден")
+            await outbox.reply_text(update.message, "Профиль водителя не найден")
             return
         
-        # Получаем offset из callback data (для пагинации)
-        offset = 0
+        # Курсор последнего показанного заказа из callback data (для пагинации)
+        after = None
         if update.callback_query:
-            try:
-                _, offset_str = update.callback_query.data.split(":")
-                offset = int(offset_str)
-            except:
-                offset = 0
+            after = OrderService.parse_history_cursor(update.callback_query.data.split(":", 1)[1])
         
         # Получаем историю поездок
         limit = 10
-        orders = OrderService.get_driver_order_history(db, driver_profile.id, limit=limit, offset=offset)
+        orders = OrderService.get_driver_order_history(db, driver_profile.id, limit=limit, after=after)
         
-        if not orders and offset == 0:
-            await update.message.reply_text(
+        if not orders and after is None:
+            await outbox.reply_text(
+                update.message,
                 "📭 <b>История поездок пуста</b>\n\n"
                 "У вас пока нет завершённых или отменённых заказов.",
                 parse_mode='HTML'
@@ -666,16 +664,18 @@ async def driver_trip_history_handler(update: Update, context: ContextTypes.DEFA
         keyboard = []
         
         if len(orders) == limit:
-            keyboard.append([InlineKeyboardButton("📄 Показать ещё", callback_data=f"driver_history:{offset + limit}")])
+            keyboard.append([InlineKeyboardButton("📄 Показать ещё", callback_data=f"driver_history:{OrderService.history_cursor(orders[-1])}")])
         
         if update.callback_query:
-            await update.callback_query.edit_message_text(
+            await outbox.edit_query_text(
+                update.callback_query,
                 message,
                 parse_mode='HTML',
                 reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
             )
         else:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 message,
                 parse_mode='HTML',
                 reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
@@ -683,9 +683,7 @@ async def driver_trip_history_handler(update: Update, context: ContextTypes.DEFA
         
     except Exception as e:
         logger.error(f"Ошибка при получении истории поездок водителя: {e}", exc_info=True)
-        await update.message.reply_text("❌ Произошла ошибка при загрузке истории")
-    finally:
-        db.close()
+        await outbox.reply_text(update.message, "❌ Произошла ошибка при загрузке истории")
 
 
 def register_driver_handlers(application: Application):
@@ -719,7 +717,7 @@ def register_driver_handlers(application: Application):
     application.add_handler(MessageHandler(filters.Regex('^🧾 Мои поездки$'), driver_trip_history_handler))
     
     # Обработчик пагинации истории водителя
-    application.add_handler(CallbackQueryHandler(driver_trip_history_handler, pattern='^driver_history:\d+$'))
+    application.add_handler(CallbackQueryHandler(driver_trip_history_handler, pattern='^driver_history:'))
     
     # Callback handlers (новая система очередей)
     application.add_handler(CallbackQueryHandler(driver_accept_order, pattern='^order_accept:\d+$'))
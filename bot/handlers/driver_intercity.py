@@ -9,11 +9,11 @@ from datetime import datetime
 from telegram import Update, Bot  # pyright: ignore[reportMissingImports]
 from telegram.ext import ContextTypes  # pyright: ignore[reportMissingImports]
 
-from database.db import SessionLocal
 from bot.services import UserService, OrderService
 from bot.models import UserRole, Driver, DriverStatus, OrderStatus, IntercityOriginZone
 from bot.utils import Keyboards
 from bot.services.queue_manager import queue_manager
+from bot.services.outbox import outbox
 
 logger = logging.getLogger(__name__)
 
@@ -36,31 +36,29 @@ async def intercity_reply_callback(update: Update, context: ContextTypes.DEFAULT
     driver_car = None
     driver_plate = None
     driver_telegram = None
-    db = SessionLocal()
-    try:
-        user = UserService.get_user_by_telegram_id(db, query.from_user.id)
-        if not user or user.role != UserRole.DRIVER:
-            await query.answer("Доступ запрещён", show_alert=True)
-            return
-
-        driver = db.query(Driver).filter(Driver.user_id == user.id).first()
-        if not driver or not driver.is_verified:
-            await query.answer("Профиль водителя не найден или не подтверждён", show_alert=True)
-            return
-
-        order = OrderService.get_order_by_id(db, order_id)
-        if not order or not order.is_intercity:
-            await query.answer("Заказ недоступен", show_alert=True)
-            return
-
-        if order.selected_driver_id:
-            await query.answer("Клиент уже выбрал водителя", show_alert=True)
-            return
-    finally:
-        db.close()
+    db = context.db
+    identity = UserService.get_identity(query.from_user.id, db)
+    if not identity or identity.role != UserRole.DRIVER:
+        await query.answer("Доступ запрещён", show_alert=True)
+        return
+
+    driver = db.query(Driver).filter(Driver.user_id == identity.id).first()
+    if not driver or not driver.is_verified:
+        await query.answer("Профиль водителя не найден или не подтверждён", show_alert=True)
+        return
+
+    order = OrderService.get_order_by_id(db, order_id)
+    if not order or not order.is_intercity:
+        await query.answer("Заказ недоступен", show_alert=True)
+        return
+
+    if order.selected_driver_id:
+        await query.answer("Клиент уже выбрал водителя", show_alert=True)
+        return
 
     context.user_data[REPLY_STATE_KEY] = order_id
-    await query.message.reply_text(
+    await outbox.reply_text(
+        query.message,
         "✍️ Напишите короткое сообщение клиенту (цена, время, условия).\n"
         "При необходимости отправьте номер телефона текстом.",
         reply_markup=Keyboards.manual_input_with_cancel(),
@@ -78,57 +76,56 @@ async def intercity_reply_message(update: Update, context: ContextTypes.DEFAULT_
     text = (update.message.text or "").strip()
     if text == "❌ Отмена":
         context.user_data.pop(REPLY_STATE_KEY, None)
-        await update.message.reply_text("Отклик отменён.")
+        await outbox.reply_text(update.message, "Отклик отменён.")
         return
 
     if len(text) < 3:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "Сообщение слишком короткое. Опишите условия поездки подробнее.",
             reply_markup=Keyboards.manual_input_with_cancel(),
         )
         return
 
-    db = SessionLocal()
-    try:
-        user = UserService.get_user_by_telegram_id(db, update.effective_user.id)
-        if not user or user.role != UserRole.DRIVER:
-            context.user_data.pop(REPLY_STATE_KEY, None)
-            return
+    db = context.db
+    user = UserService.get_user_by_telegram_id(db, update.effective_user.id)
+    if not user or user.role != UserRole.DRIVER:
+        context.user_data.pop(REPLY_STATE_KEY, None)
+        return
 
-        driver = db.query(Driver).filter(Driver.user_id == user.id).first()
-        order = OrderService.get_order_by_id(db, order_id)
+    driver = db.query(Driver).filter(Driver.user_id == user.id).first()
+    order = OrderService.get_order_by_id(db, order_id)
 
-        if not driver or not order or not order.is_intercity:
-            await update.message.reply_text("Заказ недоступен.")
-            context.user_data.pop(REPLY_STATE_KEY, None)
-            return
+    if not driver or not order or not order.is_intercity:
+        await outbox.reply_text(update.message, "Заказ недоступен.")
+        context.user_data.pop(REPLY_STATE_KEY, None)
+        return
 
-        if order.selected_driver_id and order.selected_driver_id != driver.id:
-            await update.message.reply_text("Клиент уже выбрал другого водителя.")
-            context.user_data.pop(REPLY_STATE_KEY, None)
-            return
+    if order.selected_driver_id and order.selected_driver_id != driver.id:
+        await outbox.reply_text(update.message, "Клиент уже выбрал другого водителя.")
+        context.user_data.pop(REPLY_STATE_KEY, None)
+        return
 
-        message = (
-            f"🚗 <b>Отклик на межгород #{order.id}</b>\n\n"
-            f"Водитель: {driver.user.full_name}\n"
-            f"Авто: {driver.car_model} ({driver.car_number})\n"
-            f"Сообщение: {text}"
-        )
+    message = (
+        f"🚗 <b>Отклик на межгород #{order.id}</b>\n\n"
+        f"Водитель: {driver.user.full_name}\n"
+        f"Авто: {driver.car_model} ({driver.car_number})\n"
+        f"Сообщение: {text}"
+    )
 
-        await context.bot.send_message(
-            chat_id=order.customer.telegram_id,
-            text=message,
-            parse_mode="HTML",
-            reply_markup=Keyboards.intercity_proposal_actions(
-                order.id, driver.id, driver.user.telegram_id
-            ),
-        )
-        logger.info("intercity: driver %s replied", driver.id)
-    finally:
-        db.close()
+    await outbox.send_message(
+        context.bot,
+        chat_id=order.customer.telegram_id,
+        text=message,
+        parse_mode="HTML",
+        reply_markup=Keyboards.intercity_proposal_actions(
+            order.id, driver.id, driver.user.telegram_id
+        ),
+    )
+    logger.info("intercity: driver %s replied", driver.id)
 
     context.user_data.pop(REPLY_STATE_KEY, None)
-    await update.message.reply_text("✅ Предложение отправлено клиенту.")
+    await outbox.reply_text(update.message, "✅ Предложение отправлено клиенту.")
 
 
 async def intercity_confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -143,39 +140,36 @@ async def intercity_confirm_callback(update: Update, context: ContextTypes.DEFAU
         await query.answer("Некорректные данные", show_alert=True)
         return
 
-    db = SessionLocal()
-    try:
-        user = UserService.get_user_by_telegram_id(db, query.from_user.id)
-        if not user or user.role != UserRole.DRIVER:
-            await query.answer("Доступ запрещён", show_alert=True)
-            return
-
-        driver = db.query(Driver).filter(Driver.user_id == user.id).first()
-        order = OrderService.get_order_by_id(db, order_id)
-
-        if not driver or not order or not order.is_intercity:
-            await query.answer("Заказ недоступен", show_alert=True)
-            return
-
-        if order.selected_driver_id != driver.id:
-            await query.answer("Клиент выбрал другого водителя", show_alert=True)
-            return
-
-        OrderService.confirm_intercity_order(db, order, driver)
-        driver.status = DriverStatus.BUSY
-        driver.pending_order_id = None
-        driver.pending_until = None
-        db.commit()
-        queue_manager.remove_driver(driver.id)
-        logger.info("intercity: driver %s confirmed order %s", driver.id, order_id)
-        
-        # Сохраняем данные для использования после закрытия БД
-        customer = order.customer
-        driver_user = driver.user
-    finally:
-        db.close()
+    db = context.db
+    identity = UserService.get_identity(query.from_user.id, db)
+    if not identity or identity.role != UserRole.DRIVER:
+        await query.answer("Доступ запрещён", show_alert=True)
+        return
+
+    driver = db.query(Driver).filter(Driver.user_id == identity.id).first()
+    order = OrderService.get_order_by_id(db, order_id)
+
+    if not driver or not order or not order.is_intercity:
+        await query.answer("Заказ недоступен", show_alert=True)
+        return
+
+    if order.selected_driver_id != driver.id:
+        await query.answer("Клиент выбрал другого водителя", show_alert=True)
+        return
+
+    OrderService.confirm_intercity_order(db, order, driver)
+    driver.status = DriverStatus.BUSY
+    driver.pending_order_id = None
+    driver.pending_until = None
+    db.commit()
+    queue_manager.remove_driver(driver.id)
+    logger.info("intercity: driver %s confirmed order %s", driver.id, order_id)
+    
+    # Сохраняем данные для использования после закрытия БД
+    customer = order.customer
+    driver_user = driver.user
 
-    await query.edit_message_text("✅ Поездка подтверждена. Удачной дороги!")
+    await outbox.edit_query_text(query, "✅ Поездка подтверждена. Удачной дороги!")
 
     # Уведомляем клиента с контактами водителя
     await notify_client_order_assigned(context.bot, order_id, order, customer, driver, driver_user)
@@ -197,38 +191,36 @@ async def intercity_cancel_callback(update: Update, context: ContextTypes.DEFAUL
         return
 
     customer_chat_id = None
-    db = SessionLocal()
-    try:
-        user = UserService.get_user_by_telegram_id(db, query.from_user.id)
-        if not user or user.role != UserRole.DRIVER:
-            await query.answer("Доступ запрещён", show_alert=True)
-            return
-
-        driver = db.query(Driver).filter(Driver.user_id == user.id).first()
-        order = OrderService.get_order_by_id(db, order_id)
-
-        if not driver or not order or not order.is_intercity:
-            await query.answer("Заказ недоступен", show_alert=True)
-            return
-
-        if order.selected_driver_id != driver.id:
-            await query.answer("Вы уже не выбраны клиентом", show_alert=True)
-            return
-
-        order.selected_driver_id = None
-        order.driver_id = None
-        order.accepted_at = None
-        order.status = OrderStatus.NEW
-        db.commit()
-        logger.info("intercity: driver %s cancelled selection for order %s", driver.id, order_id)
-        customer_chat_id = order.customer.telegram_id
-    finally:
-        db.close()
-
-    await query.edit_message_text("❌ Предложение отменено.")
+    db = context.db
+    identity = UserService.get_identity(query.from_user.id, db)
+    if not identity or identity.role != UserRole.DRIVER:
+        await query.answer("Доступ запрещён", show_alert=True)
+        return
+
+    driver = db.query(Driver).filter(Driver.user_id == identity.id).first()
+    order = OrderService.get_order_by_id(db, order_id)
+
+    if not driver or not order or not order.is_intercity:
+        await query.answer("Заказ недоступен", show_alert=True)
+        return
+
+    if order.selected_driver_id != driver.id:
+        await query.answer("Вы уже не выбраны клиентом", show_alert=True)
+        return
+
+    order.selected_driver_id = None
+    order.driver_id = None
+    order.accepted_at = None
+    order.status = OrderStatus.NEW
+    db.commit()
+    logger.info("intercity: driver %s cancelled selection for order %s", driver.id, order_id)
+    customer_chat_id = order.customer.telegram_id
+
+    await outbox.edit_query_text(query, "❌ Предложение отменено.")
 
     if customer_chat_id:
-        await context.bot.send_message(
+        await outbox.send_message(
+            context.bot,
             chat_id=customer_chat_id,
             text="⚠️ Водитель отменил подтверждение. Выберите другого водителя из предложений.",
         )
@@ -272,7 +264,8 @@ async def notify_client_order_assigned(bot: Bot, order_id: int, order, customer,
             phone=phone
         )
         
-        await bot.send_message(
+        await outbox.send_message(
+            bot,
             customer.telegram_id,
             message,
             parse_mode="HTML",
@@ -326,7 +319,8 @@ async def send_driver_panel(bot: Bot, order_id: int, order, customer, driver: Dr
             customer_telegram_id=customer_telegram_id
         )
         
-        await bot.send_message(
+        await outbox.send_message(
+            bot,
             driver.user.telegram_id,
             message,
             parse_mode="HTML",
@@ -6,15 +6,16 @@ from datetime import datetime
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from database.db import SessionLocal
 from bot.services.user_service import UserService
 from bot.services.queue_manager import queue_manager
+from bot.services.outbox import outbox, PRIORITY_BULK
 from bot.services.order_dispatcher import get_dispatcher
 from bot.models.user import UserRole
 from bot.models.driver import Driver, DriverStatus, DriverZone
 from bot.models.order import Order, OrderStatus
 from bot.utils.keyboards import Keyboards
-from bot.constants import ZONES, PUBLIC_ZONE_LABELS, ZONE_KEY_MAP
+from bot.services.zone_registry import zone_registry
+from bot.constants import ZONES
 
 logger = logging.getLogger(__name__)
 
@@ -24,29 +25,31 @@ async def driver_go_online(update: Update, context: ContextTypes.DEFAULT_TYPE):
     Обработка кнопки '🟢 Я на линии'
     Показывает выбор зоны
     """
-    db = SessionLocal()
+    db = context.db
     
     try:
         logger.info(f"driver_go_online вызван для пользователя {update.effective_user.id}")
         
         user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
+        identity = UserService.get_identity(user.id, db)
         
-        if not db_user or db_user.role != UserRole.DRIVER:
-            await update.message.reply_text(
+        if not identity or identity.role != UserRole.DRIVER:
+            await outbox.reply_text(
+                update.message,
                 "❌ Вы не зарегистрированы как водитель.\n"
                 "Для регистрации обратитесь к администратору."
             )
             return
         
-        driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
+        driver = db.query(Driver).filter(Driver.user_id == identity.id).first()
         
         if not driver:
-            await update.message.reply_text("❌ Профиль водителя не найден")
+            await outbox.reply_text(update.message, "❌ Профиль водителя не найден")
             return
         
         if not driver.is_verified:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "⏳ Ваш профиль еще не верифицирован администратором.\n"
                 "Ожидайте подтверждения."
             )
@@ -114,7 +117,8 @@ async def driver_go_online(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         message = f"У вас есть активный заказ #{order_id}"
                     
                     if message:
-                        await update.message.reply_text(
+                        await outbox.reply_text(
+                            update.message,
                             message,
                             parse_mode='HTML',
                             reply_markup=keyboard
@@ -127,7 +131,8 @@ async def driver_go_online(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Показываем выбор зоны
         try:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "🏘 <b>Выберите район, в котором вы находитесь:</b>\n\n"
                 "Вы будете получать заказы из этого района в первую очередь.",
                 parse_mode='HTML',
@@ -136,7 +141,8 @@ async def driver_go_online(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logger.info(f"Показан выбор зоны для водителя {driver.id}")
         except Exception as e:
             logger.error(f"Ошибка при показе выбора зоны: {e}", exc_info=True)
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "❌ Произошла ошибка. Попробуйте еще раз.",
                 reply_markup=Keyboards.driver_menu()
             )
@@ -144,180 +150,188 @@ async def driver_go_online(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Критическая ошибка в driver_go_online: {e}", exc_info=True)
         try:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "❌ Произошла ошибка. Попробуйте еще раз.",
                 reply_markup=Keyboards.driver_menu()
             )
         except:
             pass
-    finally:
-        db.close()
 
 
 async def driver_select_zone_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Обработка выбора зоны водителем
     """
-    db = SessionLocal()
+    db = context.db
     
-    try:
-        user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
-        
-        if not db_user or db_user.role != UserRole.DRIVER:
-            return
-        
-        driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
-        if not driver:
-            return
-        
-        message_text = update.message.text
-        
-        # Обработка кнопки "Назад"
-        if message_text == "🔙 Назад":
-            try:
-                await update.message.reply_text(
-                    "Выберите действие:",
-                    reply_markup=Keyboards.driver_menu()
-                )
-            except Exception as e:
-                # Если не можем ответить на сообщение, отправляем новое
-                logger.warning(f"Не удалось ответить на сообщение, отправляем новое: {e}")
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text="Выберите действие:",
-                    reply_markup=Keyboards.driver_menu()
-                )
-            return
-        
-        # Проверяем что выбрана валидная зона
-        zones_buttons = ["📍 Новое Жуково", "📍 Старое Жуково", "📍 Мысовцево", 
-                        "📍 Авдон", "📍 Уптино", "📍 Дёма", "📍 Сергеевка"]
-        
-        if message_text not in zones_buttons:
-            return
-        
-        # Удаляем эмодзи и получаем название зоны
-        selected_zone_label = message_text.replace("📍 ", "")
-        
-        # Преобразуем в ключ зоны
-        zone_key = ZONE_KEY_MAP.get(selected_zone_label)
-        
-        if not zone_key or zone_key not in ZONES:
-            await update.message.reply_text("❌ Неизвестная зона")
-            return
-        
-        # Обновляем статус водителя
-        old_status = driver.status
-        old_zone = driver.current_zone.value if hasattr(driver.current_zone, 'value') else driver.current_zone
-        
-        # ВАЖНО: Удаляем водителя из всех зон ПЕРЕД обновлением БД
-        # Это предотвращает race condition и гарантирует отсутствие дублирования
-        queue_manager._remove_driver_from_all_zones(driver.id)
-        
-        # Обновляем статус водителя
-        # online_since обновляется только при выборе зоны (выход на линию)
-        driver.status = DriverStatus.ONLINE
-        driver.current_zone = zone_key
-        driver.online_since = datetime.utcnow()  # Время когда водитель выбрал эту зону
-        db.commit()
-        
-        # Добавляем в новую очередь (add_driver также защищен от дублирования)
-        queue_manager.add_driver(driver.id, zone_key, db)
-        
-        # Определяем действие для сообщения
-        if old_status == DriverStatus.ONLINE and old_zone in ZONES and old_zone != zone_key:
-            action = "переведены"
-        else:
-            action = "вышли"
-        
-        # Получаем позицию в очереди
-        position = queue_manager.get_queue_position(driver.id)
-        
+    user = update.effective_user
+    db_user = UserService.get_user_by_telegram_id(db, user.id)
+    
+    if not db_user or db_user.role != UserRole.DRIVER:
+        return
+    
+    driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
+    if not driver:
+        return
+    
+    message_text = update.message.text
+    
+    # Обработка кнопки "Назад"
+    if message_text == "🔙 Назад":
         try:
-            await update.message.reply_text(
-                f"✅ <b>Вы {action} на линию!</b>\n\n"
-                f"🏘 <b>Район:</b> {selected_zone_label}\n"
-                f"📊 <b>Ваша позиция в очереди:</b> {position}\n\n"
-                f"Ожидайте заказы из вашего района!",
-                parse_mode='HTML',
+            await outbox.reply_text(
+                update.message,
+                "Выберите действие:",
                 reply_markup=Keyboards.driver_menu()
             )
         except Exception as e:
             # Если не можем ответить на сообщение, отправляем новое
             logger.warning(f"Не удалось ответить на сообщение, отправляем новое: {e}")
-            await context.bot.send_message(
+            await outbox.send_message(
+                context.bot,
                 chat_id=update.effective_chat.id,
-                text=(
-                    f"✅ <b>Вы {action} на линию!</b>\n\n"
-                    f"🏘 <b>Район:</b> {selected_zone_label}\n"
-                    f"📊 <b>Ваша позиция в очереди:</b> {position}\n\n"
-                    f"Ожидайте заказы из вашего района!"
-                ),
-                parse_mode='HTML',
+                priority=PRIORITY_BULK,
+                text="Выберите действие:",
                 reply_markup=Keyboards.driver_menu()
             )
-        
-        logger.info(f"Водитель {driver.id} ({db_user.full_name}) вышел на линию в зоне {zone_key}, позиция {position}")
-        
-    finally:
-        db.close()
+        return
+    
+    # Проверяем что выбрана валидная зона
+    zones_buttons = ["📍 Новое Жуково", "📍 Старое Жуково", "📍 Мысовцево", 
+                    "📍 Авдон", "📍 Уптино", "📍 Дёма", "📍 Сергеевка"]
+    
+    if message_text not in zones_buttons:
+        return
+    
+    # Удаляем эмодзи и получаем название зоны
+    selected_zone_label = message_text.replace("📍 ", "")
+    
+    # Преобразуем в ключ зоны
+    zone_key = zone_registry.queue_zone_for(selected_zone_label)
+    
+    if not zone_key or zone_key not in ZONES:
+        await outbox.reply_text(update.message, "❌ Неизвестная зона")
+        return
+    
+    # Обновляем статус водителя
+    old_status = driver.status
+    old_zone = driver.current_zone.value if hasattr(driver.current_zone, 'value') else driver.current_zone
+    
+    # ВАЖНО: Удаляем водителя из всех зон ПЕРЕД обновлением БД
+    # Это предотвращает race condition и гарантирует отсутствие дублирования
+    queue_manager._remove_driver_from_all_zones(driver.id)
+    
+    # Обновляем статус водителя
+    # online_since обновляется только при выборе зоны (выход на линию)
+    driver.status = DriverStatus.ONLINE
+    driver.current_zone = zone_key
+    driver.online_since = datetime.utcnow()  # Время когда водитель выбрал эту зону
+    db.commit()
+    
+    # Добавляем в новую очередь (add_driver также защищен от дублирования)
+    queue_manager.add_driver(driver.id, zone_key, db, online_since=driver.online_since)
+    
+    # Определяем действие для сообщения
+    if old_status == DriverStatus.ONLINE and old_zone in ZONES and old_zone != zone_key:
+        action = "переведены"
+    else:
+        action = "вышли"
+    
+    # Получаем позицию в очереди
+    position = queue_manager.get_queue_position(driver.id)
+    
+    try:
+        await outbox.reply_text(
+            update.message,
+            f"✅ <b>Вы {action} на линию!</b>\n\n"
+            f"🏘 <b>Район:</b> {selected_zone_label}\n"
+            f"📊 <b>Ваша позиция в очереди:</b> {position}\n\n"
+            f"Ожидайте заказы из вашего района!",
+            parse_mode='HTML',
+            reply_markup=Keyboards.driver_menu()
+        )
+    except Exception as e:
+        # Если не можем ответить на сообщение, отправляем новое
+        logger.warning(f"Не удалось ответить на сообщение, отправляем новое: {e}")
+        await outbox.send_message(
+            context.bot,
+            chat_id=update.effective_chat.id,
+            priority=PRIORITY_BULK,
+            text=(
+                f"✅ <b>Вы {action} на линию!</b>\n\n"
+                f"🏘 <b>Район:</b> {selected_zone_label}\n"
+                f"📊 <b>Ваша позиция в очереди:</b> {position}\n\n"
+                f"Ожидайте заказы из вашего района!"
+            ),
+            parse_mode='HTML',
+            reply_markup=Keyboards.driver_menu()
+        )
+    
+    logger.info(f"Водитель {driver.id} ({db_user.full_name}) вышел на линию в зоне {zone_key}, позиция {position}")
+    
+    # Заказы зоны, которые ждали водителя, — сразу новому водителю, не дожидаясь таймаута
+    try:
+        await get_dispatcher().match_waiting_orders(zone_key, db)
+    except Exception as e:
+        logger.error(f"Ошибка раздачи ожидающих заказов зоны {zone_key}: {e}", exc_info=True)
+
 
 
 async def driver_go_offline(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Обработка кнопки '🔴 Я оффлайн'
     """
-    db = SessionLocal()
+    db = context.db
     
-    try:
-        user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
-        
-        if not db_user or db_user.role != UserRole.DRIVER:
-            return
-        
-        driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
-        if not driver:
-            return
-        
-        # Проверяем что водитель не занят заказом
-        if driver.status == DriverStatus.BUSY:
-            await update.message.reply_text(
-                "⚠️ Вы не можете выйти оффлайн во время выполнения заказа.\n"
-                "Сначала завершите текущий заказ."
-            )
-            return
-        
-        if driver.status == DriverStatus.PENDING_ACCEPTANCE:
-            await update.message.reply_text(
-                "⚠️ У вас есть ожидающий ответа заказ.\n"
-                "Сначала примите или отклоните его."
-            )
-            return
-        
-        # Переводим оффлайн
-        old_zone = driver.current_zone.value if hasattr(driver.current_zone, 'value') else driver.current_zone
-        driver.status = DriverStatus.OFFLINE
-        # current_zone оставляем как есть (история)
-        driver.online_since = None
-        db.commit()
-        
-        # Удаляем из очереди
-        queue_manager.remove_driver(driver.id)
-        
-        await update.message.reply_text(
-            "🔴 <b>Вы вышли из линии</b>\n\n"
-            "Вы больше не будете получать заказы.\n"
-            "Чтобы снова выйти на линию, нажмите '🟢 Я на линии'.",
-            parse_mode='HTML',
-            reply_markup=Keyboards.driver_menu()
+    user = update.effective_user
+    db_user = UserService.get_user_by_telegram_id(db, user.id)
+    
+    if not db_user or db_user.role != UserRole.DRIVER:
+        return
+    
+    driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
+    if not driver:
+        return
+    
+    # Проверяем что водитель не занят заказом
+    if driver.status == DriverStatus.BUSY:
+        await outbox.reply_text(
+            update.message,
+            "⚠️ Вы не можете выйти оффлайн во время выполнения заказа.\n"
+            "Сначала завершите текущий заказ."
         )
-        
-        logger.info(f"Водитель {driver.id} ({db_user.full_name}) вышел из линии (была зона {old_zone})")
-        
-    finally:
-        db.close()
+        return
+    
+    if driver.status == DriverStatus.PENDING_ACCEPTANCE:
+        await outbox.reply_text(
+            update.message,
+            "⚠️ У вас есть ожидающий ответа заказ.\n"
+            "Сначала примите или отклоните его."
+        )
+        return
+    
+    # Переводим оффлайн
+    old_zone = driver.current_zone.value if hasattr(driver.current_zone, 'value') else driver.current_zone
+    driver.status = DriverStatus.OFFLINE
+    # current_zone оставляем как есть (история)
+    driver.online_since = None
+    db.commit()
+    
+    # Удаляем из очереди
+    queue_manager.remove_driver(driver.id)
+    
+    await outbox.reply_text(
+        update.message,
+        "🔴 <b>Вы вышли из линии</b>\n\n"
+        "Вы больше не будете получать заказы.\n"
+        "Чтобы снова выйти на линию, нажмите '🟢 Я на линии'.",
+        parse_mode='HTML',
+        reply_markup=Keyboards.driver_menu()
+    )
+    
+    logger.info(f"Водитель {driver.id} ({db_user.full_name}) вышел из линии (была зона {old_zone})")
+
 
 
 async def driver_accept_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -328,7 +342,7 @@ async def driver_accept_order(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
     
-    db = SessionLocal()
+    db = context.db
     
     try:
         # Парсим callback data
@@ -336,15 +350,15 @@ async def driver_accept_order(update: Update, context: ContextTypes.DEFAULT_TYPE
         order_id = int(order_id)
         
         user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
+        identity = UserService.get_identity(user.id, db)
         
-        if not db_user or db_user.role != UserRole.DRIVER:
-            await query.edit_message_text("❌ Вы не зарегистрированы как водитель")
+        if not identity or identity.role != UserRole.DRIVER:
+            await outbox.edit_query_text(query, "❌ Вы не зарегистрированы как водитель")
             return
         
-        driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
+        driver = db.query(Driver).filter(Driver.user_id == identity.id).first()
         if not driver:
-            await query.edit_message_text("❌ Профиль водителя не найден")
+            await outbox.edit_query_text(query, "❌ Профиль водителя не найден")
             return
         
         # Обрабатываем принятие через диспетчер
@@ -357,7 +371,8 @@ async def driver_accept_order(update: Update, context: ContextTypes.DEFAULT_TYPE
             if order:
                 # Редактируем старое сообщение
                 try:
-                    await query.edit_message_text(
+                    await outbox.edit_query_text(
+                        query,
                         "✅ <b>Заказ принят!</b>\n\n"
                         "Едьте к клиенту. Когда подъедете, нажмите 'Подъехал'.",
                         parse_mode='HTML'
@@ -366,8 +381,10 @@ async def driver_accept_order(update: Update, context: ContextTypes.DEFAULT_TYPE
                     logger.warning(f"Не удалось отредактировать сообщение: {e}")
                 
                 # Отправляем НОВОЕ сообщение с актуальными кнопками
-                await context.bot.send_message(
+                await outbox.send_message(
+                    context.bot,
                     chat_id=query.message.chat_id,
+                    priority=PRIORITY_BULK,
                     text=(
                         f"📋 <b>Заказ #{order.id}</b>\n\n"
                         f"📍 Откуда: {order.pickup_address}\n"
@@ -379,22 +396,22 @@ async def driver_accept_order(update: Update, context: ContextTypes.DEFAULT_TYPE
                     reply_markup=Keyboards.driver_after_accept(order_id)
                 )
             else:
-                await query.edit_message_text(
+                await outbox.edit_query_text(
+                    query,
                     "✅ <b>Заказ принят!</b>\n\n"
                     "Едьте к клиенту. Удачной поездки!",
                     parse_mode='HTML'
                 )
         else:
-            await query.edit_message_text(
+            await outbox.edit_query_text(
+                query,
                 "❌ Не удалось принять заказ.\n"
                 "Возможно, он уже принят другим водителем."
             )
         
     except Exception as e:
         logger.error(f"Ошибка при принятии заказа: {e}", exc_info=True)
-        await query.edit_message_text("❌ Произошла ошибка при принятии заказа")
-    finally:
-        db.close()
+        await outbox.edit_query_text(query, "❌ Произошла ошибка при принятии заказа")
 
 
 async def driver_decline_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -405,7 +422,7 @@ async def driver_decline_order(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     await query.answer()
     
-    db = SessionLocal()
+    db = context.db
     
     try:
         # Парсим callback data
@@ -413,15 +430,15 @@ async def driver_decline_order(update: Update, context: ContextTypes.DEFAULT_TYP
         order_id = int(order_id)
         
         user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
+        identity = UserService.get_identity(user.id, db)
         
-        if not db_user or db_user.role != UserRole.DRIVER:
-            await query.edit_message_text("❌ Вы не зарегистрированы как водитель")
+        if not identity or identity.role != UserRole.DRIVER:
+            await outbox.edit_query_text(query, "❌ Вы не зарегистрированы как водитель")
             return
         
-        driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
+        driver = db.query(Driver).filter(Driver.user_id == identity.id).first()
         if not driver:
-            await query.edit_message_text("❌ Профиль водителя не найден")
+            await outbox.edit_query_text(query, "❌ Профиль водителя не найден")
             return
         
         # Обрабатываем отклонение через диспетчер
@@ -429,83 +446,80 @@ async def driver_decline_order(update: Update, context: ContextTypes.DEFAULT_TYP
         success = await dispatcher.handle_driver_decline(driver.id, order_id, db)
         
         if success:
-            await query.edit_message_text(
+            await outbox.edit_query_text(
+                query,
                 "↩️ Заказ отклонён.\n\n"
                 "Вы возвращены в конец очереди своей зоны."
             )
         else:
-            await query.edit_message_text(
+            await outbox.edit_query_text(
+                query,
                 "❌ Не удалось отклонить заказ.\n"
                 "Возможно, время на ответ уже истекло."
             )
         
     except Exception as e:
         logger.error(f"Ошибка при отклонении заказа: {e}", exc_info=True)
-        await query.edit_message_text("❌ Произошла ошибка при отклонении заказа")
-    finally:
-        db.close()
+        await outbox.edit_query_text(query, "❌ Произошла ошибка при отклонении заказа")
 
 
 async def driver_my_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Показать текущий статус водителя и позицию в очереди
     """
-    db = SessionLocal()
+    db = context.db
     
-    try:
-        user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
-        
-        if not db_user or db_user.role != UserRole.DRIVER:
-            return
-        
-        driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
-        if not driver:
-            return
-        
-        # Формируем статус
-        status_emoji = {
-            DriverStatus.OFFLINE: "🔴",
-            DriverStatus.ONLINE: "🟢",
-            DriverStatus.PENDING_ACCEPTANCE: "⏳",
-            DriverStatus.BUSY: "🚗",
-        }
-        
-        status_text = {
-            DriverStatus.OFFLINE: "Оффлайн",
-            DriverStatus.ONLINE: "На линии",
-            DriverStatus.PENDING_ACCEPTANCE: "Ожидает ответа на заказ",
-            DriverStatus.BUSY: "Занят заказом",
-        }
-        
-        driver_status = driver.status.value if hasattr(driver.status, 'value') else driver.status
-        current_zone = driver.current_zone.value if hasattr(driver.current_zone, 'value') else driver.current_zone
-        
-        message = (
-            f"{status_emoji.get(driver_status, '❓')} <b>Ваш статус:</b> {status_text.get(driver_status, 'Неизвестно')}\n\n"
-        )
-        
-        if driver_status == "online":
-            zone_label = PUBLIC_ZONE_LABELS.get(current_zone, current_zone)
-            position = queue_manager.get_queue_position(driver.id)
-            queue_info = queue_manager.get_queue_info(current_zone)
-            
-            message += (
-                f"🏘 <b>Зона:</b> {zone_label}\n"
-                f"📊 <b>Позиция в очереди:</b> {position}\n"
-                f"👥 <b>Всего водителей в зоне:</b> {queue_info['count']}\n"
-            )
-        elif current_zone != "NONE":
-            zone_label = PUBLIC_ZONE_LABELS.get(current_zone, current_zone)
-            message += f"🏘 <b>Последняя зона:</b> {zone_label}\n"
+    user = update.effective_user
+    identity = UserService.get_identity(user.id, db)
+    
+    if not identity or identity.role != UserRole.DRIVER:
+        return
+    
+    driver = db.query(Driver).filter(Driver.user_id == identity.id).first()
+    if not driver:
+        return
+    
+    # Формируем статус
+    status_emoji = {
+        DriverStatus.OFFLINE: "🔴",
+        DriverStatus.ONLINE: "🟢",
+        DriverStatus.PENDING_ACCEPTANCE: "⏳",
+        DriverStatus.BUSY: "🚗",
+    }
+    
+    status_text = {
+        DriverStatus.OFFLINE: "Оффлайн",
+        DriverStatus.ONLINE: "На линии",
+        DriverStatus.PENDING_ACCEPTANCE: "Ожидает ответа на заказ",
+        DriverStatus.BUSY: "Занят заказом",
+    }
+    
+    driver_status = driver.status.value if hasattr(driver.status, 'value') else driver.status
+    current_zone = driver.current_zone.value if hasattr(driver.current_zone, 'value') else driver.current_zone
+    
+    message = (
+        f"{status_emoji.get(driver_status, '❓')} <b>Ваш статус:</b> {status_text.get(driver_status, 'Неизвестно')}\n\n"
+    )
+    
+    if driver_status == "online":
+        zone_label = zone_registry.label(current_zone)
+        position = queue_manager.get_queue_position(driver.id)
+        queue_info = queue_manager.get_queue_info(current_zone)
         
         message += (
-            f"\n⭐ <b>Рейтинг:</b> {driver.rating:.1f}\n"
-            f"🛣️ <b>Выполнено поездок:</b> {driver.total_rides}"
+            f"🏘 <b>Зона:</b> {zone_label}\n"
+            f"📊 <b>Позиция в очереди:</b> {position}\n"
+            f"👥 <b>Всего водителей в зоне:</b> {queue_info['count']}\n"
         )
-        
-        await update.message.reply_text(message, parse_mode='HTML')
-        
-    finally:
-        db.close()
+    elif current_zone != "NONE":
+        zone_label = zone_registry.label(current_zone)
+        message += f"🏘 <b>Последняя зона:</b> {zone_label}\n"
+    
+    message += (
+        f"\n⭐ <b>Рейтинг:</b> {driver.rating:.1f}\n"
+        f"🛣️ <b>Выполнено поездок:</b> {driver.total_rides}"
+    )
+    
+    await outbox.reply_text(update.message, message, parse_mode='HTML')
+
 
@@ -3,15 +3,17 @@
 """
 import asyncio
 import logging
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Tuple
+from typing import Callable, Optional, Tuple
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from database.db import SessionLocal
+from database.db import run_in_session
 from bot.services.user_service import UserService
 from bot.services.order_service import OrderService
 from bot.services.queue_manager import queue_manager
+from bot.services.outbox import outbox, PRIORITY_BULK
 from bot.models.user import UserRole
 from bot.models.driver import Driver, DriverStatus
 from bot.models.order import Order, OrderStatus
@@ -25,25 +27,23 @@ async def _send_main_menu_to_client(bot, customer_telegram_id: int, order_id: in
     Отправить главное меню клиенту через 60 сек если он не поставил оценку
     """
     try:
-        db = SessionLocal()
-        try:
-            order = OrderService.get_order_by_id(db, order_id)
-            
-            # Если клиент уже поставил оценку, не отправляем меню
-            if order and order.rating is not None:
-                logger.info(f"Клиент {customer_telegram_id} уже поставил оценку для заказа {order_id}, пропускаем автовозврат в меню")
-                return
-            
-            # Отправляем главное меню
-            await bot.send_message(
-                customer_telegram_id,
-                "Главное меню 👇\n\n"
-                "Вы можете оценить поездку позже из раздела '🧾 Мои поездки' (доступно в течение 24 часов).",
-                reply_markup=Keyboards.main_user()
-            )
-            logger.info(f"Главное меню автоматически отправлено клиенту {customer_telegram_id} (таймер 60 сек)")
-        finally:
-            db.close()
+        order = await OrderService.get_order_by_id_async(order_id)
+        
+        # Если клиент уже поставил оценку, не отправляем меню
+        if order and order.rating is not None:
+            logger.info(f"Клиент {customer_telegram_id} уже поставил оценку для заказа {order_id}, пропускаем автовозврат в меню")
+            return
+        
+        # Отправляем главное меню
+        await outbox.send_message(
+            bot,
+            customer_telegram_id,
+            "Главное меню 👇\n\n"
+            "Вы можете оценить поездку позже из раздела '🧾 Мои поездки' (доступно в течение 24 часов).",
+            priority=PRIORITY_BULK,
+            reply_markup=Keyboards.main_user()
+        )
+        logger.info(f"Главное меню автоматически отправлено клиенту {customer_telegram_id} (таймер 60 сек)")
     except Exception as e:
         logger.error(f"Ошибка при отправке главного меню клиенту {customer_telegram_id}: {e}", exc_info=True)
 
@@ -88,76 +88,126 @@ def get_active_driver_order(db, driver: Driver):
         return None
 
 
+@dataclass
+class TripStage:
+    """Результат работы с БД для этапа поездки: данные для сообщений после коммита"""
+    error: Optional[str] = None
+    driver_id: Optional[int] = None
+    status: Optional[OrderStatus] = None  # Статус заказа до перехода
+    customer_telegram_id: Optional[int] = None
+    customer_phone: Optional[str] = None
+    customer_username: Optional[str] = None
+
+
+def _run_trip_stage(
+    db,
+    telegram_id: int,
+    order_id: int,
+    allowed_statuses: list,
+    transition: Optional[Callable] = None,
+) -> TripStage:
+    """
+    Проверить водителя и заказ и выполнить переход transition(db, order, driver)
+    
+    Синхронная функция для run_in_session: вся работа с БД этапа — в одной
+    сессии, а обработчик дальше работает только с TripStage.
+    """
+    identity = UserService.get_identity(telegram_id, db)
+    if not identity or identity.role != UserRole.DRIVER:
+        return TripStage(error="❌ Вы не зарегистрированы как водитель")
+    
+    driver = db.query(Driver).filter(Driver.user_id == identity.id).first()
+    if not driver:
+        return TripStage(error="❌ Профиль водителя не найден")
+    
+    order = db.query(Order).filter(Order.id == order_id).first()
+    
+    # Валидация
+    is_valid, error_msg = validate_driver_order_access(db, driver, order, allowed_statuses)
+    if not is_valid:
+        return TripStage(error=f"⚠️ {error_msg}")
+    
+    # Контакты клиента
+    customer = order.customer
+    stage = TripStage(
+        driver_id=driver.id,
+        status=order.status,
+        customer_telegram_id=getattr(customer, 'telegram_id', None),
+        customer_phone=getattr(customer, 'phone', None),
+        customer_username=getattr(customer, 'username', None),
+    )
+    
+    if transition is not None:
+        transition(db, order, driver)
+    return stage
+
+
+def _finish_trip(db, order: Order, driver: Driver):
+    """Завершить поездку и снять водителя с линии"""
+    # Идемпотентность: повторное завершение ничего не меняет
+    if order.status == OrderStatus.FINISHED:
+        return
+    
+    OrderService.set_finished(db, order)
+    
+    # ВАЖНО: Водитель выходит из очереди после завершения поездки
+    # Он должен вручную нажать "Я на линии", чтобы вернуться в очередь
+    queue_manager.remove_driver(driver.id)
+    
+    # Переводим водителя в OFFLINE статус (как будто он не на линии)
+    driver.status = DriverStatus.OFFLINE
+    driver.online_since = None
+    driver.pending_order_id = None
+    driver.pending_until = None
+    # current_zone оставляем как есть (история, но водитель не в очереди)
+    db.commit()
+
+
 async def driver_arrived_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Водитель подъехал"""
     query = update.callback_query
     await query.answer()
     
-    db = SessionLocal()
-    
     try:
         # Парсим callback data: trip:arrived:order_id
         _, action, order_id_str = query.data.split(":")
         order_id = int(order_id_str)
         
         user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
-        
-        if not db_user or db_user.role != UserRole.DRIVER:
-            await query.edit_message_text("❌ Вы не зарегистрированы как водитель")
-            return
-        
-        driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
-        if not driver:
-            await query.edit_message_text("❌ Профиль водителя не найден")
-            return
-        
-        order = db.query(Order).filter(Order.id == order_id).first()
-        
-        # Валидация
-        is_valid, error_msg = validate_driver_order_access(
-            db, driver, order, [OrderStatus.ACCEPTED]
+        stage = await run_in_session(
+            _run_trip_stage, user.id, order_id, [OrderStatus.ACCEPTED],
+            lambda db, order, driver: OrderService.set_arrived(db, order),
         )
         
-        if not is_valid:
-            await query.edit_message_text(f"⚠️ {error_msg}")
+        if stage.error:
+            await outbox.edit_query_text(query, stage.error)
             return
         
-        # Получаем контакты клиента
-        customer = order.customer
-        customer_phone = getattr(customer, 'phone', None)
-        customer_username = getattr(customer, 'username', None)
-        customer_telegram_id = getattr(customer, 'telegram_id', None)
+        keyboard = Keyboards.driver_arrived(
+            order_id,
+            customer_phone=stage.customer_phone,
+            customer_username=stage.customer_username,
+            customer_telegram_id=stage.customer_telegram_id
+        )
         
         # Идемпотентность: если уже в статусе ARRIVED, просто возвращаем OK
-        if order.status == OrderStatus.ARRIVED:
-            await query.edit_message_text(
+        if stage.status == OrderStatus.ARRIVED:
+            await outbox.edit_query_text(
+                query,
                 "✅ <b>Вы уже подъехали!</b>\n\n"
                 "Ожидайте клиента. Когда клиент будет готов, нажмите 'Поехали'.",
                 parse_mode='HTML',
-                reply_markup=Keyboards.driver_arrived(
-                    order_id,
-                    customer_phone=customer_phone,
-                    customer_username=customer_username,
-                    customer_telegram_id=customer_telegram_id
-                )
+                reply_markup=keyboard
             )
             return
         
-        # Обновляем статус заказа
-        OrderService.set_arrived(db, order)
-        
         # Обновляем клавиатуру
-        await query.edit_message_text(
+        await outbox.edit_query_text(
+            query,
             "✅ <b>Вы подъехали!</b>\n\n"
             "Ожидайте клиента. Когда клиент будет готов, нажмите 'Поехали'.",
             parse_mode='HTML',
-            reply_markup=Keyboards.driver_arrived(
-                order_id,
-                customer_phone=customer_phone,
-                customer_username=customer_username,
-                customer_telegram_id=customer_telegram_id
-            )
+            reply_markup=keyboard
         )
         
         # Уведомляем клиента согласно ТЗ
@@ -170,8 +220,9 @@ async def driver_arrived_callback(update: Update, context: ContextTypes.DEFAULT_
             # Кнопки действий для клиента
             client_keyboard = Keyboards.client_arrived_actions(order_id)
             
-            await context.bot.send_message(
-                order.customer.telegram_id,
+            await outbox.send_message(
+                context.bot,
+                stage.customer_telegram_id,
                 message,
                 parse_mode='HTML',
                 reply_markup=client_keyboard
@@ -179,13 +230,11 @@ async def driver_arrived_callback(update: Update, context: ContextTypes.DEFAULT_
         except Exception as e:
             logger.error(f"Ошибка отправки уведомления клиенту: {e}", exc_info=True)
         
-        logger.info(f"Водитель {driver.id} подъехал к заказу {order_id}")
+        logger.info(f"Водитель {stage.driver_id} подъехал к заказу {order_id}")
         
     except Exception as e:
         logger.error(f"Ошибка при обработке подъезда водителя: {e}", exc_info=True)
-        await query.edit_message_text("❌ Произошла ошибка")
-    finally:
-        db.close()
+        await outbox.edit_query_text(query, "❌ Произошла ошибка")
 
 
 async def driver_waiting_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -193,36 +242,23 @@ async def driver_waiting_callback(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     await query.answer("Клиент уведомлен, что вы ждете")
     
-    db = SessionLocal()
-    
     try:
         _, action, order_id_str = query.data.split(":")
         order_id = int(order_id_str)
         
         user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
-        
-        if not db_user or db_user.role != UserRole.DRIVER:
-            return
-        
-        driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
-        if not driver:
-            return
-        
-        order = db.query(Order).filter(Order.id == order_id).first()
-        
-        # Валидация
-        is_valid, _ = validate_driver_order_access(
-            db, driver, order, [OrderStatus.ACCEPTED, OrderStatus.ARRIVED]
+        stage = await run_in_session(
+            _run_trip_stage, user.id, order_id, [OrderStatus.ACCEPTED, OrderStatus.ARRIVED]
         )
         
-        if not is_valid:
+        if stage.error:
             return
         
         # Уведомляем клиента
         try:
-            await context.bot.send_message(
-                order.customer.telegram_id,
+            await outbox.send_message(
+                context.bot,
+                stage.customer_telegram_id,
                 "⏳ <b>Водитель ждет вас</b>\n\n"
                 "Пожалуйста, выходите к месту подачи.",
                 parse_mode='HTML'
@@ -232,8 +268,6 @@ async def driver_waiting_callback(update: Update, context: ContextTypes.DEFAULT_
         
     except Exception as e:
         logger.error(f"Ошибка при обработке ожидания водителя: {e}", exc_info=True)
-    finally:
-        db.close()
 
 
 async def driver_start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -241,76 +275,52 @@ async def driver_start_callback(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     
-    db = SessionLocal()
-    
     try:
         _, action, order_id_str = query.data.split(":")
         order_id = int(order_id_str)
         
         user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
-        
-        if not db_user or db_user.role != UserRole.DRIVER:
-            await query.edit_message_text("❌ Вы не зарегистрированы как водитель")
-            return
-        
-        driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
-        if not driver:
-            await query.edit_message_text("❌ Профиль водителя не найден")
-            return
-        
-        order = db.query(Order).filter(Order.id == order_id).first()
-        
-        # Валидация
-        is_valid, error_msg = validate_driver_order_access(
-            db, driver, order, [OrderStatus.ARRIVED]
+        stage = await run_in_session(
+            _run_trip_stage, user.id, order_id, [OrderStatus.ARRIVED],
+            lambda db, order, driver: OrderService.set_started(db, order),
         )
         
-        if not is_valid:
-            await query.edit_message_text(f"⚠️ {error_msg}")
+        if stage.error:
+            await outbox.edit_query_text(query, stage.error)
             return
         
-        # Получаем контакты клиента
-        customer = order.customer
-        customer_phone = getattr(customer, 'phone', None)
-        customer_username = getattr(customer, 'username', None)
-        customer_telegram_id = getattr(customer, 'telegram_id', None)
+        keyboard = Keyboards.driver_onboard(
+            order_id,
+            customer_phone=stage.customer_phone,
+            customer_username=stage.customer_username,
+            customer_telegram_id=stage.customer_telegram_id
+        )
         
         # Идемпотентность: если уже в статусе ONBOARD, просто возвращаем OK
-        if order.status == OrderStatus.ONBOARD:
-            await query.edit_message_text(
+        if stage.status == OrderStatus.ONBOARD:
+            await outbox.edit_query_text(
+                query,
                 "✅ <b>Поездка уже началась!</b>\n\n"
                 "Удачной дороги! По завершении нажмите 'Завершить поездку'.",
                 parse_mode='HTML',
-                reply_markup=Keyboards.driver_onboard(
-                    order_id,
-                    customer_phone=customer_phone,
-                    customer_username=customer_username,
-                    customer_telegram_id=customer_telegram_id
-                )
+                reply_markup=keyboard
             )
             return
         
-        # Обновляем статус заказа
-        OrderService.set_started(db, order)
-        
         # Обновляем клавиатуру
-        await query.edit_message_text(
+        await outbox.edit_query_text(
+            query,
             "🚗 <b>Поездка началась!</b>\n\n"
             "Удачной дороги! По завершении нажмите 'Завершить поездку'.",
             parse_mode='HTML',
-            reply_markup=Keyboards.driver_onboard(
-                order_id,
-                customer_phone=customer_phone,
-                customer_username=customer_username,
-                customer_telegram_id=customer_telegram_id
-            )
+            reply_markup=keyboard
         )
         
         # Уведомляем клиента
         try:
-            await context.bot.send_message(
-                order.customer.telegram_id,
+            await outbox.send_message(
+                context.bot,
+                stage.customer_telegram_id,
                 "🚗 <b>Поездка началась!</b>\n\n"
                 "Приятной дороги!",
                 parse_mode='HTML'
@@ -318,13 +328,11 @@ async def driver_start_callback(update: Update, context: ContextTypes.DEFAULT_TY
         except Exception as e:
             logger.error(f"Ошибка отправки уведомления клиенту: {e}", exc_info=True)
         
-        logger.info(f"Водитель {driver.id} начал поездку {order_id}")
+        logger.info(f"Водитель {stage.driver_id} начал поездку {order_id}")
         
     except Exception as e:
         logger.error(f"Ошибка при начале поездки: {e}", exc_info=True)
-        await query.edit_message_text("❌ Произошла ошибка")
-    finally:
-        db.close()
+        await outbox.edit_query_text(query, "❌ Произошла ошибка")
 
 
 async def driver_finish_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -332,61 +340,32 @@ async def driver_finish_callback(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     await query.answer()
     
-    db = SessionLocal()
-    
     try:
         _, action, order_id_str = query.data.split(":")
         order_id = int(order_id_str)
         
         user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
-        
-        if not db_user or db_user.role != UserRole.DRIVER:
-            await query.edit_message_text("❌ Вы не зарегистрированы как водитель")
-            return
-        
-        driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
-        if not driver:
-            await query.edit_message_text("❌ Профиль водителя не найден")
-            return
-        
-        order = db.query(Order).filter(Order.id == order_id).first()
-        
-        # Валидация
-        is_valid, error_msg = validate_driver_order_access(
-            db, driver, order, [OrderStatus.ONBOARD]
+        stage = await run_in_session(
+            _run_trip_stage, user.id, order_id, [OrderStatus.ONBOARD], _finish_trip
         )
         
-        if not is_valid:
-            await query.edit_message_text(f"⚠️ {error_msg}")
+        if stage.error:
+            await outbox.edit_query_text(query, stage.error)
             return
         
         # Идемпотентность: если уже в статусе FINISHED, просто возвращаем OK
-        if order.status == OrderStatus.FINISHED:
-            await query.edit_message_text(
+        if stage.status == OrderStatus.FINISHED:
+            await outbox.edit_query_text(
+                query,
                 "✅ <b>Поездка уже завершена!</b>\n\n"
                 "Спасибо за работу! Чтобы снова выйти на линию, нажмите '🟢 Я на линии'.",
                 parse_mode='HTML'
             )
             return
         
-        # Обновляем статус заказа
-        OrderService.set_finished(db, order)
-        
-        # ВАЖНО: Водитель выходит из очереди после завершения поездки
-        # Он должен вручную нажать "Я на линии", чтобы вернуться в очередь
-        queue_manager.remove_driver(driver.id)
-        
-        # Переводим водителя в OFFLINE статус (как будто он не на линии)
-        driver.status = DriverStatus.OFFLINE
-        driver.online_since = None
-        driver.pending_order_id = None
-        driver.pending_until = None
-        # current_zone оставляем как есть (история, но водитель не в очереди)
-        db.commit()
-        
         # Обновляем сообщение водителю
-        await query.edit_message_text(
+        await outbox.edit_query_text(
+            query,
             "✅ <b>Поездка завершена!</b>\n\n"
             "Спасибо за работу!\n\n"
             "Чтобы снова выйти на линию и принимать заказы, нажмите '🟢 Я на линии'.",
@@ -395,48 +374,50 @@ async def driver_finish_callback(update: Update, context: ContextTypes.DEFAULT_T
         
         # Отправляем водителю главное меню
         try:
-            await context.bot.send_message(
+            await outbox.send_message(
+                context.bot,
                 user.id,
                 "Главное меню 👇",
+                priority=PRIORITY_BULK,
                 reply_markup=Keyboards.main_driver()
             )
         except Exception as e:
             logger.error(f"Ошибка отправки главного меню водителю: {e}", exc_info=True)
         
         # Уведомляем клиента с запросом оценки
+        customer_telegram_id = stage.customer_telegram_id
         try:
-            logger.info(f"Отправка запроса на оценку клиенту {order.customer.telegram_id} для заказа {order_id}")
+            logger.info(f"Отправка запроса на оценку клиенту {customer_telegram_id} для заказа {order_id}")
             
             rating_keyboard = Keyboards.client_rating(order_id)
             
-            await context.bot.send_message(
-                order.customer.telegram_id,
+            await outbox.send_message(
+                context.bot,
+                customer_telegram_id,
                 "🏁 <b>Поездка завершена!</b>\n\n"
                 "Пожалуйста, оцените поездку:",
                 parse_mode='HTML',
                 reply_markup=rating_keyboard
             )
             
-            logger.info(f"✅ Запрос на оценку успешно отправлен клиенту {order.customer.telegram_id}")
+            logger.info(f"✅ Запрос на оценку успешно отправлен клиенту {customer_telegram_id}")
             
             # Запускаем таймер на 60 секунд для автоматического возврата в главное меню
             # Используем asyncio.create_task вместо job_queue, так как JobQueue не установлен
             async def send_main_menu_after_delay():
                 await asyncio.sleep(60)
-                await _send_main_menu_to_client(context.bot, order.customer.telegram_id, order_id)
+                await _send_main_menu_to_client(context.bot, customer_telegram_id, order_id)
             
             asyncio.create_task(send_main_menu_after_delay())
             
         except Exception as e:
-            logger.error(f"❌ Ошибка отправки запроса на оценку клиенту {order.customer.telegram_id}: {e}", exc_info=True)
+            logger.error(f"❌ Ошибка отправки запроса на оценку клиенту {customer_telegram_id}: {e}", exc_info=True)
         
-        logger.info(f"Водитель {driver.id} завершил поездку {order_id}, вышел из очереди (должен вручную вернуться на линию)")
+        logger.info(f"Водитель {stage.driver_id} завершил поездку {order_id}, вышел из очереди (должен вручную вернуться на линию)")
         
     except Exception as e:
         logger.error(f"Ошибка при завершении поездки: {e}", exc_info=True)
-        await query.edit_message_text("❌ Произошла ошибка")
-    finally:
-        db.close()
+        await outbox.edit_query_text(query, "❌ Произошла ошибка")
 
 
 async def driver_cancel_trip_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -444,22 +425,22 @@ async def driver_cancel_trip_callback(update: Update, context: ContextTypes.DEFA
     query = update.callback_query
     await query.answer()
     
-    db = SessionLocal()
+    db = context.db
     
     try:
         _, action, order_id_str = query.data.split(":")
         order_id = int(order_id_str)
         
         user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
+        identity = UserService.get_identity(user.id, db)
         
-        if not db_user or db_user.role != UserRole.DRIVER:
-            await query.edit_message_text("❌ Вы не зарегистрированы как водитель")
+        if not identity or identity.role != UserRole.DRIVER:
+            await outbox.edit_query_text(query, "❌ Вы не зарегистрированы как водитель")
             return
         
-        driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
+        driver = db.query(Driver).filter(Driver.user_id == identity.id).first()
         if not driver:
-            await query.edit_message_text("❌ Профиль водителя не найден")
+            await outbox.edit_query_text(query, "❌ Профиль водителя не найден")
             return
         
         order = db.query(Order).filter(Order.id == order_id).first()
@@ -470,14 +451,15 @@ async def driver_cancel_trip_callback(update: Update, context: ContextTypes.DEFA
         )
         
         if not is_valid:
-            await query.edit_message_text(f"⚠️ {error_msg}")
+            await outbox.edit_query_text(query, f"⚠️ {error_msg}")
             return
         
         # Для межгорода запрашиваем причину
         if order.is_intercity:
             context.user_data['cancel_order_id'] = order_id
             context.user_data['cancel_reason_required'] = True
-            await query.edit_message_text(
+            await outbox.edit_query_text(
+                query,
                 "✍️ <b>Укажите причину отмены</b>\n\n"
                 "Напишите короткое сообщение (например: 'Техническая неисправность', 'Изменение планов').",
                 parse_mode='HTML',
@@ -491,9 +473,7 @@ async def driver_cancel_trip_callback(update: Update, context: ContextTypes.DEFA
         
     except Exception as e:
         logger.error(f"Ошибка при отмене поездки: {e}", exc_info=True)
-        await query.edit_message_text("❌ Произошла ошибка")
-    finally:
-        db.close()
+        await outbox.edit_query_text(query, "❌ Произошла ошибка")
 
 
 async def driver_cancel_reason_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -514,31 +494,32 @@ async def driver_cancel_reason_handler(update: Update, context: ContextTypes.DEF
     if text == "❌ Отмена":
         context.user_data.pop('cancel_reason_required', None)
         context.user_data.pop('cancel_order_id', None)
-        await update.message.reply_text("Отмена отмены заказа отменена.")
+        await outbox.reply_text(update.message, "Отмена отмены заказа отменена.")
         return
     
     if len(text) < 3:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "Сообщение слишком короткое. Опишите причину отмены подробнее.",
             reply_markup=Keyboards.manual_input_with_cancel()
         )
         return
     
-    db = SessionLocal()
+    db = context.db
     try:
         user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
+        identity = UserService.get_identity(user.id, db)
         
-        if not db_user or db_user.role != UserRole.DRIVER:
+        if not identity or identity.role != UserRole.DRIVER:
             context.user_data.pop('cancel_reason_required', None)
             context.user_data.pop('cancel_order_id', None)
             return
         
-        driver = db.query(Driver).filter(Driver.user_id == db_user.id).first()
+        driver = db.query(Driver).filter(Driver.user_id == identity.id).first()
         order = OrderService.get_order_by_id(db, order_id)
         
         if not driver or not order:
-            await update.message.reply_text("Заказ не найден.")
+            await outbox.reply_text(update.message, "Заказ не найден.")
             context.user_data.pop('cancel_reason_required', None)
             context.user_data.pop('cancel_order_id', None)
             return
@@ -546,7 +527,6 @@ async def driver_cancel_reason_handler(update: Update, context: ContextTypes.DEF
         await _process_cancel_order(context, order, driver, text, db)
         
     finally:
-        db.close()
         context.user_data.pop('cancel_reason_required', None)
         context.user_data.pop('cancel_order_id', None)
 
@@ -589,18 +569,20 @@ async def _process_cancel_order(context: ContextTypes.DEFAULT_TYPE, order, drive
         # Возвращаем в очередь (с сохранением FIFO порядка)
         zone = driver.current_zone.value if hasattr(driver.current_zone, 'value') else driver.current_zone
         if zone and zone != "NONE":
-            queue_manager.add_driver(driver.id, zone, db)
+            queue_manager.add_driver(driver.id, zone, db, online_since=driver.online_since)
         
         # Уведомляем водителя
         try:
-            await context.bot.send_message(
+            await outbox.send_message(
+                context.bot,
                 driver.user.telegram_id,
                 "❌ <b>Заказ отменен</b>\n\n"
                 "Вы вернулись в очередь.",
                 parse_mode='HTML'
             )
             # Отправляем главное меню водителю
-            await context.bot.send_message(
+            await outbox.send_message(
+                context.bot,
                 driver.user.telegram_id,
                 "Главное меню 👇",
                 reply_markup=Keyboards.main_driver()
@@ -618,13 +600,15 @@ async def _process_cancel_order(context: ContextTypes.DEFAULT_TYPE, order, drive
             else:
                 message += "Мы ищем другого водителя..."
             
-            await context.bot.send_message(
+            await outbox.send_message(
+                context.bot,
                 order.customer.telegram_id,
                 message,
                 parse_mode='HTML'
             )
             # Отправляем главное меню клиенту
-            await context.bot.send_message(
+            await outbox.send_message(
+                context.bot,
                 order.customer.telegram_id,
                 "Главное меню 👇",
                 reply_markup=Keyboards.main_user()
@@ -14,9 +14,9 @@ from telegram.ext import (  # pyright: ignore[reportMissingImports]
     filters
 )
 from telegram.ext import ContextTypes  # pyright: ignore[reportMissingImports]
-from database.db import SessionLocal
 from bot.services import UserService, OrderService, PricingService, UserPenaltyService
 from bot.services.broadcast_service import BroadcastService
+from bot.services.outbox import outbox, fan_out, PRIORITY_OFFER, PRIORITY_BULK
 from bot.utils import Keyboards
 from bot.models import OrderStatus, Driver, UserRole
 from bot.config import settings
@@ -45,48 +45,48 @@ async def notify_drivers_by_district(context: ContextTypes.DEFAULT_TYPE, order,
     Returns:
         int: Количество успешно уведомленных водителей
     """
-    db = SessionLocal()
+    db = context.db
     notified_count = 0
     
-    try:
-        # Получаем онлайн водителей из указанного района, отсортированных по времени отметки (FIFO)
-        online_drivers = db.query(Driver).filter(
-            Driver.is_online == True,
-            Driver.is_verified == True,
-            Driver.current_district == district
-        ).order_by(Driver.district_updated_at.asc()).all()  # FIFO - кто первый отметился
-        
-        if not online_drivers:
-            print(f"⚠️ Нет онлайн водителей в районе '{district}' для заказа #{order.id}")
-            return 0
-        
-        print(f"📢 Отправка уведомлений {len(online_drivers)} водителям из района '{district}' о заказе #{order.id}")
-        
-        # Отправляем уведомление каждому водителю
-        notification_text = (
-            "🚖 <b>НОВЫЙ ЗАКАЗ В ВАШЕМ РАЙОНЕ!</b>\n\n"
-            f"{order.display_info}\n\n"
-            "⏰ Успейте принять заказ первым!"
-        )
-        
-        for driver in online_drivers:
-            try:
-                await context.bot.send_message(
-                    chat_id=driver.user.telegram_id,
-                    text=notification_text,
-                    parse_mode='HTML',
-                    reply_markup=Keyboards.driver_order_action(order.id)
-                )
-                notified_count += 1
-                print(f"✅ Уведомлен водитель ID: {driver.user.telegram_id} ({driver.user.full_name})")
-            except Exception as e:
-                print(f"❌ Ошибка отправки уведомления водителю {driver.user.telegram_id}: {e}")
-        
-        print(f"✅ Успешно уведомлено {notified_count} из {len(online_drivers)} водителей в районе '{district}'")
-        return notified_count
-        
-    finally:
-        db.close()
+    # Получаем онлайн водителей из указанного района, отсортированных по времени отметки (FIFO)
+    online_drivers = db.query(Driver).filter(
+        Driver.is_online == True,
+        Driver.is_verified == True,
+        Driver.current_district == district
+    ).order_by(Driver.district_updated_at.asc()).all()  # FIFO - кто первый отметился
+    
+    if not online_drivers:
+        print(f"⚠️ Нет онлайн водителей в районе '{district}' для заказа #{order.id}")
+        return 0
+    
+    print(f"📢 Отправка уведомлений {len(online_drivers)} водителям из района '{district}' о заказе #{order.id}")
+    
+    # Отправляем уведомление каждому водителю
+    notification_text = (
+        "🚖 <b>НОВЫЙ ЗАКАЗ В ВАШЕМ РАЙОНЕ!</b>\n\n"
+        f"{order.display_info}\n\n"
+        "⏰ Успейте принять заказ первым!"
+    )
+    
+    # Рассылаем всем сразу: отправки стартуют в порядке FIFO
+    report = await fan_out(
+        [driver.user.telegram_id for driver in online_drivers],
+        lambda telegram_id: outbox.send_message(
+            context.bot,
+            chat_id=telegram_id,
+            text=notification_text,
+            parse_mode='HTML',
+            priority=PRIORITY_OFFER,
+            reply_markup=Keyboards.driver_order_action(order.id)
+        ),
+    )
+    for telegram_id, e in report.failed.items():
+        print(f"❌ Ошибка отправки уведомления водителю {telegram_id}: {e}")
+    notified_count = len(report.sent)
+    
+    print(f"✅ Успешно уведомлено {notified_count} из {len(online_drivers)} водителей в районе '{district}'")
+    return notified_count
+
 
 
 async def notify_online_drivers(context: ContextTypes.DEFAULT_TYPE, order):
@@ -116,22 +116,21 @@ async def notify_online_drivers(context: ContextTypes.DEFAULT_TYPE, order):
             await asyncio.sleep(60)
             
             # Проверяем статус заказа
-            db = SessionLocal()
-            try:
-                fresh_order = OrderService.get_order_by_id(db, order.id)
-                if fresh_order is not None:
-                    order_status = str(fresh_order.status.value if hasattr(fresh_order.status, 'value') else fresh_order.status)
-                    if order_status == OrderStatus.PENDING.value:
-                        # Заказ все еще ожидает, ищем в Новом Жуково
-                        print(f"⏰ Прошла 1 минута, заказ #{order.id} не принят. Поиск в Новом Жуково...")
-                        
-                        if pickup_district != "Новое Жуково":
-                            additional_notified = await notify_drivers_by_district(context, order, "Новое Жуково")
-                            notified_count += additional_notified
-                    else:
-                        print(f"✅ Заказ #{order.id} уже принят водителем")
-            finally:
-                db.close()
+            db = context.db
+            # За минуту ожидания заказ мог принять водитель: перечитываем из БД
+            db.expire_all()
+            fresh_order = OrderService.get_order_by_id(db, order.id)
+            if fresh_order is not None:
+                order_status = str(fresh_order.status.value if hasattr(fresh_order.status, 'value') else fresh_order.status)
+                if order_status == OrderStatus.PENDING.value:
+                    # Заказ все еще ожидает, ищем в Новом Жуково
+                    print(f"⏰ Прошла 1 минута, заказ #{order.id} не принят. Поиск в Новом Жуково...")
+                    
+                    if pickup_district != "Новое Жуково":
+                        additional_notified = await notify_drivers_by_district(context, order, "Новое Жуково")
+                        notified_count += additional_notified
+                else:
+                    print(f"✅ Заказ #{order.id} уже принят водителем")
         else:
             # Если в районе заказа нет водителей, сразу ищем в Новом Жуково
             print(f"⚠️ В районе '{pickup_district}' нет водителей, ищем в Новом Жуково...")
@@ -139,33 +138,32 @@ async def notify_online_drivers(context: ContextTypes.DEFAULT_TYPE, order):
     else:
         # Если район не указан, уведомляем всех
         print(f"⚠️ Район не указан, уведомляем всех онлайн водителей")
-        db = SessionLocal()
-        try:
-            online_drivers = db.query(Driver).filter(
-                Driver.is_online == True,
-                Driver.is_verified == True
-            ).all()
-            
-            notification_text = (
-                "🚖 <b>НОВЫЙ ЗАКАЗ!</b>\n\n"
-                f"{order.display_info}\n\n"
-                "⏰ Успейте принять заказ первым!"
-            )
-            
-            notified_count = 0
-            for driver in online_drivers:
-                try:
-                    await context.bot.send_message(
-                        chat_id=driver.user.telegram_id,
-                        text=notification_text,
-                        parse_mode='HTML',
-                        reply_markup=Keyboards.driver_order_action(order.id)
-                    )
-                    notified_count += 1
-                except Exception as e:
-                    print(f"❌ Ошибка: {e}")
-        finally:
-            db.close()
+        db = context.db
+        online_drivers = db.query(Driver).filter(
+            Driver.is_online == True,
+            Driver.is_verified == True
+        ).all()
+        
+        notification_text = (
+            "🚖 <b>НОВЫЙ ЗАКАЗ!</b>\n\n"
+            f"{order.display_info}\n\n"
+            "⏰ Успейте принять заказ первым!"
+        )
+        
+        report = await fan_out(
+            [driver.user.telegram_id for driver in online_drivers],
+            lambda telegram_id: outbox.send_message(
+                context.bot,
+                chat_id=telegram_id,
+                text=notification_text,
+                parse_mode='HTML',
+                priority=PRIORITY_OFFER,
+                reply_markup=Keyboards.driver_order_action(order.id)
+            ),
+        )
+        for telegram_id, e in report.failed.items():
+            print(f"❌ Ошибка: {e}")
+        notified_count = len(report.sent)
     
     return notified_count
 
@@ -178,7 +176,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     logger.info(f"🚀 /start вызван! Пользователь: {user.id if user else 'unknown'} ({user.first_name if user else 'unknown'})")
     
-    db = SessionLocal()
+    db = context.db
     
     try:
         # Создаем или получаем пользователя
@@ -241,7 +239,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             keyboard = Keyboards.main_user()
         
         logger.info(f"✓ Отправляем приветственное сообщение для {db_user.role.value}")
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             welcome_text,
             parse_mode='HTML',
             reply_markup=keyboard
@@ -250,8 +249,6 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"❌ Ошибка в /start для пользователя {user.id if user else 'unknown'}: {e}", exc_info=True)
         raise
-    finally:
-        db.close()
 
 
 async def switch_role_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -265,79 +262,77 @@ async def switch_role_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     admin_ids = set(settings.admin_ids)
 
     if admin_ids and user.id not in admin_ids:
-        await message.reply_text("❌ Эта команда доступна только администраторам.")
+        await outbox.reply_text(message, "❌ Эта команда доступна только администраторам.")
         return
 
-    db = SessionLocal()
+    db = context.db
     show_updated_menu = False
     response_text = None
 
-    try:
-        db_user = UserService.get_or_create_user(db, user)
-        current_role = db_user.role
-
-        # Определяем желаемую роль
-        args = [arg.lower() for arg in context.args] if getattr(context, "args", None) else []
-        target_role: Optional[UserRole] = None
-
-        if args:
-            arg = args[0]
-            if arg in {"driver", "водитель"}:
-                target_role = UserRole.DRIVER
-            elif arg in {"user", "customer", "клиент"}:
-                target_role = UserRole.CUSTOMER
-            elif arg in {"toggle", "сменить", "переключить"}:
-                target_role = UserRole.DRIVER if current_role != UserRole.DRIVER else UserRole.CUSTOMER
-        else:
-            # Без аргументов просто переключаем роль
+    db_user = UserService.get_or_create_user(db, user)
+    current_role = db_user.role
+
+    # Определяем желаемую роль
+    args = [arg.lower() for arg in context.args] if getattr(context, "args", None) else []
+    target_role: Optional[UserRole] = None
+
+    if args:
+        arg = args[0]
+        if arg in {"driver", "водитель"}:
+            target_role = UserRole.DRIVER
+        elif arg in {"user", "customer", "клиент"}:
+            target_role = UserRole.CUSTOMER
+        elif arg in {"toggle", "сменить", "переключить"}:
             target_role = UserRole.DRIVER if current_role != UserRole.DRIVER else UserRole.CUSTOMER
+    else:
+        # Без аргументов просто переключаем роль
+        target_role = UserRole.DRIVER if current_role != UserRole.DRIVER else UserRole.CUSTOMER
 
-        if target_role is None:
-            await message.reply_text(
-                "ℹ️ Использование: /switch_role <driver|user|toggle>\n"
-                "Без аргументов команда просто переключает текущую роль."
-            )
-            return
+    if target_role is None:
+        await outbox.reply_text(
+            message,
+            "ℹ️ Использование: /switch_role <driver|user|toggle>\n"
+            "Без аргументов команда просто переключает текущую роль."
+        )
+        return
 
-        if target_role == current_role:
-            response_text = (
-                "ℹ️ Роль уже установлена.\n"
-                f"Текущий режим: <b>{'Водитель' if current_role == UserRole.DRIVER else 'Клиент'}</b>."
-            )
-            return
+    if target_role == current_role:
+        response_text = (
+            "ℹ️ Роль уже установлена.\n"
+            f"Текущий режим: <b>{'Водитель' if current_role == UserRole.DRIVER else 'Клиент'}</b>."
+        )
+        return
 
-        driver_profile = db.query(Driver).filter(Driver.user_id == db_user.id).first()
+    driver_profile = db.query(Driver).filter(Driver.user_id == db_user.id).first()
 
-        if target_role == UserRole.DRIVER and not driver_profile:
-            await message.reply_text(
-                "❌ У вас ещё нет профиля водителя.\n"
-                "Добавьте данные через скрипт add_driver.py или обратитесь к администратору."
-            )
-            return
+    if target_role == UserRole.DRIVER and not driver_profile:
+        await outbox.reply_text(
+            message,
+            "❌ У вас ещё нет профиля водителя.\n"
+            "Добавьте данные через скрипт add_driver.py или обратитесь к администратору."
+        )
+        return
 
-        if target_role == UserRole.CUSTOMER and driver_profile:
-            driver_profile.is_online = False  # type: ignore[assignment]
+    if target_role == UserRole.CUSTOMER and driver_profile:
+        driver_profile.is_online = False  # type: ignore[assignment]
 
-        db_user.role = target_role  # type: ignore[assignment]
-        db.commit()
+    UserService.set_role(db, db_user, target_role)
 
-        show_updated_menu = True
+    show_updated_menu = True
 
-        if target_role == UserRole.DRIVER:
-            if driver_profile and not driver_profile.is_verified:
-                response_text = (
-                    "✅ Роль переключена на <b>Водителя</b>.\n"
-                    "⏳ Профиль ещё не верифицирован администратором."
-                )
-            else:
-                response_text = "✅ Роль переключена на <b>Водителя</b>."
+    if target_role == UserRole.DRIVER:
+        if driver_profile and not driver_profile.is_verified:
+            response_text = (
+                "✅ Роль переключена на <b>Водителя</b>.\n"
+                "⏳ Профиль ещё не верифицирован администратором."
+            )
         else:
-            response_text = "✅ Роль переключена на <b>Клиента</b>."
-    finally:
-        db.close()
+            response_text = "✅ Роль переключена на <b>Водителя</b>."
+    else:
+        response_text = "✅ Роль переключена на <b>Клиента</b>."
 
     if response_text:
-        await message.reply_text(response_text, parse_mode='HTML')
+        await outbox.reply_text(message, response_text, parse_mode='HTML')
 
     if show_updated_menu:
         await start_command(update, context)
@@ -367,13 +362,13 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "По всем вопросам нажмите кнопку \"Связаться\""
     )
     
-    await update.message.reply_text(help_text, parse_mode='HTML')
+    await outbox.reply_text(update.message, help_text, parse_mode='HTML')
 
 
 async def order_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало создания заказа"""
     print(f"🚖 order_start вызван! Пользователь: {update.effective_user.id}")
-    db = SessionLocal()
+    db = context.db
     
     try:
         user = update.effective_user
@@ -406,7 +401,8 @@ async def order_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         active_order = OrderService.get_active_order_by_customer(db, db_user)
         if active_order:
             print(f"⚠️ У пользователя есть активный заказ #{active_order.id}")
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 f"⚠️ <b>У вас уже есть активный заказ</b>\n\n"
                 f"{active_order.display_info_public}\n\n"
                 "Пожалуйста, завершите или отмените текущий заказ перед созданием нового.\n\n"
@@ -417,7 +413,8 @@ async def order_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return ConversationHandler.END
         
         print("✓ Нет активных заказов, показываем выбор района")
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "🏘 <b>Выберите район, где вы находитесь:</b>\n\n"
             "Это поможет быстрее найти ближайшего водителя!",
             parse_mode='HTML',
@@ -430,12 +427,11 @@ async def order_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         print(f"❌ ОШИБКА в order_start: {e}")
         import traceback
         traceback.print_exc()
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "❌ Произошла ошибка при создании заказа. Попробуйте ещё раз или обратитесь к администратору."
         )
         return ConversationHandler.END
-    finally:
-        db.close()
 
 
 async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -443,7 +439,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text or ""
 
     if text == "❌ Отмена":
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "❌ Заказ отменен.\n\n"
             "Если передумаете — просто нажмите \"Заказать такси\" снова! 🚖",
             reply_markup=Keyboards.main_menu()
@@ -459,7 +456,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if submenu == 'ufa':
         context.user_data['pickup_mode'] = None
         if text == "🔙 Назад":
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "🏘 <b>Выберите район, где вы находитесь:</b>",
                 parse_mode='HTML',
                 reply_markup=reset_to_main_keyboard()
@@ -477,7 +475,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         }
 
         if text not in ufa_options:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "⚠️ Пожалуйста, выберите район Уфы из списка ниже:",
                 reply_markup=Keyboards.select_ufa_pickup()
             )
@@ -487,7 +486,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         zone_id = PricingService.get_zone_id_by_name(selected_district)
         context.user_data.pop('pickup_submenu', None)
         if not zone_id:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "❌ Не удалось определить выбранный район. Попробуйте выбрать заново.",
                 reply_markup=Keyboards.select_ufa_pickup()
             )
@@ -498,7 +498,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['is_from_other_destination'] = False  # Явно сбрасываем для Уфы
         
         # Запрашиваем адрес
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             f"✅ <b>Район: {selected_district}</b>\n\n"
             "📍 Теперь укажите <b>точный адрес отправления</b> текстом.\n\n"
             "Например: «ул. Центральная, 15» или «Жуково, 3-я линия 4».",
@@ -509,7 +510,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif submenu == 'other_destinations':
         context.user_data['pickup_mode'] = 'other'
         if text == "🔙 Назад":
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "🏘 <b>Выберите район, где вы находитесь:</b>",
                 parse_mode='HTML',
                 reply_markup=reset_to_main_keyboard()
@@ -535,7 +537,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         }
 
         if text not in other_options:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "⚠️ Пожалуйста, выберите направление из списка ниже:",
                 reply_markup=Keyboards.select_other_destinations()
             )
@@ -546,7 +549,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data.pop('pickup_submenu', None)
         if not zone_id:
             print(f"⚠️ Не удалось определить zone_id для направления '{selected_destination}'")
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "❌ Не удалось определить выбранное направление. Попробуйте выбрать заново.",
                 reply_markup=Keyboards.select_other_destinations()
             )
@@ -559,7 +563,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data.pop('destination_submenu', None)
         
         # Запрашиваем адрес
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             f"✅ <b>Район: {selected_destination}</b>\n\n"
             "📍 Теперь укажите <b>точный адрес отправления</b> текстом.\n\n"
             "Например: «ул. Центральная, 15».",
@@ -570,7 +575,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif submenu == 'airport':
         context.user_data['pickup_mode'] = 'airport'
         if text == "🔙 Назад":
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "🏘 <b>Выберите район, где вы находитесь:</b>",
                 parse_mode='HTML',
                 reply_markup=reset_to_main_keyboard()
@@ -583,7 +589,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         }
 
         if text not in airport_options:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "⚠️ Пожалуйста, выберите терминал из списка ниже:",
                 reply_markup=Keyboards.select_airport_terminal()
             )
@@ -594,7 +601,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data.pop('pickup_submenu', None)
         if not zone_id:
             print(f"⚠️ Не удалось определить zone_id для аэропорта")
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "❌ Не удалось определить выбранный аэропорт. Попробуйте выбрать заново.",
                 reply_markup=Keyboards.select_airport_terminal()
             )
@@ -607,7 +615,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['is_from_other_destination'] = False  # Явно сбрасываем для аэропорта
         
         # Сразу переходим к выбору назначения (без запроса адреса)
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             f"✅ <b>Отправление: {selected_terminal}</b>\n\n"
             "🎯 Теперь выберите район назначения.",
             parse_mode='HTML',
@@ -618,7 +627,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif submenu == 'po_zhukovo':
         context.user_data['pickup_mode'] = 'po_zhukovo'
         if text == "🔙 Назад":
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "🏘 <b>Выберите район, где вы находитесь:</b>",
                 parse_mode='HTML',
                 reply_markup=reset_to_main_keyboard()
@@ -631,7 +641,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         }
 
         if text not in po_zhukovo_options:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "⚠️ Пожалуйста, выберите вариант из списка ниже:",
                 reply_markup=Keyboards.select_po_zhukovo_pickup()
             )
@@ -642,7 +653,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data.pop('pickup_submenu', None)
         if not zone_id:
             print(f"⚠️ Не удалось определить zone_id для района '{selected_district}'")
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "❌ Не удалось определить выбранный район. Попробуйте выбрать заново.",
                 reply_markup=Keyboards.select_po_zhukovo_pickup()
             )
@@ -653,7 +665,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['is_from_other_destination'] = False  # Явно сбрасываем для По Жуково
         
         # Запрашиваем адрес
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             f"✅ <b>Район: {selected_district}</b>\n\n"
             "📍 Теперь укажите <b>точный адрес отправления</b> текстом.\n\n"
             "Например: «ул. Центральная, 15» или «Жуково, 3-я линия 4».",
@@ -665,7 +678,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if text == "Уфа":
             context.user_data['pickup_submenu'] = 'ufa'
             context.user_data['pickup_mode'] = None
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "🏙 <b>Выберите район Уфы, где вы находитесь:</b>",
                 parse_mode='HTML',
                 reply_markup=Keyboards.select_ufa_pickup()
@@ -675,7 +689,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if text == "По Жуково":
             context.user_data['pickup_submenu'] = 'po_zhukovo'
             context.user_data['pickup_mode'] = 'po_zhukovo'
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "🚖 <b>Выберите часть Жуково, где вы находитесь:</b>",
                 parse_mode='HTML',
                 reply_markup=Keyboards.select_po_zhukovo_pickup()
@@ -687,7 +702,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data['pickup_district'] = "Дёма"
             zone_id = PricingService.get_zone_id_by_name("Дёма")
             if not zone_id:
-                await update.message.reply_text(
+                await outbox.reply_text(
+                    update.message,
                     "❌ Не удалось определить район Дёма. Попробуйте выбрать заново.",
                     reply_markup=Keyboards.select_district()
                 )
@@ -696,7 +712,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data['pickup_zone_id'] = zone_id
             context.user_data['is_from_other_destination'] = False
             
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "✅ <b>Район: Дёма (по району)</b>\n\n"
                 "📍 Укажите <b>точный адрес отправления</b> текстом.\n\n"
                 "Например: «ул. Ленина, 25» или «Дёма, ул. Мира 10».",
@@ -710,7 +727,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data['pickup_district'] = "Авдон"
             zone_id = PricingService.get_zone_id_by_name("Авдон")
             if not zone_id:
-                await update.message.reply_text(
+                await outbox.reply_text(
+                    update.message,
                     "❌ Не удалось определить район Авдон. Попробуйте выбрать заново.",
                     reply_markup=Keyboards.select_district()
                 )
@@ -719,7 +737,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data['pickup_zone_id'] = zone_id
             context.user_data['is_from_other_destination'] = False
             
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "✅ <b>Район: Авдон (по району)</b>\n\n"
                 "📍 Укажите <b>точный адрес отправления</b> текстом.\n\n"
                 "Например: «ул. Центральная, 5» или «Авдон, ул. Школьная 12».",
@@ -733,7 +752,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data['pickup_district'] = "Сергеевка"
             zone_id = PricingService.get_zone_id_by_name("Сергеевка")
             if not zone_id:
-                await update.message.reply_text(
+                await outbox.reply_text(
+                    update.message,
                     "❌ Не удалось определить район Сергеевка. Попробуйте выбрать заново.",
                     reply_markup=Keyboards.select_district()
                 )
@@ -742,7 +762,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data['pickup_zone_id'] = zone_id
             context.user_data['is_from_other_destination'] = False
             
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "✅ <b>Район: Сергеевка (по району)</b>\n\n"
                 "📍 Укажите <b>точный адрес отправления</b> текстом.\n\n"
                 "Например: «ул. Ленина, 10» или «Сергеевка, ул. Советская 25».",
@@ -755,7 +776,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if text == "Аэропорт":
             context.user_data['pickup_submenu'] = 'airport'
             context.user_data['pickup_mode'] = 'airport'
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "✈️ <b>Выберите терминал аэропорта:</b>",
                 parse_mode='HTML',
                 reply_markup=Keyboards.select_airport_terminal()
@@ -766,7 +788,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if text == "Прочие направления":
             context.user_data['pickup_submenu'] = 'other_destinations'
             context.user_data['pickup_mode'] = 'other'
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "📍 <b>Выберите направление:</b>",
                 parse_mode='HTML',
                 reply_markup=Keyboards.select_other_destinations()
@@ -785,7 +808,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         }
 
         if text not in direct_options:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "⚠️ Пожалуйста, выберите район из списка кнопок ниже:",
                 reply_markup=Keyboards.select_district()
             )
@@ -795,7 +819,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         zone_id = PricingService.get_zone_id_by_name(selected_district)
         if not zone_id:
             print(f"⚠️ Не удалось определить zone_id для района '{selected_district}'")
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "❌ Не удалось определить выбранный район. Попробуйте выбрать заново.",
                 reply_markup=Keyboards.select_district()
             )
@@ -808,7 +833,8 @@ async def district_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Сбрасываем подменю назначения, чтобы не залипало с предыдущих заказов
         context.user_data.pop('destination_submenu', None)
         
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             f"✅ <b>Район: {context.user_data['pickup_district']}</b>\n\n"
             "📍 Теперь укажите <b>точный адрес отправления</b> текстом.\n\n"
             "Например: «ул. Центральная, 15» или «Жуково, 3-я линия 4».",
@@ -824,7 +850,8 @@ async def pickup_address_handler(update: Update, context: ContextTypes.DEFAULT_T
     text = (update.message.text or "").strip()
 
     if text == "❌ Отмена":
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "❌ Заказ отменен.\n\n"
             "Если передумаете — просто нажмите \"Заказать такси\" снова! 🚖",
             reply_markup=Keyboards.main_menu()
@@ -832,7 +859,8 @@ async def pickup_address_handler(update: Update, context: ContextTypes.DEFAULT_T
         return ConversationHandler.END
 
     if len(text) < 5:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "⚠️ Адрес слишком короткий. Введите, пожалуйста, полный адрес отправления.",
             reply_markup=Keyboards.manual_input_with_cancel()
         )
@@ -848,7 +876,8 @@ async def pickup_address_handler(update: Update, context: ContextTypes.DEFAULT_T
     if pickup_mode in ['po_zhukovo', 'po_dema', 'po_avdon', 'po_sergeevka']:
         pickup_zone_id = context.user_data.get('pickup_zone_id')
         if not pickup_zone_id:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "⚠️ Не удалось определить район отправления. Пожалуйста, выберите район заново.",
                 reply_markup=Keyboards.select_district()
             )
@@ -870,7 +899,8 @@ async def pickup_address_handler(update: Update, context: ContextTypes.DEFAULT_T
 
         destination_zone_id = PricingService.get_zone_id_by_name(destination_zone_name)
         if not destination_zone_id:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 f"⚠️ Направление по {district_label} временно недоступно. Попробуйте позже или обратитесь к администратору.",
                 reply_markup=Keyboards.main_menu()
             )
@@ -880,7 +910,8 @@ async def pickup_address_handler(update: Update, context: ContextTypes.DEFAULT_T
 
         if price_result.is_intercity:
             # Внутренняя логика тарифов сохраняется, но клиенту не показываем цены
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "⚠️ Для этого направления действует межгородской режим.\n\n"
                 "Воспользуйтесь кнопкой «🛣 Межгород» в главном меню для заказа такой поездки.",
                 parse_mode='HTML',
@@ -889,7 +920,8 @@ async def pickup_address_handler(update: Update, context: ContextTypes.DEFAULT_T
             return ConversationHandler.END
 
         if price_result.is_missing or not price_result.price:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 f"⚠️ Направление по {district_label} временно недоступно. Обратитесь к диспетчеру.",
                 parse_mode='HTML',
                 reply_markup=Keyboards.main_menu()
@@ -900,7 +932,8 @@ async def pickup_address_handler(update: Update, context: ContextTypes.DEFAULT_T
         context.user_data['destination_zone_name'] = destination_zone_name
         context.user_data['calculated_price'] = float(price_result.price)
 
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             f"✅ <b>Направление:</b> {district_label}\n\n"
             f"✍️ Укажите точный адрес назначения.",
             parse_mode='HTML',
@@ -913,7 +946,8 @@ async def pickup_address_handler(update: Update, context: ContextTypes.DEFAULT_T
     is_from_other = context.user_data.get('is_from_other_destination', False)
     
     if is_from_other:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             f"✅ <b>Адрес отправления сохранен</b>\n"
             f"📍 {context.user_data['pickup_address']}\n\n"
             "🎯 Выберите район назначения из доступных:",
@@ -921,7 +955,8 @@ async def pickup_address_handler(update: Update, context: ContextTypes.DEFAULT_T
             reply_markup=Keyboards.select_destination_from_other()
         )
     else:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             f"✅ <b>Адрес отправления сохранен</b>\n"
             f"📍 {context.user_data['pickup_address']}\n\n"
             "🎯 Теперь выберите район назначения.",
@@ -941,7 +976,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
     logger.info(f"🔍 destination_zone_handler: message_text='{message_text}', submenu={destination_submenu}")
 
     if message_text == "❌ Отмена":
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "❌ Заказ отменен.\n\n"
             "Если передумаете — просто нажмите \"Заказать такси\" снова! 🚖",
             reply_markup=Keyboards.main_menu()
@@ -949,7 +985,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
         return ConversationHandler.END
 
     if message_text == "🔙 Изменить район":
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "🏘 Выберите район, где вы находитесь:",
             reply_markup=Keyboards.select_district()
         )
@@ -959,7 +996,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
     if message_text in ["По Жуково", "По Дёме", "По Авдону", "По Сергеевке"]:
         is_from_other = context.user_data.get('is_from_other_destination', False)
         keyboard = Keyboards.select_destination_from_other() if is_from_other else Keyboards.select_destination_zone()
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             f"⚠️ Кнопка «{message_text}» доступна только как отправление.\n\n"
             "Выберите, пожалуйста, район назначения.",
             reply_markup=keyboard
@@ -969,7 +1007,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
     # Обработка кнопки "Уфа" -> переход в подменю районов Уфы
     if message_text == "Уфа":
         context.user_data['destination_submenu'] = 'ufa'
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "🏙 <b>Выберите район Уфы для назначения:</b>",
             parse_mode='HTML',
             reply_markup=Keyboards.select_ufa_destination()
@@ -979,7 +1018,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
     # Обработка кнопки "Аэропорт" -> переход в подменю терминалов
     if message_text == "Аэропорт":
         context.user_data['destination_submenu'] = 'airport'
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "✈️ <b>Выберите терминал аэропорта:</b>",
             parse_mode='HTML',
             reply_markup=Keyboards.select_airport_terminal()
@@ -989,7 +1029,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
     # Обработка кнопки "Прочие направления" -> переход в подменю
     if message_text == "Прочие направления":
         context.user_data['destination_submenu'] = 'other_destinations'
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "📍 <b>Выберите направление назначения:</b>",
             parse_mode='HTML',
             reply_markup=Keyboards.select_other_destinations()
@@ -1003,7 +1044,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
         if message_text == "🔙 Назад":
             context.user_data.pop('destination_submenu', None)
             logger.info(f"✅ Обработана кнопка 🔙 Назад из submenu 'ufa', возвращаемся к select_destination_zone")
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "🎯 Выберите район назначения:",
                 reply_markup=Keyboards.select_destination_zone()
             )
@@ -1012,7 +1054,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
         # Обработка "Проспект Октября" - переход в подменю
         if message_text == "Проспект Октября":
             context.user_data['destination_submenu'] = 'prospekt_oktyabrya'
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "🏛 <b>Выберите точку на Проспекте Октября:</b>",
                 parse_mode='HTML',
                 reply_markup=Keyboards.select_prospekt_oktyabrya_submenu()
@@ -1029,7 +1072,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
         ]
         
         if message_text not in ufa_destinations:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "⚠️ Пожалуйста, выберите район Уфы из списка ниже:",
                 reply_markup=Keyboards.select_ufa_destination()
             )
@@ -1042,7 +1086,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
         if message_text == "🔙 Назад":
             context.user_data.pop('destination_submenu', None)
             logger.info(f"✅ Обработана кнопка 🔙 Назад из submenu 'other_destinations', возвращаемся к select_destination_zone")
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "🎯 Выберите район назначения:",
                 reply_markup=Keyboards.select_destination_zone()
             )
@@ -1055,7 +1100,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
         ]
         
         if message_text not in other_destinations:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "⚠️ Пожалуйста, выберите направление из списка ниже:",
                 reply_markup=Keyboards.select_other_destinations()
             )
@@ -1068,7 +1114,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
         if message_text == "🔙 Назад":
             context.user_data.pop('destination_submenu', None)
             logger.info(f"✅ Обработана кнопка 🔙 Назад из submenu 'airport', возвращаемся к select_destination_zone")
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "🎯 Выберите район назначения:",
                 reply_markup=Keyboards.select_destination_zone()
             )
@@ -1077,7 +1124,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
         airport_terminals = ["Терминал 1", "Терминал 2"]
         
         if message_text not in airport_terminals:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "⚠️ Пожалуйста, выберите терминал из списка ниже:",
                 reply_markup=Keyboards.select_airport_terminal()
             )
@@ -1091,7 +1139,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
     elif destination_submenu == 'prospekt_oktyabrya':
         if message_text == "⬅️ Назад":
             context.user_data.pop('destination_submenu', None)
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "🏙 <b>Выберите район Уфы для назначения:</b>",
                 parse_mode='HTML',
                 reply_markup=Keyboards.select_ufa_destination()
@@ -1101,7 +1150,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
         prospekt_points = ["Галле", "Горсовет", "ГДК"]
         
         if message_text not in prospekt_points:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "⚠️ Пожалуйста, выберите точку из списка ниже:",
                 reply_markup=Keyboards.select_prospekt_oktyabrya_submenu()
             )
@@ -1127,7 +1177,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
             valid_destinations = ["Старое Жуково", "Новое Жуково", "Мысовцево", "Дёма", "Авдон", "Уптино"]
             
             if message_text not in valid_destinations:
-                await update.message.reply_text(
+                await outbox.reply_text(
+                    update.message,
                     "⚠️ Для «Прочих направлений» доступны только направления:\n\n"
                     "Старое/Новое Жуково, Мысовцево, Уптино, Дёма, Авдон.",
                     reply_markup=Keyboards.select_destination_from_other()
@@ -1138,7 +1189,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
             valid_destinations = ["Старое Жуково", "Новое Жуково", "Мысовцево", "Ж/Д вокзал", "Дёма", "Авдон", "Уптино", "Затон", "ТРЦ МЕГА", "Вьетнамский рынок", "Яркий"]
             
             if message_text not in valid_destinations:
-                await update.message.reply_text(
+                await outbox.reply_text(
+                    update.message,
                     "⚠️ Пожалуйста, выберите район назначения с помощью кнопок ниже.",
                     reply_markup=Keyboards.select_destination_zone()
                 )
@@ -1146,7 +1198,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
 
     pickup_zone_id = context.user_data.get('pickup_zone_id')
     if not pickup_zone_id:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "⚠️ Сначала выберите район, где вы находитесь.",
             reply_markup=Keyboards.select_district()
         )
@@ -1154,7 +1207,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
 
     destination_zone_id = PricingService.get_zone_id_by_name(message_text)
     if not destination_zone_id:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "❌ Не удалось определить выбранный район назначения. Попробуйте еще раз.",
             reply_markup=Keyboards.select_destination_zone()
         )
@@ -1164,7 +1218,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
 
     if price_result.is_intercity:
         # Внутренняя логика тарифов сохраняется, но клиенту не показываем цены
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "⚠️ Для этого направления действует межгородской режим.\n\n"
             "Пожалуйста, выберите другой район назначения "
             "или воспользуйтесь кнопкой «🛣 Межгород» в главном меню.",
@@ -1174,7 +1229,8 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
         return SELECT_DESTINATION
 
     if price_result.is_missing:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "⚠️ Выбранное направление временно недоступно.\n\n"
             "Выберите другой район назначения или свяжитесь с диспетчером.",
             parse_mode='HTML',
@@ -1189,71 +1245,72 @@ async def destination_zone_handler(update: Update, context: ContextTypes.DEFAULT
     # Если назначение — аэропорт, адрес уже сохранён, пропускаем ввод
     if context.user_data.get('dropoff_address'):
         # Создаем заказ сразу
-        db = SessionLocal()
-        try:
-            user = update.effective_user
-            db_user = UserService.get_or_create_user(db, user)
-            
-            # Проверяем, нужен ли broadcast-режим
-            pickup_district = context.user_data.get('pickup_district', '')
-            is_broadcast = BroadcastService.is_broadcast_zone(pickup_district)
-            
-            order = OrderService.create_order(
-                db=db,
-                customer=db_user,
-                pickup_district=pickup_district,
-                pickup_address=context.user_data['pickup_address'],
-                dropoff_address=context.user_data['dropoff_address'],
-                price=context.user_data['calculated_price'],
-                dropoff_zone=context.user_data.get('destination_zone_name'),
-                is_broadcast=is_broadcast
+        db = context.db
+        user = update.effective_user
+        db_user = UserService.get_or_create_user(db, user)
+        
+        # Проверяем, нужен ли broadcast-режим
+        pickup_district = context.user_data.get('pickup_district', '')
+        is_broadcast = BroadcastService.is_broadcast_zone(pickup_district)
+        
+        order = OrderService.create_order(
+            db=db,
+            customer=db_user,
+            pickup_district=pickup_district,
+            pickup_address=context.user_data['pickup_address'],
+            dropoff_address=context.user_data['dropoff_address'],
+            price=context.user_data['calculated_price'],
+            dropoff_zone=context.user_data.get('destination_zone_name'),
+            is_broadcast=is_broadcast
+        )
+        
+        context.user_data['order_id'] = order.id
+        
+        # Если broadcast-режим, отправляем уведомления водителям
+        if is_broadcast:
+            broadcast_sent = await BroadcastService.send_broadcast(
+                db, order, update.get_bot(), context
             )
-            
-            context.user_data['order_id'] = order.id
-            
-            # Если broadcast-режим, отправляем уведомления водителям
-            if is_broadcast:
-                broadcast_sent = await BroadcastService.send_broadcast(
-                    db, order, update.get_bot(), context
+            if broadcast_sent:
+                await outbox.reply_text(
+                    update.message,
+                    "✅ <b>Заказ создан!</b>\n\n"
+                    "🔔 Уведомления отправлены водителям.\n"
+                    "Ожидайте принятия заказа...",
+                    parse_mode='HTML',
+                    reply_markup=Keyboards.main_menu()
                 )
-                if broadcast_sent:
-                    await update.message.reply_text(
-                        "✅ <b>Заказ создан!</b>\n\n"
-                        "🔔 Уведомления отправлены водителям.\n"
-                        "Ожидайте принятия заказа...",
-                        parse_mode='HTML',
-                        reply_markup=Keyboards.main_menu()
-                    )
-                    return ConversationHandler.END
-                else:
-                    await update.message.reply_text(
-                        "⚠️ Свободных водителей не найдено.\n"
-                        "Попробуйте создать заказ позже.",
-                        parse_mode='HTML',
-                        reply_markup=Keyboards.main_menu()
-                    )
-                    return ConversationHandler.END
-            
-            destination_zone = context.user_data.get('destination_zone_name', 'не указан')
-            order_summary = (
-                "📋 <b>Подтвердите заказ</b>\n\n"
-                f"{order.display_info_public}\n"
-                f"🎯 Район назначения: {destination_zone}\n\n"
-                "💬 Все вопросы по стоимости и форме оплаты вы обсуждаете напрямую с водителем."
-            )
-            
-            await update.message.reply_text(
-                order_summary,
-                parse_mode='HTML',
-                reply_markup=Keyboards.confirm_order(order.id)
-            )
-            
-            return CONFIRM_ORDER
-        finally:
-            db.close()
+                return ConversationHandler.END
+            else:
+                await outbox.reply_text(
+                    update.message,
+                    "⚠️ Свободных водителей не найдено.\n"
+                    "Попробуйте создать заказ позже.",
+                    parse_mode='HTML',
+                    reply_markup=Keyboards.main_menu()
+                )
+                return ConversationHandler.END
+        
+        destination_zone = context.user_data.get('destination_zone_name', 'не указан')
+        order_summary = (
+            "📋 <b>Подтвердите заказ</b>\n\n"
+            f"{order.display_info_public}\n"
+            f"🎯 Район назначения: {destination_zone}\n\n"
+            "💬 Все вопросы по стоимости и форме оплаты вы обсуждаете напрямую с водителем."
+        )
+        
+        await outbox.reply_text(
+            update.message,
+            order_summary,
+            parse_mode='HTML',
+            reply_markup=Keyboards.confirm_order(order.id)
+        )
+        
+        return CONFIRM_ORDER
     
     # Обычный случай - запрашиваем адрес назначения
-    await update.message.reply_text(
+    await outbox.reply_text(
+        update.message,
         "✅ <b>Направление выбрано!</b>\n\n"
         "✍️ Теперь укажите точный адрес назначения текстом.",
         parse_mode='HTML',
@@ -1268,7 +1325,8 @@ async def dropoff_address_handler(update: Update, context: ContextTypes.DEFAULT_
     text = (update.message.text or "").strip()
 
     if text == "❌ Отмена":
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "❌ Заказ отменен.\n\n"
             "Если передумаете — просто нажмите \"Заказать такси\" снова! 🚖",
             reply_markup=Keyboards.main_menu()
@@ -1276,21 +1334,24 @@ async def dropoff_address_handler(update: Update, context: ContextTypes.DEFAULT_
         return ConversationHandler.END
     
     if not context.user_data.get('destination_zone_id'):
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "⚠️ Сначала выберите район назначения.",
             reply_markup=Keyboards.select_destination_zone()
         )
         return SELECT_DESTINATION
 
     if not context.user_data.get('calculated_price'):
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "⚠️ Направление не определено. Попробуйте выбрать район назначения заново.",
             reply_markup=Keyboards.select_destination_zone()
         )
         return SELECT_DESTINATION
     
     if len(text) < 5:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "⚠️ Адрес слишком короткий. Укажите, пожалуйста, полный адрес назначения.",
             reply_markup=Keyboards.manual_input_with_cancel()
         )
@@ -1301,7 +1362,7 @@ async def dropoff_address_handler(update: Update, context: ContextTypes.DEFAULT_
     context.user_data['dropoff_lon'] = None
     
     # Создаем заказ
-    db = SessionLocal()
+    db = context.db
     try:
         user = update.effective_user
         db_user = UserService.get_or_create_user(db, user)
@@ -1340,7 +1401,8 @@ async def dropoff_address_handler(update: Update, context: ContextTypes.DEFAULT_
                 db, order, update.get_bot(), context
             )
             if broadcast_sent:
-                await update.message.reply_text(
+                await outbox.reply_text(
+                    update.message,
                     "✅ <b>Заказ создан!</b>\n\n"
                     "🔔 Уведомления отправлены водителям.\n"
                     "Ожидайте принятия заказа...",
@@ -1349,7 +1411,8 @@ async def dropoff_address_handler(update: Update, context: ContextTypes.DEFAULT_
                 )
                 return ConversationHandler.END
             else:
-                await update.message.reply_text(
+                await outbox.reply_text(
+                    update.message,
                     "⚠️ Свободных водителей не найдено.\n"
                     "Попробуйте создать заказ позже.",
                     parse_mode='HTML',
@@ -1365,7 +1428,8 @@ async def dropoff_address_handler(update: Update, context: ContextTypes.DEFAULT_
             "💬 Все вопросы по стоимости и форме оплаты вы обсуждаете напрямую с водителем."
         )
         
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             order_summary,
             parse_mode='HTML',
             reply_markup=Keyboards.confirm_order(order.id)
@@ -1376,13 +1440,12 @@ async def dropoff_address_handler(update: Update, context: ContextTypes.DEFAULT_
         print(f"❌ ОШИБКА при создании заказа: {e}")
         import traceback
         traceback.print_exc()
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "❌ Произошла ошибка при создании заказа. Попробуйте ещё раз или обратитесь к администратору.",
             reply_markup=Keyboards.main_menu()
         )
         return ConversationHandler.END
-    finally:
-        db.close()
 
 
 async def confirm_order_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1393,91 +1456,91 @@ async def confirm_order_callback(update: Update, context: ContextTypes.DEFAULT_T
     action, order_id = query.data.split(':')
     order_id = int(order_id)
     
-    db = SessionLocal()
-    try:
-        order = OrderService.get_order_by_id(db, order_id)
-        
-        if action == "confirm_order":
-            await query.edit_message_text(
-                f"✅ <b>Заказ #{order.id} подтвержден!</b>\n\n"
-                "🔍 Ищем ближайшего свободного водителя...\n"
-                "⏱ Обычно это занимает не более 1-2 минут.\n\n"
-                "📱 Вы получите уведомление, как только водитель примет заказ!\n\n"
-                "💡 <i>Следите за обновлениями в этом чате</i>\n\n"
-                "👇 Если передумали, можете отменить заказ:",
-                parse_mode='HTML',
-                reply_markup=Keyboards.customer_cancel_order(order.id)
-            )
-            
-            # Запускаем новую систему очередей
-            if order.zone:
-                from bot.handlers.user_queue import dispatch_order_to_queue
-                await dispatch_order_to_queue(order.id, db)
-            else:
-                # Fallback на старую систему если зона не установлена
-                await notify_online_drivers(context, order)
-            
-        elif action == "cancel_order":
-            OrderService.cancel_order(db, order, canceled_by="client")
-            await query.edit_message_text(
-                "❌ <b>Заказ отменен</b>\n\n"
-                "Не переживайте, вы можете создать новый заказ в любое время! 🚖",
-                parse_mode='HTML'
-            )
-        
-        # Возвращаем главное меню
-        await context.bot.send_message(
-            chat_id=query.message.chat_id,
-            text="👇 Что хотите сделать дальше?",
-            reply_markup=Keyboards.main_menu()
+    db = context.db
+    order = OrderService.get_order_by_id(db, order_id)
+    
+    if action == "confirm_order":
+        await outbox.edit_query_text(
+            query,
+            f"✅ <b>Заказ #{order.id} подтвержден!</b>\n\n"
+            "🔍 Ищем ближайшего свободного водителя...\n"
+            "⏱ Обычно это занимает не более 1-2 минут.\n\n"
+            "📱 Вы получите уведомление, как только водитель примет заказ!\n\n"
+            "💡 <i>Следите за обновлениями в этом чате</i>\n\n"
+            "👇 Если передумали, можете отменить заказ:",
+            parse_mode='HTML',
+            reply_markup=Keyboards.customer_cancel_order(order.id)
         )
         
-        return ConversationHandler.END
-    finally:
-        db.close()
+        # Запускаем новую систему очередей
+        if order.zone:
+            from bot.handlers.user_queue import dispatch_order_to_queue
+            await dispatch_order_to_queue(order.id, db)
+        else:
+            # Fallback на старую систему если зона не установлена
+            await notify_online_drivers(context, order)
+        
+    elif action == "cancel_order":
+        OrderService.cancel_order(db, order, canceled_by="client")
+        await outbox.edit_query_text(
+            query,
+            "❌ <b>Заказ отменен</b>\n\n"
+            "Не переживайте, вы можете создать новый заказ в любое время! 🚖",
+            parse_mode='HTML'
+        )
+    
+    # Возвращаем главное меню
+    await outbox.send_message(
+        context.bot,
+        chat_id=query.message.chat_id,
+        priority=PRIORITY_BULK,
+        text="👇 Что хотите сделать дальше?",
+        reply_markup=Keyboards.main_menu()
+    )
+    
+    return ConversationHandler.END
 
 
 async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """История заказов"""
     print(f"📋 history_command вызван! Пользователь: {update.effective_user.id}")
-    db = SessionLocal()
+    db = context.db
     
-    try:
-        user = update.effective_user
-        db_user = UserService.get_or_create_user(db, user)
-        print(f"✓ Пользователь найден: {db_user.full_name if db_user else 'не найден'}")
-        
-        if not await ensure_user_authenticated(update, context, db_user):
-            return
-        
-        orders = OrderService.get_customer_history(db, db_user)
-        
-        if not orders:
-            await update.message.reply_text(
-                "📋 <b>История заказов</b>\n\n"
-                "У вас пока нет завершенных заказов.\n\n"
-                "🚖 Нажмите \"Заказать такси\", чтобы сделать первый заказ!",
-                parse_mode='HTML'
-            )
-            return
-        
-        history_text = "📋 <b>История ваших поездок</b>\n\n"
-        for i, order in enumerate(orders, 1):
-            history_text += f"<b>Поездка #{i}</b>\n"
-            history_text += f"{order.display_info_public}\n"
-            if order.rating:
-                history_text += f"⭐ Ваша оценка: {order.rating}/5\n"
-            history_text += "➖➖➖➖➖➖➖➖➖\n\n"
-        
-        await update.message.reply_text(history_text, parse_mode='HTML')
-    finally:
-        db.close()
+    user = update.effective_user
+    db_user = UserService.get_or_create_user(db, user)
+    print(f"✓ Пользователь найден: {db_user.full_name if db_user else 'не найден'}")
+    
+    if not await ensure_user_authenticated(update, context, db_user):
+        return
+    
+    orders = OrderService.get_customer_history(db, db_user)
+    
+    if not orders:
+        await outbox.reply_text(
+            update.message,
+            "📋 <b>История заказов</b>\n\n"
+            "У вас пока нет завершенных заказов.\n\n"
+            "🚖 Нажмите \"Заказать такси\", чтобы сделать первый заказ!",
+            parse_mode='HTML'
+        )
+        return
+    
+    history_text = "📋 <b>История ваших поездок</b>\n\n"
+    for i, order in enumerate(orders, 1):
+        history_text += f"<b>Поездка #{i}</b>\n"
+        history_text += f"{order.display_info_public}\n"
+        if order.rating:
+            history_text += f"⭐ Ваша оценка: {order.rating}/5\n"
+        history_text += "➖➖➖➖➖➖➖➖➖\n\n"
+    
+    await outbox.reply_text(update.message, history_text, parse_mode='HTML')
 
 
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отмена текущего действия"""
     context.user_data.clear()
-    await update.message.reply_text(
+    await outbox.reply_text(
+        update.message,
         "❌ Действие отменено.\n\n"
         "Возвращаю вас в главное меню 👇",
         reply_markup=Keyboards.main_menu()
@@ -1507,7 +1570,7 @@ async def pricing_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Все вопросы по стоимости и форме оплаты вы обсуждаете напрямую с водителем."
     )
 
-    await update.message.reply_text(info_text, parse_mode='HTML')
+    await outbox.reply_text(update.message, info_text, parse_mode='HTML')
 
 
 async def contact_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1529,7 +1592,7 @@ async def contact_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Просто напишите нам, и мы обязательно поможем!"
     )
     
-    await update.message.reply_text(contact_text, parse_mode='HTML')
+    await outbox.reply_text(update.message, contact_text, parse_mode='HTML')
 
 
 async def rules_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1542,12 +1605,12 @@ async def rules_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "• Повторная отмена в течение 2 месяцев приводит к перманентной блокировке аккаунта.\n"
         "• Межгород: стоимость и детали поездки обсуждаются напрямую с водителем."
     )
-    await update.message.reply_text(rules_text, parse_mode='HTML')
+    await outbox.reply_text(update.message, rules_text, parse_mode='HTML')
 
 
 async def back_to_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Возврат в главное меню"""
-    await update.message.reply_text("👇 Главное меню", reply_markup=Keyboards.main_menu())
+    await outbox.reply_text(update.message, "👇 Главное меню", reply_markup=Keyboards.main_menu())
 
 async def intercity_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Информация о междугороднем тарифе"""
@@ -1570,59 +1633,58 @@ async def intercity_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "ℹ️ Стоимость и детали поездки уточняются напрямую с водителем."
     )
     
-    await update.message.reply_text(intercity_text, parse_mode='HTML', reply_markup=Keyboards.intercity_menu())
+    await outbox.reply_text(update.message, intercity_text, parse_mode='HTML', reply_markup=Keyboards.intercity_menu())
     return None  # Явно возвращаем None, чтобы не было ошибки с await
 
 
 async def active_order_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать активный заказ"""
     print(f"📍 active_order_command вызван! Пользователь: {update.effective_user.id}")
-    db = SessionLocal()
+    db = context.db
     
-    try:
-        user = update.effective_user
-        db_user = UserService.get_or_create_user(db, user)
-        print(f"✓ Пользователь найден: {db_user.full_name if db_user else 'не найден'}")
-        
-        if not await ensure_user_authenticated(update, context, db_user):
-            return
-        
-        # Получаем активный заказ
-        active_order = OrderService.get_active_order_by_customer(db, db_user)
-        
-        if not active_order:
-            await update.message.reply_text(
-                "✅ <b>У вас нет активных заказов</b>\n\n"
-                "Вы можете создать новый заказ, нажав кнопку \"Заказать такси\" 🚖",
-                parse_mode='HTML'
-            )
-            return
-        
-        # Показываем информацию об активном заказе с кнопкой отмены
-        status_text = {
-            "pending": "⏳ Ожидает водителя",
-            "accepted": "✅ Водитель принял заказ",
-            "in_progress": "🚗 Поездка в процессе"
-        }
-        
-        message = (
-            f"<b>📋 Ваш активный заказ</b>\n\n"
-            f"{active_order.display_info_public}\n\n"
-            f"<b>Статус:</b> {status_text.get(active_order.status, active_order.status)}\n\n"
-        )
-        
-        if active_order.driver:
-            message += f"<b>👤 Водитель:</b> {active_order.driver.full_name}\n\n"
-        
-        message += "Если хотите отменить заказ, нажмите кнопку ниже:"
-        
-        await update.message.reply_text(
-            message,
-            parse_mode='HTML',
-            reply_markup=Keyboards.customer_cancel_order(active_order.id)
+    user = update.effective_user
+    db_user = UserService.get_or_create_user(db, user)
+    print(f"✓ Пользователь найден: {db_user.full_name if db_user else 'не найден'}")
+    
+    if not await ensure_user_authenticated(update, context, db_user):
+        return
+    
+    # Получаем активный заказ
+    active_order = OrderService.get_active_order_by_customer(db, db_user)
+    
+    if not active_order:
+        await outbox.reply_text(
+            update.message,
+            "✅ <b>У вас нет активных заказов</b>\n\n"
+            "Вы можете создать новый заказ, нажав кнопку \"Заказать такси\" 🚖",
+            parse_mode='HTML'
         )
-    finally:
-        db.close()
+        return
+    
+    # Показываем информацию об активном заказе с кнопкой отмены
+    status_text = {
+        "pending": "⏳ Ожидает водителя",
+        "accepted": "✅ Водитель принял заказ",
+        "in_progress": "🚗 Поездка в процессе"
+    }
+    
+    message = (
+        f"<b>📋 Ваш активный заказ</b>\n\n"
+        f"{active_order.display_info_public}\n\n"
+        f"<b>Статус:</b> {status_text.get(active_order.status, active_order.status)}\n\n"
+    )
+    
+    if active_order.driver:
+        message += f"<b>👤 Водитель:</b> {active_order.driver.full_name}\n\n"
+    
+    message += "Если хотите отменить заказ, нажмите кнопку ниже:"
+    
+    await outbox.reply_text(
+        update.message,
+        message,
+        parse_mode='HTML',
+        reply_markup=Keyboards.customer_cancel_order(active_order.id)
+    )
 
 
 async def customer_cancel_order_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1640,118 +1702,120 @@ async def customer_cancel_order_callback(update: Update, context: ContextTypes.D
     action, order_id = query.data.split(':')
     order_id = int(order_id)
     
-    db = SessionLocal()
+    db = context.db
+    order = OrderService.get_order_by_id(db, order_id)
+    
+    # Проверяем, что заказ принадлежит этому клиенту
+    user = update.effective_user
+    db_user = UserService.get_user_by_telegram_id(db, user.id)
+    
+    if not order or order.customer_id != db_user.id:
+        await query.answer("❌ Заказ не найден", show_alert=True)
+        return
+    
+    # Проверяем, что заказ не завершен
+    if order.status in {
+        OrderStatus.COMPLETED,
+        OrderStatus.CANCELLED,
+        OrderStatus.CANCELLED_BY_CLIENT,
+        OrderStatus.CANCELLED_BY_DRIVER,
+    }:
+        await query.answer("⚠️ Этот заказ уже завершен", show_alert=True)
+        return
+    
+    # Проверяем, нужно ли применять санкции
+    penalize = False
+    if order.accepted_at:
+        elapsed = datetime.utcnow() - order.accepted_at
+        if elapsed > timedelta(minutes=5):
+            penalize = True
+
+    # Отменяем заказ
+    OrderService.cancel_order(db, order, canceled_by="client")
+    
+    # Отменяем таймеры для этого заказа (если они есть)
+    from bot.services.scheduler import scheduler
+    from bot.services.order_dispatcher import get_dispatcher
     try:
-        order = OrderService.get_order_by_id(db, order_id)
-        
-        # Проверяем, что заказ принадлежит этому клиенту
-        user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
-        
-        if not order or order.customer_id != db_user.id:
-            await query.answer("❌ Заказ не найден", show_alert=True)
-            return
-        
-        # Проверяем, что заказ не завершен
-        if order.status in {
-            OrderStatus.COMPLETED,
-            OrderStatus.CANCELLED,
-            OrderStatus.CANCELLED_BY_CLIENT,
-            OrderStatus.CANCELLED_BY_DRIVER,
-        }:
-            await query.answer("⚠️ Этот заказ уже завершен", show_alert=True)
-            return
-        
-        # Проверяем, нужно ли применять санкции
-        penalize = False
-        if order.accepted_at:
-            elapsed = datetime.utcnow() - order.accepted_at
-            if elapsed > timedelta(minutes=5):
-                penalize = True
-
-        # Отменяем заказ
-        OrderService.cancel_order(db, order, canceled_by="client")
-        
-        # Отменяем таймеры для этого заказа (если они есть)
-        from bot.services.scheduler import scheduler
-        from bot.services.order_dispatcher import get_dispatcher
-        try:
-            dispatcher = get_dispatcher()
-            await scheduler.cancel_order_timeout(order.id)
-            # Если заказ был назначен водителю, отменяем и таймер водителя
-            if order.assigned_driver_id:
-                await scheduler.cancel_driver_timeout(order.assigned_driver_id)
-        except Exception as e:
-            # Если не удалось отменить таймеры, это не критично
-            pass
-        
-        # Формируем сообщение в зависимости от статуса
-        if order.status == OrderStatus.PENDING:
-            message = (
-                "❌ <b>Заказ отменен</b>\n\n"
-                f"Заказ #{order.id} был успешно отменен.\n\n"
-                "Не переживайте, вы можете создать новый заказ в любое время! 🚖"
+        dispatcher = get_dispatcher()
+        await scheduler.cancel_order_timeout(order.id)
+        # Если заказ был назначен водителю, отменяем и таймер водителя
+        if order.assigned_driver_id:
+            await scheduler.cancel_driver_timeout(order.assigned_driver_id)
+        # Каскадная рассылка: снимаем предложения у остальных водителей
+        await dispatcher.withdraw_offers(order.id, db)
+    except Exception as e:
+        # Если не удалось отменить таймеры, это не критично
+        pass
+    
+    # Формируем сообщение в зависимости от статуса
+    if order.status == OrderStatus.PENDING:
+        message = (
+            "❌ <b>Заказ отменен</b>\n\n"
+            f"Заказ #{order.id} был успешно отменен.\n\n"
+            "Не переживайте, вы можете создать новый заказ в любое время! 🚖"
+        )
+    else:
+        message = (
+            "❌ <b>Заказ отменен</b>\n\n"
+            f"Заказ #{order.id} был отменен.\n\n"
+            "⚠️ Если водитель уже был назначен, пожалуйста, извинитесь за отмену.\n\n"
+            "🚖 Вы можете создать новый заказ в любое время!"
+        )
+    
+    await outbox.edit_query_text(query, message, parse_mode='HTML')
+
+    if penalize:
+        penalty_result = UserPenaltyService.warn_or_ban(db, db_user)
+        if penalty_result == "warning":
+            await outbox.send_message(
+                context.bot,
+                chat_id=query.message.chat_id,
+                priority=PRIORITY_BULK,
+                text="⚠️ Вы отменили поездку спустя 5 минут после подтверждения. Предупреждение действует 2 месяца."
             )
-        else:
-            message = (
-                "❌ <b>Заказ отменен</b>\n\n"
-                f"Заказ #{order.id} был отменен.\n\n"
-                "⚠️ Если водитель уже был назначен, пожалуйста, извинитесь за отмену.\n\n"
-                "🚖 Вы можете создать новый заказ в любое время!"
+        elif penalty_result == "banned":
+            await outbox.send_message(
+                context.bot,
+                chat_id=query.message.chat_id,
+                priority=PRIORITY_BULK,
+                text="⛔ Аккаунт заблокирован за повторную отмену в течение 2 месяцев. Для разблокировки обратитесь к администратору @mrbrennan"
             )
-        
-        await query.edit_message_text(message, parse_mode='HTML')
-
-        if penalize:
-            penalty_result = UserPenaltyService.warn_or_ban(db, db_user)
-            if penalty_result == "warning":
-                await context.bot.send_message(
-                    chat_id=query.message.chat_id,
-                    text="⚠️ Вы отменили поездку спустя 5 минут после подтверждения. Предупреждение действует 2 месяца."
-                )
-            elif penalty_result == "banned":
-                await context.bot.send_message(
-                    chat_id=query.message.chat_id,
-                    text="⛔ Аккаунт заблокирован за повторную отмену в течение 2 месяцев. Для разблокировки обратитесь к администратору @mrbrennan"
-                )
-        
-        # Отправляем главное меню
-        await context.bot.send_message(
-            chat_id=query.message.chat_id,
-            text="👇 Что хотите сделать дальше?",
-            reply_markup=Keyboards.main_menu()
-        )
-    finally:
-        db.close()
+    
+    # Отправляем главное меню
+    await outbox.send_message(
+        context.bot,
+        chat_id=query.message.chat_id,
+        priority=PRIORITY_BULK,
+        text="👇 Что хотите сделать дальше?",
+        reply_markup=Keyboards.main_menu()
+    )
 
 
 async def user_order_history_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды '🧾 Мои поездки' для клиента"""
-    db = SessionLocal()
+    db = context.db
     
     try:
         user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
+        identity = UserService.get_identity(user.id, db)
         
-        if not db_user:
-            await update.message.reply_text("❌ Вы не зарегистрированы в системе")
+        if not identity:
+            await outbox.reply_text(update.message, "❌ Вы не зарегистрированы в системе")
             return
         
-        # Получаем offset из callback data (для пагинации)
-        offset = 0
+        # Курсор последнего показанного заказа из callback data (для пагинации)
+        after = None
         if update.callback_query:
-            try:
-                _, offset_str = update.callback_query.data.split(":")
-                offset = int(offset_str)
-            except:
-                offset = 0
+            after = OrderService.parse_history_cursor(update.callback_query.data.split(":", 1)[1])
         
         # Получаем историю заказов
         limit = 10
-        orders = OrderService.get_user_order_history(db, db_user.id, limit=limit, offset=offset)
+        orders = OrderService.get_user_order_history(db, identity.id, limit=limit, after=after)
         
-        if not orders and offset == 0:
-            await update.message.reply_text(
+        if not orders and after is None:
+            await outbox.reply_text(
+                update.message,
                 "📭 <b>История поездок пуста</b>\n\n"
                 "У вас пока нет завершённых или отменённых заказов.",
                 parse_mode='HTML'
@@ -1816,16 +1880,18 @@ async def user_order_history_handler(update: Update, context: ContextTypes.DEFAU
         keyboard = []
         
         if len(orders) == limit:
-            keyboard.append([InlineKeyboardButton("📄 Показать ещё", callback_data=f"user_history:{offset + limit}")])
+            keyboard.append([InlineKeyboardButton("📄 Показать ещё", callback_data=f"user_history:{OrderService.history_cursor(orders[-1])}")])
         
         if update.callback_query:
-            await update.callback_query.edit_message_text(
+            await outbox.edit_query_text(
+                update.callback_query,
                 message,
                 parse_mode='HTML',
                 reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
             )
         else:
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 message,
                 parse_mode='HTML',
                 reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
@@ -1835,9 +1901,7 @@ async def user_order_history_handler(update: Update, context: ContextTypes.DEFAU
         print(f"❌ Ошибка при получении истории заказов клиента: {e}")
         import traceback
         traceback.print_exc()
-        await update.message.reply_text("❌ Произошла ошибка при загрузке истории")
-    finally:
-        db.close()
+        await outbox.reply_text(update.message, "❌ Произошла ошибка при загрузке истории")
 
 
 def register_user_handlers(application: Application):
@@ -1910,7 +1974,7 @@ def register_user_handlers(application: Application):
     application.add_handler(MessageHandler(filters.Regex('^🔙 В главное меню$'), back_to_main_menu), group=-1)
     
     # Обработчик пагинации истории
-    application.add_handler(CallbackQueryHandler(user_order_history_handler, pattern='^user_history:\d+$'), group=-1)
+    application.add_handler(CallbackQueryHandler(user_order_history_handler, pattern='^user_history:'), group=-1)
     
     # ConversationHandler регистрируем в группе 1 (НИЗКИЙ ПРИОРИТЕТ)
     # block=False позволяет другим обработчикам обрабатывать сообщения
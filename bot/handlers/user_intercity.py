@@ -15,9 +15,9 @@ from telegram.ext import (  # pyright: ignore[reportMissingImports]
     filters,
 )
 
-from database.db import SessionLocal
 from bot.models import IntercityOriginZone, Driver, DriverStatus
 from bot.services import UserService, OrderService
+from bot.services.outbox import outbox, fan_out, PRIORITY_OFFER
 from bot.handlers.auth import ensure_user_authenticated
 from bot.utils import Keyboards
 
@@ -38,26 +38,25 @@ async def start_intercity_order(update: Update, context: ContextTypes.DEFAULT_TY
     if not message:
         return ConversationHandler.END
 
-    db = SessionLocal()
-    try:
-        user = update.effective_user
-        db_user = UserService.get_or_create_user(db, user)
-        if not await ensure_user_authenticated(update, context, db_user):
-            return ConversationHandler.END
-
-        active_order = OrderService.get_active_order_by_customer(db, db_user)
-        if active_order:
-            await message.reply_text(
-                "⚠️ У вас уже есть активный заказ.\n"
-                "Сначала завершите или отмените его.",
-                reply_markup=Keyboards.customer_cancel_order(active_order.id),
-            )
-            return ConversationHandler.END
-    finally:
-        db.close()
+    db = context.db
+    user = update.effective_user
+    db_user = UserService.get_or_create_user(db, user)
+    if not await ensure_user_authenticated(update, context, db_user):
+        return ConversationHandler.END
+
+    active_order = OrderService.get_active_order_by_customer(db, db_user)
+    if active_order:
+        await outbox.reply_text(
+            message,
+            "⚠️ У вас уже есть активный заказ.\n"
+            "Сначала завершите или отмените его.",
+            reply_markup=Keyboards.customer_cancel_order(active_order.id),
+        )
+        return ConversationHandler.END
 
     context.user_data.pop("intercity_origin_zone", None)
-    await message.reply_text(
+    await outbox.reply_text(
+        message,
         "🏁 Выберите, откуда начинается поездка:",
         reply_markup=Keyboards.intercity_origin_selector(),
     )
@@ -68,12 +67,13 @@ async def intercity_origin_handler(update: Update, context: ContextTypes.DEFAULT
     message_text = (update.message.text or "").strip()
 
     if message_text == "❌ Отмена":
-        await update.message.reply_text("Отменено.", reply_markup=Keyboards.main_menu())
+        await outbox.reply_text(update.message, "Отменено.", reply_markup=Keyboards.main_menu())
         return ConversationHandler.END
 
     origin_info = ORIGIN_LABELS.get(message_text)
     if not origin_info:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "Пожалуйста, выберите вариант из списка.",
             reply_markup=Keyboards.intercity_origin_selector(),
         )
@@ -83,7 +83,8 @@ async def intercity_origin_handler(update: Update, context: ContextTypes.DEFAULT
     context.user_data["intercity_origin_zone"] = origin_zone
     context.user_data["intercity_origin_label"] = origin_label
 
-    await update.message.reply_text(
+    await outbox.reply_text(
+        update.message,
         "✍️ Введите населённый пункт или адрес назначения.",
         reply_markup=Keyboards.manual_input_with_cancel(),
     )
@@ -94,11 +95,12 @@ async def intercity_destination_handler(update: Update, context: ContextTypes.DE
     text = (update.message.text or "").strip()
 
     if text == "❌ Отмена":
-        await update.message.reply_text("Отменено.", reply_markup=Keyboards.main_menu())
+        await outbox.reply_text(update.message, "Отменено.", reply_markup=Keyboards.main_menu())
         return ConversationHandler.END
 
     if len(text) < 3:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "Адрес слишком короткий. Укажите населённый пункт или улицу полностью.",
             reply_markup=Keyboards.manual_input_with_cancel(),
         )
@@ -106,29 +108,28 @@ async def intercity_destination_handler(update: Update, context: ContextTypes.DE
 
     origin_zone = context.user_data.get("intercity_origin_zone")
     if not origin_zone:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "Не удалось определить точку отправления. Начните заново.",
             reply_markup=Keyboards.main_menu(),
         )
         return ConversationHandler.END
 
-    db = SessionLocal()
-    try:
-        user = update.effective_user
-        db_user = UserService.get_or_create_user(db, user)
-        if not await ensure_user_authenticated(update, context, db_user):
-            return ConversationHandler.END
+    db = context.db
+    user = update.effective_user
+    db_user = UserService.get_or_create_user(db, user)
+    if not await ensure_user_authenticated(update, context, db_user):
+        return ConversationHandler.END
 
-        order = OrderService.create_intercity_order(db, db_user, origin_zone, text)
-        logger.info('intercity: created from=%s to="%s"', origin_zone.value, text)
-    finally:
-        db.close()
+    order = OrderService.create_intercity_order(db, db_user, origin_zone, text)
+    logger.info('intercity: created from=%s to="%s"', origin_zone.value, text)
 
     origin_label = context.user_data.get("intercity_origin_label", "—")
     context.user_data.pop("intercity_origin_zone", None)
     context.user_data.pop("intercity_origin_label", None)
 
-    await update.message.reply_text(
+    await outbox.reply_text(
+        update.message,
         "🛣 <b>Межгородской заказ создан</b>\n\n"
         f"Откуда: {origin_label}\n"
         f"Куда: {text}\n\n"
@@ -143,7 +144,7 @@ async def intercity_destination_handler(update: Update, context: ContextTypes.DE
 
 
 async def cancel_intercity_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Отменено.", reply_markup=Keyboards.main_menu())
+    await outbox.reply_text(update.message, "Отменено.", reply_markup=Keyboards.main_menu())
     context.user_data.pop("intercity_origin_zone", None)
     context.user_data.pop("intercity_origin_label", None)
     return ConversationHandler.END
@@ -151,45 +152,48 @@ async def cancel_intercity_order(update: Update, context: ContextTypes.DEFAULT_T
 
 async def broadcast_intercity_request(order_id: int, origin_label: str, destination: str, context):
     """Рассылка межгородского запроса всем онлайн-водителям"""
-    db = SessionLocal()
-    try:
-        drivers = (
-            db.query(Driver)
-            .filter(
-                Driver.status == DriverStatus.ONLINE,
-                Driver.is_verified == True,  # noqa: E712
-            )
-            .all()
+    db = context.db
+    drivers = (
+        db.query(Driver)
+        .filter(
+            Driver.status == DriverStatus.ONLINE,
+            Driver.is_verified == True,  # noqa: E712
         )
-        count = 0
-        for driver in drivers:
-            try:
-                await context.bot.send_message(
-                    chat_id=driver.user.telegram_id,
-                    text=(
-                        f"🛣 <b>Новый межгород #{order_id}</b>\n\n"
-                        f"Откуда: {origin_label}\n"
-                        f"Куда: {destination}\n\n"
-                        "Нажмите «Откликнуться» и отправьте клиенту условия (цена/время/детали)."
-                    ),
-                    parse_mode="HTML",
-                    reply_markup=Keyboards.intercity_driver_actions(order_id),
-                )
-                count += 1
-            except Exception as exc:  # pragma: no cover - уведомление может не доставиться
-                # Если водитель не активировал бота - это нормально, не пугаем владельца
-                if "bot can't initiate conversation" in str(exc):
-                    logger.warning(
-                        "⚠️ Водитель %s (ID=%s) не активировал бота. "
-                        "Попросите его нажать /start",
-                        driver.user.full_name if driver.user else "неизвестен",
-                        driver.id
-                    )
-                else:
-                    logger.error("Не удалось уведомить водителя %s: %s", driver.id, exc)
-        logger.info("intercity: broadcast sent to %s drivers", count)
-    finally:
-        db.close()
+        .all()
+    )
+    text = (
+        f"🛣 <b>Новый межгород #{order_id}</b>\n\n"
+        f"Откуда: {origin_label}\n"
+        f"Куда: {destination}\n\n"
+        "Нажмите «Откликнуться» и отправьте клиенту условия (цена/время/детали)."
+    )
+    recipients = {driver.id: driver for driver in drivers}
+    report = await fan_out(
+        [(driver.id, driver.user.telegram_id) for driver in drivers],
+        lambda recipient: outbox.send_message(
+            context.bot,
+            chat_id=recipient[1],
+            text=text,
+            parse_mode="HTML",
+            priority=PRIORITY_OFFER,
+            reply_markup=Keyboards.intercity_driver_actions(order_id),
+        ),
+        key=lambda recipient: recipient[0],
+    )
+    for driver_id, exc in report.failed.items():  # pragma: no cover - уведомление может не доставиться
+        driver = recipients[driver_id]
+        # Если водитель не активировал бота - это нормально, не пугаем владельца
+        if "bot can't initiate conversation" in str(exc):
+            logger.warning(
+                "⚠️ Водитель %s (ID=%s) не активировал бота. "
+                "Попросите его нажать /start",
+                driver.user.full_name if driver.user else "неизвестен",
+                driver.id
+            )
+        else:
+            logger.error("Не удалось уведомить водителя %s: %s", driver.id, exc)
+    count = len(report.sent)
+    logger.info("intercity: broadcast sent to %s drivers (%s)", count, report.summary())
 
 
 async def handle_intercity_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -206,39 +210,38 @@ async def handle_intercity_select(update: Update, context: ContextTypes.DEFAULT_
         return
 
     driver_chat_id = None
-    db = SessionLocal()
-    try:
-        order = OrderService.get_order_by_id(db, order_id)
-        if not order or not order.is_intercity:
-            await query.answer("Заказ не найден", show_alert=True)
-            return
-
-        if order.customer.telegram_id != query.from_user.id:
-            await query.answer("Это не ваш заказ", show_alert=True)
-            return
-
-        if order.selected_driver_id:
-            await query.answer("Вы уже выбрали водителя", show_alert=True)
-            return
-
-        driver = db.query(Driver).filter(Driver.id == driver_id).first()
-        if not driver:
-            await query.answer("Водитель недоступен", show_alert=True)
-            return
-
-        OrderService.set_selected_driver(db, order, driver)
-        logger.info("intercity: user selected driver %s for order %s", driver_id, order_id)
-        driver_chat_id = driver.user.telegram_id
-    finally:
-        db.close()
-
-    await query.edit_message_text(
+    db = context.db
+    order = OrderService.get_order_by_id(db, order_id)
+    if not order or not order.is_intercity:
+        await query.answer("Заказ не найден", show_alert=True)
+        return
+
+    if order.customer.telegram_id != query.from_user.id:
+        await query.answer("Это не ваш заказ", show_alert=True)
+        return
+
+    if order.selected_driver_id:
+        await query.answer("Вы уже выбрали водителя", show_alert=True)
+        return
+
+    driver = db.query(Driver).filter(Driver.id == driver_id).first()
+    if not driver:
+        await query.answer("Водитель недоступен", show_alert=True)
+        return
+
+    OrderService.set_selected_driver(db, order, driver)
+    logger.info("intercity: user selected driver %s for order %s", driver_id, order_id)
+    driver_chat_id = driver.user.telegram_id
+
+    await outbox.edit_query_text(
+        query,
         "✅ Вы выбрали водителя. Ожидаем подтверждения поездки.",
         parse_mode="HTML",
     )
 
     if driver_chat_id:
-        await context.bot.send_message(
+        await outbox.send_message(
+            context.bot,
             chat_id=driver_chat_id,
             text=(
                 f"✅ Клиент выбрал вас для межгорода #{order_id}.\n"
@@ -2,7 +2,6 @@
 Интеграция системы очередей для клиентских хэндлеров
 """
 import logging
-from bot.constants import ZONE_KEY_MAP
 from bot.models.order import OrderZone
 
 logger = logging.getLogger(__name__)
@@ -21,36 +20,8 @@ def map_district_to_zone(district: str) -> str:
     if not district:
         return None
     
-    # Пробуем найти точное совпадение
-    zone_key = ZONE_KEY_MAP.get(district)
-    
-    if zone_key:
-        logger.debug(f"Район '{district}' → зона '{zone_key}'")
-        return zone_key
-    
-    # Пробуем частичное совпадение (на случай разных вариантов написания)
-    district_lower = district.lower().strip()
-    
-    mappings = {
-        "новое жуково": "NEW_ZHUKOVO",
-        "новое": "NEW_ZHUKOVO",
-        "старое жуково": "OLD_ZHUKOVO",
-        "старое": "OLD_ZHUKOVO",
-        "мысовцево": "MYSOVTSEVO",
-        "авдон": "AVDON",
-        "уптино": "UPTINO",
-        "дёма": "DEMA",
-        "дема": "DEMA",
-        "сергеевка": "SERGEEVKA",
-    }
-    
-    for key, value in mappings.items():
-        if key in district_lower:
-            logger.debug(f"Район '{district}' → зона '{value}' (частичное совпадение)")
-            return value
-    
-    logger.warning(f"Не удалось сопоставить район '{district}' с зоной")
-    return None
+    from bot.services.zone_registry import zone_registry  # локальный импорт чтобы избежать циклов
+    return zone_registry.queue_zone_for(district)
 
 
 async def dispatch_order_to_queue(order_id: int, db):
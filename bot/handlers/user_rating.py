@@ -5,10 +5,10 @@ import logging
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, CallbackQueryHandler, filters
 
-from database.db import SessionLocal
 from bot.services.user_service import UserService
 from bot.services.order_service import OrderService
-from bot.models.user import UserRole
+from bot.services.outbox import outbox, PRIORITY_BULK
+from bot.models.user import User, UserRole
 from bot.models.order import Order, OrderStatus
 
 logger = logging.getLogger(__name__)
@@ -22,7 +22,7 @@ async def rate_order_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
     
-    db = SessionLocal()
+    db = context.db
     
     try:
         # Парсим callback data: rate:{order_id}:{rating}
@@ -35,25 +35,25 @@ async def rate_order_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
             return
         
         user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
+        identity = UserService.get_identity(user.id, db)
         
-        if not db_user:
-            await query.edit_message_text("❌ Пользователь не найден")
+        if not identity:
+            await outbox.edit_query_text(query, "❌ Пользователь не найден")
             return
         
         order = db.query(Order).filter(Order.id == order_id).first()
         if not order:
-            await query.edit_message_text("❌ Заказ не найден")
+            await outbox.edit_query_text(query, "❌ Заказ не найден")
             return
         
         # Проверяем что заказ принадлежит этому клиенту
-        if order.customer_id != db_user.id:
-            await query.edit_message_text("❌ Этот заказ не принадлежит вам")
+        if order.customer_id != identity.id:
+            await outbox.edit_query_text(query, "❌ Этот заказ не принадлежит вам")
             return
         
         # Проверяем что заказ завершен
         if order.status not in [OrderStatus.FINISHED, OrderStatus.COMPLETED]:
-            await query.edit_message_text("❌ Заказ еще не завершен")
+            await outbox.edit_query_text(query, "❌ Заказ еще не завершен")
             return
         
         # Сохраняем оценку
@@ -67,7 +67,8 @@ async def rate_order_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
             logger.info(f"Таймер главного меню {job_name} отменён (клиент поставил оценку)")
         
         # Обновляем сообщение
-        await query.edit_message_text(
+        await outbox.edit_query_text(
+            query,
             f"✅ <b>Спасибо за оценку!</b>\n\n"
             f"Вы оценили поездку на {rating} {'⭐' * rating}\n\n"
             f"Хотите оставить комментарий?",
@@ -84,19 +85,19 @@ async def rate_order_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
             [InlineKeyboardButton("❌ Пропустить", callback_data=f"rate_skip_comment:{order_id}")]
         ])
         
-        await context.bot.send_message(
+        await outbox.send_message(
+            context.bot,
             chat_id=query.message.chat_id,
+            priority=PRIORITY_BULK,
             text="Хотите оставить комментарий к поездке?",
             reply_markup=comment_keyboard
         )
         
-        logger.info(f"Клиент {db_user.id} оценил заказ {order_id} на {rating} звезд")
+        logger.info(f"Клиент {identity.id} оценил заказ {order_id} на {rating} звезд")
         
     except Exception as e:
         logger.error(f"Ошибка при оценке заказа: {e}", exc_info=True)
-        await query.edit_message_text("❌ Произошла ошибка при оценке")
-    finally:
-        db.close()
+        await outbox.edit_query_text(query, "❌ Произошла ошибка при оценке")
 
 
 async def rate_comment_start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -110,15 +111,18 @@ async def rate_comment_start_callback(update: Update, context: ContextTypes.DEFA
         
         context.user_data['rating_order_id'] = order_id
         
-        await query.edit_message_text(
+        await outbox.edit_query_text(
+            query,
             "✍️ <b>Оставьте комментарий к поездке</b>\n\n"
             "Напишите ваш отзыв или нажмите 'Пропустить'",
             parse_mode='HTML'
         )
         
         from bot.utils.keyboards import Keyboards
-        await context.bot.send_message(
+        await outbox.send_message(
+            context.bot,
             chat_id=query.message.chat_id,
+            priority=PRIORITY_BULK,
             text="Введите ваш комментарий:",
             reply_markup=Keyboards.cancel_action()
         )
@@ -136,7 +140,7 @@ async def rate_comment_received(update: Update, context: ContextTypes.DEFAULT_TY
     if update.message.text in ["🟢 Я на линии", "🔴 Я оффлайн", "📋 Мои заказы", "📊 Статистика"]:
         return ConversationHandler.END
     
-    db = SessionLocal()
+    db = context.db
     
     try:
         order_id = context.user_data.get('rating_order_id')
@@ -147,15 +151,15 @@ async def rate_comment_received(update: Update, context: ContextTypes.DEFAULT_TY
         comment = update.message.text
         
         user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
+        identity = UserService.get_identity(user.id, db)
         
-        if not db_user:
-            await update.message.reply_text("❌ Пользователь не найден")
+        if not identity:
+            await outbox.reply_text(update.message, "❌ Пользователь не найден")
             return ConversationHandler.END
         
         order = db.query(Order).filter(Order.id == order_id).first()
-        if not order or order.customer_id != db_user.id:
-            await update.message.reply_text("❌ Заказ не найден")
+        if not order or order.customer_id != identity.id:
+            await outbox.reply_text(update.message, "❌ Заказ не найден")
             return ConversationHandler.END
         
         # Обновляем комментарий (оценка уже была сохранена ранее)
@@ -164,7 +168,8 @@ async def rate_comment_received(update: Update, context: ContextTypes.DEFAULT_TY
             order.feedback = comment
         db.commit()
         
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "✅ <b>Комментарий сохранен!</b>\n\n"
             "Спасибо за ваш отзыв!",
             parse_mode='HTML',
@@ -174,15 +179,17 @@ async def rate_comment_received(update: Update, context: ContextTypes.DEFAULT_TY
         # Отправляем главное меню клиенту
         from bot.utils.keyboards import Keyboards
         try:
-            await context.bot.send_message(
+            await outbox.send_message(
+                context.bot,
                 chat_id=update.effective_chat.id,
+                priority=PRIORITY_BULK,
                 text="Главное меню 👇",
                 reply_markup=Keyboards.main_user()
             )
         except Exception as e:
             logger.error(f"Ошибка отправки главного меню клиенту: {e}", exc_info=True)
         
-        logger.info(f"Клиент {db_user.id} оставил комментарий к заказу {order_id}")
+        logger.info(f"Клиент {identity.id} оставил комментарий к заказу {order_id}")
         
         # Очищаем данные
         context.user_data.pop('rating_order_id', None)
@@ -191,10 +198,8 @@ async def rate_comment_received(update: Update, context: ContextTypes.DEFAULT_TY
         
     except Exception as e:
         logger.error(f"Ошибка при сохранении комментария: {e}", exc_info=True)
-        await update.message.reply_text("❌ Произошла ошибка")
+        await outbox.reply_text(update.message, "❌ Произошла ошибка")
         return ConversationHandler.END
-    finally:
-        db.close()
 
 
 async def rate_skip_comment_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -202,7 +207,8 @@ async def rate_skip_comment_callback(update: Update, context: ContextTypes.DEFAU
     query = update.callback_query
     await query.answer()
     
-    await query.edit_message_text(
+    await outbox.edit_query_text(
+        query,
         "✅ <b>Спасибо за оценку!</b>\n\n"
         "Ваша оценка учтена.",
         parse_mode='HTML'
@@ -211,8 +217,10 @@ async def rate_skip_comment_callback(update: Update, context: ContextTypes.DEFAU
     # Отправляем главное меню клиенту
     from bot.utils.keyboards import Keyboards
     try:
-        await context.bot.send_message(
+        await outbox.send_message(
+            context.bot,
             chat_id=query.message.chat_id,
+            priority=PRIORITY_BULK,
             text="Главное меню 👇",
             reply_markup=Keyboards.main_user()
         )
@@ -230,28 +238,29 @@ async def client_coming_callback(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     await query.answer("Водитель уведомлен, что вы выходите")
     
-    db = SessionLocal()
+    db = context.db
     
     try:
         _, order_id = query.data.split(":")
         order_id = int(order_id)
         
         user = update.effective_user
-        db_user = UserService.get_user_by_telegram_id(db, user.id)
+        identity = UserService.get_identity(user.id, db)
         
-        if not db_user:
+        if not identity:
             return
         
         order = db.query(Order).filter(Order.id == order_id).first()
-        if not order or order.customer_id != db_user.id:
+        if not order or order.customer_id != identity.id:
             return
         
         # Уведомляем водителя
         if order.driver_id:
             try:
-                driver_user = db.query(db_user.__class__).filter(db_user.__class__.id == order.driver_id).first()
+                driver_user = db.query(User).filter(User.id == order.driver_id).first()
                 if driver_user:
-                    await context.bot.send_message(
+                    await outbox.send_message(
+                        context.bot,
                         driver_user.telegram_id,
                         "🚶 <b>Клиент выходит</b>\n\n"
                         "Клиент сообщил, что выходит к месту подачи.",
@@ -262,8 +271,6 @@ async def client_coming_callback(update: Update, context: ContextTypes.DEFAULT_T
         
     except Exception as e:
         logger.error(f"Ошибка при обработке выхода клиента: {e}", exc_info=True)
-    finally:
-        db.close()
 
 
 async def client_cancel_arrived_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -14,6 +14,7 @@ from bot.handlers import (
 )
 from bot.handlers.broadcast_handlers import register_broadcast_handlers
 from bot.middlewares.ban_guard import install_ban_guard
+from bot.middlewares.db_session import install_db_session
 from database.db import init_db, SessionLocal
 
 # Настройка логирования
@@ -29,18 +30,66 @@ async def post_init(application: Application) -> None:
     """Действия после инициализации бота"""
     logger.info("Инициализация системы очередей...")
     
+    # Реестр зон (район ↔ тариф ↔ очередь) собирается один раз до первого заказа
+    from bot.services.zone_registry import zone_registry
+    zone_registry.load()
+    
+    # Очередь исходящих сообщений (лимиты Telegram и приоритеты)
+    from bot.services.outbox import outbox
+    outbox.start()
+    
     # Инициализируем диспетчер заказов
     from bot.services.order_dispatcher import init_dispatcher
     init_dispatcher(application.bot)
     logger.info("Order Dispatcher инициализирован")
     
-    # Перестраиваем очереди из БД
+    # Восстанавливаем очереди: из журнала (мгновенно) или перестройкой из БД
     from bot.services.queue_manager import queue_manager
+    from bot.services.queue_journal import QueueJournal
     from bot.services.scheduler import scheduler
+    restored = False
+    if settings.queue_backend == "db":
+        # Общая очередь в БД уже переживает рестарт — не перестраиваем её,
+        # чтобы не сбить порядок у остальных воркеров, только сверяем в фоне
+        from bot.services.queue_backends import DatabaseQueueBackend
+        queue_manager.set_backend(DatabaseQueueBackend(SessionLocal))
+        restored = True
+    elif settings.queue_journal_path:
+        queue_manager.attach_journal(
+            QueueJournal(settings.queue_journal_path, settings.queue_journal_compact_every)
+        )
+        restored = queue_manager.restore_from_journal()
+    
+    if restored:
+        # Очереди уже готовы к распределению, сверка с БД идёт в фоне
+        application.create_task(queue_manager.reconcile_with_db_async())
+        logger.info("Очереди водителей восстановлены без перестройки, сверка с БД запущена в фоне")
+    else:
+        db = SessionLocal()
+        try:
+            queue_manager.rebuild_from_db(db)
+            logger.info("Очереди водителей восстановлены из БД")
+        finally:
+            db.close()
+    
+    # Таймауты предложений и заказов, прерванные остановкой бота
+    from bot.services.broadcast_service import BroadcastService, BROADCAST_TIMEOUT_HANDLER
+    from bot.services.order_dispatcher import DRIVER_TIMEOUT_HANDLER
+    from bot.services.timer_store import TimerStore
+    scheduler.attach_store(TimerStore(SessionLocal))
+    scheduler.register_handler(
+        BROADCAST_TIMEOUT_HANDLER,
+        lambda oid: BroadcastService.expire_broadcast_window(application.bot, oid)
+    )
+    await scheduler.restore_timers(offer_handler=DRIVER_TIMEOUT_HANDLER)
+    
+    # Заказы, ждавшие водителя в своей зоне до остановки бота
+    from bot.services.order_dispatcher import get_dispatcher
     db = SessionLocal()
     try:
-        queue_manager.rebuild_from_db(db)
-        logger.info("Очереди водителей восстановлены из БД")
+        waiting = get_dispatcher().restore_waiting_orders(db)
+        if waiting:
+            logger.info(f"Восстановлено заказов, ожидающих водителя: {waiting}")
     finally:
         db.close()
     
@@ -48,6 +97,9 @@ async def post_init(application: Application) -> None:
     logger.info("Ночная очистка предупреждений активирована")
     await scheduler.start_broadcast_cleanup_loop()
     logger.info("Фоновая очистка просроченных broadcast-резервов активирована")
+    if settings.order_archive_after_days > 0:
+        await scheduler.start_order_archive_loop()
+        logger.info("Ночная архивация заказов активирована")
     
     logger.info("Бот инициализирован и готов к работе")
 
@@ -60,6 +112,18 @@ async def post_shutdown(application: Application) -> None:
     from bot.services.scheduler import scheduler
     await scheduler.cancel_all()
     
+    # Досылаем то, что осталось в очереди исходящих сообщений
+    from bot.services.outbox import outbox
+    await outbox.stop()
+    
+    # Фиксируем очереди снапшотом журнала для тёплого рестарта
+    from bot.services.queue_manager import queue_manager
+    queue_manager.close_journal()
+    
+    # Закрываем соединения асинхронного движка БД
+    from database.db import dispose_async_engine
+    await dispose_async_engine()
+    
     logger.info("Бот остановлен")
 
 
@@ -95,8 +159,9 @@ def main():
     init_db()
     
     # Создание приложения с правильной регистрацией callbacks
+    # и одной сессией БД на каждое обновление (context.db)
     application = (
-        Application.builder()
+        install_db_session(Application.builder())
         .token(settings.telegram_bot_token)
         .post_init(post_init)
         .post_shutdown(post_shutdown)
@@ -117,7 +182,13 @@ def main():
     # Регистрация обработчика ошибок
     application.add_error_handler(error_handler)
     
-    # Запуск бота
+    # Запуск бота: webhook, если задан TELEGRAM_WEBHOOK_URL, иначе long polling
+    if settings.telegram_webhook_url:
+        from bot.webhook import run_webhook
+        logger.info("✅ Бот запущен в режиме webhook!")
+        run_webhook(application)
+        return
+    
     logger.info("✅ Бот запущен и работает!")
     try:
         application.run_polling(
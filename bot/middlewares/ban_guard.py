@@ -12,8 +12,8 @@ from telegram.ext import (  # pyright: ignore[reportMissingImports]
     ApplicationHandlerStop,
 )
 
-from database.db import SessionLocal
 from bot.services import UserService
+from bot.services.outbox import outbox, PRIORITY_BULK
 from bot.services.user_penalty_service import EXEMPT_USER_TELEGRAM_ID
 
 logger = logging.getLogger(__name__)
@@ -29,21 +29,20 @@ async def _ban_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if tg_user.id == EXEMPT_USER_TELEGRAM_ID:
         return
 
-    db = SessionLocal()
-    try:
-        db_user = UserService.get_user_by_telegram_id(db, tg_user.id)
-        if db_user and db_user.is_banned:
-            await context.bot.send_message(
-                chat_id=tg_user.id,
-                text=(
-                    "⛔ Аккаунт заблокирован за повторную отмену поездок в течение 2 месяцев.\n"
-                    "Для разблокировки обратитесь к администратору @mrbrennan"
-                ),
-            )
-            logger.warning("Блокируем событие от забаненного пользователя %s", tg_user.id)
-            raise ApplicationHandlerStop()
-    finally:
-        db.close()
+    # Бан берём из кеша пользователей: в БД идём только при промахе
+    identity = await UserService.get_identity_async(tg_user.id)
+    if identity and identity.is_banned:
+        await outbox.send_message(
+            context.bot,
+            chat_id=tg_user.id,
+            priority=PRIORITY_BULK,
+            text=(
+                "⛔ Аккаунт заблокирован за повторную отмену поездок в течение 2 месяцев.\n"
+                "Для разблокировки обратитесь к администратору @mrbrennan"
+            ),
+        )
+        logger.warning("Блокируем событие от забаненного пользователя %s", tg_user.id)
+        raise ApplicationHandlerStop()
 
 
 def install_ban_guard(application: Application):
@@ -0,0 +1,166 @@
+"""
+Middleware: одна сессия БД на обновление Telegram
+Все обработчики одного обновления (auth, ban guard, основной хэндлер) работают
+с общей сессией из context.db вместо того, чтобы каждый открывал свою.
+В конце обновления сессия коммитится (или откатывается, если обработчик упал)
+и закрывается; число запросов и время в БД пишутся в лог и в общую статистику.
+"""
+from __future__ import annotations
+
+import logging
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy.orm import Session
+from telegram.ext import (  # pyright: ignore[reportMissingImports]
+    Application,
+    ApplicationBuilder,
+    CallbackContext,
+    ContextTypes,
+)
+
+from bot.config import settings
+from database.db import SessionLocal, count_queries
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDbScope:
+    """Сессия и счётчики одного обновления"""
+
+    def __init__(self, update_id: Optional[int]):
+        self.update_id = update_id
+        self.active = True
+        self.failed = False
+        self.queries = 0
+        self.db_time = 0.0
+        self._session: Optional[Session] = None
+
+    @property
+    def session(self) -> Session:
+        """Сессия открывается при первом обращении: обновления без БД соединение не берут"""
+        if self._session is None:
+            self._session = SessionLocal()
+        return self._session
+
+    def finish(self):
+        """Коммит при успехе, откат при ошибке обработчика; сессия закрывается всегда"""
+        self.active = False
+        db = self._session
+        if db is None:
+            return
+        try:
+            if self.failed:
+                db.rollback()
+            else:
+                db.commit()
+        except Exception as e:
+            logger.warning("Обновление %s: не удалось зафиксировать сессию: %s", self.update_id, e)
+            db.rollback()
+        finally:
+            db.close()
+
+
+_current_scope: ContextVar[Optional[UpdateDbScope]] = ContextVar("update_db_scope", default=None)
+
+# Сводная статистика по обработанным обновлениям (для /queue_status)
+_totals = {"updates": 0, "with_db": 0, "queries": 0, "db_time": 0.0, "max_queries": 0, "slow": 0}
+
+
+def _active_scope() -> Optional[UpdateDbScope]:
+    scope = _current_scope.get()
+    return scope if scope is not None and scope.active else None
+
+
+class DbContext(CallbackContext):
+    """CallbackContext с сессией обновления в context.db"""
+
+    @property
+    def db(self) -> Session:
+        scope = _active_scope()
+        if scope is None:
+            raise RuntimeError("context.db доступен только во время обработки обновления")
+        return scope.session
+
+
+def _record(scope: UpdateDbScope, is_update: bool):
+    if is_update:
+        _totals["updates"] += 1
+    if not scope.queries:
+        return
+    _totals["with_db"] += 1
+    _totals["queries"] += scope.queries
+    _totals["db_time"] += scope.db_time
+    _totals["max_queries"] = max(_totals["max_queries"], scope.queries)
+
+    db_ms = scope.db_time * 1000
+    if scope.queries > settings.db_update_warn_queries or db_ms > settings.db_update_warn_ms:
+        _totals["slow"] += 1
+        logger.warning(
+            "Обновление %s: %s запросов, %.1f мс в БД",
+            scope.update_id, scope.queries, db_ms,
+        )
+    else:
+        logger.debug(
+            "Обновление %s: %s запросов, %.1f мс в БД",
+            scope.update_id, scope.queries, db_ms,
+        )
+
+
+async def _run_in_scope(awaitable, update: object, is_update: bool = True):
+    """Выполнить обработку обновления (или его неблокирующего обработчика) в собственной сессии БД"""
+    scope = UpdateDbScope(getattr(update, "update_id", None))
+    token = _current_scope.set(scope)
+    with count_queries() as counter:
+        try:
+            return await awaitable
+        except BaseException:
+            scope.failed = True
+            raise
+        finally:
+            # Коммит тоже считается временем обновления в БД
+            scope.finish()
+            _current_scope.reset(token)
+            scope.queries = int(counter["queries"])
+            scope.db_time = counter["db_time"]
+            _record(scope, is_update)
+
+
+class DbSessionApplication(Application):
+    """Application, открывающий сессию БД на каждое обновление"""
+
+    async def process_update(self, update: object) -> None:
+        await _run_in_scope(super().process_update(update), update)
+
+    def create_task(self, coroutine, update: object = None, *, name: Optional[str] = None):
+        # Обработчики с block=False выполняются отдельной задачей уже после
+        # process_update — им нужна своя сессия, а не закрытая общая
+        if update is not None:
+            coroutine = _run_in_scope(coroutine, update, is_update=False)
+        return super().create_task(coroutine, update=update, name=name)
+
+    async def process_error(self, update, error, job=None, coroutine=None) -> bool:
+        scope = _active_scope()
+        if scope is not None:
+            scope.failed = True
+        return await super().process_error(update, error, job=job, coroutine=coroutine)
+
+
+def install_db_session(builder: ApplicationBuilder) -> ApplicationBuilder:
+    """Подключить сессию на обновление к строящемуся Application"""
+    return builder.application_class(DbSessionApplication).context_types(
+        ContextTypes(context=DbContext)
+    )
+
+
+def get_update_db_stats() -> dict:
+    """Сводка по запросам в БД на одно обновление"""
+    with_db = _totals["with_db"]
+    return {
+        "updates": _totals["updates"],
+        "with_db": with_db,
+        "avg_queries": round(_totals["queries"] / with_db, 1) if with_db else 0.0,
+        "avg_db_ms": round(_totals["db_time"] * 1000 / with_db, 1) if with_db else 0.0,
+        "max_queries": _totals["max_queries"],
+        "slow": _totals["slow"],
+    }
@@ -11,6 +11,10 @@ from .order import (
     OrderTariff,
     IntercityOriginZone,
 )
+from .order_archive import ArchivedOrder
+from .queue_entry import QueueEntry
+from .scheduled_timer import ScheduledTimer
+from .stats_rollup import StatsRollup
 
 __all__ = [
     "User",
@@ -24,5 +28,9 @@ __all__ = [
     "OrderZone",
     "OrderTariff",
     "IntercityOriginZone",
+    "ArchivedOrder",
+    "QueueEntry",
+    "ScheduledTimer",
+    "StatsRollup",
 ]
 
@@ -3,7 +3,7 @@
 """
 from datetime import datetime
 from enum import Enum
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Index, Enum as SQLEnum
 from sqlalchemy.orm import relationship
 from database.db import Base
 
@@ -47,6 +47,7 @@ class Driver(Base):
     rating = Column(Float, default=5.0)  # Средний рейтинг (DEPRECATED: используйте rating_avg)
     rating_avg = Column(Float, default=0.0)  # Средний рейтинг (истинный)
     rating_count = Column(Integer, default=0)  # Количество оценок
+    rating_sum = Column(Integer, default=0)  # Сумма оценок: rating_avg = rating_sum / rating_count
     total_rides = Column(Integer, default=0)  # Общее количество поездок (DEPRECATED: используйте completed_trips_count)
     completed_trips_count = Column(Integer, default=0)  # Счётчик завершённых поездок
     is_verified = Column(Boolean, default=False)
@@ -91,6 +92,11 @@ class Driver(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        # Все выборки QueueManager: status + зона + без pending, порядок по online_since
+        Index("ix_drivers_queue_lookup", "status", "current_zone", "pending_order_id", "online_since"),
+    )
+    
     # Relationships
     user = relationship("User", backref="driver_profile", foreign_keys=[user_id])
     
@@ -13,6 +13,7 @@ from sqlalchemy import (
     Text,
     Enum as SQLEnum,
     Boolean,
+    Index,
 )
 from sqlalchemy.orm import relationship
 from database.db import Base
@@ -164,6 +165,18 @@ class Order(Base):
     completed_at = Column(DateTime, nullable=True)  # DEPRECATED: используйте finished_at
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        # Активный заказ клиента
+        Index("ix_orders_customer_status_finished", "customer_id", "status", "finished_at"),
+        # Пересчёт рейтинга водителя и его последние оценки
+        Index("ix_orders_driver_rating", "assigned_driver_id", "rating"),
+        # Keyset-пагинация истории клиента и водителя: (finished_at, id) < курсора
+        Index("ix_orders_customer_history", "customer_id", "finished_at", "id"),
+        Index("ix_orders_driver_history", "assigned_driver_id", "finished_at", "id"),
+        # id не переиспользуются после архивации: иначе новый заказ получит id из orders_archive
+        {"sqlite_autoincrement": True},
+    )
+    
     # Relationships
     customer = relationship("User", foreign_keys=[customer_id], backref="orders_as_customer")
     driver = relationship("User", foreign_keys=[driver_id], backref="orders_as_driver")
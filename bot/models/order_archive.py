@@ -0,0 +1,50 @@
+"""
+Модель архивного заказа
+Завершённые и отменённые заказы старше ORDER_ARCHIVE_AFTER_DAYS переносятся
+из orders в orders_archive (см. OrderArchiveService): живая таблица остаётся
+маленькой, история клиента и водителя читается из обеих.
+"""
+from sqlalchemy import Index, Table
+from sqlalchemy.orm import relationship
+from database.db import Base
+from .order import Order
+
+
+def _archive_columns():
+    """Копии колонок orders без одиночных индексов: архиву нужны только индексы истории"""
+    columns = []
+    for column in Order.__table__.columns:
+        copy = column._copy()
+        copy.index = None
+        columns.append(copy)
+    return columns
+
+
+class ArchivedOrder(Base):
+    """Заказ в архиве: те же колонки и id, что были в orders"""
+    __table__ = Table(
+        "orders_archive",
+        Base.metadata,
+        *_archive_columns(),
+        # Keyset-пагинация истории клиента и водителя (finished_at, id)
+        Index("ix_orders_archive_customer_history", "customer_id", "finished_at", "id"),
+        Index("ix_orders_archive_driver_history", "assigned_driver_id", "finished_at", "id"),
+    )
+    
+    # Внешних ключей в архиве нет, связи только для чтения
+    customer = relationship(
+        "User", primaryjoin="foreign(ArchivedOrder.customer_id) == User.id", viewonly=True
+    )
+    driver = relationship(
+        "User", primaryjoin="foreign(ArchivedOrder.driver_id) == User.id", viewonly=True
+    )
+    selected_driver = relationship(
+        "Driver", primaryjoin="foreign(ArchivedOrder.selected_driver_id) == Driver.id", viewonly=True
+    )
+    
+    # Отображение такое же, как у живого заказа
+    display_info = Order.display_info
+    display_info_public = Order.display_info_public
+    
+    def __repr__(self):
+        return f"<ArchivedOrder(id={self.id}, status={self.status}, price={self.price})>"
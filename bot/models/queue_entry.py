@@ -0,0 +1,27 @@
+"""
+Модель записи очереди водителей (общая очередь для нескольких воркеров)
+"""
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from database.db import Base
+
+# Ключ сортировки для водителей без online_since (стоят в конце очереди)
+QUEUE_TAIL_KEY = datetime(9999, 12, 31)
+
+
+class QueueEntry(Base):
+    """Водитель в очереди зоны"""
+    __tablename__ = "driver_queue"
+    
+    driver_id = Column(Integer, ForeignKey("drivers.id"), primary_key=True)
+    zone = Column(String, nullable=False)
+    online_since = Column(DateTime, nullable=True)  # Реальное время выхода на линию
+    sort_key = Column(DateTime, nullable=False)  # online_since или QUEUE_TAIL_KEY
+    enqueued_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_driver_queue_zone_order", "zone", "sort_key", "driver_id"),
+    )
+    
+    def __repr__(self):
+        return f"<QueueEntry(driver_id={self.driver_id}, zone={self.zone}, online_since={self.online_since})>"
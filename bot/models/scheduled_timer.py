@@ -0,0 +1,23 @@
+"""
+Модель сохранённого таймера планировщика (переживает перезапуск бота)
+"""
+from sqlalchemy import Column, Integer, String, DateTime, Index
+from database.db import Base
+
+
+class ScheduledTimer(Base):
+    """Активный таймаут водителя или заказа"""
+    __tablename__ = "scheduled_timers"
+    
+    kind = Column(String(16), primary_key=True)  # driver / order
+    key = Column(Integer, primary_key=True)  # driver_id или order_id
+    order_id = Column(Integer, nullable=True)  # Заказ, к которому относится таймер водителя
+    handler = Column(String(64), nullable=False)  # Имя зарегистрированного обработчика
+    due_at = Column(DateTime, nullable=False)  # Когда сработать (UTC)
+    
+    __table_args__ = (
+        Index("ix_scheduled_timers_due_at", "due_at"),
+    )
+    
+    def __repr__(self):
+        return f"<ScheduledTimer(kind={self.kind}, key={self.key}, handler={self.handler}, due_at={self.due_at})>"
@@ -0,0 +1,38 @@
+"""
+Модель свёрнутой статистики заказов (по часам, суткам и за всё время)
+Строки обновляются в момент событий заказа (создан, завершён, отменён, истёк)
+в той же транзакции, см. StatsService — статистика читается без обхода истории.
+"""
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime, Float
+from database.db import Base
+
+# bucket для строк за всё время
+ALL_TIME_BUCKET = datetime(1970, 1, 1)
+
+
+class StatsRollup(Base):
+    """Счётчики заказов за один период в одном разрезе"""
+    __tablename__ = "stats_rollups"
+    
+    period = Column(String(8), primary_key=True)  # hour / day / all
+    bucket = Column(DateTime, primary_key=True)  # Начало часа или суток (местное время), для all — ALL_TIME_BUCKET
+    scope = Column(String(8), primary_key=True)  # total / zone / driver
+    key = Column(String(32), primary_key=True)  # Зона или id водителя, для total — ""
+    
+    orders = Column(Integer, default=0, nullable=False)  # Создано заказов
+    completed = Column(Integer, default=0, nullable=False)  # Завершено поездок
+    cancelled = Column(Integer, default=0, nullable=False)  # Отменено (клиентом, водителем, системой)
+    expired = Column(Integer, default=0, nullable=False)  # Истекло без водителя
+    revenue = Column(Float, default=0.0, nullable=False)  # Сумма цен завершённых поездок
+    
+    @property
+    def avg_check(self) -> float:
+        """Средний чек завершённой поездки"""
+        return self.revenue / self.completed if self.completed else 0.0
+    
+    def __repr__(self):
+        return (
+            f"<StatsRollup(period={self.period}, bucket={self.bucket}, scope={self.scope}, key={self.key}, "
+            f"orders={self.orders}, completed={self.completed})>"
+        )
@@ -1,10 +1,11 @@
 """
 Сервисы бота
 """
+from .claim_service import ClaimService
 from .order_service import OrderService
 from .pricing_service import PricingService
 from .user_service import UserService
 from .user_penalty_service import UserPenaltyService
 
-__all__ = ["OrderService", "PricingService", "UserService", "UserPenaltyService"]
+__all__ = ["ClaimService", "OrderService", "PricingService", "UserService", "UserPenaltyService"]
 
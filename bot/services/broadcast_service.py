@@ -12,24 +12,17 @@ from telegram.error import BadRequest
 from bot.models.driver import Driver, DriverStatus
 from bot.models.order import Order, OrderStatus
 from bot.models.user import User
+from bot.services.claim_service import ClaimService, CLAIM_DRIVER_BUSY, CLAIM_ORDER_TAKEN
+from bot.services.outbox import outbox, fan_out, PRIORITY_OFFER
 from bot.services.scheduler import scheduler
+from bot.services.stats_service import StatsService
 from bot.services.queue_manager import queue_manager
-from bot.services.queue_manager import queue_manager
-
-
-# Зоны, которые используют broadcast-режим
-BROADCAST_ZONES = [
-    "Уфа-Центр", "Телецентр", "Сипайлово", "Черниковка", "Чесноковка",
-    "Инорс", "Зелёная роща",  # Уфа
-    "Ж/Д вокзал",  # ЖД
-    "Аэропорт",  # Аэропорт с терминалами
-    "Дмитриевка", "Михайловка", "Миловский Парк", "Миловка",
-    "Николаевка", "Юматово", "Алкино", "Кафе Отдых",
-    "Иглино", "Шакша", "Акбердино", "Нагаево", "Чишмы"  # Прочие направления
-]
+from bot.services.zone_registry import zone_registry
+from bot.constants import BROADCAST_ZONES  # noqa: F401  (список переехал в constants)
 
 # Настройки таймингов
 BROADCAST_WINDOW_SECONDS = 30  # Окно для откликов
+BROADCAST_TIMEOUT_HANDLER = "broadcast.window_timeout"  # Обработчик таймера окна (переживает рестарт)
 MAX_ETA_FOR_RESERVE_MINUTES = 15  # Макс ETA для резервации занятым
 RESERVE_TTL_MINUTES = 15  # Срок действия резерва
 
@@ -39,12 +32,8 @@ class BroadcastService:
     
     @staticmethod
     def is_broadcast_zone(pickup_district: str) -> bool:
-        """Проверяет, является ли зона broadcast-зоной"""
-        # Проверяем по списку или если начинается с "Аэропорт, Терминал"
-        return (
-            pickup_district in BROADCAST_ZONES or
-            pickup_district.startswith("Аэропорт")
-        )
+        """Проверяет, является ли зона broadcast-зоной (по реестру зон)"""
+        return zone_registry.is_broadcast(pickup_district)
     
     @staticmethod
     def get_eligible_drivers(
@@ -95,95 +84,101 @@ class BroadcastService:
             print(f"⚠️  Нет доступных водителей для broadcast заказа #{order.id}")
             return False
         
-        sent_count = 0
-        
         # Формируем сообщение для водителей
         order_info = BroadcastService._format_order_info(order)
-        
-        # Отправляем свободным водителям
-        for driver in free_drivers:
-            try:
-                keyboard = InlineKeyboardMarkup([[
-                    InlineKeyboardButton(
-                        "✅ Принять",
-                        callback_data=f"broadcast_accept:{order.id}"
-                    )
-                ]])
-                
-                await bot.send_message(
-                    chat_id=driver.user.telegram_id,
+        accept_keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton(
+                "✅ Принять",
+                callback_data=f"broadcast_accept:{order.id}"
+            )
+        ]])
+        reserve_keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton(
+                "📌 Взять после текущей",
+                callback_data=f"broadcast_reserve:{order.id}"
+            )
+        ]])
+        
+        # Получатели: сначала свободные водители, затем занятые "по пути"
+        recipients = [(driver.id, driver.user.telegram_id, None) for driver in free_drivers]
+        recipients += [
+            (driver.id, driver.user.telegram_id, driver.eta_to_finish) for driver in busy_drivers
+        ]
+        free_ids = {driver.id for driver in free_drivers}
+        
+        async def send_to_driver(recipient):
+            driver_id, chat_id, eta_to_finish = recipient
+            if driver_id in free_ids:
+                return await outbox.send_message(
+                    bot,
+                    chat_id=chat_id,
                     text=f"🔔 <b>Новый заказ (broadcast)</b>\n\n{order_info}",
                     parse_mode='HTML',
-                    reply_markup=keyboard
+                    priority=PRIORITY_OFFER,
+                    reply_markup=accept_keyboard
                 )
-                sent_count += 1
-                print(f"✅ Broadcast отправлен свободному водителю #{driver.id}")
-            except Exception as e:
-                print(f"❌ Ошибка отправки broadcast водителю #{driver.id}: {e}")
-        
-        # Отправляем занятым "по пути"
-        for driver in busy_drivers:
-            try:
-                keyboard = InlineKeyboardMarkup([[
-                    InlineKeyboardButton(
-                        "📌 Взять после текущей",
-                        callback_data=f"broadcast_reserve:{order.id}"
-                    )
-                ]])
-                
-                eta_text = f"(≈ {driver.eta_to_finish} мин)" if driver.eta_to_finish else ""
-                await bot.send_message(
-                    chat_id=driver.user.telegram_id,
-                    text=(
-                        f"🔔 <b>Новый заказ (резерв)</b>\n\n"
-                        f"{order_info}\n\n"
-                        f"💡 Вы можете зарезервировать этот заказ после завершения текущей поездки {eta_text}"
-                    ),
-                    parse_mode='HTML',
-                    reply_markup=keyboard
-                )
-                sent_count += 1
-                print(f"✅ Broadcast резерв отправлен занятому водителю #{driver.id}")
-            except Exception as e:
-                print(f"❌ Ошибка отправки broadcast резерва водителю #{driver.id}: {e}")
+            eta_text = f"(≈ {eta_to_finish} мин)" if eta_to_finish else ""
+            return await outbox.send_message(
+                bot,
+                chat_id=chat_id,
+                text=(
+                    f"🔔 <b>Новый заказ (резерв)</b>\n\n"
+                    f"{order_info}\n\n"
+                    f"💡 Вы можете зарезервировать этот заказ после завершения текущей поездки {eta_text}"
+                ),
+                parse_mode='HTML',
+                priority=PRIORITY_OFFER,
+                reply_markup=reserve_keyboard
+            )
+        
+        # Все водители получают заказ одновременно, а не по очереди
+        report = await fan_out(recipients, send_to_driver, key=lambda recipient: recipient[0])
+        for driver_id, error in report.failed.items():
+            print(f"❌ Ошибка отправки broadcast водителю #{driver_id}: {error}")
+        print(f"✅ Broadcast заказа #{order.id}: {report.summary()}")
+        sent_count = len(report.sent)
         
         # Устанавливаем таймер на истечение broadcast-окна
         if sent_count > 0:
-            async def on_broadcast_timeout(order_id: int):
-                """Callback при истечении broadcast-окна"""
-                from database.db import SessionLocal
-                timeout_db = SessionLocal()
-                try:
-                    timeout_order = timeout_db.query(Order).filter(Order.id == order_id).first()
-                    if timeout_order and timeout_order.status == OrderStatus.NEW:
-                        # Переводим в EXPIRED
-                        timeout_order.status = OrderStatus.EXPIRED
-                        timeout_db.commit()
-                        
-                        # Уведомляем клиента
-                        try:
-                            customer = timeout_db.query(User).filter(User.id == timeout_order.customer_id).first()
-                            if customer:
-                                await bot.send_message(
-                                    customer.telegram_id,
-                                    "⚠️ К сожалению, ни один водитель не принял ваш заказ.\n\n"
-                                    "Попробуйте создать новый заказ или свяжитесь с диспетчером."
-                                )
-                        except Exception as e:
-                            print(f"❌ Ошибка уведомления клиента о истечении заказа #{order_id}: {e}")
-                        
-                        print(f"⏰ Broadcast-окно истекло для заказа #{order_id}, статус → EXPIRED")
-                finally:
-                    timeout_db.close()
-            
             await scheduler.schedule_order_timeout(
                 order.id,
                 BROADCAST_WINDOW_SECONDS,
-                on_broadcast_timeout
+                lambda oid: BroadcastService.expire_broadcast_window(bot, oid),
+                handler=BROADCAST_TIMEOUT_HANDLER
             )
         
         return sent_count > 0
     
+    @staticmethod
+    async def expire_broadcast_window(bot, order_id: int):
+        """Callback при истечении broadcast-окна: заказ без откликов → EXPIRED"""
+        from database.db import SessionLocal
+        timeout_db = SessionLocal()
+        try:
+            timeout_order = timeout_db.query(Order).filter(Order.id == order_id).first()
+            if timeout_order and timeout_order.status == OrderStatus.NEW:
+                # Переводим в EXPIRED
+                timeout_order.status = OrderStatus.EXPIRED
+                StatsService.record_order_event(timeout_db, timeout_order, "expired")
+                timeout_db.commit()
+                
+                # Уведомляем клиента
+                try:
+                    customer = timeout_db.query(User).filter(User.id == timeout_order.customer_id).first()
+                    if customer:
+                        await outbox.send_message(
+                            bot,
+                            customer.telegram_id,
+                            "⚠️ К сожалению, ни один водитель не принял ваш заказ.\n\n"
+                            "Попробуйте создать новый заказ или свяжитесь с диспетчером."
+                        )
+                except Exception as e:
+                    print(f"❌ Ошибка уведомления клиента о истечении заказа #{order_id}: {e}")
+                
+                print(f"⏰ Broadcast-окно истекло для заказа #{order_id}, статус → EXPIRED")
+        finally:
+            timeout_db.close()
+    
     @staticmethod
     def _format_order_info(order: Order) -> str:
         """Форматирует информацию о заказе для водителя"""
@@ -213,30 +208,22 @@ class BroadcastService:
         Returns:
             (успех, сообщение)
         """
-        order = db.query(Order).filter(Order.id == order_id).first()
+        # Проверка статусов и запись — одним условным UPDATE на водителя и заказ:
+        # при одновременных нажатиях заказ получает ровно один водитель
+        result = ClaimService.accept_broadcast(db, order_id, driver.id, driver.user_id)
         
-        if not order:
-            return False, "Заказ не найден"
-        
-        if order.status != OrderStatus.NEW:
-            return False, "Заказ уже принят другим водителем"
-        
-        if driver.pending_order_id is not None:
+        if result == CLAIM_DRIVER_BUSY:
             return False, "У вас уже есть активный заказ"
         
-        # Назначаем заказ водителю
-        order.status = OrderStatus.ACCEPTED
-        order.driver_id = driver.user_id
-        order.assigned_driver_id = driver.id
-        order.accepted_at = datetime.utcnow()
+        if result == CLAIM_ORDER_TAKEN:
+            if db.query(Order.id).filter(Order.id == order_id).first() is None:
+                return False, "Заказ не найден"
+            return False, "Заказ уже принят другим водителем"
         
-        driver.status = DriverStatus.BUSY
-        driver.pending_order_id = None
-        driver.pending_until = None
         # Важное: убираем водителя из очереди, чтобы он не получал параллельные заказы
         queue_manager.remove_driver(driver.id)
         
-        db.commit()
+        order = db.query(Order).filter(Order.id == order_id).first()
         
         print(f"✅ handle_accept saved order={order_id} assigned_driver={driver.id} status={order.status.value}")
         
@@ -249,7 +236,8 @@ class BroadcastService:
         # Уведомляем водителя новым сообщением с актуальными кнопками
         try:
             from bot.utils.keyboards import Keyboards
-            await bot.send_message(
+            await outbox.send_message(
+                bot,
                 chat_id=driver.user.telegram_id,
                 text=(
                     f"📋 <b>Заказ #{order.id}</b>\n\n"
@@ -306,7 +294,8 @@ class BroadcastService:
                 )
                 
                 try:
-                    await bot.send_message(
+                    await outbox.send_message(
+                        bot,
                         chat_id=customer.telegram_id,
                         text=message,
                         parse_mode='HTML',
@@ -324,7 +313,8 @@ class BroadcastService:
                                 telegram_id=None  # Не используем tg://user?id= если есть username
                             )
                             try:
-                                await bot.send_message(
+                                await outbox.send_message(
+                                    bot,
                                     chat_id=customer.telegram_id,
                                     text=message,
                                     parse_mode='HTML',
@@ -334,7 +324,8 @@ class BroadcastService:
                             except Exception as e2:
                                 # Если и с username не получилось, отправляем без кнопки
                                 print(f"⚠️ Не удалось отправить с username, отправляем без кнопки: {e2}")
-                                await bot.send_message(
+                                await outbox.send_message(
+                                    bot,
                                     chat_id=customer.telegram_id,
                                     text=message,
                                     parse_mode='HTML'
@@ -342,7 +333,8 @@ class BroadcastService:
                                 print(f"✅ notify_assigned ok (без кнопки) order={order_id} user={customer.telegram_id}")
                         else:
                             # Если username нет, отправляем без кнопки
-                            await bot.send_message(
+                            await outbox.send_message(
+                                bot,
                                 chat_id=customer.telegram_id,
                                 text=message,
                                 parse_mode='HTML'
@@ -435,7 +427,8 @@ class BroadcastService:
                     ]
                 ])
                 
-                await bot.send_message(
+                await outbox.send_message(
+                    bot,
                     chat_id=customer.telegram_id,
                     text=(
                         f"🚗 <b>Водитель готов взять ваш заказ!</b>\n\n"
@@ -493,7 +486,8 @@ class BroadcastService:
         # Уведомляем водителя новым сообщением с актуальными кнопками
         try:
             from bot.utils.keyboards import Keyboards
-            await bot.send_message(
+            await outbox.send_message(
+                bot,
                 chat_id=driver.user.telegram_id,
                 text=(
                     f"✅ <b>Клиент подтвердил ожидание!</b>\n\n"
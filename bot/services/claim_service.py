@@ -0,0 +1,184 @@
+"""
+Сервис атомарного захвата водителя и заказа
+Вместо «прочитать → проверить в Python → записать» каждая операция — условный
+UPDATE: из конкурентных попыток строку меняет ровно одна, остальные видят rowcount == 0
+"""
+import logging
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from bot.models.driver import Driver, DriverStatus
+from bot.models.order import Order, OrderStatus
+from bot.utils.clock import utcnow
+
+logger = logging.getLogger(__name__)
+
+
+# Результаты захвата
+CLAIM_OK = "ok"
+CLAIM_DRIVER_BUSY = "driver_busy"  # Водитель уже занят другим заказом / не онлайн
+CLAIM_ORDER_TAKEN = "order_taken"  # Заказ уже принят, отменён или назначен другому
+
+# Статусы заказа, в которых его можно предложить водителю
+OFFERABLE_ORDER_STATUSES = (OrderStatus.NEW, OrderStatus.ASSIGNED, OrderStatus.FALLBACK)
+
+
+class ClaimService:
+    """
+    Условные UPDATE для предложения и принятия заказов
+
+    Сессия обычно общая для всего обновления (context.db) или таймера: захват
+    выполняется в savepoint, и проигранная гонка не откатывает незакоммиченную
+    работу вызывающего.
+    """
+
+    @staticmethod
+    def offer_order(db: Session, order_id: int, driver_id: int, pending_until: datetime) -> str:
+        """
+        Предложить заказ водителю: перевести водителя в pending_acceptance
+        и назначить ему заказ одной транзакцией
+
+        Водитель захватывается, только если он онлайн и без pending-заказа,
+        заказ — только если он ещё ищет водителя.
+
+        При успехе коммитит сессию, при проигрыше откатывает только savepoint захвата.
+        """
+        with db.begin_nested() as savepoint:
+            claimed = db.query(Driver).filter(
+                Driver.id == driver_id,
+                Driver.status == DriverStatus.ONLINE,
+                Driver.pending_order_id.is_(None),
+            ).update({
+                Driver.status: DriverStatus.PENDING_ACCEPTANCE,
+                Driver.pending_order_id: order_id,
+                Driver.pending_until: pending_until,
+            }, synchronize_session=False)
+            if claimed != 1:
+                savepoint.rollback()
+                return CLAIM_DRIVER_BUSY
+
+            assigned = db.query(Order).filter(
+                Order.id == order_id,
+                Order.status.in_(OFFERABLE_ORDER_STATUSES),
+            ).update({
+                Order.status: OrderStatus.ASSIGNED,
+                Order.assigned_driver_id: driver_id,
+            }, synchronize_session=False)
+            if assigned != 1:
+                # Откатываем и захват водителя
+                savepoint.rollback()
+                return CLAIM_ORDER_TAKEN
+
+        db.commit()
+        return CLAIM_OK
+
+    @staticmethod
+    def accept_offer(db: Session, order_id: int, driver_id: int, driver_user_id: int) -> str:
+        """
+        Принять предложенный заказ
+
+        Предложение должно всё ещё висеть на водителе (не снято таймаутом),
+        а заказ — ждать ответа. При каскадной рассылке предложение есть
+        сразу у нескольких водителей: заказ достаётся первому принявшему.
+
+        При успехе коммитит сессию, при проигрыше откатывает только savepoint захвата.
+        """
+        with db.begin_nested() as savepoint:
+            claimed = db.query(Driver).filter(
+                Driver.id == driver_id,
+                Driver.pending_order_id == order_id,
+            ).update({
+                Driver.status: DriverStatus.BUSY,
+                Driver.pending_order_id: None,
+                Driver.pending_until: None,
+            }, synchronize_session=False)
+            if claimed != 1:
+                savepoint.rollback()
+                return CLAIM_DRIVER_BUSY
+
+            accepted = db.query(Order).filter(
+                Order.id == order_id,
+                Order.status == OrderStatus.ASSIGNED,
+            ).update({
+                Order.status: OrderStatus.ACCEPTED,
+                Order.driver_id: driver_user_id,
+                Order.assigned_driver_id: driver_id,
+                Order.accepted_at: utcnow(),
+            }, synchronize_session=False)
+            if accepted != 1:
+                # Откатываем и захват водителя
+                savepoint.rollback()
+                return CLAIM_ORDER_TAKEN
+
+        db.commit()
+        return CLAIM_OK
+
+    @staticmethod
+    def accept_broadcast(db: Session, order_id: int, driver_id: int, driver_user_id: int) -> str:
+        """
+        Принять broadcast-заказ: первый откликнувшийся водитель забирает заказ
+
+        Водитель должен быть свободен (без pending-заказа и не на поездке),
+        заказ — в статусе NEW.
+
+        При успехе коммитит сессию, при проигрыше откатывает только savepoint захвата.
+        """
+        with db.begin_nested() as savepoint:
+            claimed = db.query(Driver).filter(
+                Driver.id == driver_id,
+                Driver.pending_order_id.is_(None),
+                Driver.status != DriverStatus.BUSY,
+            ).update({
+                Driver.status: DriverStatus.BUSY,
+                Driver.pending_until: None,
+            }, synchronize_session=False)
+            if claimed != 1:
+                savepoint.rollback()
+                return CLAIM_DRIVER_BUSY
+
+            accepted = db.query(Order).filter(
+                Order.id == order_id,
+                Order.status == OrderStatus.NEW,
+            ).update({
+                Order.status: OrderStatus.ACCEPTED,
+                Order.driver_id: driver_user_id,
+                Order.assigned_driver_id: driver_id,
+                Order.accepted_at: utcnow(),
+            }, synchronize_session=False)
+            if accepted != 1:
+                savepoint.rollback()
+                return CLAIM_ORDER_TAKEN
+
+        db.commit()
+        return CLAIM_OK
+
+    @staticmethod
+    def release_offer(
+        db: Session,
+        driver_id: int,
+        order_id: int,
+        online_since: Optional[datetime] = None,
+    ) -> bool:
+        """
+        Снять предложение с водителя (таймаут/отказ/отзыв) и вернуть его онлайн
+
+        Срабатывает, только если у водителя всё ещё висит именно этот заказ
+        и он ждёт ответа (не сброшен в оффлайн и не взял заказ).
+        online_since=None — водитель сохраняет своё место в очереди.
+        """
+        values = {
+            Driver.status: DriverStatus.ONLINE,
+            Driver.pending_order_id: None,
+            Driver.pending_until: None,
+        }
+        if online_since is not None:
+            values[Driver.online_since] = online_since
+        released = db.query(Driver).filter(
+            Driver.id == driver_id,
+            Driver.pending_order_id == order_id,
+            Driver.status == DriverStatus.PENDING_ACCEPTANCE,
+        ).update(values, synchronize_session=False)
+        db.commit()
+        return released == 1
@@ -0,0 +1,113 @@
+"""
+Архивация заказов: перенос старых завершённых и отменённых заказов в orders_archive
+Живая таблица orders хранит только то, с чем работают диспетчер и активные
+поездки, поэтому остаётся маленькой; история читается из обеих таблиц
+(OrderService.get_user_order_history / get_driver_order_history).
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from bot.config import settings
+from bot.models.driver import Driver
+from bot.models.order import Order, OrderStatus
+from bot.models.order_archive import ArchivedOrder
+
+logger = logging.getLogger(__name__)
+
+# Статусы, после которых заказ больше не меняется
+TERMINAL_STATUSES = [
+    OrderStatus.FINISHED,
+    OrderStatus.COMPLETED,
+    OrderStatus.CANCELLED,
+    OrderStatus.CANCELLED_BY_CLIENT,
+    OrderStatus.CANCELLED_BY_DRIVER,
+    OrderStatus.EXPIRED,
+]
+
+
+class OrderArchiveService:
+    """Перенос заказов из orders в orders_archive пачками"""
+
+    @staticmethod
+    def archive_batch(db: Session, cutoff: datetime, batch_size: int) -> int:
+        """
+        Перенести одну пачку заказов, завершённых раньше cutoff (одна транзакция)
+
+        Returns:
+            Сколько заказов перенесено (0 — переносить больше нечего)
+        """
+        # Заказ, на который ещё ссылается водитель (pending_order_id), не трогаем
+        referenced = select(Driver.pending_order_id).where(Driver.pending_order_id.isnot(None))
+        ids: List[int] = list(db.scalars(
+            select(Order.id)
+            .where(
+                Order.status.in_(TERMINAL_STATUSES),
+                func.coalesce(Order.finished_at, Order.created_at) < cutoff,
+                Order.id.not_in(referenced),
+            )
+            .order_by(Order.id)
+            .limit(batch_size)
+        ))
+        if not ids:
+            return 0
+
+        names = [column.name for column in Order.__table__.columns]
+        try:
+            db.execute(
+                insert(ArchivedOrder.__table__).from_select(
+                    names,
+                    select(*(Order.__table__.c[name] for name in names)).where(Order.id.in_(ids)),
+                )
+            )
+            db.execute(delete(Order.__table__).where(Order.id.in_(ids)))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        return len(ids)
+
+    @staticmethod
+    def archive_old_orders(
+        older_than_days: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        max_batches: Optional[int] = None,
+    ) -> int:
+        """
+        Перенести в архив все заказы старше older_than_days дней
+
+        Каждая пачка — отдельная короткая транзакция, так что запись в orders
+        не блокируется надолго. Возвращает общее число перенесённых заказов.
+        """
+        from database.db import session_scope  # локальный импорт чтобы избежать циклов
+
+        days = settings.order_archive_after_days if older_than_days is None else older_than_days
+        size = batch_size or settings.order_archive_batch_size
+        if days <= 0:
+            return 0
+
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        total = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            with session_scope() as db:
+                moved = OrderArchiveService.archive_batch(db, cutoff, size)
+            if not moved:
+                break
+            total += moved
+            batches += 1
+
+        if total:
+            logger.info("Архивировано заказов: %s (старше %s дн., пачек %s)", total, days, batches)
+        return total
+
+    @staticmethod
+    def get_stats(db: Session) -> dict:
+        """Размеры живой и архивной таблиц"""
+        return {
+            "live": db.query(func.count(Order.id)).scalar() or 0,
+            "archived": db.query(func.count(ArchivedOrder.id)).scalar() or 0,
+        }
@@ -3,8 +3,10 @@
 Управляет распределением заказов по водителям через систему очередей
 """
 import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 from sqlalchemy.orm import Session
 from telegram import Bot
@@ -13,18 +15,100 @@ from telegram.error import BadRequest
 
 from bot.models.order import Order, OrderStatus, OrderZone
 from bot.models.driver import Driver, DriverStatus, DriverZone
+from bot.config import settings
+from bot.services.claim_service import ClaimService, CLAIM_OK, CLAIM_DRIVER_BUSY, CLAIM_ORDER_TAKEN
+from bot.services.outbox import outbox, PRIORITY_OFFER
 from bot.services.queue_manager import queue_manager
 from bot.services.scheduler import scheduler
-from bot.constants import DRIVER_RESPONSE_TIMEOUT, ORDER_GLOBAL_TIMEOUT, PUBLIC_ZONE_LABELS
+from bot.services.stats_service import StatsService
+from bot.services.zone_registry import zone_registry
+from bot.utils.clock import utcnow
+from database.db import session_scope
+from bot.constants import DRIVER_RESPONSE_TIMEOUT, ORDER_GLOBAL_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
+# Имена обработчиков таймеров для восстановления после перезапуска
+DRIVER_TIMEOUT_HANDLER = "dispatcher.driver_timeout"
+ORDER_TIMEOUT_HANDLER = "dispatcher.order_timeout"
+CASCADE_STEP_HANDLER = "dispatcher.cascade_step"
+
+
+@dataclass
+class CascadeState:
+    """Каскадная рассылка заказа: кому сейчас висит предложение"""
+    order_id: int
+    started_at: datetime
+    # {driver_id: (chat_id, message_id)} — сообщение с предложением, чтобы отозвать его
+    offers: Dict[int, Tuple[Optional[int], Optional[int]]] = field(default_factory=dict)
+
+
+class PendingBacklog:
+    """
+    Заказы, которым в их зоне не нашлось водителя, — по зонам, от старых к новым
+    
+    Добавление, удаление и выдача самого старого заказа зоны — O(1):
+    id заказов растут вместе со временем создания, поэтому порядок
+    вставки совпадает с порядком создания (кроме редкого возврата
+    в ожидание заказа старше уже ждущих — тогда зона пересортировывается).
+    """
+    
+    def __init__(self):
+        self._zones: Dict[str, "OrderedDict[int, None]"] = {}
+        self._zone_of: Dict[int, str] = {}
+    
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self._zone_of
+    
+    def __len__(self) -> int:
+        return len(self._zone_of)
+    
+    def add(self, order_id: int, zone: str):
+        """Поставить заказ в ожидание водителя зоны"""
+        if self._zone_of.get(order_id) == zone:
+            return
+        self.discard(order_id)
+        waiting = self._zones.setdefault(zone, OrderedDict())
+        if waiting and order_id < next(reversed(waiting)):
+            # Вернулся заказ старше уже ожидающих (редко) — встаёт на своё место
+            self._zones[zone] = OrderedDict.fromkeys(sorted([*waiting, order_id]))
+        else:
+            waiting[order_id] = None
+        self._zone_of[order_id] = zone
+    
+    def discard(self, order_id: int) -> bool:
+        """Убрать заказ из ожидания (получил предложение, отменён, ушёл в fallback)"""
+        zone = self._zone_of.pop(order_id, None)
+        if zone is None:
+            return False
+        self._zones[zone].pop(order_id, None)
+        return True
+    
+    def pop_oldest(self, zone: str) -> Optional[int]:
+        """Самый старый ожидающий заказ зоны (или None)"""
+        waiting = self._zones.get(zone)
+        if not waiting:
+            return None
+        order_id, _ = waiting.popitem(last=False)
+        del self._zone_of[order_id]
+        return order_id
+    
+    def count(self, zone: str) -> int:
+        return len(self._zones.get(zone) or ())
+    
+    def order_ids(self, zone: str) -> List[int]:
+        return list(self._zones.get(zone) or ())
+
 
 class OrderDispatcher:
     """Диспетчер распределения заказов"""
     
     def __init__(self, bot: Bot):
         self.bot = bot
+        # Каскадные рассылки в работе: {order_id: CascadeState}
+        self._cascades: Dict[int, CascadeState] = {}
+        # Заказы, ждущие появления водителя в своей зоне
+        self._backlog = PendingBacklog()
     
     async def create_and_dispatch_order(self, order_id: int, db: Session):
         """
@@ -46,77 +130,301 @@ class OrderDispatcher:
         await scheduler.schedule_order_timeout(
             order_id,
             ORDER_GLOBAL_TIMEOUT,
-            lambda oid: self._on_order_global_timeout(oid, db)
+            self._order_timeout_job,
+            handler=ORDER_TIMEOUT_HANDLER
         )
         
         # Начинаем первичное распределение
         await self._assign_to_next_driver_in_zone(order_id, db)
     
-    async def _assign_to_next_driver_in_zone(self, order_id: int, db: Session):
-        """Назначить заказ следующему водителю в зоне заказа"""
+    async def _assign_to_next_driver_in_zone(self, order_id: int, db: Session) -> Optional[str]:
+        """
+        Назначить заказ следующему водителю в зоне заказа
+        
+        Returns:
+            CLAIM_OK — предложение ушло водителю, CLAIM_ORDER_TAKEN — заказ уже занят,
+            None — заказ не ищет водителя или водителей в зоне нет
+        """
         order = db.query(Order).filter(Order.id == order_id).first()
         if not order:
-            return
+            return None
         
         # Проверяем что заказ всё ещё в нужном статусе
         if order.status not in [OrderStatus.NEW, OrderStatus.ASSIGNED]:
             logger.info(f"Заказ {order_id} уже не в статусе NEW/ASSIGNED, пропускаем назначение")
-            return
+            return None
         
         # Получаем зону заказа
         zone = order.zone.value if hasattr(order.zone, 'value') else order.zone
         
-        # Получаем следующего водителя из очереди
-        driver_id = queue_manager.get_next_driver(zone, db)
-        
-        if not driver_id:
-            logger.warning(f"Нет доступных водителей в зоне {zone} для заказа {order_id}")
-            # Ждём глобального таймаута
-            return
+        if settings.dispatch_cascade_enabled:
+            return await self._dispatch_cascade(order, zone, db)
         
-        # Назначаем водителю
-        await self._assign_to_driver(order_id, driver_id, db)
+        # Берём водителей из очереди по одному, пока захват не удастся:
+        # водитель мог уйти в другой заказ (broadcast, другой воркер) после постановки в очередь
+        while True:
+            # Получаем следующего водителя из очереди и сразу забираем его из неё
+            # (захват атомарный: при общем хранилище другой воркер этого водителя не получит)
+            driver_id = queue_manager.claim_next_driver(zone, db)
+            
+            if not driver_id:
+                logger.warning(f"Нет доступных водителей в зоне {zone} для заказа {order_id}")
+                # Ждём водителя в зоне (или глобального таймаута)
+                self._park(order_id, zone)
+                return None
+            
+            # Назначаем водителю
+            result = await self._assign_to_driver(order_id, driver_id, db)
+            if result != CLAIM_DRIVER_BUSY:
+                return result
     
-    async def _assign_to_driver(self, order_id: int, driver_id: int, db: Session):
-        """Назначить заказ конкретному водителю"""
-        order = db.query(Order).filter(Order.id == order_id).first()
-        driver = db.query(Driver).filter(Driver.id == driver_id).first()
-        
-        if not order or not driver:
-            logger.error(f"Заказ {order_id} или водитель {driver_id} не найдены")
-            return
-        
-        # Переводим водителя в pending_acceptance
-        driver.status = DriverStatus.PENDING_ACCEPTANCE
-        driver.pending_order_id = order_id
-        driver.pending_until = datetime.utcnow() + timedelta(seconds=DRIVER_RESPONSE_TIMEOUT)
-        
-        # Обновляем заказ
-        order.status = OrderStatus.ASSIGNED
-        order.assigned_driver_id = driver_id
+    async def _assign_to_driver(self, order_id: int, driver_id: int, db: Session) -> str:
+        """
+        Назначить заказ конкретному водителю
         
-        db.commit()
+        Returns:
+            CLAIM_OK / CLAIM_DRIVER_BUSY / CLAIM_ORDER_TAKEN
+        """
+        # Условный UPDATE водителя и заказа: проверка и запись одной транзакцией
+        pending_until = utcnow() + timedelta(seconds=DRIVER_RESPONSE_TIMEOUT)
+        result = ClaimService.offer_order(db, order_id, driver_id, pending_until)
+        
+        if result == CLAIM_OK:
+            # Удаляем водителя из очереди (временно, до ответа)
+            queue_manager.remove_driver(driver_id)
+        elif result != CLAIM_DRIVER_BUSY:
+            # Заказ ушёл раньше — водитель, захваченный из очереди, свободен:
+            # возвращаем на прежнее место
+            self._return_to_queue(driver_id, db)
+        
+        if result != CLAIM_DRIVER_BUSY:
+            # Предложение ушло водителю (или заказ уже занят) — ждать больше нечего
+            self._backlog.discard(order_id)
+        
+        if result != CLAIM_OK:
+            logger.info(f"Заказ {order_id} не назначен водителю {driver_id}: {result}")
+            return result
         
-        # Удаляем водителя из очереди (временно)
-        queue_manager.remove_driver(driver_id)
+        order = db.query(Order).filter(Order.id == order_id).first()
+        driver = db.query(Driver).filter(Driver.id == driver_id).first()
         
         logger.info(f"Заказ {order_id} назначен водителю {driver_id} ({driver.user.full_name})")
         
         # Отправляем уведомление водителю
-        await self._send_order_notification(order, driver)
+        sent = await self._send_order_notification(order, driver)
+        
+        cascade = self._cascades.get(order_id)
+        if cascade is not None:
+            cascade.offers[driver_id] = (
+                (sent.chat_id, sent.message_id) if sent is not None else (None, None)
+            )
         
         # Запускаем таймер 30 секунд
         await scheduler.schedule_driver_timeout(
             driver_id,
             order_id,
             DRIVER_RESPONSE_TIMEOUT,
-            lambda did, oid: self._on_driver_timeout(did, oid, db)
+            self._driver_timeout_job,
+            handler=DRIVER_TIMEOUT_HANDLER
+        )
+        return result
+    
+    def _return_to_queue(self, driver_id: int, db: Session) -> Optional[str]:
+        """
+        Вернуть водителя в очередь его зоны на прежнее место (online_since не меняется)
+        
+        Состояние водителя перечитывается из БД: в очередь возвращается только
+        свободный водитель на линии (не ушёл оффлайн, не получил другой заказ).
+        
+        Returns:
+            Зона, в которую вернулся водитель, или None
+        """
+        row = db.query(
+            Driver.status, Driver.pending_order_id, Driver.current_zone, Driver.online_since
+        ).filter(Driver.id == driver_id).first()
+        if row is None or row.status != DriverStatus.ONLINE or row.pending_order_id is not None:
+            return None
+        zone = row.current_zone.value if hasattr(row.current_zone, 'value') else row.current_zone
+        if not zone or zone == "NONE":
+            return None
+        queue_manager.add_driver(driver_id, zone, db, online_since=row.online_since)
+        return zone
+    
+    def _park(self, order_id: int, zone: str):
+        """Заказ ждёт водителя: его получит первый, кто выйдет на линию в этой зоне"""
+        # Только пока идёт поиск по зоне: после глобального таймаута заказ в fallback
+        if zone and scheduler.has_order_timeout(order_id):
+            self._backlog.add(order_id, zone)
+            logger.info(f"Заказ {order_id} ждёт водителя в зоне {zone} (в ожидании: {self._backlog.count(zone)})")
+    
+    async def match_waiting_orders(self, zone: str, db: Session) -> int:
+        """
+        В зоне появился водитель (вышел на линию или сменил зону) —
+        сразу раздать ожидающие заказы зоны, начиная с самого старого
+        
+        Returns:
+            Сколько ожидающих заказов разобрано
+        """
+        matched = 0
+        while True:
+            order_id = self._backlog.pop_oldest(zone)
+            if order_id is None:
+                return matched
+            remaining = scheduler.order_timeout_remaining(order_id)
+            if remaining is None or remaining < DRIVER_RESPONSE_TIMEOUT:
+                # Водитель не успеет ответить до fallback — такой заказ только заберёт его время
+                continue
+            # Отменённые и принятые заказы отсеивает проверка статуса внутри
+            result = await self._assign_to_next_driver_in_zone(order_id, db)
+            if order_id in self._backlog:
+                # Водители зоны закончились — заказ снова ждёт, остальные тоже
+                return matched
+            if result != CLAIM_OK:
+                # Заказ уже не ищет водителя — он просто выбыл из ожидания
+                continue
+            matched += 1
+            logger.info(f"Ожидающий заказ {order_id} разобран при появлении водителя в зоне {zone}")
+    
+    def restore_waiting_orders(self, db: Session) -> int:
+        """
+        Восстановить ожидающие заказы после перезапуска: заказы в поиске
+        по зоне, предложение которых сейчас не висит ни у одного водителя
+        (вызывать после scheduler.restore_timers)
+        """
+        offered = db.query(Driver.pending_order_id).filter(Driver.pending_order_id.isnot(None))
+        rows = db.query(Order.id, Order.zone).filter(
+            Order.status.in_([OrderStatus.NEW, OrderStatus.ASSIGNED]),
+            Order.zone.isnot(None),
+            Order.is_broadcast.is_(False),
+            Order.id.not_in(offered),
+        ).order_by(Order.id).all()
+        for row in rows:
+            self._park(row.id, row.zone.value if hasattr(row.zone, 'value') else row.zone)
+        return len(self._backlog)
+    
+    def _cascade_size(self, elapsed_seconds: float) -> int:
+        """Сколько водителей должно держать предложение через elapsed_seconds после старта"""
+        widen = max(1, settings.dispatch_cascade_widen_seconds)
+        size = settings.dispatch_cascade_initial + settings.dispatch_cascade_step * int(elapsed_seconds // widen)
+        return max(1, min(size, settings.dispatch_cascade_max))
+    
+    async def _dispatch_cascade(self, order: Order, zone: str, db: Session) -> Optional[str]:
+        """
+        Каскадная рассылка: предложение висит сразу у K первых водителей очереди
+        
+        Первый принявший забирает заказ (условный UPDATE в ClaimService),
+        остальным предложение отзывается. Выбывшие по таймауту/отказу
+        заменяются следующими из очереди; K растёт каждые widen_seconds
+        до dispatch_cascade_max, пока не наступит ORDER_GLOBAL_TIMEOUT.
+        
+        Returns:
+            CLAIM_OK — хотя бы одно новое предложение ушло, CLAIM_ORDER_TAKEN —
+            заказ уже занят, None — новых предложений нет
+        """
+        order_id = order.id
+        # После рестарта состояния в памяти нет — отсчитываем от создания заказа
+        cascade = self._cascades.setdefault(
+            order_id, CascadeState(order_id, order.created_at or utcnow())
+        )
+        elapsed = (utcnow() - cascade.started_at).total_seconds()
+        target = self._cascade_size(elapsed)
+        offered = False
+        
+        while len(cascade.offers) < target:
+            driver_id = queue_manager.claim_next_driver(zone, db)
+            if not driver_id:
+                if not cascade.offers:
+                    logger.warning(f"Нет доступных водителей в зоне {zone} для заказа {order_id}")
+                    self._park(order_id, zone)
+                break
+            
+            result = await self._assign_to_driver(order_id, driver_id, db)
+            if result == CLAIM_ORDER_TAKEN:
+                return result
+            offered = offered or result == CLAIM_OK
+        
+        logger.info(
+            f"Каскад заказа {order_id}: предложение у {len(cascade.offers)} водителей (K={target})"
         )
+        
+        # Следующее расширение — если K ещё может вырасти до глобального таймаута
+        widen = max(1, settings.dispatch_cascade_widen_seconds)
+        next_step = widen - (elapsed % widen)
+        if target < settings.dispatch_cascade_max and elapsed + next_step < ORDER_GLOBAL_TIMEOUT:
+            await scheduler.schedule_cascade_step(
+                order_id,
+                next_step,
+                self._cascade_step_job,
+                handler=CASCADE_STEP_HANDLER
+            )
+        return CLAIM_OK if offered else None
+    
+    async def _withdraw_offers(self, order_id: int, db: Session, text: str, keep_driver_id: Optional[int] = None):
+        """
+        Отозвать предложения каскадной рассылки (кроме keep_driver_id)
+        Водители возвращаются в очередь на своё прежнее место
+        """
+        cascade = self._cascades.pop(order_id, None)
+        await scheduler.cancel_cascade_step(order_id)
+        if cascade is None:
+            return
+        
+        withdrawn = {
+            driver_id: message
+            for driver_id, message in cascade.offers.items()
+            if driver_id != keep_driver_id
+        }
+        if not withdrawn:
+            return
+        
+        released = []
+        for driver_id in withdrawn:
+            await scheduler.cancel_driver_timeout(driver_id)
+            if ClaimService.release_offer(db, driver_id, order_id):
+                released.append(driver_id)
+        
+        # online_since не менялся при предложении — водитель встаёт на прежнее место
+        if released:
+            rows = db.query(Driver.id, Driver.current_zone, Driver.online_since).filter(
+                Driver.id.in_(released)
+            ).all()
+            for row in rows:
+                zone = row.current_zone.value if hasattr(row.current_zone, 'value') else row.current_zone
+                if zone and zone != "NONE":
+                    queue_manager.add_driver(row.id, zone, db, online_since=row.online_since)
+        
+        for driver_id, (chat_id, message_id) in withdrawn.items():
+            if chat_id is None or message_id is None:
+                continue
+            try:
+                await outbox.edit_message_text(
+                    self.bot,
+                    chat_id,
+                    text,
+                    priority=PRIORITY_OFFER,
+                    message_id=message_id,
+                    parse_mode="HTML"
+                )
+            except Exception as e:
+                logger.warning(f"Не удалось отозвать предложение заказа {order_id} у водителя {driver_id}: {e}")
+        
+        logger.info(f"Заказ {order_id}: отозвано предложений {len(withdrawn)}, возвращено в очередь {len(released)}")
+    
+    def _forget_offer(self, order_id: int, driver_id: int):
+        """Водитель выбыл из каскада (таймаут/отказ) — его место займёт следующий"""
+        cascade = self._cascades.get(order_id)
+        if cascade is not None:
+            cascade.offers.pop(driver_id, None)
+    
+    async def withdraw_offers(self, order_id: int, db: Session):
+        """Отозвать все висящие предложения заказа (заказ отменён клиентом)"""
+        self._backlog.discard(order_id)
+        await self._withdraw_offers(order_id, db, f"❌ <b>Заказ #{order_id} отменён клиентом.</b>")
     
     async def _send_order_notification(self, order: Order, driver: Driver):
         """Отправить уведомление водителю о новом заказе"""
         try:
-            zone_label = PUBLIC_ZONE_LABELS.get(order.zone.value if hasattr(order.zone, 'value') else order.zone, order.zone)
+            zone_label = zone_registry.label(order.zone)
             
             message = (
                 f"🚖 <b>НОВЫЙ ЗАКАЗ #{order.id}</b>\n\n"
@@ -138,17 +446,38 @@ class OrderDispatcher:
                 ]
             ])
             
-            await self.bot.send_message(
+            sent = await outbox.send_message(
+                self.bot,
                 driver.user.telegram_id,
                 message,
+                priority=PRIORITY_OFFER,
                 parse_mode="HTML",
                 reply_markup=keyboard
             )
             
             logger.info(f"Уведомление о заказе {order.id} отправлено водителю {driver.id}")
+            return sent
             
         except Exception as e:
             logger.error(f"Ошибка отправки уведомления водителю {driver.id}: {e}", exc_info=True)
+            return None
+    
+    # Таймеры срабатывают спустя десятки секунд после обработчика, создавшего заказ:
+    # каждый запуск получает собственную короткую сессию, а не сессию апдейта
+    async def _driver_timeout_job(self, driver_id: int, order_id: int):
+        """Таймаут водителя в отдельной сессии"""
+        with session_scope() as db:
+            await self._on_driver_timeout(driver_id, order_id, db)
+    
+    async def _order_timeout_job(self, order_id: int):
+        """Глобальный таймаут заказа (и fallback-поиск) в отдельной сессии"""
+        with session_scope() as db:
+            await self._on_order_global_timeout(order_id, db)
+    
+    async def _cascade_step_job(self, order_id: int):
+        """Расширение каскадной рассылки в отдельной сессии"""
+        with session_scope() as db:
+            await self._assign_to_next_driver_in_zone(order_id, db)
     
     async def _on_driver_timeout(self, driver_id: int, order_id: int, db: Session):
         """Обработка таймаута водителя (30 секунд истекли без ответа)"""
@@ -160,27 +489,39 @@ class OrderDispatcher:
         if not driver or not order:
             return
         
-        # Проверяем что заказ всё ещё назначен этому водителю
-        if order.assigned_driver_id != driver_id:
-            logger.debug(f"Заказ {order_id} уже не назначен водителю {driver_id}")
+        # Проверяем что заказ ещё не принят
+        # (принятие могло прийти в другой воркер, где этого таймера нет)
+        if order.status != OrderStatus.ASSIGNED:
+            logger.debug(f"Заказ {order_id} уже не ожидает ответа водителя {driver_id}")
+            # Заказ ушёл в fallback/истёк, пока предложение висело, — водитель
+            # не должен остаться в ожидании ответа навсегда: возвращаем на прежнее место
+            if ClaimService.release_offer(db, driver_id, order_id):
+                self._forget_offer(order_id, driver_id)
+                # Состояние водителя перечитывается: за время предложения он мог
+                # уйти оффлайн или его сбросил администратор
+                zone = self._return_to_queue(driver_id, db)
+                if zone:
+                    await self.match_waiting_orders(zone, db)
             return
         
-        # Возвращаем водителя онлайн и в хвост очереди
-        driver.status = DriverStatus.ONLINE
-        driver.pending_order_id = None
-        driver.pending_until = None
-        driver.online_since = datetime.utcnow()  # Обновляем время (штраф: в конец)
-        db.commit()
+        # Возвращаем водителя онлайн и в хвост очереди (штраф: в конец),
+        # только если предложение ещё висит на нём
+        online_since = utcnow()
+        if not ClaimService.release_offer(db, driver_id, order_id, online_since):
+            logger.debug(f"Предложение заказа {order_id} уже снято с водителя {driver_id}")
+            return
+        self._forget_offer(order_id, driver_id)
         
         # Добавляем обратно в очередь
         zone = driver.current_zone.value if hasattr(driver.current_zone, 'value') else driver.current_zone
-        queue_manager.add_driver(driver_id, zone, db)
+        queue_manager.add_driver(driver_id, zone, db, online_since=online_since)
         
         logger.info(f"Водитель {driver_id} возвращён в очередь {zone}")
         
         # Уведомляем водителя
         try:
-            await self.bot.send_message(
+            await outbox.send_message(
+                self.bot,
                 driver.user.telegram_id,
                 "⏱ <b>Время на ответ истекло.</b>\n\nВы вернулись в конец очереди.",
                 parse_mode="HTML"
@@ -195,15 +536,23 @@ class OrderDispatcher:
         """Обработка глобального таймаута заказа (180 секунд) → fallback"""
         logger.info(f"Глобальный таймаут заказа {order_id} → переход в fallback")
         
+        # Водителя в зоне так и не дождались — дальше ищем по всем зонам
+        self._backlog.discard(order_id)
+        
         order = db.query(Order).filter(Order.id == order_id).first()
         if not order:
             return
         
-        # Проверяем что заказ не принят
-        if order.status == OrderStatus.ACCEPTED:
-            logger.info(f"Заказ {order_id} уже принят, fallback не требуется")
+        # Проверяем что заказ всё ещё ищет водителя (не принят, не отменён)
+        if order.status not in (OrderStatus.NEW, OrderStatus.ASSIGNED):
+            logger.info(f"Заказ {order_id} в статусе {order.status}, fallback не требуется")
             return
         
+        # Каскад по зоне закончен — снимаем висящие предложения
+        await self._withdraw_offers(
+            order_id, db, f"⏱ <b>Предложение заказа #{order_id} снято:</b> время поиска в зоне истекло."
+        )
+        
         # Переводим в fallback
         order.status = OrderStatus.FALLBACK
         db.commit()
@@ -225,11 +574,13 @@ class OrderDispatcher:
         if not driver_ids:
             logger.warning(f"Нет доступных водителей для fallback заказа {order_id}")
             order.status = OrderStatus.EXPIRED
+            StatsService.record_order_event(db, order, "expired")
             db.commit()
             
             # Уведомляем клиента
             try:
-                await self.bot.send_message(
+                await outbox.send_message(
+                    self.bot,
                     order.customer.telegram_id,
                     "😔 <b>К сожалению, сейчас нет доступных водителей.</b>\n\n"
                     "Попробуйте создать заказ позже.",
@@ -240,21 +591,24 @@ class OrderDispatcher:
             
             return
         
-        # Назначаем первому доступному водителю
-        await self._assign_to_driver(order_id, driver_ids[0], db)
+        # Назначаем первому доступному водителю (занятых за это время пропускаем)
+        for driver_id in driver_ids:
+            result = await self._assign_to_driver(order_id, driver_id, db)
+            if result != CLAIM_DRIVER_BUSY:
+                return
     
     async def handle_driver_accept(self, driver_id: int, order_id: int, db: Session):
         """Обработка принятия заказа водителем"""
         driver = db.query(Driver).filter(Driver.id == driver_id).first()
-        order = db.query(Order).filter(Order.id == order_id).first()
-        
-        if not driver or not order:
-            logger.error(f"Водитель {driver_id} или заказ {order_id} не найдены")
+        if not driver:
+            logger.error(f"Водитель {driver_id} не найден")
             return False
         
-        # Проверяем что заказ назначен этому водителю
-        if order.assigned_driver_id != driver_id:
-            logger.warning(f"Заказ {order_id} не назначен водителю {driver_id}")
+        # Заказ должен быть назначен этому водителю и ещё ждать ответа —
+        # проверка и запись одним условным UPDATE
+        result = ClaimService.accept_offer(db, order_id, driver_id, driver.user_id)
+        if result != CLAIM_OK:
+            logger.warning(f"Заказ {order_id} не может быть принят водителем {driver_id}: {result}")
             return False
         
         # Отменяем таймеры (безопасно - если таймеров нет, это не ошибка)
@@ -268,18 +622,12 @@ class OrderDispatcher:
         except Exception as e:
             logger.warning(f"Ошибка при отмене таймера заказа {order_id}: {e}")
         
-        # Обновляем статусы
-        driver.status = DriverStatus.BUSY
-        driver.pending_order_id = None
-        driver.pending_until = None
-        
-        order.status = OrderStatus.ACCEPTED
-        order.driver_id = driver.user_id
-        order.accepted_at = datetime.utcnow()
+        logger.info(f"✅ handle_accept saved order={order_id} assigned_driver={driver_id} status={OrderStatus.ACCEPTED.value}")
         
-        db.commit()
-        
-        logger.info(f"✅ handle_accept saved order={order_id} assigned_driver={driver_id} status={order.status.value}")
+        # Каскадная рассылка: остальным водителям предложение больше не актуально
+        await self._withdraw_offers(
+            order_id, db, f"✅ <b>Заказ #{order_id} уже принят другим водителем.</b>", keep_driver_id=driver_id
+        )
         
         # Уведомляем клиента с контактами водителя (единый формат для всех типов заказов)
         try:
@@ -287,7 +635,9 @@ class OrderDispatcher:
             from bot.models.user import User
             
             # Получаем клиента из БД (избегаем lazy loading)
-            customer = db.query(User).filter(User.id == order.customer_id).first()
+            customer = db.query(User).join(Order, Order.customer_id == User.id).filter(
+                Order.id == order_id
+            ).first()
             if not customer:
                 logger.error(f"❌ Клиент для заказа {order_id} не найден в БД!")
                 return True
@@ -329,7 +679,8 @@ class OrderDispatcher:
             )
             
             try:
-                await self.bot.send_message(
+                await outbox.send_message(
+                    self.bot,
                     customer.telegram_id,
                     message,
                     parse_mode="HTML",
@@ -347,7 +698,8 @@ class OrderDispatcher:
                             telegram_id=None  # Не используем tg://user?id= если есть username
                         )
                         try:
-                            await self.bot.send_message(
+                            await outbox.send_message(
+                                self.bot,
                                 customer.telegram_id,
                                 message,
                                 parse_mode="HTML",
@@ -357,7 +709,8 @@ class OrderDispatcher:
                         except Exception as e2:
                             # Если и с username не получилось, отправляем без кнопки
                             logger.warning(f"⚠️ Не удалось отправить с username, отправляем без кнопки: {e2}")
-                            await self.bot.send_message(
+                            await outbox.send_message(
+                                self.bot,
                                 customer.telegram_id,
                                 message,
                                 parse_mode="HTML"
@@ -365,7 +718,8 @@ class OrderDispatcher:
                             logger.info(f"✅ notify_assigned ok (без кнопки) order={order_id} user={customer.telegram_id}")
                     else:
                         # Если username нет, отправляем без кнопки
-                        await self.bot.send_message(
+                        await outbox.send_message(
+                            self.bot,
                             customer.telegram_id,
                             message,
                             parse_mode="HTML"
@@ -389,25 +743,20 @@ class OrderDispatcher:
             logger.error(f"Водитель {driver_id} или заказ {order_id} не найдены")
             return False
         
-        # Проверяем что заказ назначен этому водителю
-        if order.assigned_driver_id != driver_id:
-            logger.warning(f"Заказ {order_id} не назначен водителю {driver_id}")
+        # Возвращаем водителя онлайн в хвост очереди (штраф: конец очереди),
+        # только если предложение этого заказа ещё висит на нём
+        online_since = utcnow()
+        if not ClaimService.release_offer(db, driver_id, order_id, online_since):
+            logger.warning(f"Заказ {order_id} не предложен водителю {driver_id} (или предложение уже снято)")
             return False
+        self._forget_offer(order_id, driver_id)
         
         # Отменяем таймер водителя
         await scheduler.cancel_driver_timeout(driver_id)
         
-        # Возвращаем водителя онлайн в хвост очереди
-        driver.status = DriverStatus.ONLINE
-        driver.pending_order_id = None
-        driver.pending_until = None
-        driver.online_since = datetime.utcnow()  # штраф: конец очереди
-        
-        db.commit()
-        
         # Добавляем обратно в очередь
         zone = driver.current_zone.value if hasattr(driver.current_zone, 'value') else driver.current_zone
-        queue_manager.add_driver(driver_id, zone, db)
+        queue_manager.add_driver(driver_id, zone, db, online_since=online_since)
         
         logger.info(f"Водитель {driver_id} отклонил заказ {order_id}, возвращён в очередь {zone}")
         
@@ -427,6 +776,10 @@ def init_dispatcher(bot: Bot):
     """Инициализировать диспетчер"""
     global _dispatcher
     _dispatcher = OrderDispatcher(bot)
+    # Обработчики для таймеров, восстановленных после перезапуска
+    scheduler.register_handler(DRIVER_TIMEOUT_HANDLER, _dispatcher._driver_timeout_job)
+    scheduler.register_handler(ORDER_TIMEOUT_HANDLER, _dispatcher._order_timeout_job)
+    scheduler.register_handler(CASCADE_STEP_HANDLER, _dispatcher._cascade_step_job)
     logger.info("Order Dispatcher инициализирован")
 
 def get_dispatcher() -> OrderDispatcher:
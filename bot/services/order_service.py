@@ -1,11 +1,13 @@
 """
 Сервис управления заказами
 """
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, tuple_, union_all, update
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from bot.models import (
+    ArchivedOrder,
     Order,
     OrderStatus,
     User,
@@ -13,6 +15,22 @@ from bot.models import (
     IntercityOriginZone,
     OrderTariff,
 )
+from bot.services.stats_service import CANCELLED_STATUSES, StatsService
+
+
+# Курсор истории: (finished_at, id) последнего показанного заказа
+HistoryCursor = Tuple[Optional[datetime], int]
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _history_sort_key(order):
+    """finished_at DESC NULLS LAST, id DESC — как в SQL-запросах истории"""
+    return (
+        order.finished_at is not None,
+        order.finished_at or datetime.min,
+        order.id,
+    )
 
 
 class OrderService:
@@ -64,8 +82,8 @@ class OrderService:
         # Преобразуем район подачи в зону для системы очередей
         zone_key = None
         if pickup_district:
-            from bot.handlers.user_queue import map_district_to_zone
-            zone_key = map_district_to_zone(pickup_district)
+            from bot.services.zone_registry import zone_registry  # локальный импорт чтобы избежать циклов
+            zone_key = zone_registry.queue_zone_for(pickup_district)
 
         order = Order(
             customer_id=customer.id,
@@ -87,6 +105,7 @@ class OrderService:
         )
         
         db.add(order)
+        StatsService.record_order_event(db, order, "created")
         db.commit()
         db.refresh(order)
         
@@ -120,6 +139,7 @@ class OrderService:
         )
 
         db.add(order)
+        StatsService.record_order_event(db, order, "created")
         db.commit()
         db.refresh(order)
         return order
@@ -237,6 +257,9 @@ class OrderService:
                     f"avg={driver.rating_avg:.2f} cnt={driver.rating_count}"
                 )
         
+        StatsService.record_order_event(
+            db, order, "completed", at=order.finished_at, driver_id=order.assigned_driver_id
+        )
         db.commit()
         db.refresh(order)
         return order
@@ -262,6 +285,7 @@ class OrderService:
         
         # Сохраняем текущего назначенного водителя до очистки полей
         assigned_driver_id = order.assigned_driver_id
+        already_cancelled = order.status in CANCELLED_STATUSES
         
         # Назначаем статус отмены по инициатору
         if canceled_by == "client":
@@ -273,13 +297,14 @@ class OrderService:
         order.assigned_driver_id = None
         order.selected_driver_id = None
         
-        # Находим водителя, у которого этот заказ в pending_order_id
+        # Находим водителей, у которых этот заказ в pending_order_id
+        # (при каскадной рассылке их может быть несколько)
         if order.id:
-            driver_with_pending = db.query(Driver).filter(
+            drivers_with_pending = db.query(Driver).filter(
                 Driver.pending_order_id == order.id
-            ).first()
+            ).all()
             
-            if driver_with_pending:
+            for driver_with_pending in drivers_with_pending:
                 # Очищаем pending_order_id и pending_until
                 driver_with_pending.pending_order_id = None
                 driver_with_pending.pending_until = None
@@ -295,7 +320,10 @@ class OrderService:
                     # Возвращаем водителя в очередь
                     zone = driver_with_pending.current_zone.value if hasattr(driver_with_pending.current_zone, 'value') else driver_with_pending.current_zone
                     if zone and zone != "NONE":
-                        queue_manager.add_driver(driver_with_pending.id, zone, db)
+                        queue_manager.add_driver(
+                            driver_with_pending.id, zone, db,
+                            online_since=driver_with_pending.online_since,
+                        )
         
         # Если заказ был назначен водителю (ACCEPTED/ARRIVED/ONBOARD/BUSY)
         if assigned_driver_id:
@@ -312,8 +340,13 @@ class OrderService:
                 
                 zone = driver_assigned.current_zone.value if hasattr(driver_assigned.current_zone, 'value') else driver_assigned.current_zone
                 if zone and zone != "NONE":
-                    queue_manager.add_driver(driver_assigned.id, zone, db)
+                    queue_manager.add_driver(
+                        driver_assigned.id, zone, db,
+                        online_since=driver_assigned.online_since,
+                    )
         
+        if not already_cancelled:
+            StatsService.record_order_event(db, order, "cancelled", driver_id=assigned_driver_id)
         db.commit()
         db.refresh(order)
         return order
@@ -323,8 +356,12 @@ class OrderService:
         """
         Оценить заказ (с поддержкой изменения оценки в течение 24ч)
         
-        Автоматически пересчитывает средний рейтинг водителя на основе
-        всех оценок в БД (истинный пересчёт).
+        Рейтинг водителя обновляется инкрементально в той же транзакции:
+        к rating_sum добавляется разница оценок, rating_count растёт только
+        для первой оценки. Оценка меняется условным UPDATE по старому значению,
+        поэтому двойное нажатие не засчитывается дважды. Изменения идут в savepoint:
+        проигранная гонка не откатывает чужую работу в сессии, успех коммитит сессию.
+        Сверка с заказами — OrderService.recompute_driver_ratings.
         
         Args:
             db: Сессия БД
@@ -350,49 +387,117 @@ class OrderService:
             logger.warning(f"rating_set order={order.id} stars={rating} changed=False (time limit exceeded)")
             return order
         
-        # Сохраняем оценку
+        # Сохраняем оценку, только если её никто не поменял с момента чтения
         old_rating = order.rating
-        order.rating = rating
-        order.rating_comment = comment
+        values = {"rating": rating, "rating_comment": comment}
         # Для обратной совместимости
         if comment:
-            order.feedback = comment
+            values["feedback"] = comment
+        same_rating = Order.rating.is_(None) if old_rating is None else Order.rating == old_rating
+        
+        # Инкрементальное обновление рейтинга водителя — в том же savepoint
+        driver_id = order.assigned_driver_id
+        delta_sum = rating - (old_rating or 0)
+        delta_count = 0 if is_changed else 1
+        
+        with db.begin_nested() as savepoint:
+            result = db.execute(
+                update(Order)
+                .where(Order.id == order.id, same_rating)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            rated = result.rowcount == 1
+            if not rated:
+                # Оценку успели поменять: откатываем только свой savepoint,
+                # остальная работа обработчика в общей сессии остаётся
+                savepoint.rollback()
+            elif driver_id and (delta_sum or delta_count):
+                db.execute(
+                    update(Driver)
+                    .where(Driver.id == driver_id)
+                    .values(
+                        rating_sum=func.coalesce(Driver.rating_sum, 0) + delta_sum,
+                        rating_count=func.coalesce(Driver.rating_count, 0) + delta_count,
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                rating_sum, rating_count = db.execute(
+                    select(Driver.rating_sum, Driver.rating_count).where(Driver.id == driver_id)
+                ).one()
+                avg_rating = round(rating_sum / rating_count, 2) if rating_count else 0.0
+                # Старое поле rating обновляем для совместимости
+                db.execute(
+                    update(Driver)
+                    .where(Driver.id == driver_id)
+                    .values(rating_avg=avg_rating, rating=avg_rating)
+                    .execution_options(synchronize_session=False)
+                )
+        
+        if not rated:
+            db.refresh(order)
+            logger.warning(f"rating_set order={order.id} stars={rating} changed=False (concurrent update)")
+            return order
         
         db.commit()
         db.refresh(order)
         
         logger.info(f"rating_set order={order.id} stars={rating} changed={is_changed} old_rating={old_rating}")
+        if driver_id and (delta_sum or delta_count):
+            logger.info(f"driver_rating_updated driver={driver_id} avg={avg_rating:.2f} cnt={rating_count}")
         
-        # Обновить рейтинг водителя через ИСТИННЫЙ пересчёт из БД
-        if order.assigned_driver_id:
-            driver = db.query(Driver).filter(Driver.id == order.assigned_driver_id).first()
-            if driver:
-                # Истинный пересчёт: AVG и COUNT по всем оценкам в orders
-                from sqlalchemy import func
-                result = db.query(
-                    func.avg(Order.rating),
-                    func.count(Order.rating)
-                ).filter(
-                    Order.assigned_driver_id == driver.id,
-                    Order.rating.isnot(None)
-                ).first()
-                
-                avg_rating = result[0] if result[0] is not None else 0.0
-                rating_count = result[1] if result[1] is not None else 0
-                
-                driver.rating_avg = round(float(avg_rating), 2)
+        return order
+    
+    @staticmethod
+    def recompute_driver_ratings(db: Session, repair: bool = False) -> List[dict]:
+        """
+        Пересчитать рейтинги всех водителей по оценкам в orders и orders_archive
+        
+        Один сгруппированный запрос по обеим таблицам; сравнивает результат
+        с rating_sum / rating_count / rating_avg в drivers.
+        
+        Args:
+            db: Сессия БД
+            repair: Исправить расхождения (иначе только отчёт)
+            
+        Returns:
+            Список расхождений: driver_id, stored (sum, count, avg), actual (sum, count, avg)
+        """
+        rated = union_all(*(
+            select(model.assigned_driver_id.label("driver_id"), model.rating.label("rating"))
+            .where(model.assigned_driver_id.isnot(None), model.rating.isnot(None))
+            for model in (Order, ArchivedOrder)
+        )).subquery()
+        actual = {
+            driver_id: (int(rating_sum), rating_count)
+            for driver_id, rating_sum, rating_count in db.execute(
+                select(rated.c.driver_id, func.sum(rated.c.rating), func.count(rated.c.rating))
+                .group_by(rated.c.driver_id)
+            )
+        }
+        
+        mismatches = []
+        for driver in db.query(Driver).all():
+            rating_sum, rating_count = actual.get(driver.id, (0, 0))
+            avg_rating = round(rating_sum / rating_count, 2) if rating_count else 0.0
+            stored = (driver.rating_sum, driver.rating_count, driver.rating_avg)
+            if stored == (rating_sum, rating_count, avg_rating):
+                continue
+            mismatches.append({
+                "driver_id": driver.id,
+                "stored": stored,
+                "actual": (rating_sum, rating_count, avg_rating),
+            })
+            if repair:
+                driver.rating_sum = rating_sum
                 driver.rating_count = rating_count
-                # Обновляем и старое поле для совместимости
-                driver.rating = round(float(avg_rating), 2)
-                
-                db.commit()
-                
-                logger.info(
-                    f"driver_stats_updated driver={driver.id} trips={driver.completed_trips_count} "
-                    f"avg={driver.rating_avg:.2f} cnt={driver.rating_count}"
-                )
+                driver.rating_avg = avg_rating
+                if rating_count:
+                    driver.rating = avg_rating
         
-        return order
+        if repair and mismatches:
+            db.commit()
+        return mismatches
     
     @staticmethod
     def rate_order(db: Session, order: Order, rating: int, feedback: Optional[str] = None) -> Order:
@@ -445,7 +550,17 @@ class OrderService:
         ).order_by(Order.completed_at.desc()).limit(limit).all()
     
     @staticmethod
-    def get_user_order_history(db: Session, user_id: int, limit: int = 10, offset: int = 0) -> List[Order]:
+    def get_recent_rated_orders(db: Session, driver_id: int, limit: int = 3) -> List[Order]:
+        """Последние оценённые заказы водителя (для статистики)"""
+        return db.query(Order).filter(
+            Order.assigned_driver_id == driver_id,
+            Order.rating.isnot(None)
+        ).order_by(Order.finished_at.desc()).limit(limit).all()
+    
+    @staticmethod
+    def get_user_order_history(
+        db: Session, user_id: int, limit: int = 10, after: Optional[HistoryCursor] = None
+    ) -> List[Order]:
         """
         Получить историю заказов клиента (с пагинацией)
         
@@ -455,10 +570,10 @@ class OrderService:
             db: Сессия БД
             user_id: ID пользователя
             limit: Количество записей (по умолчанию 10)
-            offset: Смещение для пагинации (по умолчанию 0)
+            after: Курсор последнего заказа предыдущей страницы (None — первая страница)
             
         Returns:
-            Список заказов (сортировка по finished_at DESC)
+            Список заказов (сортировка по finished_at DESC, id DESC)
         """
         import logging
         logger = logging.getLogger(__name__)
@@ -472,20 +587,18 @@ class OrderService:
             OrderStatus.COMPLETED,
         ]
         
-        orders = db.query(Order).filter(
-            Order.customer_id == user_id,
-            Order.status.in_(history_statuses)
-        ).order_by(
-            Order.finished_at.desc().nullslast(),
-            Order.created_at.desc()
-        ).limit(limit).offset(offset).all()
+        orders = OrderService._merge_history(
+            db, "customer_id", user_id, history_statuses, limit, after
+        )
         
-        logger.info(f"history_user served uid={user_id} count={len(orders)} offset={offset}")
+        logger.info(f"history_user served uid={user_id} count={len(orders)} after={after}")
         
         return orders
     
     @staticmethod
-    def get_driver_order_history(db: Session, driver_id: int, limit: int = 10, offset: int = 0) -> List[Order]:
+    def get_driver_order_history(
+        db: Session, driver_id: int, limit: int = 10, after: Optional[HistoryCursor] = None
+    ) -> List[Order]:
         """
         Получить историю заказов водителя (с пагинацией)
         
@@ -495,10 +608,10 @@ class OrderService:
             db: Сессия БД
             driver_id: ID водителя (Driver.id, не User.id)
             limit: Количество записей (по умолчанию 10)
-            offset: Смещение для пагинации (по умолчанию 0)
+            after: Курсор последнего заказа предыдущей страницы (None — первая страница)
             
         Returns:
-            Список заказов (сортировка по finished_at DESC)
+            Список заказов (сортировка по finished_at DESC, id DESC)
         """
         import logging
         logger = logging.getLogger(__name__)
@@ -511,15 +624,83 @@ class OrderService:
             OrderStatus.COMPLETED,
         ]
         
-        orders = db.query(Order).filter(
-            Order.assigned_driver_id == driver_id,
-            Order.status.in_(history_statuses)
-        ).order_by(
-            Order.finished_at.desc().nullslast(),
-            Order.created_at.desc()
-        ).limit(limit).offset(offset).all()
+        orders = OrderService._merge_history(
+            db, "assigned_driver_id", driver_id, history_statuses, limit, after
+        )
         
-        logger.info(f"history_driver served driver_id={driver_id} count={len(orders)} offset={offset}")
+        logger.info(f"history_driver served driver_id={driver_id} count={len(orders)} after={after}")
         
         return orders
-
+    
+    @staticmethod
+    def _merge_history(
+        db: Session, owner_column: str, owner_id: int, statuses, limit: int, after: Optional[HistoryCursor]
+    ) -> List[Order]:
+        """
+        Страница истории из живой таблицы и архива
+        
+        Из каждой таблицы берётся не больше limit строк после курсора,
+        затем они сливаются в общем порядке. В списке могут быть и Order,
+        и ArchivedOrder — колонки у них одинаковые.
+        """
+        rows = []
+        for model in (Order, ArchivedOrder):
+            rows.extend(OrderService._history_page(
+                db.query(model).filter(
+                    getattr(model, owner_column) == owner_id,
+                    model.status.in_(statuses)
+                ),
+                model, limit, after
+            ))
+        rows.sort(key=_history_sort_key, reverse=True)
+        return rows[:limit]
+    
+    @staticmethod
+    def _history_page(query, model, limit: int, after: Optional[HistoryCursor]) -> list:
+        """
+        Keyset-страница: строки строго после курсора в порядке finished_at DESC NULLS LAST, id DESC
+        
+        Заказы с finished_at и без него (отменённые, истёкшие) читаются отдельными
+        запросами, каждый идёт по индексу (владелец, finished_at, id) от позиции
+        курсора — глубокая страница стоит столько же, сколько первая.
+        """
+        rows = []
+        if after is None or after[0] is not None:
+            finished = query.filter(model.finished_at.isnot(None))
+            if after is not None:
+                finished = finished.filter(tuple_(model.finished_at, model.id) < after)
+            rows = finished.order_by(model.finished_at.desc(), model.id.desc()).limit(limit).all()
+        if len(rows) < limit:
+            unfinished = query.filter(model.finished_at.is_(None))
+            if after is not None and after[0] is None:
+                unfinished = unfinished.filter(model.id < after[1])
+            rows += unfinished.order_by(model.id.desc()).limit(limit - len(rows)).all()
+        return rows
+    
+    @staticmethod
+    def history_cursor(order: Order) -> str:
+        """Курсор заказа для callback_data: "<finished_at в мкс>:<id>" или "-:<id>" """
+        if order.finished_at is None:
+            return f"-:{order.id}"
+        return f"{(order.finished_at - _EPOCH) // timedelta(microseconds=1)}:{order.id}"
+    
+    @staticmethod
+    def parse_history_cursor(value: str) -> Optional[HistoryCursor]:
+        """Разобрать курсор из callback_data (None — некорректный, показываем первую страницу)"""
+        try:
+            finished_str, id_str = value.split(":")
+            finished_at = None if finished_str == "-" else _EPOCH + timedelta(microseconds=int(finished_str))
+            return finished_at, int(id_str)
+        except (ValueError, OverflowError):
+            return None
+    
+    # ==================== АСИНХРОННЫЕ ВАРИАНТЫ ====================
+    # Выполняются через run_in_session: с асинхронным драйвером (DATABASE_URL
+    # sqlite+aiosqlite:// или postgresql+asyncpg://) не блокируют event loop.
+    # Возвращаемые заказы отсоединены от сессии — связи (customer и т.п.) не подгружаются.
+    
+    @staticmethod
+    async def get_order_by_id_async(order_id: int) -> Optional[Order]:
+        """Получить заказ по ID (async)"""
+        from database.db import run_in_session
+        return await run_in_session(OrderService.get_order_by_id, order_id)
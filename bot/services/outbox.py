@@ -0,0 +1,427 @@
+"""
+Очередь исходящих сообщений Telegram
+Все рассылки водителям и уведомления клиентам идут через одну очередь:
+- глобальный token bucket (лимит бота на все чаты) и token bucket на каждый чат;
+- полосы приоритета: предложения заказов → статусы для клиентов → меню и рассылки;
+- RetryAfter от Telegram ставит отправку на паузу, сообщение уходит повторно.
+
+Предложения никогда не ждут за массовой рассылкой: воркер всегда сначала
+выбирает из старших полос, массовые сообщения не тратят резерв глобального лимита,
+а часть одновременных отправок (offer_reserved_in_flight) держится только для предложений.
+
+Ответы пользователю в его же чате (меню, reply_text, правка сообщения с нажатой
+кнопкой) идут полосой PRIORITY_BULK, уведомления другой стороне заказа — PRIORITY_STATUS.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Iterable, List, Optional, TypeVar
+
+from telegram.error import RetryAfter
+
+from bot.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# Полосы приоритета (меньше — важнее)
+PRIORITY_OFFER = 0   # Предложения заказов водителям
+PRIORITY_STATUS = 1  # Статусы заказа для клиентов и водителей
+PRIORITY_BULK = 2    # Меню, массовые рассылки
+
+PRIORITY_NAMES = ("offer", "status", "bulk")
+
+T = TypeVar("T")
+
+# Как часто чистить бакеты чатов, которым давно ничего не отправляли (секунды)
+_BUCKET_PRUNE_INTERVAL = 60.0
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity про запас"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float, reserve: float = 0.0) -> float:
+        """Сколько ждать, пока появится токен сверх reserve (0 — можно сейчас)"""
+        self.refill(now)
+        missing = reserve + 1.0 - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate
+
+    def take(self):
+        self.tokens -= 1.0
+
+    def is_full(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Outgoing:
+    """Сообщение в очереди"""
+
+    __slots__ = ("bot", "method", "chat_id", "kwargs", "priority", "future", "attempts")
+
+    def __init__(self, bot, method: str, chat_id: int, kwargs: Dict[str, Any], priority: int, future):
+        self.bot = bot
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+
+
+class Outbox:
+    """
+    Очередь исходящих вызовов Bot API с лимитами и приоритетами
+
+    Каждая полоса — OrderedDict {chat_id: deque}: чаты обслуживаются по кругу,
+    поэтому один чат с длинной очередью не задерживает остальные.
+    Пока очередь не запущена (скрипты, симулятор), вызовы уходят напрямую.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        max_in_flight: int = 16,
+        offer_reserved_in_flight: int = 4,
+        bulk_reserve: float = 5.0,
+        max_retries: int = 3,
+    ):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_in_flight = max_in_flight
+        # Статусам и меню остаётся max_in_flight - offer_reserved_in_flight (но хотя бы 1)
+        self.offer_reserved_in_flight = min(max(0, offer_reserved_in_flight), max_in_flight - 1)
+        self.bulk_reserve = bulk_reserve
+        self.max_retries = max_retries
+
+        self._lanes: List["OrderedDict[int, Deque[_Outgoing]]"] = [
+            OrderedDict() for _ in PRIORITY_NAMES
+        ]
+        self._depth = [0] * len(PRIORITY_NAMES)
+        self._global: Optional[TokenBucket] = None
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._in_flight: Dict[asyncio.Task, _Outgoing] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._last_prune = 0.0
+
+        self._sent = 0
+        self._failed = 0
+        self._retries = 0
+        self._max_wait = [0.0] * len(PRIORITY_NAMES)
+
+    # ==================== ЗАПУСК / ОСТАНОВКА ====================
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def start(self):
+        """Запустить воркер очереди (в работающем event loop)"""
+        if self.running:
+            return
+        now = time.monotonic()
+        self._global = TokenBucket(self.global_rate, self.global_rate, now)
+        self._wakeup = asyncio.Event()
+        self._last_prune = now
+        self._worker = asyncio.create_task(self._run())
+        logger.info(
+            "Outbox запущен: %.0f msg/s глобально, %.1f msg/s на чат",
+            self.global_rate, self.chat_rate,
+        )
+
+    async def stop(self, drain_timeout: float = 5.0):
+        """
+        Остановить воркер: дать очереди до drain_timeout секунд на отправку,
+        оставшиеся сообщения отменить
+        """
+        if not self.running:
+            return
+        deadline = time.monotonic() + drain_timeout
+        while (self._total_depth() or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        dropped = 0
+        for lane in self._lanes:
+            for items in lane.values():
+                for item in items:
+                    if not item.future.done():
+                        item.future.cancel()
+                    dropped += 1
+            lane.clear()
+        self._depth = [0] * len(PRIORITY_NAMES)
+        if dropped:
+            logger.warning("Outbox остановлен, не отправлено сообщений: %s", dropped)
+
+    # ==================== ПУБЛИЧНЫЙ API ====================
+
+    async def send_message(self, bot, chat_id: int, text: str, priority: int = PRIORITY_STATUS, **kwargs):
+        """Отправить сообщение через очередь. Возвращает Message или бросает ошибку Bot API"""
+        kwargs["text"] = text
+        return await self.call(bot, "send_message", chat_id, priority, **kwargs)
+
+    async def edit_message_text(self, bot, chat_id: int, text: str, priority: int = PRIORITY_STATUS, **kwargs):
+        """Отредактировать сообщение через очередь"""
+        kwargs["text"] = text
+        return await self.call(bot, "edit_message_text", chat_id, priority, **kwargs)
+
+    async def reply_text(self, message, text: str, priority: int = PRIORITY_BULK, **kwargs):
+        """message.reply_text через очередь: ответ в чат сообщения"""
+        return await self.send_message(message.get_bot(), message.chat_id, text, priority, **kwargs)
+
+    async def edit_query_text(self, query, text: str, priority: int = PRIORITY_BULK, **kwargs):
+        """query.edit_message_text через очередь: правка сообщения с нажатой кнопкой"""
+        if query.message is None:
+            # Сообщение inline-режима: чата нет, лимиты чата не применить
+            return await query.edit_message_text(text, **kwargs)
+        kwargs["message_id"] = query.message.message_id
+        return await self.edit_message_text(query.get_bot(), query.message.chat_id, text, priority, **kwargs)
+
+    async def call(self, bot, method: str, chat_id: int, priority: int = PRIORITY_STATUS, **kwargs):
+        """Вызвать метод Bot API с chat_id через очередь"""
+        if not self.running:
+            return await getattr(bot, method)(chat_id=chat_id, **kwargs)
+
+        future = asyncio.get_running_loop().create_future()
+        item = _Outgoing(bot, method, chat_id, kwargs, priority, future)
+        self._enqueue(item)
+        enqueued_at = time.monotonic()
+        try:
+            return await future
+        finally:
+            waited = time.monotonic() - enqueued_at
+            if waited > self._max_wait[priority]:
+                self._max_wait[priority] = waited
+
+    def get_stats(self) -> dict:
+        """Метрики очереди: глубина полос, сообщения в полёте, счётчики"""
+        return {
+            "running": self.running,
+            "depth": {name: self._depth[i] for i, name in enumerate(PRIORITY_NAMES)},
+            "chats_waiting": {name: len(self._lanes[i]) for i, name in enumerate(PRIORITY_NAMES)},
+            "max_wait_seconds": {
+                name: round(self._max_wait[i], 2) for i, name in enumerate(PRIORITY_NAMES)
+            },
+            "in_flight": len(self._in_flight),
+            "sent": self._sent,
+            "failed": self._failed,
+            "retries": self._retries,
+            "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 1),
+            "chat_buckets": len(self._chat_buckets),
+        }
+
+    # ==================== ВНУТРЕННЕЕ ====================
+
+    def _total_depth(self) -> int:
+        return sum(self._depth)
+
+    def _enqueue(self, item: _Outgoing, front: bool = False):
+        lane = self._lanes[item.priority]
+        items = lane.get(item.chat_id)
+        if items is None:
+            items = lane[item.chat_id] = deque()
+            if front:
+                lane.move_to_end(item.chat_id, last=False)
+        if front:
+            items.appendleft(item)
+        else:
+            items.append(item)
+        self._depth[item.priority] += 1
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def _prune_buckets(self, now: float):
+        """Удалить полные бакеты чатов, которых нет в очереди"""
+        waiting = set()
+        for lane in self._lanes:
+            waiting.update(lane.keys())
+        for chat_id in [
+            chat_id for chat_id, bucket in self._chat_buckets.items()
+            if chat_id not in waiting and bucket.is_full(now)
+        ]:
+            del self._chat_buckets[chat_id]
+        self._last_prune = now
+
+    def _dispatch(self, now: float) -> Optional[float]:
+        """
+        Отправить всё, что позволяют лимиты
+
+        Возвращает, через сколько секунд стоит проверить очередь снова
+        (None — ждать нового сообщения или завершения отправки).
+        """
+        if now < self._paused_until:
+            return self._paused_until - now
+
+        next_check: Optional[float] = None
+        for priority, lane in enumerate(self._lanes):
+            reserve = self.bulk_reserve if priority == PRIORITY_BULK else 0.0
+            max_in_flight = self.max_in_flight
+            if priority != PRIORITY_OFFER:
+                max_in_flight -= self.offer_reserved_in_flight
+            for chat_id in list(lane.keys()):
+                if len(self._in_flight) >= max_in_flight:
+                    # Младшие полосы ограничены не слабее
+                    return next_check
+
+                global_wait = self._global.wait_time(now, reserve)
+                if global_wait > 0:
+                    # Глобальный лимит исчерпан: младшие полосы тем более ждут
+                    return global_wait if next_check is None else min(next_check, global_wait)
+
+                bucket = self._chat_bucket(chat_id, now)
+                chat_wait = bucket.wait_time(now)
+                if chat_wait > 0:
+                    next_check = chat_wait if next_check is None else min(next_check, chat_wait)
+                    continue
+
+                items = lane[chat_id]
+                item = items.popleft()
+                if items:
+                    lane.move_to_end(chat_id)
+                else:
+                    del lane[chat_id]
+                self._depth[priority] -= 1
+
+                if item.future.done():
+                    # Отправитель уже отменил ожидание
+                    continue
+
+                self._global.take()
+                bucket.take()
+                task = asyncio.create_task(self._deliver(item))
+                self._in_flight[task] = item
+        return next_check
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            if now - self._last_prune >= _BUCKET_PRUNE_INTERVAL:
+                self._prune_buckets(now)
+            delay = self._dispatch(now)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, item: _Outgoing):
+        item.attempts += 1
+        try:
+            result = await getattr(item.bot, item.method)(chat_id=item.chat_id, **item.kwargs)
+        except RetryAfter as e:
+            self._retries += 1
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            self._paused_until = max(self._paused_until, time.monotonic() + float(retry_after))
+            logger.warning(
+                "Outbox: RetryAfter %ss (chat %s, попытка %s)",
+                retry_after, item.chat_id, item.attempts,
+            )
+            if item.attempts < self.max_retries and not item.future.done():
+                self._enqueue(item, front=True)
+            elif not item.future.done():
+                self._failed += 1
+                item.future.set_exception(e)
+        except Exception as e:
+            self._failed += 1
+            if not item.future.done():
+                item.future.set_exception(e)
+        else:
+            self._sent += 1
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            self._in_flight.pop(asyncio.current_task(), None)
+            self._wakeup.set()
+
+
+@dataclass
+class FanOutReport:
+    """Итог рассылки: результат или ошибка по каждому получателю"""
+    sent: Dict[Hashable, Any] = field(default_factory=dict)
+    failed: Dict[Hashable, BaseException] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    @property
+    def total(self) -> int:
+        return len(self.sent) + len(self.failed)
+
+    def summary(self) -> str:
+        return (
+            f"отправлено {len(self.sent)} из {self.total}, "
+            f"ошибок {len(self.failed)}, за {self.elapsed:.2f} с"
+        )
+
+
+async def fan_out(
+    recipients: Iterable[T],
+    send: Callable[[T], Awaitable[Any]],
+    key: Callable[[T], Hashable] = lambda recipient: recipient,
+    concurrency: Optional[int] = None,
+) -> FanOutReport:
+    """
+    Разослать сообщение всем получателям параллельно, не больше concurrency сразу
+
+    Отправки стартуют в порядке recipients (очерёдность FIFO сохраняется),
+    ошибка одному получателю не прерывает рассылку остальным.
+    """
+    report = FanOutReport()
+    semaphore = asyncio.Semaphore(concurrency or settings.fan_out_concurrency)
+    started = time.monotonic()
+
+    async def deliver(recipient: T):
+        recipient_key = key(recipient)
+        async with semaphore:
+            try:
+                report.sent[recipient_key] = await send(recipient)
+            except Exception as e:
+                report.failed[recipient_key] = e
+
+    await asyncio.gather(*(deliver(recipient) for recipient in recipients))
+    report.elapsed = time.monotonic() - started
+    return report
+
+
+# Глобальный экземпляр очереди
+outbox = Outbox(
+    global_rate=settings.outbox_global_rate,
+    chat_rate=settings.outbox_chat_rate,
+    chat_burst=settings.outbox_chat_burst,
+    max_in_flight=settings.outbox_max_in_flight,
+    offer_reserved_in_flight=settings.outbox_offer_reserved_in_flight,
+)
@@ -1,19 +1,28 @@
 """
 Сервис расчета фиксированной стоимости поездок.
 
-Работает на основе JSON-конфигурации с тарифами между зонами.
+Работает на основе JSON-конфигурации с тарифами между зонами. При загрузке
+конфигурация компилируется в матрицу зона × зона: симметрия и межгород
+разрешаются заранее, каждая ячейка — готовый неизменяемый PriceResult.
+Файл перечитывается, когда меняется его mtime; новая таблица подменяет
+старую целиком, так что запрос никогда не видит наполовину загруженные тарифы.
 """
 from __future__ import annotations
 
 import json
-from dataclasses import dataclass
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional, Tuple, Dict, Any
+from typing import Optional, Tuple, Dict, Any, List
 
 from bot.config import settings
 
+logger = logging.getLogger(__name__)
 
-@dataclass
+
+@dataclass(frozen=True)
 class PriceResult:
     """Результат поиска тарифа."""
 
@@ -36,21 +45,127 @@ class PriceResult:
         return self.mode == "missing"
 
 
+@dataclass
+class PricingReport:
+    """Отчёт о проверке конфигурации тарифов."""
+
+    zones: int = 0
+    entries: int = 0
+    # Пары зон, между которыми нет тарифа ни в одну сторону (с учётом симметрии)
+    missing_pairs: List[Tuple[str, str]] = field(default_factory=list)
+    # Пары, заданные несколько раз (действует последняя запись)
+    duplicate_pairs: List[Tuple[str, str]] = field(default_factory=list)
+    # Записи, ссылающиеся на зоны, которых нет в списке zones
+    unknown_zone_entries: List[Tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def is_clean(self) -> bool:
+        return not (self.missing_pairs or self.duplicate_pairs or self.unknown_zone_entries)
+
+    def summary(self) -> str:
+        return (
+            f"зон {self.zones}, тарифов {self.entries}, "
+            f"пар без тарифа {len(self.missing_pairs)}, повторов {len(self.duplicate_pairs)}, "
+            f"записей с неизвестной зоной {len(self.unknown_zone_entries)}"
+        )
+
+
+class _PricingTable:
+    """Скомпилированная конфигурация: индексы зон и матрица готовых результатов."""
+
+    def __init__(self, config: Dict[str, Any], mtime: Optional[float] = None):
+        self.mtime = mtime
+        zones = config.get("zones", [])
+        self.zones_by_id: Dict[str, Dict[str, str]] = {zone["id"]: zone for zone in zones}
+        self.zones_by_name: Dict[str, str] = {zone["name"]: zone["id"] for zone in zones}
+        self.index: Dict[str, int] = {zone_id: i for i, zone_id in enumerate(self.zones_by_id)}
+        # (id, название) в порядке файла — источник для реестра зон
+        self.zones: Tuple[Tuple[str, str], ...] = tuple(
+            (zone["id"], zone["name"]) for zone in self.zones_by_id.values()
+        )
+
+        rules = config.get("pricing_rules", {})
+        symmetry = bool(rules.get("fallback_symmetry"))
+        rate_per_km = rules.get("intercity_rate_per_km")
+
+        report = PricingReport(zones=len(self.index))
+        entries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for entry in config.get("prices", []):
+            from_zone = entry.get("from")
+            to_zone = entry.get("to")
+            if not from_zone or not to_zone:
+                continue
+            pair = (from_zone, to_zone)
+            report.entries += 1
+            if pair in entries:
+                report.duplicate_pairs.append(pair)
+            if from_zone not in self.index or to_zone not in self.index:
+                report.unknown_zone_entries.append(pair)
+            entries[pair] = entry
+
+        # Одинаковые результаты — один и тот же объект
+        interned: Dict[PriceResult, PriceResult] = {}
+
+        def _resolve(from_zone: str, to_zone: str) -> PriceResult:
+            entry, used_reverse = entries.get((from_zone, to_zone)), False
+            if not entry and symmetry:
+                entry, used_reverse = entries.get((to_zone, from_zone)), True
+            if not entry:
+                result = PriceResult(price=None, mode="missing", source_pair=(from_zone, to_zone))
+            else:
+                source_pair = (entry.get("from"), entry.get("to"))
+                mode = entry.get("mode") or "fixed"
+                if mode == "intercity":
+                    result = PriceResult(
+                        price=None, mode="intercity", used_reverse=used_reverse,
+                        rate_per_km=rate_per_km, source_pair=source_pair,
+                    )
+                elif entry.get("price") is None:
+                    result = PriceResult(
+                        price=None, mode="missing", used_reverse=used_reverse, source_pair=source_pair,
+                    )
+                else:
+                    result = PriceResult(
+                        price=entry["price"], mode="fixed", used_reverse=used_reverse, source_pair=source_pair,
+                    )
+            return interned.setdefault(result, result)
+
+        zone_ids = list(self.index)
+        self.matrix: Tuple[Tuple[PriceResult, ...], ...] = tuple(
+            tuple(_resolve(from_zone, to_zone) for to_zone in zone_ids) for from_zone in zone_ids
+        )
+
+        for i, from_zone in enumerate(zone_ids):
+            for j, to_zone in enumerate(zone_ids):
+                # С симметрией обе стороны пары одинаковы — в отчёт попадает одна
+                if i == j or (symmetry and j < i):
+                    continue
+                if self.matrix[i][j].is_missing:
+                    report.missing_pairs.append((from_zone, to_zone))
+        self.report = report
+
+    def get(self, from_zone_id: str, to_zone_id: str) -> PriceResult:
+        i = self.index.get(from_zone_id)
+        j = self.index.get(to_zone_id)
+        if i is None or j is None:
+            return PriceResult(price=None, mode="missing", source_pair=(from_zone_id, to_zone_id))
+        return self.matrix[i][j]
+
+
 class PricingService:
     """Сервис для работы с фиксированными тарифами."""
 
-    _config_data: Optional[Dict[str, Any]] = None
-    _zones_by_id: Dict[str, Dict[str, str]] = {}
-    _zones_by_name: Dict[str, str] = {}
-    _price_map: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    _table: Optional[_PricingTable] = None
+    _next_check: float = 0.0
+    _failed_mtime: Optional[float] = None
+    _reload_lock = threading.Lock()
 
     @classmethod
     def refresh(cls) -> None:
         """Сбросить кэшированные данные (например, после обновления файла)."""
-        cls._config_data = None
-        cls._zones_by_id = {}
-        cls._zones_by_name = {}
-        cls._price_map = {}
+        cls._table = None
+        cls._next_check = 0.0
+        cls._failed_mtime = None
 
     @classmethod
     def _resolve_config_path(cls) -> Path:
@@ -64,73 +179,91 @@ class PricingService:
         return (project_root / configured_path).resolve()
 
     @classmethod
-    def _load_config(cls) -> Dict[str, Any]:
-        """Загрузить JSON с тарифами и подготовить структуры для быстрого доступа."""
-        if cls._config_data is not None:
-            return cls._config_data
-
-        path = cls._resolve_config_path()
-        if not path.exists():
-            raise FileNotFoundError(
-                f"Файл конфигурации тарифов не найден: {path}"
-            )
-
+    def _compile(cls, path: Path) -> _PricingTable:
+        mtime = path.stat().st_mtime
         with path.open("r", encoding="utf-8") as fp:
-            cls._config_data = json.load(fp)
+            table = _PricingTable(json.load(fp), mtime)
+        if table.report.is_clean:
+            logger.info("Тарифы загружены: %s", table.report.summary())
+        else:
+            logger.warning("Тарифы загружены с замечаниями: %s", table.report.summary())
+        return table
 
-        zones = cls._config_data.get("zones", [])
-        cls._zones_by_id = {zone["id"]: zone for zone in zones}
-        cls._zones_by_name = {zone["name"]: zone["id"] for zone in zones}
+    @classmethod
+    def _get_table(cls) -> _PricingTable:
+        """Текущая скомпилированная таблица (перечитывается, если файл изменился)."""
+        table = cls._table
+        if table is None:
+            with cls._reload_lock:
+                if cls._table is None:
+                    path = cls._resolve_config_path()
+                    if not path.exists():
+                        raise FileNotFoundError(
+                            f"Файл конфигурации тарифов не найден: {path}"
+                        )
+                    cls._table = cls._compile(path)
+                    cls._next_check = time.monotonic() + settings.pricing_reload_interval
+                return cls._table
+
+        now = time.monotonic()
+        if now < cls._next_check or not cls._reload_lock.acquire(blocking=False):
+            return table
+        # Проверяет только один поток, остальные пока работают со старой таблицей
+        try:
+            cls._next_check = now + settings.pricing_reload_interval
+            path = cls._resolve_config_path()
+            try:
+                mtime = path.stat().st_mtime
+            except OSError as e:
+                logger.error("Файл тарифов недоступен, работаем со старыми тарифами: %s", e)
+                return table
+            if mtime == table.mtime or mtime == cls._failed_mtime:
+                return table
+            try:
+                cls._table = cls._compile(path)
+                cls._failed_mtime = None
+                logger.info("Тарифы перезагружены после изменения файла %s", path)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                # Ошибка в новом файле не должна ломать расчёт: оставляем старые тарифы
+                cls._failed_mtime = mtime
+                logger.error("Не удалось перезагрузить тарифы, работаем со старыми: %s", e)
+            return cls._table
+        finally:
+            cls._reload_lock.release()
 
-        prices = cls._config_data.get("prices", [])
-        cls._price_map = {}
-        for entry in prices:
-            from_zone = entry.get("from")
-            to_zone = entry.get("to")
-            if not from_zone or not to_zone:
-                continue
-            cls._price_map[(from_zone, to_zone)] = entry
+    @classmethod
+    def get_report(cls) -> PricingReport:
+        """Отчёт о проверке текущей конфигурации тарифов."""
+        return cls._get_table().report
 
-        return cls._config_data
+    @classmethod
+    def get_zones(cls) -> Tuple[Tuple[str, str], ...]:
+        """Зоны текущей конфигурации: (id, название). Новый объект — после перезагрузки файла."""
+        return cls._get_table().zones
 
     @classmethod
     def get_zone_id_by_name(cls, name: str) -> Optional[str]:
-        """Получить ID зоны по отображаемому названию."""
+        """Получить ID зоны по отображаемому названию (или его варианту написания)."""
         if not name:
             return None
-        cls._load_config()
-        return cls._zones_by_name.get(name.strip())
+        zone_id = cls._get_table().zones_by_name.get(name.strip())
+        if zone_id is None:
+            from bot.services.zone_registry import zone_registry  # локальный импорт чтобы избежать циклов
+            zone_id = zone_registry.pricing_id_for(name)
+        return zone_id
 
     @classmethod
     def get_zone_name_by_id(cls, zone_id: str) -> Optional[str]:
         """Получить отображаемое название зоны по её ID."""
         if not zone_id:
             return None
-        cls._load_config()
-        zone = cls._zones_by_id.get(zone_id)
+        zone = cls._get_table().zones_by_id.get(zone_id)
         return zone.get("name") if zone else None
 
     @classmethod
     def list_zone_names(cls) -> list[str]:
         """Список всех отображаемых названий зон."""
-        cls._load_config()
-        return list(cls._zones_by_name.keys())
-
-    @classmethod
-    def _find_price_entry(cls, from_zone_id: str, to_zone_id: str) -> Tuple[Optional[Dict[str, Any]], bool]:
-        """Найти тариф между зонами с учётом симметрии."""
-        cls._load_config()
-        direct = cls._price_map.get((from_zone_id, to_zone_id))
-        if direct:
-            return direct, False
-
-        rules = cls._config_data.get("pricing_rules", {})
-        if rules.get("fallback_symmetry"):
-            reverse = cls._price_map.get((to_zone_id, from_zone_id))
-            if reverse:
-                return reverse, True
-
-        return None, False
+        return list(cls._get_table().zones_by_name.keys())
 
     @classmethod
     def get_price(cls, from_zone_id: str, to_zone_id: str) -> PriceResult:
@@ -141,44 +274,10 @@ class PricingService:
         - fixed: найдена фиксированная цена;
         - intercity: тариф рассчитывается по межгороду (по километражу);
         - missing: тариф не задан.
-        """
-        entry, used_reverse = cls._find_price_entry(from_zone_id, to_zone_id)
-        if not entry:
-            return PriceResult(
-                price=None,
-                mode="missing",
-                used_reverse=False,
-                source_pair=(from_zone_id, to_zone_id),
-            )
-
-        mode = entry.get("mode") or "fixed"
-        rules = cls._config_data.get("pricing_rules", {})
-
-        if mode == "intercity":
-            return PriceResult(
-                price=None,
-                mode="intercity",
-                used_reverse=used_reverse,
-                rate_per_km=rules.get("intercity_rate_per_km"),
-                source_pair=(entry.get("from"), entry.get("to")),
-            )
-
-        price = entry.get("price")
-        if price is None:
-            return PriceResult(
-                price=None,
-                mode="missing",
-                used_reverse=used_reverse,
-                source_pair=(entry.get("from"), entry.get("to")),
-            )
 
-        return PriceResult(
-            price=price,
-            mode="fixed",
-            used_reverse=used_reverse,
-            rate_per_km=None,
-            source_pair=(entry.get("from"), entry.get("to")),
-        )
+        Результат общий для всех вызовов — не изменяйте его.
+        """
+        return cls._get_table().get(from_zone_id, to_zone_id)
 
     @classmethod
     def ensure_price_available(cls, from_zone_id: str, to_zone_id: str) -> PriceResult:
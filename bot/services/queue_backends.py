@@ -0,0 +1,363 @@
+"""
+Хранилища очередей водителей для QueueManager
+- InMemoryQueueBackend: очереди в памяти процесса (один воркер)
+- DatabaseQueueBackend: очереди в таблице driver_queue, общие для нескольких воркеров
+"""
+import logging
+from abc import ABC, abstractmethod
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from bot.models.queue_entry import QueueEntry, QUEUE_TAIL_KEY
+
+logger = logging.getLogger(__name__)
+
+
+# Ключ сортировки: (online_since is None, online_since, driver_id)
+QueueKey = Tuple[bool, datetime, int]
+
+
+class ZoneQueue:
+    """
+    Упорядоченная очередь одной зоны
+
+    Хранит водителей отсортированными по (online_since, driver_id) и держит
+    online_since в памяти, поэтому вставка, удаление и позиция считаются
+    бинарным поиском без обращения к БД. Водители без online_since — в конце.
+    """
+
+    def __init__(self):
+        self._keys: List[QueueKey] = []
+        self._key_by_driver: Dict[int, QueueKey] = {}
+
+    @staticmethod
+    def _make_key(driver_id: int, online_since: Optional[datetime]) -> QueueKey:
+        # None трактуем как самый новый (в конец)
+        return (online_since is None, online_since or datetime.max, driver_id)
+
+    def add(self, driver_id: int, online_since: Optional[datetime]) -> int:
+        """Вставить водителя (или переставить, если он уже в очереди). Возвращает позицию (1-based)"""
+        self.remove(driver_id)
+        key = self._make_key(driver_id, online_since)
+        insort(self._keys, key)
+        self._key_by_driver[driver_id] = key
+        return bisect_left(self._keys, key) + 1
+
+    def remove(self, driver_id: int) -> bool:
+        """Удалить водителя из очереди"""
+        key = self._key_by_driver.pop(driver_id, None)
+        if key is None:
+            return False
+        index = bisect_left(self._keys, key)
+        del self._keys[index]
+        return True
+
+    def position(self, driver_id: int) -> Optional[int]:
+        """Позиция водителя в очереди (1-based) или None"""
+        key = self._key_by_driver.get(driver_id)
+        if key is None:
+            return None
+        return bisect_left(self._keys, key) + 1
+
+    def online_since(self, driver_id: int) -> Optional[datetime]:
+        """online_since водителя, с которым он стоит в очереди"""
+        key = self._key_by_driver.get(driver_id)
+        if key is None or key[0]:
+            return None
+        return key[1]
+
+    def entries(self) -> List[Tuple[int, Optional[datetime]]]:
+        """Список (driver_id, online_since) в порядке очереди"""
+        return [(key[2], None if key[0] else key[1]) for key in self._keys]
+
+    def ids(self) -> List[int]:
+        """Список driver_id в порядке очереди"""
+        return [key[2] for key in self._keys]
+
+    def clear(self):
+        """Очистить очередь"""
+        self._keys.clear()
+        self._key_by_driver.clear()
+
+    def __contains__(self, driver_id: int) -> bool:
+        return driver_id in self._key_by_driver
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.ids())
+
+    def __repr__(self) -> str:
+        return repr(self.ids())
+
+
+class QueueBackend(ABC):
+    """
+    Хранилище очередей зон
+
+    Водитель может стоять не больше чем в одной очереди: add() переносит его
+    из любой другой зоны. claim() — атомарный захват водителя из очереди:
+    из нескольких конкурентных вызовов True получает ровно один.
+    """
+
+    @abstractmethod
+    def add(self, driver_id: int, zone: str, online_since: Optional[datetime]) -> int:
+        """Поставить водителя в очередь зоны. Возвращает позицию (1-based)"""
+
+    @abstractmethod
+    def remove(self, driver_id: int) -> Optional[str]:
+        """Убрать водителя из всех очередей. Возвращает зону, где он стоял"""
+
+    def claim(self, driver_id: int) -> bool:
+        """Захватить водителя (убрать из очереди), True — если захват наш"""
+        return self.remove(driver_id) is not None
+
+    @abstractmethod
+    def zone_of(self, driver_id: int) -> Optional[str]:
+        """Зона, в очереди которой стоит водитель"""
+
+    @abstractmethod
+    def position(self, driver_id: int) -> Optional[int]:
+        """Позиция водителя в его очереди (1-based)"""
+
+    @abstractmethod
+    def online_since(self, driver_id: int) -> Optional[datetime]:
+        """online_since, с которым водитель стоит в очереди"""
+
+    @abstractmethod
+    def entries(self, zone: str) -> List[Tuple[int, Optional[datetime]]]:
+        """(driver_id, online_since) очереди зоны по порядку"""
+
+    def ids(self, zone: str) -> List[int]:
+        """driver_id очереди зоны по порядку"""
+        return [driver_id for driver_id, _ in self.entries(zone)]
+
+    @abstractmethod
+    def driver_zones(self) -> Dict[int, str]:
+        """Все водители в очередях: {driver_id: zone}"""
+
+    @abstractmethod
+    def clear_zone(self, zone: str) -> List[int]:
+        """Очистить очередь зоны. Возвращает удалённых водителей"""
+
+    @abstractmethod
+    def clear(self):
+        """Очистить все очереди"""
+
+
+class InMemoryQueueBackend(QueueBackend):
+    """Очереди в памяти процесса (ZoneQueue на каждую зону)"""
+
+    def __init__(self, zones: List[str]):
+        self._queues: Dict[str, ZoneQueue] = {zone: ZoneQueue() for zone in zones}
+        # Кеш: {driver_id: zone} для быстрого поиска
+        self._driver_zones: Dict[int, str] = {}
+
+    def add(self, driver_id: int, zone: str, online_since: Optional[datetime]) -> int:
+        self.remove(driver_id)
+        position = self._queues[zone].add(driver_id, online_since)
+        self._driver_zones[driver_id] = zone
+        return position
+
+    def remove(self, driver_id: int) -> Optional[str]:
+        removed_zone = None
+        # Проверяем все очереди (на случай бага), каждая проверка — O(1)
+        for zone, queue in self._queues.items():
+            if queue.remove(driver_id):
+                removed_zone = zone
+        self._driver_zones.pop(driver_id, None)
+        return removed_zone
+
+    def zone_of(self, driver_id: int) -> Optional[str]:
+        return self._driver_zones.get(driver_id)
+
+    def position(self, driver_id: int) -> Optional[int]:
+        zone = self._driver_zones.get(driver_id)
+        if zone is None:
+            return None
+        return self._queues[zone].position(driver_id)
+
+    def online_since(self, driver_id: int) -> Optional[datetime]:
+        zone = self._driver_zones.get(driver_id)
+        if zone is None:
+            return None
+        return self._queues[zone].online_since(driver_id)
+
+    def entries(self, zone: str) -> List[Tuple[int, Optional[datetime]]]:
+        return self._queues[zone].entries()
+
+    def ids(self, zone: str) -> List[int]:
+        return self._queues[zone].ids()
+
+    def driver_zones(self) -> Dict[int, str]:
+        return dict(self._driver_zones)
+
+    def clear_zone(self, zone: str) -> List[int]:
+        removed = self._queues[zone].ids()
+        for driver_id in removed:
+            if self._driver_zones.get(driver_id) == zone:
+                del self._driver_zones[driver_id]
+        self._queues[zone].clear()
+        return removed
+
+    def clear(self):
+        for queue in self._queues.values():
+            queue.clear()
+        self._driver_zones = {}
+
+
+class DatabaseQueueBackend(QueueBackend):
+    """
+    Очереди в таблице driver_queue
+
+    Состояние общее для всех воркеров, подключённых к одной БД. Каждая операция —
+    короткая транзакция в собственной сессии. Захват водителя — DELETE по PK:
+    строку удаляет ровно один воркер, остальные получают rowcount == 0.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session]):
+        self._session_factory = session_factory
+
+    def _session(self) -> Session:
+        return self._session_factory()
+
+    @staticmethod
+    def _sort_key(online_since: Optional[datetime]) -> datetime:
+        # Водители без online_since — в конец (одинаково для SQLite и PostgreSQL)
+        return online_since or QUEUE_TAIL_KEY
+
+    def add(self, driver_id: int, zone: str, online_since: Optional[datetime]) -> int:
+        sort_key = self._sort_key(online_since)
+        db = self._session()
+        try:
+            for attempt in range(2):
+                try:
+                    db.execute(delete(QueueEntry).where(QueueEntry.driver_id == driver_id))
+                    db.add(QueueEntry(
+                        driver_id=driver_id,
+                        zone=zone,
+                        online_since=online_since,
+                        sort_key=sort_key,
+                    ))
+                    db.commit()
+                    break
+                except IntegrityError:
+                    # Конкурентный add того же водителя из другого воркера — повторяем
+                    db.rollback()
+                    if attempt:
+                        raise
+            return self._position_in(db, driver_id, zone, sort_key)
+        finally:
+            db.close()
+
+    def remove(self, driver_id: int) -> Optional[str]:
+        db = self._session()
+        try:
+            zone = db.execute(
+                select(QueueEntry.zone).where(QueueEntry.driver_id == driver_id)
+            ).scalar()
+            if zone is None:
+                return None
+            result = db.execute(delete(QueueEntry).where(QueueEntry.driver_id == driver_id))
+            db.commit()
+            return zone if result.rowcount else None
+        finally:
+            db.close()
+
+    def claim(self, driver_id: int) -> bool:
+        db = self._session()
+        try:
+            result = db.execute(delete(QueueEntry).where(QueueEntry.driver_id == driver_id))
+            db.commit()
+            return result.rowcount == 1
+        finally:
+            db.close()
+
+    def zone_of(self, driver_id: int) -> Optional[str]:
+        db = self._session()
+        try:
+            return db.execute(
+                select(QueueEntry.zone).where(QueueEntry.driver_id == driver_id)
+            ).scalar()
+        finally:
+            db.close()
+
+    @staticmethod
+    def _position_in(db: Session, driver_id: int, zone: str, sort_key: datetime) -> int:
+        ahead = db.execute(
+            select(func.count()).select_from(QueueEntry).where(
+                QueueEntry.zone == zone,
+                or_(
+                    QueueEntry.sort_key < sort_key,
+                    and_(QueueEntry.sort_key == sort_key, QueueEntry.driver_id < driver_id),
+                ),
+            )
+        ).scalar()
+        return (ahead or 0) + 1
+
+    def position(self, driver_id: int) -> Optional[int]:
+        db = self._session()
+        try:
+            entry = db.execute(
+                select(QueueEntry.zone, QueueEntry.sort_key).where(QueueEntry.driver_id == driver_id)
+            ).first()
+            if entry is None:
+                return None
+            return self._position_in(db, driver_id, entry.zone, entry.sort_key)
+        finally:
+            db.close()
+
+    def online_since(self, driver_id: int) -> Optional[datetime]:
+        db = self._session()
+        try:
+            return db.execute(
+                select(QueueEntry.online_since).where(QueueEntry.driver_id == driver_id)
+            ).scalar()
+        finally:
+            db.close()
+
+    def entries(self, zone: str) -> List[Tuple[int, Optional[datetime]]]:
+        db = self._session()
+        try:
+            rows = db.execute(
+                select(QueueEntry.driver_id, QueueEntry.online_since)
+                .where(QueueEntry.zone == zone)
+                .order_by(QueueEntry.sort_key, QueueEntry.driver_id)
+            ).all()
+            return [(row.driver_id, row.online_since) for row in rows]
+        finally:
+            db.close()
+
+    def driver_zones(self) -> Dict[int, str]:
+        db = self._session()
+        try:
+            rows = db.execute(select(QueueEntry.driver_id, QueueEntry.zone)).all()
+            return {row.driver_id: row.zone for row in rows}
+        finally:
+            db.close()
+
+    def clear_zone(self, zone: str) -> List[int]:
+        db = self._session()
+        try:
+            removed = list(db.execute(
+                select(QueueEntry.driver_id).where(QueueEntry.zone == zone)
+            ).scalars())
+            db.execute(delete(QueueEntry).where(QueueEntry.zone == zone))
+            db.commit()
+            return removed
+        finally:
+            db.close()
+
+    def clear(self):
+        db = self._session()
+        try:
+            db.execute(delete(QueueEntry))
+            db.commit()
+        finally:
+            db.close()
@@ -0,0 +1,181 @@
+"""
+Журнал очередей водителей
+Append-only журнал событий QueueManager (add/remove/switch/clear) со снапшотом,
+чтобы после перезапуска восстановить очереди без сканирования БД и без потери FIFO
+"""
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Состояние очередей: {zone: [(driver_id, online_since), ...]} в порядке очереди
+QueueState = Dict[str, List[Tuple[int, Optional[datetime]]]]
+
+SNAPSHOT_VERSION = 1
+
+
+def _dump_dt(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _load_dt(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+class QueueJournal:
+    """
+    Журнал очередей: снапшот + хвост событий
+
+    Файлы:
+    - <path>          — хвост событий, по одному JSON на строку
+    - <path>.snapshot — состояние очередей на момент последней компакции
+
+    Каждое событие полностью задаёт положение одного водителя (или очищает всё),
+    поэтому повторное применение хвоста поверх более нового снапшота
+    (сбой между записью снапшота и усечением журнала) даёт то же состояние.
+    """
+
+    def __init__(self, path: str, compact_every: int = 1000):
+        self.path = Path(path)
+        self.snapshot_path = self.path.with_name(self.path.name + ".snapshot")
+        self.compact_every = compact_every
+        self._fp = None
+        self._events_since_compaction = 0
+        # При чтении встретились повреждённые строки: хвост нужно переписать снапшотом
+        self._damaged = False
+
+    def _open(self):
+        if self._fp is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._fp = self.path.open("a", encoding="utf-8")
+        return self._fp
+
+    def record(
+        self,
+        op: str,
+        driver_id: Optional[int] = None,
+        zone: Optional[str] = None,
+        online_since: Optional[datetime] = None,
+    ):
+        """Дописать событие в журнал"""
+        event = {"op": op}
+        if driver_id is not None:
+            event["driver_id"] = driver_id
+        if zone is not None:
+            event["zone"] = zone
+        if op in ("add", "switch"):
+            event["online_since"] = _dump_dt(online_since)
+
+        fp = self._open()
+        fp.write(json.dumps(event, ensure_ascii=False) + "\n")
+        fp.flush()
+        self._events_since_compaction += 1
+
+    def needs_compaction(self) -> bool:
+        return self._damaged or self._events_since_compaction >= self.compact_every
+
+    def compact(self, state: QueueState):
+        """Записать снапшот текущего состояния и обнулить хвост журнала"""
+        payload = {
+            "version": SNAPSHOT_VERSION,
+            "created_at": _dump_dt(datetime.utcnow()),
+            "queues": {
+                zone: [[driver_id, _dump_dt(online_since)] for driver_id, online_since in entries]
+                for zone, entries in state.items()
+            },
+        }
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.snapshot_path.with_name(self.snapshot_path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as fp:
+            json.dump(payload, fp, ensure_ascii=False)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        # Снапшот на месте — хвост больше не нужен
+        if self._fp is not None:
+            self._fp.close()
+        self._fp = self.path.open("w", encoding="utf-8")
+        self._events_since_compaction = 0
+        self._damaged = False
+        logger.info(f"Журнал очередей сжат: {sum(len(e) for e in state.values())} водителей в снапшоте")
+
+    def load(self, zones: List[str]) -> Optional[QueueState]:
+        """
+        Восстановить состояние очередей: снапшот + хвост событий
+        Возвращает None, если журнала нет (первый запуск)
+
+        Повреждённые строки пропускаются, а журнал помечается для компакции
+        (needs_compaction): иначе новые события дописывались бы за оборванной строкой.
+        """
+        if not self.snapshot_path.exists() and not self.path.exists():
+            return None
+
+        queues: Dict[str, Dict[int, Optional[datetime]]] = {zone: {} for zone in zones}
+
+        if self.snapshot_path.exists():
+            with self.snapshot_path.open("r", encoding="utf-8") as fp:
+                payload = json.load(fp)
+            if payload.get("version") != SNAPSHOT_VERSION:
+                logger.warning(f"Неизвестная версия снапшота очередей: {payload.get('version')}")
+                return None
+            for zone, entries in payload.get("queues", {}).items():
+                if zone not in queues:
+                    continue
+                for driver_id, online_since in entries:
+                    queues[zone][int(driver_id)] = _load_dt(online_since)
+
+        replayed = 0
+        skipped = 0
+        if self.path.exists():
+            with self.path.open("r", encoding="utf-8") as fp:
+                for line in fp:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # Недописанная строка при аварийной остановке (или склеенная с ней следующая)
+                        skipped += 1
+                        continue
+                    if not isinstance(event, dict):
+                        skipped += 1
+                        continue
+                    self._apply(queues, event)
+                    replayed += 1
+
+        self._events_since_compaction = replayed
+        self._damaged = skipped > 0
+        if skipped:
+            logger.warning(f"Журнал очередей: пропущено повреждённых строк: {skipped}")
+        logger.info(f"Журнал очередей прочитан: применено {replayed} событий после снапшота")
+        return {zone: list(entries.items()) for zone, entries in queues.items()}
+
+    @staticmethod
+    def _apply(queues: Dict[str, Dict[int, Optional[datetime]]], event: Dict):
+        op = event.get("op")
+        if op == "clear":
+            for entries in queues.values():
+                entries.clear()
+            return
+
+        driver_id = event.get("driver_id")
+        if driver_id is None:
+            return
+        for entries in queues.values():
+            entries.pop(driver_id, None)
+
+        if op in ("add", "switch"):
+            zone = event.get("zone")
+            if zone in queues:
+                queues[zone][driver_id] = _load_dt(event.get("online_since"))
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
@@ -1,15 +1,17 @@
 """
 Менеджер очередей водителей
-Управляет ZoneQueue для каждой зоны
+Управляет очередями зон через QueueBackend (ZoneQueue в памяти или общая таблица в БД)
 """
+import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import List, Optional, Dict
-from collections import defaultdict
+from datetime import datetime
+from typing import AbstractSet, List, Optional, Dict, Set, Tuple
 
 from sqlalchemy.orm import Session
 from bot.models.driver import Driver, DriverStatus, DriverZone
 from bot.constants import ZONES
+from bot.services.queue_backends import QueueBackend, InMemoryQueueBackend
+from bot.services.queue_journal import QueueJournal, QueueState
 
 logger = logging.getLogger(__name__)
 
@@ -17,22 +19,220 @@ logger = logging.getLogger(__name__)
 class QueueManager:
     """Менеджер очередей водителей по зонам"""
     
-    def __init__(self):
-        # Очереди для каждой зоны: {zone: [driver_id, ...]} (упорядочены по online_since)
-        self._queues: Dict[str, List[int]] = {zone: [] for zone in ZONES}
-        # Кеш: {driver_id: zone} для быстрого поиска
-        self._driver_zones: Dict[int, str] = {}
+    def __init__(self, backend: Optional[QueueBackend] = None):
+        # Хранилище очередей: {zone: [driver_id, ...]} (упорядочены по online_since)
+        self._backend: QueueBackend = backend or InMemoryQueueBackend(ZONES)
+        # Счётчики get_next_driver: вызовы, прочитанные строки, вычищенные записи
+        self._lookup_stats: Dict[str, int] = {
+            "lookups": 0,
+            "rows_fetched": 0,
+            "pruned": 0,
+            "last_rows": 0,
+            "max_rows": 0,
+        }
+        # Журнал событий для тёплого рестарта (подключается в post_init)
+        self._journal: Optional[QueueJournal] = None
+        # Водители, чьё место в очереди менялось, пока фоновая сверка читала БД
+        # (None — сверка не идёт); их состояние в очереди новее прочитанного
+        self._changed_during_reconcile: Optional[Set[int]] = None
+        self._cleared_during_reconcile = False
+    
+    def set_backend(self, backend: QueueBackend):
+        """Сменить хранилище очередей (например, на общее в БД для нескольких воркеров)"""
+        self._backend = backend
+        logger.info(f"Хранилище очередей: {type(backend).__name__}")
+    
+    @property
+    def backend(self) -> QueueBackend:
+        return self._backend
+    
+    def attach_journal(self, journal: QueueJournal):
+        """Подключить журнал: дальше каждое изменение очередей записывается в него"""
+        self._journal = journal
+    
+    def close_journal(self):
+        """Сжать и закрыть журнал (при остановке бота)"""
+        if not self._journal:
+            return
+        try:
+            self._journal.compact(self._snapshot_state())
+        except OSError as e:
+            logger.error(f"Не удалось сжать журнал очередей: {e}")
+        self._journal.close()
+        self._journal = None
+    
+    def _snapshot_state(self) -> QueueState:
+        return {zone: self._backend.entries(zone) for zone in ZONES}
+    
+    def _journal_event(
+        self,
+        op: str,
+        driver_id: Optional[int] = None,
+        zone: Optional[str] = None,
+        online_since: Optional[datetime] = None,
+    ):
+        """Записать событие в журнал (ошибки журнала не должны ломать распределение)"""
+        if self._changed_during_reconcile is not None:
+            if op == "clear":
+                self._cleared_during_reconcile = True
+            elif driver_id is not None:
+                self._changed_during_reconcile.add(driver_id)
+        if not self._journal:
+            return
+        try:
+            self._journal.record(op, driver_id, zone, online_since)
+            if self._journal.needs_compaction():
+                self._journal.compact(self._snapshot_state())
+        except OSError as e:
+            logger.error(f"Ошибка записи журнала очередей: {e}")
+    
+    def _compact_journal(self):
+        if not self._journal:
+            return
+        try:
+            self._journal.compact(self._snapshot_state())
+        except OSError as e:
+            logger.error(f"Не удалось сжать журнал очередей: {e}")
+    
+    def restore_from_journal(self) -> bool:
+        """
+        Восстановить очереди из журнала (снапшот + хвост) без обращения к БД
+        Возвращает False, если журнал не подключён или ещё пуст
+        """
+        if not self._journal:
+            return False
+        
+        try:
+            state = self._journal.load(ZONES)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать журнал очередей: {e}")
+            return False
+        if state is None:
+            return False
+        
+        self._backend.clear()
+        for zone, entries in state.items():
+            for driver_id, online_since in entries:
+                self._backend.add(driver_id, zone, online_since)
+        
+        logger.info(f"Очереди восстановлены из журнала. Активных водителей: {len(self._backend.driver_zones())}")
+        self._log_queues()
+        
+        if self._journal.needs_compaction():
+            # В хвосте были повреждённые строки — новые события не должны дописываться за ними
+            self._compact_journal()
+        return True
+    
+    def _log_queues(self):
+        for zone in ZONES:
+            queue = self._backend.ids(zone)
+            if queue:
+                logger.info(f"  {zone}: {len(queue)} водителей {queue}")
+    
+    @staticmethod
+    def _load_online_state(db: Session) -> List:
+        """Онлайн водители без pending-заказа: (id, current_zone, online_since)"""
+        return db.query(
+            Driver.id,
+            Driver.current_zone,
+            Driver.online_since,
+        ).filter(
+            Driver.status == DriverStatus.ONLINE,
+            Driver.current_zone.in_(ZONES),
+            Driver.pending_order_id.is_(None)
+        ).all()
+    
+    def _apply_reconcile(self, rows: List, skip: AbstractSet[int] = frozenset()) -> Dict[str, int]:
+        """
+        Сверить очереди в памяти с состоянием БД
+        
+        Порядок водителей, которые есть и там и там, берётся из журнала
+        (в нём сохранён настоящий online_since), лишние удаляются,
+        недостающие добавляются с online_since из БД.
+        Водители из skip не трогаются: их место в очереди изменилось
+        уже после того, как rows были прочитаны.
+        """
+        expected: Dict[int, Tuple[str, Optional[datetime]]] = {}
+        for row in rows:
+            zone = row.current_zone.value if hasattr(row.current_zone, 'value') else row.current_zone
+            expected[row.id] = (zone, row.online_since)
+        
+        queued = self._backend.driver_zones()
+        removed = 0
+        for driver_id, zone in queued.items():
+            if driver_id in skip:
+                continue
+            if expected.get(driver_id, (None, None))[0] != zone:
+                self.remove_driver(driver_id)
+                removed += 1
+        
+        added = 0
+        for driver_id, (zone, online_since) in expected.items():
+            if driver_id in skip:
+                continue
+            if queued.get(driver_id) != zone:
+                self.add_driver(driver_id, zone, online_since=online_since)
+                added += 1
+        
+        logger.info(
+            f"Сверка очередей с БД завершена: удалено {removed}, добавлено {added}, "
+            f"пропущено изменившихся во время чтения {len(skip)}"
+        )
+        return {"removed": removed, "added": added}
+    
+    def reconcile_with_db(self, db: Session) -> Dict[str, int]:
+        """Сверить очереди с БД (синхронно)"""
+        return self._apply_reconcile(self._load_online_state(db))
+    
+    async def reconcile_with_db_async(self) -> Dict[str, int]:
+        """
+        Сверить очереди с БД в фоне после восстановления из журнала
+        Запрос выполняется асинхронным драйвером (или в пуле потоков),
+        изменения очередей — в event loop. Водители, вышедшие на линию или
+        ушедшие с неё, пока шёл запрос, сверкой не трогаются.
+        """
+        from database.db import ASYNC_DB_ENABLED, SessionLocal, run_in_session  # локальный импорт чтобы избежать циклов
+        
+        def _load():
+            db = SessionLocal()
+            try:
+                return self._load_online_state(db)
+            finally:
+                db.close()
+        
+        self._changed_during_reconcile = set()
+        self._cleared_during_reconcile = False
+        try:
+            if ASYNC_DB_ENABLED:
+                rows = await run_in_session(self._load_online_state)
+            else:
+                rows = await asyncio.get_running_loop().run_in_executor(None, _load)
+            changed, cleared = self._changed_during_reconcile, self._cleared_during_reconcile
+            self._changed_during_reconcile = None
+            if cleared:
+                logger.info("Очереди очищены во время сверки с БД — сверка пропущена")
+                return {"removed": 0, "added": 0}
+            return self._apply_reconcile(rows, skip=changed)
+        except Exception as e:
+            logger.error(f"Ошибка сверки очередей с БД: {e}", exc_info=True)
+            return {"removed": 0, "added": 0}
+        finally:
+            self._changed_during_reconcile = None
     
     def rebuild_from_db(self, db: Session):
         """Перестроить очереди из БД (при старте бота)"""
         logger.info("Перестройка очередей из БД...")
         
         # Очищаем текущие очереди
-        self._queues = {zone: [] for zone in ZONES}
-        self._driver_zones = {}
+        self._backend.clear()
         
-        # Получаем всех онлайн водителей
-        drivers = db.query(Driver).filter(
+        # Получаем всех онлайн водителей (только нужные колонки, без загрузки user)
+        drivers = db.query(
+            Driver.id,
+            Driver.current_zone,
+            Driver.pending_order_id,
+            Driver.online_since,
+        ).filter(
             Driver.status == DriverStatus.ONLINE,
             Driver.current_zone.in_(ZONES)
         ).order_by(Driver.online_since).all()
@@ -45,18 +245,18 @@ class QueueManager:
             if zone in ZONES:
                 # Пропускаем водителей с pending_order_id
                 if driver.pending_order_id is None:
-                    self._queues[zone].append(driver.id)
-                    self._driver_zones[driver.id] = zone
-                    logger.debug(f"Водитель {driver.id} ({driver.user.full_name if driver.user else 'unknown'}) добавлен в очередь {zone}")
+                    self._backend.add(driver.id, zone, driver.online_since)
+                    logger.debug(f"Водитель {driver.id} добавлен в очередь {zone}")
                 else:
                     logger.debug(f"Водитель {driver.id} пропущен (pending_order_id={driver.pending_order_id})")
             else:
                 logger.warning(f"Водитель {driver.id} имеет недопустимую зону: {zone}")
         
-        logger.info(f"Очереди перестроены. Активных водителей: {len(self._driver_zones)}")
-        for zone, queue in self._queues.items():
-            if queue:
-                logger.info(f"  {zone}: {len(queue)} водителей {queue}")
+        logger.info(f"Очереди перестроены. Активных водителей: {len(self._backend.driver_zones())}")
+        self._log_queues()
+        
+        # Очереди построены с нуля — фиксируем их снапшотом журнала
+        self._compact_journal()
     
     def _rebuild_zone_from_db(self, zone: str, db: Session):
         """Перестроить очередь для одной зоны из БД"""
@@ -66,14 +266,11 @@ class QueueManager:
         logger.info(f"Перестройка очереди зоны {zone} из БД...")
         
         # Очищаем очередь для этой зоны
-        old_drivers = self._queues[zone][:]
-        for driver_id in old_drivers:
-            if self._driver_zones.get(driver_id) == zone:
-                del self._driver_zones[driver_id]
-        self._queues[zone] = []
+        for driver_id in self._backend.clear_zone(zone):
+            self._journal_event("remove", driver_id)
         
         # Получаем всех онлайн водителей в этой зоне
-        drivers = db.query(Driver).filter(
+        drivers = db.query(Driver.id, Driver.online_since).filter(
             Driver.status == DriverStatus.ONLINE,
             Driver.current_zone == zone,
             Driver.pending_order_id.is_(None)
@@ -83,50 +280,76 @@ class QueueManager:
         
         # Добавляем в очередь
         for driver in drivers:
-            self._queues[zone].append(driver.id)
-            self._driver_zones[driver.id] = zone
-            logger.info(f"Водитель {driver.id} ({driver.user.full_name if driver.user else 'unknown'}) добавлен в очередь {zone}")
+            self._backend.add(driver.id, zone, driver.online_since)
+            self._journal_event("add", driver.id, zone, driver.online_since)
+            logger.info(f"Водитель {driver.id} добавлен в очередь {zone}")
     
-    def add_driver(self, driver_id: int, zone: str, db: Session):
+    def add_driver(
+        self,
+        driver_id: int,
+        zone: str,
+        db: Optional[Session] = None,
+        online_since: Optional[datetime] = None,
+    ):
         """
         Добавить водителя в очередь зоны
         
         Защита от дублирования:
         - Удаляет водителя из всех зон перед добавлением
         - Проверяет, что водитель не уже в этой очереди
-        Вставляет водителя в очередь по online_since (FIFO по времени выхода)
+        Вставляет водителя в очередь по online_since (FIFO по времени выхода).
+        Если online_since не передан, он читается из БД одним запросом по PK.
         """
         if zone not in ZONES:
             logger.warning(f"Попытка добавить водителя {driver_id} в неизвестную зону {zone}")
             return
         
-        # КРИТИЧЕСКИ ВАЖНО: Удаляем из ВСЕХ зон перед добавлением
-        # Это предотвращает дублирование и race condition
-        self._remove_driver_from_all_zones(driver_id)
-        
-        # Дополнительная проверка: если водитель уже в этой очереди, не добавляем
-        if driver_id in self._queues[zone]:
-            logger.warning(f"Водитель {driver_id} уже в очереди {zone}, пропускаем добавление")
-            return
+        if online_since is None and db is not None:
+            online_since = db.query(Driver.online_since).filter(Driver.id == driver_id).scalar()
         
-        # Добавляем и пересортировываем по online_since (None -> в конец)
-        self._queues[zone].append(driver_id)
-        self._driver_zones[driver_id] = zone
-        self._sort_queue_by_online_since(zone, db)
+        # КРИТИЧЕСКИ ВАЖНО: хранилище удаляет водителя из ВСЕХ зон перед добавлением
+        # Это предотвращает дублирование и race condition
+        # Вставка по online_since (None -> в конец)
+        position = self._backend.add(driver_id, zone, online_since)
         
-        logger.info(f"Водитель {driver_id} добавлен в очередь {zone} (позиция {len(self._queues[zone])})")
+        self._journal_event("add", driver_id, zone, online_since)
+        logger.info(f"Водитель {driver_id} добавлен в очередь {zone} (позиция {position})")
     
     def remove_driver(self, driver_id: int):
         """Удалить водителя из очереди"""
-        if driver_id not in self._driver_zones:
+        zone = self._backend.remove(driver_id)
+        if zone is None:
             return
         
-        zone = self._driver_zones[driver_id]
-        if driver_id in self._queues[zone]:
-            self._queues[zone].remove(driver_id)
-            logger.info(f"Водитель {driver_id} удалён из очереди {zone}")
+        logger.info(f"Водитель {driver_id} удалён из очереди {zone}")
+        self._journal_event("remove", driver_id)
+    
+    def claim_driver(self, driver_id: int) -> bool:
+        """
+        Атомарно забрать водителя из очереди под предложение заказа
         
-        del self._driver_zones[driver_id]
+        True получает ровно один из конкурирующих вызовов (в том числе из разных
+        воркеров при общем хранилище в БД).
+        """
+        if not self._backend.claim(driver_id):
+            return False
+        self._journal_event("remove", driver_id)
+        return True
+    
+    def claim_next_driver(self, zone: str, db: Session) -> Optional[int]:
+        """Найти следующего водителя зоны и сразу захватить его (см. claim_driver)"""
+        while True:
+            driver_id = self.get_next_driver(zone, db)
+            if driver_id is None:
+                return None
+            if self.claim_driver(driver_id):
+                return driver_id
+            logger.info(f"Водитель {driver_id} уже захвачен другим воркером, берём следующего")
+    
+    def clear(self):
+        """Очистить все очереди"""
+        self._backend.clear()
+        self._journal_event("clear")
     
     def get_next_driver(self, zone: str, db: Session) -> Optional[int]:
         """
@@ -137,20 +360,25 @@ class QueueManager:
             logger.warning(f"Попытка получить водителя из неизвестной зоны {zone}")
             return None
         
-        queue = self._queues[zone]
+        queue = self._backend.ids(zone)
         logger.info(f"Поиск водителя в зоне {zone}, в очереди {len(queue)} водителей: {queue}")
         
         if not queue:
             logger.warning(f"Очередь зоны {zone} пуста! Перестраиваем очередь из БД...")
             # Пытаемся перестроить очередь для этой зоны
             self._rebuild_zone_from_db(zone, db)
-            queue = self._queues[zone]
+            queue = self._backend.ids(zone)
             logger.info(f"После перестройки в очереди {len(queue)} водителей: {queue}")
             
             # Если все еще пусто, проверяем все зоны - может водитель в другой зоне
             if not queue:
                 logger.warning(f"В зоне {zone} все еще нет водителей. Проверяем все зоны...")
-                all_drivers = db.query(Driver).filter(
+                all_drivers = db.query(
+                    Driver.id,
+                    Driver.status,
+                    Driver.current_zone,
+                    Driver.pending_order_id,
+                ).filter(
                     Driver.status == DriverStatus.ONLINE,
                     Driver.current_zone.in_(ZONES),
                     Driver.pending_order_id.is_(None)
@@ -161,42 +389,81 @@ class QueueManager:
                     driver_zone = driver.current_zone.value if hasattr(driver.current_zone, 'value') else driver.current_zone
                     logger.info(f"  Водитель {driver.id}: зона={driver_zone}, status={driver.status}, pending={driver.pending_order_id}")
         
-        # Проходим по очереди и ищем первого доступного
-        for driver_id in queue[:]:  # копия списка для безопасной итерации
-            driver = db.query(Driver).filter(Driver.id == driver_id).first()
+        if not queue:
+            self._record_lookup(rows=0, pruned=0)
+            logger.warning(f"Нет доступных водителей в зоне {zone} после проверки всей очереди")
+            return None
+        
+        # Одним запросом получаем состояние всех водителей очереди (без загрузки ORM-объектов и user)
+        rows = db.query(
+            Driver.id,
+            Driver.status,
+            Driver.current_zone,
+            Driver.pending_order_id,
+        ).filter(Driver.id.in_(queue)).all()
+        states = {row.id: row for row in rows}
+        
+        # Проходим по очереди в памяти: первый подходящий — следующий, неподходящие вычищаем
+        next_driver_id = None
+        stale: List[int] = []
+        for driver_id in queue:
+            state = states.get(driver_id)
             
-            if not driver:
+            if state is None:
                 # Водитель удалён из БД
                 logger.warning(f"Водитель {driver_id} не найден в БД, удаляем из очереди")
-                self.remove_driver(driver_id)
+                stale.append(driver_id)
                 continue
             
-            # Проверяем что водитель всё ещё онлайн и в этой зоне
-            driver_zone = driver.current_zone.value if hasattr(driver.current_zone, 'value') else driver.current_zone
+            driver_zone = state.current_zone.value if hasattr(state.current_zone, 'value') else state.current_zone
             
-            logger.debug(f"Проверка водителя {driver_id}: status={driver.status}, zone={driver_zone}, pending_order_id={driver.pending_order_id}")
+            logger.debug(f"Проверка водителя {driver_id}: status={state.status}, zone={driver_zone}, pending_order_id={state.pending_order_id}")
             
-            if (driver.status == DriverStatus.ONLINE and 
+            if (state.status == DriverStatus.ONLINE and
                 driver_zone == zone and
-                driver.pending_order_id is None):
-                logger.info(f"Следующий водитель для зоны {zone}: {driver_id}")
-                return driver_id
-            else:
-                # Водитель больше не подходит, удаляем из очереди
-                reason = []
-                if driver.status != DriverStatus.ONLINE:
-                    reason.append(f"status={driver.status}")
-                if driver_zone != zone:
-                    reason.append(f"zone={driver_zone} (ожидалось {zone})")
-                if driver.pending_order_id is not None:
-                    reason.append(f"pending_order_id={driver.pending_order_id}")
-                
-                logger.warning(f"Водитель {driver_id} ({driver.user.full_name if driver.user else 'unknown'}) больше не подходит: {', '.join(reason)}")
-                self.remove_driver(driver_id)
+                state.pending_order_id is None):
+                next_driver_id = driver_id
+                break
+            
+            # Водитель больше не подходит, удаляем из очереди
+            reason = []
+            if state.status != DriverStatus.ONLINE:
+                reason.append(f"status={state.status}")
+            if driver_zone != zone:
+                reason.append(f"zone={driver_zone} (ожидалось {zone})")
+            if state.pending_order_id is not None:
+                reason.append(f"pending_order_id={state.pending_order_id}")
+            
+            logger.warning(f"Водитель {driver_id} больше не подходит: {', '.join(reason)}")
+            stale.append(driver_id)
+        
+        for driver_id in stale:
+            self.remove_driver(driver_id)
+        
+        self._record_lookup(rows=len(rows), pruned=len(stale))
+        
+        if next_driver_id is not None:
+            logger.info(f"Следующий водитель для зоны {zone}: {next_driver_id}")
+            return next_driver_id
         
         logger.warning(f"Нет доступных водителей в зоне {zone} после проверки всей очереди")
         return None
     
+    def _record_lookup(self, rows: int, pruned: int):
+        """Учесть в счётчиках один вызов get_next_driver"""
+        self._lookup_stats["lookups"] += 1
+        self._lookup_stats["rows_fetched"] += rows
+        self._lookup_stats["pruned"] += pruned
+        self._lookup_stats["last_rows"] = rows
+        self._lookup_stats["max_rows"] = max(self._lookup_stats["max_rows"], rows)
+    
+    def get_lookup_stats(self) -> Dict:
+        """Статистика поиска следующего водителя (сколько строк БД потребовал каждый вызов)"""
+        stats = dict(self._lookup_stats)
+        lookups = stats["lookups"]
+        stats["avg_rows"] = stats["rows_fetched"] / lookups if lookups else 0.0
+        return stats
+    
     def get_all_online_drivers(self, db: Session) -> List[int]:
         """
         Получить всех онлайн водителей из всех зон
@@ -212,7 +479,8 @@ class QueueManager:
         logger.info(f"Всего онлайн водителей во всех зонах: {len(driver_ids)}")
         return driver_ids
     
-    def switch_zone(self, driver_id: int, new_zone: str, db: Session):
+    def switch_zone(self, driver_id: int, new_zone: str, db: Optional[Session] = None,
+                    online_since: Optional[datetime] = None):
         """
         Переместить водителя в другую зону
         
@@ -223,17 +491,18 @@ class QueueManager:
             logger.warning(f"Попытка переместить водителя {driver_id} в неизвестную зону {new_zone}")
             return
         
-        old_zone = self._driver_zones.get(driver_id)
+        old_zone = self._backend.zone_of(driver_id)
         if old_zone == new_zone:
             logger.debug(f"Водитель {driver_id} уже в зоне {new_zone}")
             return
         
-        # КРИТИЧЕСКИ ВАЖНО: Удаляем водителя из ВСЕХ возможных зон
-        # Это гарантирует отсутствие дублирования при быстром переключении между зонами
-        self._remove_driver_from_all_zones(driver_id)
+        if online_since is None and db is not None:
+            online_since = db.query(Driver.online_since).filter(Driver.id == driver_id).scalar()
         
-        # Добавляем в новую зону
-        self.add_driver(driver_id, new_zone, db)
+        # Добавляем в новую зону (хранилище удаляет водителя из ВСЕХ возможных зон,
+        # это гарантирует отсутствие дублирования при быстром переключении между зонами)
+        self._backend.add(driver_id, new_zone, online_since)
+        self._journal_event("switch", driver_id, new_zone, online_since)
         
         logger.info(f"Водитель {driver_id} переведён из зоны {old_zone} в {new_zone}")
     
@@ -242,63 +511,31 @@ class QueueManager:
         Удалить водителя из всех зон (внутренний метод для безопасности)
         Используется для предотвращения дублирования водителя в нескольких зонах
         """
-        # Удаляем из всех очередей (на случай бага)
-        for zone in ZONES:
-            if driver_id in self._queues[zone]:
-                self._queues[zone].remove(driver_id)
-                logger.debug(f"Водитель {driver_id} удалён из зоны {zone} (очистка)")
-        
-        # Удаляем из кеша
-        if driver_id in self._driver_zones:
-            del self._driver_zones[driver_id]
+        zone = self._backend.remove(driver_id)
+        if zone is not None:
+            logger.debug(f"Водитель {driver_id} удалён из зоны {zone} (очистка)")
+            self._journal_event("remove", driver_id)
     
     def get_queue_position(self, driver_id: int) -> Optional[int]:
         """Получить позицию водителя в очереди (1-based)"""
-        if driver_id not in self._driver_zones:
-            return None
-        
-        zone = self._driver_zones[driver_id]
-        try:
-            position = self._queues[zone].index(driver_id) + 1
-            return position
-        except ValueError:
-            return None
+        return self._backend.position(driver_id)
     
     def get_queue_info(self, zone: str) -> Dict:
         """Получить информацию об очереди зоны"""
         if zone not in ZONES:
             return {"zone": zone, "count": 0, "drivers": []}
         
+        drivers = self._backend.ids(zone)
         return {
             "zone": zone,
-            "count": len(self._queues[zone]),
-            "drivers": self._queues[zone].copy()
+            "count": len(drivers),
+            "drivers": drivers
         }
     
     def get_all_queues_info(self) -> Dict[str, Dict]:
         """Получить информацию о всех очередях"""
         return {zone: self.get_queue_info(zone) for zone in ZONES}
 
-    def _sort_queue_by_online_since(self, zone: str, db: Session):
-        """Упорядочить очередь зоны по online_since (FIFO: раньше online_since — выше)"""
-        ids = self._queues.get(zone, [])
-        if not ids:
-            return
-
-        drivers = (
-            db.query(Driver.id, Driver.online_since)
-            .filter(Driver.id.in_(ids))
-            .all()
-        )
-        online_map = {d.id: d.online_since for d in drivers}
-
-        def sort_key(did: int):
-            ts = online_map.get(did)
-            # None трактуем как самый новый (в конец)
-            return (ts is None, ts or datetime.utcnow() + timedelta(days=3650))
-
-        self._queues[zone] = sorted(ids, key=sort_key)
-
 
 # Глобальный экземпляр менеджера очередей
 queue_manager = QueueManager()
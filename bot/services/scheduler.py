@@ -3,148 +3,436 @@
 Управляет 30-секундными таймерами водителей и 180-секундным таймером заказов
 """
 import asyncio
+import heapq
+import itertools
 import logging
-from typing import Dict, Optional, Callable, Awaitable
+from typing import Dict, List, Optional, Callable, Awaitable, Set, Tuple, TYPE_CHECKING
 from datetime import datetime, timedelta
 
+from bot.config import settings
+from bot.utils.clock import utcnow
+
+if TYPE_CHECKING:
+    from bot.services.timer_store import TimerStore
+
 logger = logging.getLogger(__name__)
 
 
+class _Timer:
+    """Запись таймера в куче планировщика"""
+
+    __slots__ = ("due", "seq", "kind", "key", "callback", "args", "handler", "cancelled")
+
+    def __init__(
+        self,
+        due: float,
+        seq: int,
+        kind: str,
+        key: int,
+        callback: Callable,
+        args: Tuple,
+        handler: Optional[str] = None,
+    ):
+        self.due = due
+        self.seq = seq
+        self.kind = kind
+        self.key = key
+        self.callback = callback
+        self.args = args
+        # Имя обработчика для восстановления после рестарта (None — таймер не сохраняется)
+        self.handler = handler
+        self.cancelled = False
+
+    def __lt__(self, other: "_Timer") -> bool:
+        return (self.due, self.seq) < (other.due, other.seq)
+
+
+# Виды таймеров
+TIMER_DRIVER = "driver"
+TIMER_ORDER = "order"
+TIMER_CASCADE = "cascade"  # Расширение каскадной рассылки заказа
+
+# Перестраиваем кучу, когда отменённых записей в ней больше половины
+_COMPACT_MIN_CANCELLED = 64
+
+
 class Scheduler:
-    """Планировщик задач с поддержкой отмены"""
+    """
+    Планировщик задач с поддержкой отмены
+
+    Все таймауты водителей и заказов живут в одной куче (due, seq) и
+    обслуживаются одной фоновой задачей. Отмена — O(1): запись помечается
+    отменённой и удаляется из словаря, из кучи её лениво выбрасывает
+    обработчик (или периодическая перестройка). Отдельная задача создаётся
+    только на время выполнения сработавшего callback.
+
+    Таймеры с именем обработчика (handler) записываются в TimerStore и
+    после перезапуска взводятся заново через restore_timers(). Запись
+    отложенная: изменения за timer_store_flush_seconds сводятся к последнему
+    по каждому таймеру и уходят в БД одной транзакцией в пуле потоков.
+    """
     
     def __init__(self):
-        # Таймеры водителей: {driver_id: task}
-        self._driver_tasks: Dict[int, asyncio.Task] = {}
-        # Таймеры заказов: {order_id: task}
-        self._order_tasks: Dict[int, asyncio.Task] = {}
+        # Таймеры водителей: {driver_id: timer}
+        self._driver_timers: Dict[int, _Timer] = {}
+        # Таймеры заказов: {order_id: timer}
+        self._order_timers: Dict[int, _Timer] = {}
+        # Шаги каскадной рассылки: {order_id: timer}
+        self._cascade_timers: Dict[int, _Timer] = {}
+        self._timers: Dict[str, Dict[int, _Timer]] = {
+            TIMER_DRIVER: self._driver_timers,
+            TIMER_ORDER: self._order_timers,
+            TIMER_CASCADE: self._cascade_timers,
+        }
+        self._heap: List[_Timer] = []
+        self._seq = itertools.count()
+        self._cancelled_in_heap = 0
+        self._timer_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        # Выполняющиеся callback сработавших таймеров
+        self._firing: Set[asyncio.Task] = set()
+        # Сохранение таймеров между перезапусками
+        self._store: Optional["TimerStore"] = None
+        self._handlers: Dict[str, Callable[..., Awaitable[None]]] = {}
+        # Ещё не записанные изменения: {(kind, key): (handler, due_at, order_id)}, None — удалить
+        self._pending_writes: Dict[Tuple[str, int], Optional[tuple]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._stopping = False
         self._warning_cleanup_task: Optional[asyncio.Task] = None
         self._broadcast_cleanup_task: Optional[asyncio.Task] = None
+        self._order_archive_task: Optional[asyncio.Task] = None
+    
+    def _timers_of(self, kind: str) -> Dict[int, _Timer]:
+        return self._timers[kind]
+    
+    def attach_store(self, store: "TimerStore"):
+        """Подключить хранилище таймеров"""
+        self._store = store
+    
+    def register_handler(self, name: str, callback: Callable[..., Awaitable[None]]):
+        """
+        Зарегистрировать обработчик для восстановленных таймеров
+        Для таймеров водителей: callback(driver_id, order_id), для заказов: callback(order_id)
+        """
+        self._handlers[name] = callback
+    
+    def _persist(self, timer: _Timer, timeout_seconds: float):
+        if self._store is None or timer.handler is None:
+            return
+        order_id = timer.args[1] if timer.kind == TIMER_DRIVER else None
+        due_at = utcnow() + timedelta(seconds=timeout_seconds)
+        self._queue_write(timer.kind, timer.key, (timer.handler, due_at, order_id))
+    
+    def _forget(self, kind: str, key: int):
+        if self._store is None:
+            return
+        self._queue_write(kind, key, None)
+    
+    def _queue_write(self, kind: str, key: int, row: Optional[tuple]):
+        """Отложить запись в хранилище: из нескольких изменений таймера останется последнее"""
+        self._pending_writes[(kind, key)] = row
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_writes())
+    
+    async def _flush_writes(self):
+        """Фоновая запись накопленных изменений: одна транзакция, вне event loop"""
+        loop = asyncio.get_running_loop()
+        while self._pending_writes:
+            await asyncio.sleep(settings.timer_store_flush_seconds)
+            changes, self._pending_writes = self._pending_writes, {}
+            try:
+                await loop.run_in_executor(None, self._store.apply, changes)
+            except Exception as e:
+                logger.error(f"Не удалось сохранить таймеры ({len(changes)} изменений): {e}")
+    
+    async def flush_store(self):
+        """Дождаться записи всех отложенных изменений таймеров"""
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+    
+    def _arm(
+        self,
+        kind: str,
+        key: int,
+        timeout_seconds: float,
+        callback: Callable,
+        args: Tuple,
+        handler: Optional[str] = None,
+        persist: bool = True,
+    ):
+        """Поставить таймер в кучу (предыдущий таймер с тем же ключом отменяется)"""
+        # Строку в хранилище не удаляем: её перезапишет _persist
+        self._disarm(kind, key, forget=handler is None)
+        
+        loop = asyncio.get_running_loop()
+        timer = _Timer(loop.time() + timeout_seconds, next(self._seq), kind, key, callback, args, handler)
+        self._timers_of(kind)[key] = timer
+        heapq.heappush(self._heap, timer)
+        if persist:
+            self._persist(timer, timeout_seconds)
+        
+        self._ensure_runner()
+        # Новый таймер раньше всех — будим обработчик, чтобы он пересчитал ожидание
+        if self._heap[0] is timer:
+            self._wakeup.set()
+    
+    def _disarm(self, kind: str, key: int, forget: bool = True) -> bool:
+        """Отменить таймер: O(1), запись остаётся в куче помеченной"""
+        timer = self._timers_of(kind).pop(key, None)
+        if timer is None:
+            return False
+        timer.cancelled = True
+        self._cancelled_in_heap += 1
+        if forget and timer.handler is not None:
+            self._forget(kind, key)
+        
+        if (
+            self._cancelled_in_heap >= _COMPACT_MIN_CANCELLED
+            and self._cancelled_in_heap * 2 > len(self._heap)
+        ):
+            self._heap = [t for t in self._heap if not t.cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled_in_heap = 0
+        return True
+    
+    def _ensure_runner(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._timer_task is None or self._timer_task.done():
+            self._timer_task = asyncio.create_task(self._run_timers())
+    
+    async def _run_timers(self):
+        """Фоновая задача: ждёт ближайший таймер и запускает сработавшие"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                self._wakeup.clear()
+                now = loop.time()
+                while self._heap and (self._heap[0].cancelled or self._heap[0].due <= now):
+                    timer = heapq.heappop(self._heap)
+                    if timer.cancelled:
+                        self._cancelled_in_heap -= 1
+                        continue
+                    self._fire(timer)
+                
+                timeout = self._heap[0].due - now if self._heap else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике таймеров: {e}", exc_info=True)
+    
+    def _fire(self, timer: _Timer):
+        """Снять сработавший таймер и запустить его callback отдельной задачей"""
+        timers = self._timers_of(timer.kind)
+        if timers.get(timer.key) is timer:
+            del timers[timer.key]
+        
+        task = asyncio.create_task(self._run_callback(timer))
+        self._firing.add(task)
+        task.add_done_callback(self._firing.discard)
+    
+    async def _run_callback(self, timer: _Timer):
+        try:
+            await self._invoke(timer)
+        finally:
+            # Сохранённая строка больше не нужна, если callback не взвёл таймер заново
+            # (при остановке бота прерванный callback должен повториться после рестарта)
+            if (
+                timer.handler is not None
+                and not self._stopping
+                and timer.key not in self._timers_of(timer.kind)
+            ):
+                self._forget(timer.kind, timer.key)
+    
+    @staticmethod
+    async def _invoke(timer: _Timer):
+        if timer.kind == TIMER_DRIVER:
+            driver_id, order_id = timer.args
+            try:
+                logger.info(f"Таймаут водителя {driver_id} истёк для заказа {order_id}")
+                await timer.callback(driver_id, order_id)
+            except asyncio.CancelledError:
+                logger.debug(f"Обработка таймаута водителя {driver_id} прервана")
+            except Exception as e:
+                logger.error(f"Ошибка в таймере водителя {driver_id}: {e}", exc_info=True)
+        elif timer.kind == TIMER_CASCADE:
+            (order_id,) = timer.args
+            try:
+                logger.debug(f"Шаг каскадной рассылки заказа {order_id}")
+                await timer.callback(order_id)
+            except asyncio.CancelledError:
+                logger.debug(f"Шаг каскадной рассылки заказа {order_id} прерван")
+            except Exception as e:
+                logger.error(f"Ошибка в шаге каскадной рассылки заказа {order_id}: {e}", exc_info=True)
+        else:
+            (order_id,) = timer.args
+            try:
+                logger.info(f"Глобальный таймаут заказа {order_id} истёк → переход в fallback")
+                await timer.callback(order_id)
+            except asyncio.CancelledError:
+                logger.debug(f"Обработка глобального таймаута заказа {order_id} прервана")
+            except Exception as e:
+                logger.error(f"Ошибка в глобальном таймере заказа {order_id}: {e}", exc_info=True)
     
     async def schedule_driver_timeout(
         self,
         driver_id: int,
         order_id: int,
         timeout_seconds: int,
-        callback: Callable[[int, int], Awaitable[None]]
+        callback: Callable[[int, int], Awaitable[None]],
+        handler: Optional[str] = None
     ):
         """
         Запланировать таймаут для водителя (30 секунд)
         callback(driver_id, order_id) будет вызван при истечении времени
+        handler — имя обработчика (register_handler), если таймер должен пережить перезапуск
         """
-        # Отменяем предыдущий таймер если есть
-        await self.cancel_driver_timeout(driver_id)
-        
-        async def timeout_task():
-            try:
-                logger.info(f"Запущен таймер для водителя {driver_id} (заказ {order_id}): {timeout_seconds}s")
-                await asyncio.sleep(timeout_seconds)
-                logger.info(f"Таймаут водителя {driver_id} истёк для заказа {order_id}")
-                await callback(driver_id, order_id)
-            except asyncio.CancelledError:
-                logger.debug(f"Таймер водителя {driver_id} отменён")
-            except Exception as e:
-                logger.error(f"Ошибка в таймере водителя {driver_id}: {e}", exc_info=True)
-            finally:
-                # Удаляем из списка задач
-                if driver_id in self._driver_tasks:
-                    del self._driver_tasks[driver_id]
-        
-        task = asyncio.create_task(timeout_task())
-        self._driver_tasks[driver_id] = task
-        logger.debug(f"Таймер водителя {driver_id} создан")
+        # Предыдущий таймер водителя (если есть) отменяется
+        self._arm(TIMER_DRIVER, driver_id, timeout_seconds, callback, (driver_id, order_id), handler)
+        logger.info(f"Запущен таймер для водителя {driver_id} (заказ {order_id}): {timeout_seconds}s")
     
     async def cancel_driver_timeout(self, driver_id: int) -> bool:
         """Отменить таймер водителя"""
-        if driver_id not in self._driver_tasks:
+        if not self._disarm(TIMER_DRIVER, driver_id):
             logger.debug(f"Таймер водителя {driver_id} не найден (уже отменён или не был создан)")
             return False
-        
-        task = self._driver_tasks[driver_id]
-        if not task.done():
-            task.cancel()
-            try:
-                await task
-            except asyncio.CancelledError:
-                pass
-        
-        # Безопасное удаление - проверяем что ключ все еще есть
-        if driver_id in self._driver_tasks:
-            del self._driver_tasks[driver_id]
-            logger.debug(f"Таймер водителя {driver_id} отменён")
+        logger.debug(f"Таймер водителя {driver_id} отменён")
         return True
     
     async def schedule_order_timeout(
         self,
         order_id: int,
         timeout_seconds: int,
-        callback: Callable[[int], Awaitable[None]]
+        callback: Callable[[int], Awaitable[None]],
+        handler: Optional[str] = None
     ):
         """
         Запланировать глобальный таймаут заказа (180 секунд)
         callback(order_id) будет вызван при истечении времени
+        handler — имя обработчика (register_handler), если таймер должен пережить перезапуск
         """
-        # Отменяем предыдущий таймер если есть
-        await self.cancel_order_timeout(order_id)
-        
-        async def timeout_task():
-            try:
-                logger.info(f"Запущен глобальный таймер для заказа {order_id}: {timeout_seconds}s")
-                await asyncio.sleep(timeout_seconds)
-                logger.info(f"Глобальный таймаут заказа {order_id} истёк → переход в fallback")
-                await callback(order_id)
-            except asyncio.CancelledError:
-                logger.debug(f"Глобальный таймер заказа {order_id} отменён")
-            except Exception as e:
-                logger.error(f"Ошибка в глобальном таймере заказа {order_id}: {e}", exc_info=True)
-            finally:
-                # Удаляем из списка задач
-                if order_id in self._order_tasks:
-                    del self._order_tasks[order_id]
-        
-        task = asyncio.create_task(timeout_task())
-        self._order_tasks[order_id] = task
-        logger.debug(f"Глобальный таймер заказа {order_id} создан")
+        # Предыдущий таймер заказа (если есть) отменяется
+        self._arm(TIMER_ORDER, order_id, timeout_seconds, callback, (order_id,), handler)
+        logger.info(f"Запущен глобальный таймер для заказа {order_id}: {timeout_seconds}s")
     
     async def cancel_order_timeout(self, order_id: int) -> bool:
         """Отменить глобальный таймер заказа"""
-        if order_id not in self._order_tasks:
+        if not self._disarm(TIMER_ORDER, order_id):
             logger.debug(f"Таймер заказа {order_id} не найден (уже отменён или не был создан)")
             return False
-        
-        task = self._order_tasks[order_id]
-        if not task.done():
-            task.cancel()
-            try:
-                await task
-            except asyncio.CancelledError:
-                pass
-        
-        # Безопасное удаление - проверяем что ключ все еще есть
-        if order_id in self._order_tasks:
-            del self._order_tasks[order_id]
-            logger.debug(f"Глобальный таймер заказа {order_id} отменён")
+        logger.debug(f"Глобальный таймер заказа {order_id} отменён")
         return True
     
+    async def schedule_cascade_step(
+        self,
+        order_id: int,
+        delay_seconds: float,
+        callback: Callable[[int], Awaitable[None]],
+        handler: Optional[str] = None
+    ):
+        """
+        Запланировать расширение каскадной рассылки заказа
+        callback(order_id) будет вызван через delay_seconds
+        """
+        self._arm(TIMER_CASCADE, order_id, delay_seconds, callback, (order_id,), handler)
+        logger.debug(f"Шаг каскадной рассылки заказа {order_id} через {delay_seconds:.0f}s")
+    
+    async def cancel_cascade_step(self, order_id: int) -> bool:
+        """Отменить расширение каскадной рассылки заказа"""
+        return self._disarm(TIMER_CASCADE, order_id)
+    
     def has_driver_timeout(self, driver_id: int) -> bool:
         """Проверить есть ли активный таймер у водителя"""
-        return driver_id in self._driver_tasks and not self._driver_tasks[driver_id].done()
+        return driver_id in self._driver_timers
     
     def has_order_timeout(self, order_id: int) -> bool:
         """Проверить есть ли активный глобальный таймер у заказа"""
-        return order_id in self._order_tasks and not self._order_tasks[order_id].done()
+        return order_id in self._order_timers
+    
+    def order_timeout_remaining(self, order_id: int) -> Optional[float]:
+        """Сколько секунд осталось до глобального таймаута заказа (None — таймера нет)"""
+        timer = self._order_timers.get(order_id)
+        if timer is None:
+            return None
+        return max(0.0, timer.due - asyncio.get_running_loop().time())
+    
+    async def restore_timers(self, offer_handler: Optional[str] = None) -> int:
+        """
+        Взвести сохранённые таймеры после перезапуска
+        
+        Все строки читаются одним запросом; просроченные срабатывают сразу
+        (в первом же проходе обработчика). offer_handler — обработчик для
+        предложений, висящих на водителях (pending_until), но отсутствующих
+        в таблице таймеров.
+        """
+        if self._store is None:
+            return 0
+        
+        loop = asyncio.get_running_loop()
+        rows = await loop.run_in_executor(None, self._store.load_all)
+        now = utcnow()
+        restored = overdue = 0
+        
+        for row in rows:
+            callback = self._handlers.get(row.handler)
+            if callback is None:
+                logger.warning(f"Нет обработчика {row.handler} для таймера {row.kind}:{row.key}, удаляем")
+                self._forget(row.kind, row.key)
+                continue
+            args = (row.key, row.order_id) if row.kind == TIMER_DRIVER else (row.key,)
+            delay = max(0.0, (row.due_at - now).total_seconds())
+            overdue += delay == 0
+            self._arm(row.kind, row.key, delay, callback, args, row.handler, persist=False)
+            restored += 1
+        
+        if offer_handler and offer_handler in self._handlers:
+            offers = await loop.run_in_executor(None, self._store.load_pending_offers)
+            for driver_id, order_id, pending_until in offers:
+                if driver_id in self._driver_timers:
+                    continue
+                delay = max(0.0, (pending_until - now).total_seconds())
+                overdue += delay == 0
+                self._arm(
+                    TIMER_DRIVER, driver_id, delay, self._handlers[offer_handler],
+                    (driver_id, order_id), offer_handler,
+                )
+                restored += 1
+        
+        logger.info(f"Восстановлено таймеров: {restored} (просроченных, сработают сразу: {overdue})")
+        return restored
     
     async def cancel_all(self):
-        """Отменить все таймеры (при остановке бота)"""
+        """
+        Отменить все таймеры (при остановке бота)
+        Сохранённые строки остаются в хранилище — restore_timers() взведёт их заново
+        """
         logger.info("Отмена всех таймеров...")
+        self._stopping = True
         
-        # Отменяем таймеры водителей
-        for driver_id in list(self._driver_tasks.keys()):
-            await self.cancel_driver_timeout(driver_id)
+        # Отменяем таймеры водителей и заказов
+        for kind in self._timers:
+            for key in list(self._timers_of(kind).keys()):
+                self._disarm(kind, key, forget=False)
+        self._heap = []
+        self._cancelled_in_heap = 0
         
-        # Отменяем таймеры заказов
-        for order_id in list(self._order_tasks.keys()):
-            await self.cancel_order_timeout(order_id)
+        # Останавливаем обработчик таймеров и прерываем выполняющиеся callback
+        tasks = list(self._firing)
+        if self._timer_task and not self._timer_task.done():
+            tasks.append(self._timer_task)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._timer_task = None
+        self._stopping = False
+        
+        # Взведённые перед остановкой таймеры должны пережить рестарт
+        await self.flush_store()
 
         # Останавливаем ночной джоб
         if self._warning_cleanup_task and not self._warning_cleanup_task.done():
@@ -164,15 +452,29 @@ class Scheduler:
                 pass
             self._broadcast_cleanup_task = None
 
+        # Останавливаем архивацию заказов
+        if self._order_archive_task and not self._order_archive_task.done():
+            self._order_archive_task.cancel()
+            try:
+                await self._order_archive_task
+            except asyncio.CancelledError:
+                pass
+            self._order_archive_task = None
+
         logger.info("Все таймеры отменены")
     
     def get_stats(self) -> Dict:
         """Получить статистику активных таймеров"""
         return {
-            "active_driver_timeouts": len([t for t in self._driver_tasks.values() if not t.done()]),
-            "active_order_timeouts": len([t for t in self._order_tasks.values() if not t.done()]),
-            "total_driver_tasks": len(self._driver_tasks),
-            "total_order_tasks": len(self._order_tasks),
+            "active_driver_timeouts": len(self._driver_timers),
+            "active_order_timeouts": len(self._order_timers),
+            "total_driver_tasks": len(self._driver_timers),
+            "total_order_tasks": len(self._order_timers),
+            "active_cascade_steps": len(self._cascade_timers),
+            "heap_size": len(self._heap),
+            "cancelled_in_heap": self._cancelled_in_heap,
+            "firing_callbacks": len(self._firing),
+            "pending_store_writes": len(self._pending_writes),
         }
 
     async def start_warning_cleanup_loop(self):
@@ -210,6 +512,35 @@ class Scheduler:
         self._broadcast_cleanup_task = asyncio.create_task(_worker())
         logger.info("Фоновая очистка broadcast-резервов запущена")
 
+    async def start_order_archive_loop(self):
+        """Запустить ночной перенос старых заказов в архив"""
+        if self._order_archive_task and not self._order_archive_task.done():
+            return
+
+        async def _worker():
+            while True:
+                try:
+                    await asyncio.sleep(self._seconds_until_hour(4))
+                    await self.run_order_archive_once()
+                except asyncio.CancelledError:
+                    logger.info("Архивация заказов остановлена")
+                    break
+                except Exception as exc:
+                    logger.error("Ошибка архивации заказов: %s", exc, exc_info=True)
+                    await asyncio.sleep(60)
+
+        self._order_archive_task = asyncio.create_task(_worker())
+        logger.info("Ночная архивация заказов запущена")
+
+    async def run_order_archive_once(self) -> int:
+        """Перенести старые заказы в архив вручную"""
+        from bot.services.order_archive_service import OrderArchiveService  # локальный импорт
+
+        loop = asyncio.get_running_loop()
+        archived = await loop.run_in_executor(None, OrderArchiveService.archive_old_orders)
+        logger.info("[scheduler] archived %s orders", archived)
+        return archived
+
     async def _warning_cleanup_worker(self):
         """Фоновая задача очистки предупреждений"""
         while True:
@@ -0,0 +1,223 @@
+"""
+Свёрнутая статистика заказов (таблица stats_rollups)
+
+Каждое событие заказа увеличивает счётчики за час, сутки и всё время — в целом,
+по зоне заказа и по водителю. Запись идёт в той же транзакции, что и смена
+статуса заказа, поэтому /admin_stats и статистика водителя читают готовые
+строки по первичному ключу, а не считают COUNT/AVG по всей истории.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from bot.config import settings
+from bot.constants import PUBLIC_ZONE_LABELS
+from bot.models.order import Order, OrderStatus
+from bot.models.order_archive import ArchivedOrder
+from bot.models.stats_rollup import ALL_TIME_BUCKET, StatsRollup
+from bot.utils.clock import utcnow
+
+logger = logging.getLogger(__name__)
+
+# Событие заказа → счётчик
+EVENT_COUNTERS = {
+    "created": "orders",
+    "completed": "completed",
+    "cancelled": "cancelled",
+    "expired": "expired",
+}
+
+COUNTERS = ("orders", "completed", "cancelled", "expired", "revenue")
+
+COMPLETED_STATUSES = (OrderStatus.FINISHED, OrderStatus.COMPLETED)
+CANCELLED_STATUSES = (
+    OrderStatus.CANCELLED,
+    OrderStatus.CANCELLED_BY_CLIENT,
+    OrderStatus.CANCELLED_BY_DRIVER,
+)
+
+# Подписи зон в отчётах
+ZONE_LABELS = {**PUBLIC_ZONE_LABELS, "INTERCITY": "Межгород", "NONE": "Без зоны"}
+
+RollupKey = Tuple[str, datetime, str, str]
+
+
+def _local(at: datetime) -> datetime:
+    return at + timedelta(hours=settings.stats_utc_offset_hours)
+
+
+def hour_bucket(at: Optional[datetime] = None) -> datetime:
+    """Начало местного часа для момента at (UTC)"""
+    return _local(at or utcnow()).replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(at: Optional[datetime] = None) -> datetime:
+    """Начало местных суток для момента at (UTC)"""
+    return _local(at or utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def order_zone_key(order) -> str:
+    """Зона заказа для статистики: зона очереди, INTERCITY для межгорода, NONE для старых заказов"""
+    if order.zone:
+        return order.zone.value if hasattr(order.zone, "value") else str(order.zone)
+    return "INTERCITY" if order.is_intercity else "NONE"
+
+
+def _rollup_keys(order, at: datetime, driver_id: Optional[int]) -> Iterator[RollupKey]:
+    zone = order_zone_key(order)
+    for period, bucket in (("hour", hour_bucket(at)), ("day", day_bucket(at)), ("all", ALL_TIME_BUCKET)):
+        yield period, bucket, "total", ""
+        yield period, bucket, "zone", zone
+        if driver_id:
+            yield period, bucket, "driver", str(driver_id)
+
+
+def _event_deltas(order, event: str) -> Dict[str, float]:
+    deltas = {EVENT_COUNTERS[event]: 1}
+    if event == "completed":
+        deltas["revenue"] = float(order.price or 0)
+    return deltas
+
+
+def _upsert(db: Session, key: RollupKey, deltas: Dict[str, float]):
+    """Прибавить deltas к строке key, создав её при необходимости (одним запросом)"""
+    table = StatsRollup.__table__
+    period, bucket, scope, key_value = key
+    values = {"period": period, "bucket": bucket, "scope": scope, "key": key_value}
+    values.update({name: deltas.get(name, 0) for name in COUNTERS})
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table).values(**values)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["period", "bucket", "scope", "key"],
+            set_={name: table.c[name] + stmt.excluded[name] for name in deltas},
+        ))
+        return
+
+    # Прочие СУБД: UPDATE, а если строки ещё нет — INSERT
+    result = db.execute(
+        update(table)
+        .where(
+            table.c.period == period, table.c.bucket == bucket,
+            table.c.scope == scope, table.c.key == key_value,
+        )
+        .values({name: table.c[name] + delta for name, delta in deltas.items()})
+    )
+    if result.rowcount == 0:
+        db.execute(insert(table).values(**values))
+
+
+class StatsService:
+    """Обновление и чтение свёрнутой статистики"""
+
+    @staticmethod
+    def record_order_event(
+        db: Session,
+        order: Order,
+        event: str,
+        at: Optional[datetime] = None,
+        driver_id: Optional[int] = None,
+    ):
+        """
+        Учесть событие заказа (без commit — фиксируется вместе со сменой статуса)
+
+        Args:
+            event: created / completed / cancelled / expired
+            at: Время события (UTC), по умолчанию сейчас
+            driver_id: Водитель, к которому относится событие (Driver.id)
+        """
+        deltas = _event_deltas(order, event)
+        for key in _rollup_keys(order, at or utcnow(), driver_id):
+            _upsert(db, key, deltas)
+
+    @staticmethod
+    def get(db: Session, period: str, bucket: datetime, scope: str = "total", key: str = "") -> StatsRollup:
+        """Строка статистики по первичному ключу (пустая, если событий не было)"""
+        row = db.get(StatsRollup, (period, bucket, scope, key))
+        if row is None:
+            row = StatsRollup(
+                period=period, bucket=bucket, scope=scope, key=key,
+                orders=0, completed=0, cancelled=0, expired=0, revenue=0.0,
+            )
+        return row
+
+    @staticmethod
+    def get_all_time(db: Session, scope: str = "total", key: str = "") -> StatsRollup:
+        return StatsService.get(db, "all", ALL_TIME_BUCKET, scope, key)
+
+    @staticmethod
+    def get_today(db: Session, scope: str = "total", key: str = "") -> StatsRollup:
+        return StatsService.get(db, "day", day_bucket(), scope, key)
+
+    @staticmethod
+    def get_this_hour(db: Session, scope: str = "total", key: str = "") -> StatsRollup:
+        return StatsService.get(db, "hour", hour_bucket(), scope, key)
+
+    @staticmethod
+    def get_zones(db: Session, period: str, bucket: datetime) -> List[StatsRollup]:
+        """Строки всех зон за период (диапазон первичного ключа)"""
+        return list(db.scalars(
+            select(StatsRollup)
+            .where(
+                StatsRollup.period == period,
+                StatsRollup.bucket == bucket,
+                StatsRollup.scope == "zone",
+            )
+            .order_by(StatsRollup.orders.desc())
+        ))
+
+    @staticmethod
+    def rebuild(db: Session) -> int:
+        """
+        Пересчитать всю статистику по orders и orders_archive (без commit)
+
+        Время событий из истории: создание — created_at, завершение — finished_at,
+        отмена и истечение — updated_at. У отменённых заказов водитель уже снят,
+        поэтому их отмены в разрезе водителя не восстанавливаются.
+
+        Returns:
+            Сколько строк статистики записано
+        """
+        totals: Dict[RollupKey, Dict[str, float]] = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+
+        def _add(order, event: str, at: Optional[datetime], driver_id: Optional[int]):
+            deltas = _event_deltas(order, event)
+            for key in _rollup_keys(order, at or order.created_at or utcnow(), driver_id):
+                row = totals[key]
+                for name, delta in deltas.items():
+                    row[name] += delta
+
+        for model in (Order, ArchivedOrder):
+            rows = db.execute(
+                select(
+                    model.zone, model.is_intercity, model.assigned_driver_id, model.status, model.price,
+                    model.created_at, model.finished_at, model.completed_at, model.updated_at,
+                ).execution_options(yield_per=1000)
+            )
+            for order in rows:
+                # При создании водителя ещё нет — как и у живого события
+                _add(order, "created", order.created_at, None)
+                if order.status in COMPLETED_STATUSES:
+                    _add(order, "completed", order.finished_at or order.completed_at, order.assigned_driver_id)
+                elif order.status in CANCELLED_STATUSES:
+                    _add(order, "cancelled", order.updated_at, order.assigned_driver_id)
+                elif order.status == OrderStatus.EXPIRED:
+                    _add(order, "expired", order.updated_at, order.assigned_driver_id)
+
+        db.execute(delete(StatsRollup))
+        if totals:
+            db.execute(insert(StatsRollup), [
+                {"period": period, "bucket": bucket, "scope": scope, "key": key, **counters}
+                for (period, bucket, scope, key), counters in totals.items()
+            ])
+        logger.info("Статистика пересчитана: %s строк", len(totals))
+        return len(totals)
@@ -0,0 +1,79 @@
+"""
+Хранилище таймеров планировщика
+Таймауты водителей и заказов записываются в таблицу scheduled_timers,
+чтобы после перезапуска их можно было взвести заново
+"""
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from bot.models.driver import Driver
+from bot.models.scheduled_timer import ScheduledTimer
+
+logger = logging.getLogger(__name__)
+
+
+class TimerStore:
+    """Таблица scheduled_timers: одна строка на активный таймер (kind, key)"""
+
+    def __init__(self, session_factory: Callable[[], Session]):
+        self._session_factory = session_factory
+
+    def apply(self, changes: Dict[Tuple[str, int], Optional[tuple]]):
+        """
+        Записать пачку изменений одной транзакцией
+        changes: {(kind, key): (handler, due_at, order_id)}, None — удалить таймер
+        """
+        db = self._session_factory()
+        try:
+            for (kind, key), row in changes.items():
+                if row is None:
+                    db.execute(delete(ScheduledTimer).where(
+                        ScheduledTimer.kind == kind,
+                        ScheduledTimer.key == key,
+                    ))
+                    continue
+                handler, due_at, order_id = row
+                db.merge(ScheduledTimer(
+                    kind=kind,
+                    key=key,
+                    order_id=order_id,
+                    handler=handler,
+                    due_at=due_at,
+                ))
+            db.commit()
+        finally:
+            db.close()
+
+    def load_all(self) -> List[ScheduledTimer]:
+        """Все сохранённые таймеры одним запросом, по возрастанию due_at"""
+        db = self._session_factory()
+        try:
+            rows = db.execute(
+                select(ScheduledTimer).order_by(ScheduledTimer.due_at)
+            ).scalars().all()
+            db.expunge_all()
+            return list(rows)
+        finally:
+            db.close()
+
+    def load_pending_offers(self) -> List[tuple]:
+        """
+        Предложения заказов, висящие на водителях: (driver_id, order_id, pending_until)
+        Нужны для офферов, выданных до появления таблицы таймеров
+        """
+        db = self._session_factory()
+        try:
+            return [
+                (row.id, row.pending_order_id, row.pending_until)
+                for row in db.execute(
+                    select(Driver.id, Driver.pending_order_id, Driver.pending_until).where(
+                        Driver.pending_order_id.isnot(None),
+                        Driver.pending_until.isnot(None),
+                    )
+                )
+            ]
+        finally:
+            db.close()
@@ -0,0 +1,100 @@
+"""
+Кеш идентичности пользователей по telegram_id
+Хранит то, что нужно почти каждому обновлению (id, роль, бан, телефон), чтобы
+ban guard и проверки ролей не ходили в БД. LRU с ограничением размера и TTL:
+изменения из других процессов (скрипты add_driver и т.п.) подхватываются по истечении TTL,
+изменения внутри бота сбрасывают запись явно через invalidate().
+"""
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from bot.config import settings
+from bot.models.user import User, UserRole
+
+
+@dataclass(frozen=True)
+class UserIdentity:
+    """Снимок пользователя для кеша"""
+    id: int
+    telegram_id: int
+    role: UserRole
+    is_banned: bool
+    phone_number: Optional[str]
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserIdentity":
+        return cls(
+            id=user.id,
+            telegram_id=user.telegram_id,
+            role=user.role,
+            is_banned=bool(user.is_banned),
+            phone_number=user.phone_number,
+        )
+
+
+class UserIdentityCache:
+    """
+    LRU-кеш {telegram_id: UserIdentity | None}
+
+    None — пользователь не зарегистрирован (тоже кешируется, чтобы незнакомцы
+    не давали запрос на каждое обновление; при регистрации запись сбрасывается).
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 300.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[int, Tuple[float, Optional[UserIdentity]]]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def lookup(self, telegram_id: int) -> Tuple[bool, Optional[UserIdentity]]:
+        """(найдено в кеше, снимок или None для незарегистрированного)"""
+        entry = self._entries.get(telegram_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[telegram_id]
+            self._misses += 1
+            return False, None
+        self._entries.move_to_end(telegram_id)
+        self._hits += 1
+        return True, entry[1]
+
+    def put(self, telegram_id: int, identity: Optional[UserIdentity]):
+        """Запомнить снимок (None — пользователя нет в БД)"""
+        self._entries[telegram_id] = (time.monotonic() + self.ttl_seconds, identity)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def put_user(self, user: Optional[User], telegram_id: Optional[int] = None):
+        """Запомнить пользователя из БД"""
+        if user is None:
+            if telegram_id is not None:
+                self.put(telegram_id, None)
+            return
+        self.put(user.telegram_id, UserIdentity.from_user(user))
+
+    def invalidate(self, telegram_id: int):
+        """Сбросить запись после изменения пользователя"""
+        self._entries.pop(telegram_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> dict:
+        total = self._hits + self._misses
+        return {
+            "size": len(self._entries),
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / total, 3) if total else 0.0,
+        }
+
+
+# Глобальный экземпляр кеша
+user_cache = UserIdentityCache(
+    max_size=settings.user_cache_max_size,
+    ttl_seconds=settings.user_cache_ttl_seconds,
+)
@@ -9,6 +9,7 @@ from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 
 from bot.models import User
+from bot.services.user_cache import user_cache
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +56,8 @@ class UserPenaltyService:
         user.warning_count = user.warning_count or 1
         user.last_warning_at = now
         db.commit()
+        # Ban guard читает бан из кеша — сбрасываем, чтобы бан действовал сразу
+        user_cache.invalidate(user.telegram_id)
         logger.error("penalty: banned user_id=%s phone=%s", user.id, user.phone_number)
         return "banned"
 
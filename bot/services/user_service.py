@@ -5,6 +5,7 @@ from typing import Optional
 from sqlalchemy.orm import Session
 from telegram import User as TelegramUser
 from bot.models import User, UserRole
+from bot.services.user_cache import user_cache, UserIdentity
 
 
 class UserService:
@@ -36,12 +37,51 @@ class UserService:
             db.commit()
             db.refresh(user)
         
+        user_cache.put_user(user)
         return user
     
     @staticmethod
     def get_user_by_telegram_id(db: Session, telegram_id: int) -> Optional[User]:
         """Получить пользователя по Telegram ID"""
-        return db.query(User).filter(User.telegram_id == telegram_id).first()
+        user = db.query(User).filter(User.telegram_id == telegram_id).first()
+        user_cache.put_user(user, telegram_id)
+        return user
+    
+    @staticmethod
+    def get_identity(telegram_id: int, db: Optional[Session] = None) -> Optional[UserIdentity]:
+        """
+        Роль, бан и телефон пользователя из кеша
+        
+        В БД идём только при промахе (сессия открывается, если не передана).
+        None — пользователь не зарегистрирован.
+        """
+        found, identity = user_cache.lookup(telegram_id)
+        if found:
+            return identity
+        
+        if db is not None:
+            return UserService._load_identity(db, telegram_id)
+        
+        from database.db import SessionLocal
+        db = SessionLocal()
+        try:
+            return UserService._load_identity(db, telegram_id)
+        finally:
+            db.close()
+    
+    @staticmethod
+    def _load_identity(db: Session, telegram_id: int) -> Optional[UserIdentity]:
+        user = db.query(User).filter(User.telegram_id == telegram_id).first()
+        user_cache.put_user(user, telegram_id)
+        return UserIdentity.from_user(user) if user else None
+    
+    @staticmethod
+    def set_role(db: Session, user: User, role: UserRole) -> User:
+        """Сменить роль пользователя"""
+        user.role = role
+        db.commit()
+        user_cache.invalidate(user.telegram_id)
+        return user
     
     @staticmethod
     def is_admin(telegram_id: int) -> bool:
@@ -55,5 +95,17 @@ class UserService:
         user.phone_number = phone_number
         db.commit()
         db.refresh(user)
+        user_cache.invalidate(user.telegram_id)
         return user
-
+    
+    # ==================== АСИНХРОННЫЕ ВАРИАНТЫ ====================
+    
+    @staticmethod
+    async def get_identity_async(telegram_id: int) -> Optional[UserIdentity]:
+        """Роль, бан и телефон из кеша; при промахе — запрос без блокировки event loop"""
+        found, identity = user_cache.lookup(telegram_id)
+        if found:
+            return identity
+        
+        from database.db import run_in_session
+        return await run_in_session(UserService._load_identity, telegram_id)
@@ -0,0 +1,201 @@
+"""
+Единый реестр зон: район подачи ↔ тарифная зона ↔ зона очереди
+
+Раньше одно и то же название района разбиралось в трёх местах по-разному:
+тарифы искали id по точному имени, очередь — перебором подстрок
+(map_district_to_zone), broadcast — по списку BROADCAST_ZONES. Реестр собирает
+всё это один раз из зон pricing.json и констант очередей и отвечает на любой
+вопрос одним поиском в словаре по нормализованному названию.
+
+Реестр пересобирается, когда PricingService перечитал файл тарифов.
+"""
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from bot.constants import BROADCAST_ZONES, PUBLIC_ZONE_LABELS, ZONE_KEY_MAP, ZONES
+from bot.services.pricing_service import PricingService
+
+logger = logging.getLogger(__name__)
+
+# Подстроки названий района → зона очереди (порядок важен: первое совпадение)
+DISTRICT_SUBSTRINGS = (
+    ("новое жуково", "NEW_ZHUKOVO"),
+    ("новое", "NEW_ZHUKOVO"),
+    ("старое жуково", "OLD_ZHUKOVO"),
+    ("старое", "OLD_ZHUKOVO"),
+    ("мысовцево", "MYSOVTSEVO"),
+    ("авдон", "AVDON"),
+    ("уптино", "UPTINO"),
+    ("дёма", "DEMA"),
+    ("дема", "DEMA"),
+    ("сергеевка", "SERGEEVKA"),
+)
+
+# Сколько незнакомых названий запоминать (защита от роста на мусорном вводе)
+UNKNOWN_CACHE_SIZE = 1024
+
+
+@dataclass(frozen=True)
+class ZoneInfo:
+    """Всё, что известно о районе подачи"""
+
+    label: str
+    pricing_id: Optional[str] = None
+    queue_key: Optional[str] = None
+    is_broadcast: bool = False
+
+
+def normalize_zone_name(name: str) -> str:
+    """Ключ поиска: без регистра, ё = е, пробелы схлопнуты"""
+    return " ".join(name.lower().replace("ё", "е").split())
+
+
+def _queue_key_by_substring(name: str) -> Optional[str]:
+    lowered = name.lower().strip()
+    for substring, zone_key in DISTRICT_SUBSTRINGS:
+        if substring in lowered:
+            return zone_key
+    return None
+
+
+def _is_broadcast_name(name: str) -> bool:
+    return name in BROADCAST_ZONES or name.startswith("Аэропорт")
+
+
+def _describe(name: str, pricing_id: Optional[str] = None) -> ZoneInfo:
+    """Описание района по правилам, которые раньше применялись при каждом заказе"""
+    return ZoneInfo(
+        label=name,
+        pricing_id=pricing_id,
+        queue_key=ZONE_KEY_MAP.get(name) or _queue_key_by_substring(name),
+        is_broadcast=_is_broadcast_name(name),
+    )
+
+
+class _RegistrySnapshot:
+    """Индексы реестра для одной версии тарифов"""
+
+    def __init__(self, pricing_zones: Iterable[Tuple[str, str]], source=None):
+        self.source = source
+        self.by_alias: Dict[str, ZoneInfo] = {}
+        self.by_pricing_id: Dict[str, ZoneInfo] = {}
+        self.by_queue_key: Dict[str, ZoneInfo] = {}
+        # Уже встречавшиеся написания как есть — без нормализации
+        self.by_name: Dict[str, ZoneInfo] = {}
+        self.unknown: Dict[str, ZoneInfo] = {}
+
+        for pricing_id, name in pricing_zones:
+            info = _describe(name, pricing_id)
+            self.by_pricing_id[pricing_id] = info
+            self.by_alias.setdefault(normalize_zone_name(name), info)
+            if info.queue_key and PUBLIC_ZONE_LABELS.get(info.queue_key) == name:
+                self.by_queue_key[info.queue_key] = info
+
+        # Зона очереди без тарифа всё равно должна разрешаться
+        for zone_key in ZONES:
+            label = PUBLIC_ZONE_LABELS.get(zone_key, zone_key)
+            info = self.by_queue_key.setdefault(zone_key, ZoneInfo(label=label, queue_key=zone_key))
+            self.by_alias.setdefault(normalize_zone_name(label), info)
+
+        # Технические ключи — тоже допустимые названия
+        for pricing_id, info in self.by_pricing_id.items():
+            self.by_alias.setdefault(normalize_zone_name(pricing_id), info)
+        for zone_key, info in self.by_queue_key.items():
+            self.by_alias.setdefault(normalize_zone_name(zone_key), info)
+
+        for info in self.by_pricing_id.values():
+            self.by_name.setdefault(info.label, info)
+        for info in self.by_queue_key.values():
+            self.by_name.setdefault(info.label, info)
+
+    def resolve(self, name: str) -> ZoneInfo:
+        info = self.by_name.get(name)
+        if info is not None:
+            return info
+        alias = normalize_zone_name(name)
+        info = self.by_alias.get(alias) or self.unknown.get(alias)
+        if info is None:
+            info = _describe(name.strip())
+            if len(self.unknown) < UNKNOWN_CACHE_SIZE:
+                self.unknown[alias] = info
+            if info.queue_key is None and not info.is_broadcast:
+                logger.warning(f"Не удалось сопоставить район '{name}' с зоной")
+        if len(self.by_name) < UNKNOWN_CACHE_SIZE:
+            self.by_name[name] = info
+        return info
+
+
+class ZoneRegistry:
+    """Поиск зоны по любому названию за O(1)"""
+
+    def __init__(self):
+        self._snapshot: Optional[_RegistrySnapshot] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> int:
+        """Собрать реестр заново (при старте бота). Возвращает число известных названий"""
+        with self._lock:
+            self._snapshot = self._build()
+        snapshot = self._snapshot
+        logger.info(
+            "Реестр зон загружен: тарифных зон %s, зон очереди %s, названий %s",
+            len(snapshot.by_pricing_id), len(snapshot.by_queue_key), len(snapshot.by_alias),
+        )
+        return len(snapshot.by_alias)
+
+    @staticmethod
+    def _build() -> _RegistrySnapshot:
+        try:
+            pricing_zones = PricingService.get_zones()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Тарифы недоступны, реестр зон собран только по зонам очереди: {e}")
+            return _RegistrySnapshot(())
+        return _RegistrySnapshot(pricing_zones, source=pricing_zones)
+
+    def _current(self) -> _RegistrySnapshot:
+        """Актуальные индексы: пересборка, только если тарифы перечитаны"""
+        snapshot = self._snapshot
+        if snapshot is not None:
+            try:
+                if PricingService.get_zones() is snapshot.source:
+                    return snapshot
+            except (OSError, ValueError, KeyError, TypeError):
+                return snapshot
+        with self._lock:
+            if self._snapshot is snapshot:
+                self._snapshot = self._build()
+            return self._snapshot
+
+    def resolve(self, name: str) -> Optional[ZoneInfo]:
+        """Описание района по названию, id тарифа или ключу очереди"""
+        if not name:
+            return None
+        return self._current().resolve(name)
+
+    def queue_zone_for(self, district: str) -> Optional[str]:
+        """Ключ зоны очереди для района подачи (None — район вне очередей)"""
+        info = self.resolve(district)
+        return info.queue_key if info else None
+
+    def is_broadcast(self, district: str) -> bool:
+        """Заказы из района идут broadcast-рассылкой"""
+        info = self.resolve(district)
+        return bool(info and info.is_broadcast)
+
+    def pricing_id_for(self, name: str) -> Optional[str]:
+        """id тарифной зоны по названию (с учётом регистра, ё и ключей очереди)"""
+        info = self.resolve(name)
+        return info.pricing_id if info else None
+
+    def label(self, queue_key) -> Optional[str]:
+        """Публичное название зоны очереди (сам ключ, если зона неизвестна)"""
+        if queue_key is None:
+            return None
+        key = queue_key.value if hasattr(queue_key, "value") else str(queue_key)
+        info = self._current().by_queue_key.get(key)
+        return info.label if info else key
+
+
+zone_registry = ZoneRegistry()
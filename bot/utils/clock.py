@@ -0,0 +1,20 @@
+"""
+Часы диспетчеризации
+Текущее время (UTC) для таймаутов, очередей и каскадной рассылки берётся через
+utcnow(), чтобы симулятор мог подменить его виртуальными часами
+"""
+from datetime import datetime
+from typing import Callable, Optional
+
+_now: Callable[[], datetime] = datetime.utcnow
+
+
+def utcnow() -> datetime:
+    """Текущее время UTC (naive, как datetime.utcnow)"""
+    return _now()
+
+
+def set_clock(now: Optional[Callable[[], datetime]] = None):
+    """Подменить источник времени (None — вернуть системные часы)"""
+    global _now
+    _now = now or datetime.utcnow
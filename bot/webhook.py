@@ -0,0 +1,167 @@
+"""
+Режим webhook: приём обновлений Telegram через aiohttp-сервер вместо long polling
+Обработчики регистрируются в Application так же, как для polling — сервер только
+кладёт пришедшие обновления в application.update_queue.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import signal
+from urllib.parse import urlparse
+
+from aiohttp import web
+from telegram import Update  # pyright: ignore[reportMissingImports]
+from telegram.ext import Application  # pyright: ignore[reportMissingImports]
+
+from bot.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передаёт secret_token из setWebhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+# Ключи aiohttp-приложения
+APP_KEY = "telegram_application"
+SECRET_KEY = "webhook_secret"
+STATE_KEY = "webhook_state"
+
+
+def webhook_secret() -> str:
+    """
+    Секрет для проверки запросов от Telegram
+
+    Если TELEGRAM_WEBHOOK_SECRET не задан, выводится из токена бота:
+    стабилен между перезапусками и не совпадает с самим токеном.
+    """
+    if settings.telegram_webhook_secret:
+        return settings.telegram_webhook_secret
+    return hashlib.sha256(settings.telegram_bot_token.encode()).hexdigest()
+
+
+def webhook_path() -> str:
+    """Путь, на который Telegram присылает обновления (из TELEGRAM_WEBHOOK_URL)"""
+    return urlparse(settings.telegram_webhook_url).path or "/telegram"
+
+
+async def handle_update(request: web.Request) -> web.Response:
+    """POST от Telegram: проверить секрет и поставить обновление в очередь"""
+    if request.app[STATE_KEY]["draining"]:
+        # Бот останавливается: Telegram повторит доставку новому экземпляру
+        return web.Response(status=503)
+
+    secret = request.headers.get(SECRET_HEADER, "")
+    if not hmac.compare_digest(secret, request.app[SECRET_KEY]):
+        logger.warning("Webhook: запрос с неверным secret token от %s", request.remote)
+        return web.Response(status=403)
+
+    application: Application = request.app[APP_KEY]
+    try:
+        data = await request.json()
+        update = Update.de_json(data, application.bot)
+    except Exception as e:
+        logger.warning("Webhook: не удалось разобрать обновление: %s", e)
+        return web.Response(status=400)
+
+    # Остановка могла начаться, пока читалось тело запроса
+    if request.app[STATE_KEY]["draining"]:
+        return web.Response(status=503)
+
+    await application.update_queue.put(update)
+    return web.Response(status=200)
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    """GET /health: жив ли бот и сколько обновлений ждёт обработки"""
+    from bot.services.outbox import outbox
+
+    application: Application = request.app[APP_KEY]
+    draining = request.app[STATE_KEY]["draining"]
+    return web.json_response(
+        {
+            "status": "draining" if draining else "ok",
+            "mode": "webhook",
+            "update_queue": application.update_queue.qsize(),
+            "outbox": outbox.get_stats()["depth"],
+        },
+        status=503 if draining else 200,
+    )
+
+
+def build_webhook_app(application: Application, secret: str) -> web.Application:
+    """aiohttp-приложение с маршрутами webhook и health"""
+    app = web.Application()
+    app[APP_KEY] = application
+    app[SECRET_KEY] = secret
+    # Изменяемое состояние: aiohttp запрещает менять app[...] после запуска
+    app[STATE_KEY] = {"draining": False}
+    app.router.add_post(webhook_path(), handle_update)
+    app.router.add_get("/health", handle_health)
+    return app
+
+
+async def serve_webhook(application: Application, stop_event: asyncio.Event):
+    """
+    Запустить бота в режиме webhook и работать до stop_event
+
+    Остановка: сервер перестаёт принимать обновления (503) и закрывается,
+    Application дорабатывает уже принятые, затем выполняется post_shutdown.
+    """
+    secret = webhook_secret()
+    app = build_webhook_app(application, secret)
+    runner = web.AppRunner(app)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    await runner.setup()
+    site = web.TCPSite(runner, settings.webhook_listen, settings.webhook_port)
+    await site.start()
+    logger.info(
+        "Webhook-сервер слушает %s:%s%s",
+        settings.webhook_listen, settings.webhook_port, webhook_path(),
+    )
+
+    # Старые обновления не выбрасываем: нажатия во время рестарта будут обработаны
+    await application.bot.set_webhook(
+        url=settings.telegram_webhook_url,
+        secret_token=secret,
+        allowed_updates=ALLOWED_UPDATES,
+        max_connections=settings.webhook_max_connections,
+        drop_pending_updates=False,
+    )
+    logger.info("Webhook зарегистрирован в Telegram: %s", settings.telegram_webhook_url)
+
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("Остановка webhook: дорабатываем принятые обновления...")
+        app[STATE_KEY]["draining"] = True
+        # Сначала закрываем сервер: после этого в update_queue ничего не попадёт
+        await runner.cleanup()
+        # Application.stop() обрабатывает всё, что уже лежит в update_queue
+        await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
+        logger.info("Webhook-сервер остановлен")
+
+
+def run_webhook(application: Application):
+    """Блокирующий запуск webhook-режима до SIGINT/SIGTERM"""
+    async def _main():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                # Windows: остаётся KeyboardInterrupt
+                pass
+        await serve_webhook(application, stop_event)
+
+    asyncio.run(_main())
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Сверка рейтингов водителей с оценками в заказах
+
+Рейтинг водителя (rating_sum / rating_count / rating_avg) обновляется
+инкрементально при каждой оценке. Скрипт пересчитывает его одним
+сгруппированным запросом по orders и orders_archive и показывает расхождения.
+
+Использование:
+    python check_driver_ratings.py          # только отчёт
+    python check_driver_ratings.py --fix    # исправить расхождения
+"""
+import argparse
+import sys
+
+from database.db import SessionLocal
+from bot.services.order_service import OrderService
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Сверка рейтингов водителей")
+    parser.add_argument("--fix", action="store_true", help="исправить найденные расхождения")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        mismatches = OrderService.recompute_driver_ratings(db, repair=args.fix)
+    finally:
+        db.close()
+
+    for item in mismatches:
+        stored_sum, stored_count, stored_avg = item["stored"]
+        actual_sum, actual_count, actual_avg = item["actual"]
+        print(
+            f"⚠️ Водитель ID {item['driver_id']}: "
+            f"в БД сумма={stored_sum} оценок={stored_count} средний={stored_avg}, "
+            f"по заказам сумма={actual_sum} оценок={actual_count} средний={actual_avg:.2f}"
+        )
+
+    print("=" * 60)
+    if not mismatches:
+        print("✅ Рейтинги всех водителей совпадают с оценками в заказах")
+        return 0
+    if args.fix:
+        print(f"✅ Исправлено водителей: {len(mismatches)}")
+        return 0
+    print(f"❌ Расхождений: {len(mismatches)} (запустите с --fix, чтобы исправить)")
+    return 1
+
+
+if __name__ == "__main__":
+    if sys.platform == 'win32':
+        sys.stdout.reconfigure(encoding='utf-8')
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Проверка: id заказов не переиспользуются после архивации
+
+Архивирует самые новые заказы (OrderArchiveService.archive_batch), затем
+создаёт новый заказ и проверяет, что его id больше всех архивных, а повторная
+архивация проходит без конфликта первичного ключа в orders_archive.
+Сценарии:
+  1. схема из моделей (новая БД);
+  2. БД на миграции 0007 (orders без AUTOINCREMENT) с уже заархивированными
+     заказами, обновлённая до последней миграции.
+
+Использование:
+    python check_order_archive.py
+"""
+import os
+
+# До импорта бота: схема в памяти, журнал очередей не нужен
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["QUEUE_JOURNAL_PATH"] = ""
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:order-archive")
+
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from typing import List
+
+from alembic import command
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+from database.db import Base
+from database.schema import alembic_config
+from bot.models import User, UserRole, Order, OrderStatus
+from bot.models.order_archive import ArchivedOrder
+from bot.services.order_archive_service import OrderArchiveService
+
+ORDERS = 5
+
+
+def _create_order(db: Session, customer_id: int, status: OrderStatus) -> Order:
+    order = Order(
+        customer_id=customer_id, pickup_address="a", dropoff_address="b", price=300,
+        status=status, finished_at=datetime.utcnow() - timedelta(hours=1),
+    )
+    db.add(order)
+    db.commit()
+    return order
+
+
+def _seed(db: Session) -> int:
+    """Клиент и несколько завершённых заказов; возвращает id клиента"""
+    customer = User(telegram_id=1, first_name="client", role=UserRole.CUSTOMER)
+    db.add(customer)
+    db.commit()
+    for _ in range(ORDERS):
+        _create_order(db, customer.id, OrderStatus.FINISHED)
+    return customer.id
+
+
+def _archive_all(db: Session) -> int:
+    cutoff = datetime.utcnow() + timedelta(days=1)
+    return OrderArchiveService.archive_batch(db, cutoff, ORDERS * 2)
+
+
+def _check_new_ids(db: Session, customer_id: int) -> List[str]:
+    """Заказы после архивации: id растут, повторная архивация проходит"""
+    errors = []
+    archived_max = db.scalar(select(func.max(ArchivedOrder.id))) or 0
+
+    order = _create_order(db, customer_id, OrderStatus.FINISHED)
+    if order.id <= archived_max:
+        errors.append(f"новый заказ получил id {order.id}, в архиве уже есть id до {archived_max}")
+
+    try:
+        moved = _archive_all(db)
+    except Exception as e:
+        errors.append(f"повторная архивация упала: {e}")
+        return errors
+    if moved != 1:
+        errors.append(f"повторно архивировано {moved} заказов вместо 1")
+
+    archived = db.scalar(select(func.count(ArchivedOrder.id)))
+    distinct = db.scalar(select(func.count(func.distinct(ArchivedOrder.id))))
+    if archived != distinct:
+        errors.append(f"в архиве повторяющиеся id: {archived} строк, {distinct} разных")
+    return errors
+
+
+def check_models_schema() -> List[str]:
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        customer_id = _seed(db)
+        if _archive_all(db) != ORDERS:
+            return ["архивированы не все заказы"]
+        return _check_new_ids(db, customer_id)
+
+
+def check_upgraded_database() -> List[str]:
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'orders.db')}")
+        with engine.begin() as connection:
+            command.upgrade(alembic_config(connection), "0007")
+
+        # До 0008: самые новые заказы уже ушли в архив
+        with Session(engine) as db:
+            customer_id = _seed(db)
+            if _archive_all(db) != ORDERS:
+                return ["архивированы не все заказы"]
+
+        with engine.begin() as connection:
+            command.upgrade(alembic_config(connection), "head")
+
+        with Session(engine) as db:
+            errors = _check_new_ids(db, customer_id)
+        engine.dispose()
+        return errors
+
+
+def main() -> int:
+    failures = 0
+    for name, check in (
+        ("Новая БД (схема из моделей)", check_models_schema),
+        ("Старая БД, обновлённая миграциями", check_upgraded_database),
+    ):
+        errors = check()
+        print(f"{'❌' if errors else '✅'} {name}")
+        for error in errors:
+            print(f"     ⚠️ {error}")
+        failures += bool(errors)
+
+    print("=" * 60)
+    if failures:
+        print(f"❌ Сценариев с переиспользованием id: {failures}")
+        return 1
+    print("✅ id заказов не переиспользуются после архивации")
+    return 0
+
+
+if __name__ == "__main__":
+    if sys.platform == 'win32':
+        sys.stdout.reconfigure(encoding='utf-8')
+    sys.exit(main())
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Проверка конфигурации тарифов (bot/config/pricing.json или PRICING_CONFIG_PATH)
+
+Показывает пары зон без тарифа (с учётом симметрии), повторяющиеся записи
+и записи с неизвестными зонами. Код выхода 1, если есть повторы или
+неизвестные зоны; пары без тарифа — только информация (часть из них,
+например между районами Уфы, не обслуживается намеренно).
+
+Использование:
+    python check_pricing.py
+    python check_pricing.py --missing    # вывести все пары без тарифа
+"""
+import argparse
+import os
+import sys
+from collections import defaultdict
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:check-pricing")
+
+from bot.services.pricing_service import PricingService
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Проверка конфигурации тарифов")
+    parser.add_argument("--missing", action="store_true", help="вывести все пары зон без тарифа")
+    args = parser.parse_args()
+
+    report = PricingService.get_report()
+    name = lambda zone_id: PricingService.get_zone_name_by_id(zone_id) or zone_id
+
+    print(f"📋 {report.summary()}")
+
+    for from_zone, to_zone in report.duplicate_pairs:
+        print(f"⚠️ Повтор: {from_zone} → {to_zone} (действует последняя запись)")
+    for from_zone, to_zone in report.unknown_zone_entries:
+        print(f"❌ Неизвестная зона: {from_zone} → {to_zone}")
+
+    missing_by_zone = defaultdict(list)
+    for from_zone, to_zone in report.missing_pairs:
+        missing_by_zone[from_zone].append(to_zone)
+        missing_by_zone[to_zone].append(from_zone)
+    if missing_by_zone:
+        print("\nЗоны с наибольшим числом пар без тарифа:")
+        for zone_id, others in sorted(missing_by_zone.items(), key=lambda item: -len(item[1]))[:10]:
+            print(f"   {name(zone_id)}: {len(others)}")
+    if args.missing:
+        print("\nПары без тарифа:")
+        for from_zone, to_zone in report.missing_pairs:
+            print(f"   {name(from_zone)} — {name(to_zone)}")
+
+    print("=" * 60)
+    if report.unknown_zone_entries or report.duplicate_pairs:
+        print("❌ Конфигурация тарифов требует исправления")
+        return 1
+    print("✅ Ошибок в конфигурации тарифов нет")
+    return 0
+
+
+if __name__ == "__main__":
+    if sys.platform == 'win32':
+        sys.stdout.reconfigure(encoding='utf-8')
+    sys.exit(main())
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Проверка планов горячих запросов (регрессия индексов)
+
+Вызывает настоящие функции QueueManager и OrderService на SQLite в памяти
+(схема из моделей), перехватывает выполненные SELECT и прогоняет каждый через
+EXPLAIN QUERY PLAN. Если хоть один запрос читает таблицу полным сканированием
+(SCAN <таблица> без индекса) или страница истории сортируется во временном
+B-дереве вместо обхода индекса (тогда глубокая страница дороже первой),
+скрипт завершается с кодом 1.
+
+Использование:
+    python check_query_plans.py
+    python check_query_plans.py --database sqlite:///./taxi_zhukovo.db   # планы на рабочей БД
+"""
+import os
+
+# До импорта бота: схема в памяти, журнал очередей не нужен
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["QUEUE_JOURNAL_PATH"] = ""
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:query-plans")
+
+import argparse
+import re
+import sys
+from datetime import datetime, timedelta
+from typing import Callable, List, Tuple
+
+from sqlalchemy import create_engine, event
+
+from database.db import Base, engine, SessionLocal
+from bot.models import User, UserRole, Driver, DriverStatus, Order, OrderStatus
+from bot.services.order_service import OrderService
+from bot.services.queue_manager import QueueManager
+
+# "SCAN orders" / "SCAN TABLE orders" — полное чтение таблицы;
+# "SCAN orders USING INDEX ..." — обход индекса, допустим
+FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)$")
+# Keyset-страница должна идти по индексу в нужном порядке и останавливаться на LIMIT
+TEMP_SORT = "USE TEMP B-TREE FOR ORDER BY"
+
+
+def _seed(db):
+    """Минимальные данные, чтобы функции дошли до всех своих запросов"""
+    customer = User(telegram_id=1, first_name="client", role=UserRole.CUSTOMER)
+    driver_user = User(telegram_id=2, first_name="driver", role=UserRole.DRIVER)
+    db.add_all([customer, driver_user])
+    db.flush()
+    driver = Driver(
+        user_id=driver_user.id, car_model="x", car_number="y", license_number="z",
+        status=DriverStatus.ONLINE, current_zone="DEMA", online_since=datetime.utcnow(),
+        is_verified=True,
+    )
+    db.add(driver)
+    db.flush()
+    order = Order(
+        customer_id=customer.id, assigned_driver_id=driver.id, pickup_address="a",
+        dropoff_address="b", price=300, status=OrderStatus.FINISHED,
+        finished_at=datetime.utcnow() - timedelta(hours=1),
+    )
+    db.add(order)
+    db.commit()
+    return customer, driver, order
+
+
+def _hot_queries(customer, driver, order) -> List[Tuple[str, Callable, bool]]:
+    """(название, вызов, нужен ли порядок по индексу)"""
+    queues = QueueManager()
+    # Курсоры глубоких страниц: внутри заказов с finished_at и среди заказов без него
+    deep = OrderService.parse_history_cursor(OrderService.history_cursor(order))
+    deep_unfinished = (None, order.id + 1)
+    return [
+        ("QueueManager: сверка онлайн-водителей", lambda db: QueueManager._load_online_state(db), False),
+        ("QueueManager: перестройка очередей", lambda db: queues.rebuild_from_db(db), False),
+        ("QueueManager: очередь зоны", lambda db: queues._rebuild_zone_from_db("DEMA", db), False),
+        ("QueueManager: все онлайн-водители", lambda db: queues.get_all_online_drivers(db), False),
+        ("OrderService: история клиента", lambda db: OrderService.get_user_order_history(db, customer.id), True),
+        ("OrderService: история клиента, глубокая страница",
+         lambda db: OrderService.get_user_order_history(db, customer.id, after=deep), True),
+        ("OrderService: история клиента, отменённые",
+         lambda db: OrderService.get_user_order_history(db, customer.id, after=deep_unfinished), True),
+        ("OrderService: активный заказ клиента",
+         lambda db: OrderService.get_active_order_by_customer(db, customer), False),
+        ("OrderService: история водителя", lambda db: OrderService.get_driver_order_history(db, driver.id), True),
+        ("OrderService: история водителя, глубокая страница",
+         lambda db: OrderService.get_driver_order_history(db, driver.id, after=deep), True),
+        ("OrderService: оценка и пересчёт рейтинга",
+         lambda db: OrderService.set_rating(db, OrderService.get_order_by_id(db, order.id), 5), False),
+        ("Статистика водителя: последние оценки",
+         lambda db: OrderService.get_recent_rated_orders(db, driver.id), False),
+    ]
+
+
+def capture_queries() -> List[Tuple[str, str, tuple, bool]]:
+    """(название, SQL, параметры, нужен ли порядок по индексу) для каждого SELECT горячих функций"""
+    Base.metadata.create_all(bind=engine)
+    captured: List[Tuple[str, str, tuple, bool]] = []
+    current = {"name": None, "ordered": False}
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        if current["name"] and statement.lstrip().upper().startswith("SELECT"):
+            captured.append((current["name"], statement, parameters, current["ordered"]))
+
+    db = SessionLocal()
+    event.listen(engine, "before_cursor_execute", _capture)
+    try:
+        for name, fn, ordered in _hot_queries(*_seed(db)):
+            current["name"] = name
+            current["ordered"] = ordered
+            # Каждая функция читает из БД, а не из identity map
+            db.expire_all()
+            fn(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", _capture)
+        db.close()
+    return captured
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Проверка планов горячих запросов")
+    parser.add_argument("--database", help="SQLite-БД для EXPLAIN (по умолчанию схема из моделей в памяти)")
+    args = parser.parse_args()
+
+    captured = capture_queries()
+    target = create_engine(args.database) if args.database else engine
+
+    failures = 0
+    with target.connect() as connection:
+        for name, statement, parameters, ordered in captured:
+            plan = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+            details = [row[-1] for row in plan]
+            scans = [m.group(1) for m in map(FULL_SCAN.match, details) if m]
+            sorted_in_temp = ordered and TEMP_SORT in details
+            mark = "❌" if scans or sorted_in_temp else "✅"
+            print(f"{mark} {name}")
+            for detail in details:
+                print(f"     {detail}")
+            if scans:
+                print(f"     ⚠️ Полное сканирование: {', '.join(scans)}")
+            if sorted_in_temp:
+                print("     ⚠️ Сортировка во временном B-дереве вместо обхода индекса")
+            if scans or sorted_in_temp:
+                failures += 1
+
+    print("=" * 60)
+    if failures:
+        print(f"❌ Запросов с полным сканированием или сортировкой без индекса: {failures} из {len(captured)}")
+        return 1
+    print(f"✅ Все {len(captured)} запросов используют индексы")
+    return 0
+
+
+if __name__ == "__main__":
+    if sys.platform == 'win32':
+        sys.stdout.reconfigure(encoding='utf-8')
+    sys.exit(main())
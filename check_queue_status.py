@@ -15,7 +15,8 @@ try:
         print(f"  Driver {d.id}: status={d.status}, zone={zone}, pending={d.pending_order_id}")
     
     print("\nСостояние очередей:")
-    for zone, queue in queue_manager._queues.items():
+    for zone, info in queue_manager.get_all_queues_info().items():
+        queue = info["drivers"]
         if queue:
             print(f"  {zone}: {len(queue)} водителей {queue}")
         else:
@@ -0,0 +1,50 @@
+"""
+Окружение Alembic: схема из моделей бота, подключение из DATABASE_URL
+"""
+from alembic import context
+
+from database.db import Base, engine
+import bot.models  # noqa: F401  регистрирует все таблицы в Base.metadata
+
+config = context.config
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    """Сгенерировать SQL без подключения к БД (alembic upgrade --sql)"""
+    context.configure(
+        url=str(engine.url),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        render_as_batch=engine.dialect.name == "sqlite",
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    """Применить миграции; при запуске из init_db соединение передаётся готовым"""
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        _run(connection)
+        return
+    
+    with engine.connect() as connection:
+        _run(connection)
+
+
+def _run(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # SQLite не умеет ALTER COLUMN — batch-режим пересоздаёт таблицу
+        render_as_batch=connection.dialect.name == "sqlite",
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
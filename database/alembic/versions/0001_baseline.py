@@ -0,0 +1,233 @@
+"""Базовая схема
+
+Сводит все старые БД к одной точке отсчёта: создаёт недостающие таблицы и
+добавляет колонки, которые раньше добавлялись разовыми скриптами
+(database/migrations/*.py, apply_migration.py, migrate_now.py).
+Что уже есть — не трогается, ошибки ALTER TABLE не подавляются.
+
+Схема записана здесь явно, как она была на момент этой ревизии, а не берётся
+из моделей: последующие изменения моделей вносятся своими миграциями.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from typing import Dict, List, Sequence, Tuple, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from database.schema import has_column, has_table
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _users() -> List[sa.Column]:
+    return [
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("telegram_id", sa.BigInteger(), nullable=False),
+        sa.Column("username", sa.String(), nullable=True),
+        sa.Column("first_name", sa.String(), nullable=True),
+        sa.Column("last_name", sa.String(), nullable=True),
+        sa.Column("phone_number", sa.String(), nullable=True),
+        sa.Column("is_banned", sa.Boolean(), nullable=False),
+        sa.Column("warning_count", sa.Integer(), nullable=False),
+        sa.Column("last_warning_at", sa.DateTime(), nullable=True),
+        sa.Column("role", sa.Enum("CUSTOMER", "DRIVER", "ADMIN", name="userrole"), nullable=False),
+        sa.Column("is_active", sa.Boolean(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+    ]
+
+
+def _drivers(with_pending_fk: bool) -> List[sa.Column]:
+    pending_order = (
+        sa.Column("pending_order_id", sa.Integer(), sa.ForeignKey("orders.id"), nullable=True)
+        if with_pending_fk
+        else sa.Column("pending_order_id", sa.Integer(), nullable=True)
+    )
+    return [
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False, unique=True),
+        sa.Column("car_model", sa.String(), nullable=False),
+        sa.Column("car_number", sa.String(), nullable=False),
+        sa.Column("car_color", sa.String(), nullable=True),
+        sa.Column("license_number", sa.String(), nullable=False),
+        sa.Column("rating", sa.Float(), nullable=True),
+        sa.Column("rating_avg", sa.Float(), nullable=True),
+        sa.Column("rating_count", sa.Integer(), nullable=True),
+        sa.Column("total_rides", sa.Integer(), nullable=True),
+        sa.Column("completed_trips_count", sa.Integer(), nullable=True),
+        sa.Column("is_verified", sa.Boolean(), nullable=True),
+        sa.Column("status", sa.String(18), nullable=False),
+        sa.Column("current_zone", sa.String(11), nullable=False),
+        sa.Column("online_since", sa.DateTime(), nullable=True),
+        pending_order,
+        sa.Column("pending_until", sa.DateTime(), nullable=True),
+        sa.Column("next_finish_zone", sa.String(), nullable=True),
+        sa.Column("eta_to_finish", sa.Integer(), nullable=True),
+        sa.Column("is_online", sa.Boolean(), nullable=True),
+        sa.Column("current_district", sa.String(), nullable=True),
+        sa.Column("district_updated_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+    ]
+
+
+def _orders() -> List[sa.Column]:
+    return [
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("customer_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("driver_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+        sa.Column("zone", sa.String(11), nullable=True),
+        sa.Column("assigned_driver_id", sa.Integer(), sa.ForeignKey("drivers.id"), nullable=True),
+        sa.Column("pickup_district", sa.String(), nullable=True),
+        sa.Column("pickup_address", sa.String(), nullable=False),
+        sa.Column("pickup_latitude", sa.Float(), nullable=True),
+        sa.Column("pickup_longitude", sa.Float(), nullable=True),
+        sa.Column("dropoff_address", sa.String(), nullable=False),
+        sa.Column("dropoff_latitude", sa.Float(), nullable=True),
+        sa.Column("dropoff_longitude", sa.Float(), nullable=True),
+        sa.Column("status", sa.String(19), nullable=False),
+        sa.Column("distance_km", sa.Float(), nullable=True),
+        sa.Column("price", sa.Float(), nullable=False),
+        sa.Column("tariff", sa.String(10), nullable=False),
+        sa.Column("is_intercity", sa.Boolean(), nullable=False),
+        sa.Column("from_zone", sa.String(11), nullable=True),
+        sa.Column("to_text", sa.Text(), nullable=True),
+        sa.Column("selected_driver_id", sa.Integer(), sa.ForeignKey("drivers.id"), nullable=True),
+        sa.Column("is_broadcast", sa.Boolean(), nullable=False),
+        sa.Column("reserved_driver_id", sa.Integer(), sa.ForeignKey("drivers.id"), nullable=True),
+        sa.Column("reserve_expires_at", sa.DateTime(), nullable=True),
+        sa.Column("customer_comment", sa.Text(), nullable=True),
+        sa.Column("rating", sa.Integer(), nullable=True),
+        sa.Column("feedback", sa.Text(), nullable=True),
+        sa.Column("rating_comment", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("accepted_at", sa.DateTime(), nullable=True),
+        sa.Column("arrived_at", sa.DateTime(), nullable=True),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+        sa.Column("completed_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+    ]
+
+
+def _driver_queue() -> List[sa.Column]:
+    return [
+        sa.Column("driver_id", sa.Integer(), sa.ForeignKey("drivers.id"), primary_key=True),
+        sa.Column("zone", sa.String(), nullable=False),
+        sa.Column("online_since", sa.DateTime(), nullable=True),
+        sa.Column("sort_key", sa.DateTime(), nullable=False),
+        sa.Column("enqueued_at", sa.DateTime(), nullable=False),
+    ]
+
+
+def _scheduled_timers() -> List[sa.Column]:
+    return [
+        sa.Column("kind", sa.String(16), primary_key=True),
+        sa.Column("key", sa.Integer(), primary_key=True),
+        sa.Column("order_id", sa.Integer(), nullable=True),
+        sa.Column("handler", sa.String(64), nullable=False),
+        sa.Column("due_at", sa.DateTime(), nullable=False),
+    ]
+
+
+# Индексы, которые создаются вместе с новой таблицей: (имя, колонки, unique)
+TABLE_INDEXES: Dict[str, List[Tuple[str, List[str], bool]]] = {
+    "users": [
+        ("ix_users_id", ["id"], False),
+        ("ix_users_telegram_id", ["telegram_id"], True),
+        ("ix_users_is_banned", ["is_banned"], False),
+        ("ix_users_warning_count", ["warning_count"], False),
+        ("ix_users_last_warning_at", ["last_warning_at"], False),
+    ],
+    "drivers": [
+        ("ix_drivers_id", ["id"], False),
+    ],
+    "orders": [
+        ("ix_orders_id", ["id"], False),
+        ("ix_orders_is_intercity", ["is_intercity"], False),
+        ("ix_orders_is_broadcast", ["is_broadcast"], False),
+    ],
+    "driver_queue": [
+        ("ix_driver_queue_zone_order", ["zone", "sort_key", "driver_id"], False),
+    ],
+    "scheduled_timers": [
+        ("ix_scheduled_timers_due_at", ["due_at"], False),
+    ],
+}
+
+# DEFAULT для колонок, добавляемых в существующую таблицу (чтобы заполнить старые строки)
+BACKFILL_DEFAULTS: Dict[Tuple[str, str], sa.sql.expression.ClauseElement] = {
+    ("users", "is_banned"): sa.false(),
+    ("users", "warning_count"): sa.text("0"),
+    ("users", "role"): sa.text("'CUSTOMER'"),
+    ("users", "is_active"): sa.true(),
+    ("drivers", "rating"): sa.text("5.0"),
+    ("drivers", "rating_avg"): sa.text("0.0"),
+    ("drivers", "rating_count"): sa.text("0"),
+    ("drivers", "total_rides"): sa.text("0"),
+    ("drivers", "completed_trips_count"): sa.text("0"),
+    ("drivers", "is_verified"): sa.false(),
+    ("drivers", "status"): sa.text("'offline'"),
+    ("drivers", "current_zone"): sa.text("'NONE'"),
+    ("drivers", "is_online"): sa.false(),
+    ("orders", "status"): sa.text("'pending'"),
+    ("orders", "tariff"): sa.text("'fixed'"),
+    ("orders", "is_intercity"): sa.false(),
+    ("orders", "is_broadcast"): sa.false(),
+}
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    sqlite = bind.dialect.name == "sqlite"
+
+    # drivers и orders ссылаются друг на друга: вне SQLite внешний ключ
+    # drivers.pending_order_id добавляется после создания orders
+    tables = [
+        ("users", _users),
+        ("drivers", lambda: _drivers(with_pending_fk=sqlite)),
+        ("orders", _orders),
+        ("driver_queue", _driver_queue),
+        ("scheduled_timers", _scheduled_timers),
+    ]
+    created = set()
+    for name, columns in tables:
+        if has_table(bind, name):
+            continue
+        op.create_table(name, *columns())
+        for index_name, index_columns, unique in TABLE_INDEXES[name]:
+            op.create_index(index_name, name, index_columns, unique=unique)
+        created.add(name)
+
+    if not sqlite and "drivers" in created:
+        op.create_foreign_key(
+            "drivers_pending_order_id_fkey", "drivers", "orders", ["pending_order_id"], ["id"]
+        )
+
+    for name, columns in tables:
+        if name in created:
+            continue
+        for column in columns():
+            if has_column(bind, name, column.name):
+                continue
+            # В существующую таблицу колонка добавляется nullable: старые строки
+            # получают DEFAULT, если он был у колонки
+            op.add_column(
+                name,
+                sa.Column(
+                    column.name, column.type, nullable=True,
+                    server_default=BACKFILL_DEFAULTS.get((name, column.name)),
+                ),
+            )
+
+
+def downgrade() -> None:
+    # Базовую схему не откатываем: до неё БД не была под управлением миграций
+    pass
@@ -0,0 +1,33 @@
+"""Статусы заказов в нижнем регистре
+
+Раньше выполнялось при каждом запуске бота (полный проход по orders),
+теперь — один раз.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        UPDATE orders
+        SET status = lower(status)
+        WHERE status IS NOT NULL AND status != lower(status)
+        """
+    )
+
+
+def downgrade() -> None:
+    # Исходный регистр не сохранялся
+    pass
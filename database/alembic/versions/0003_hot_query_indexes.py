@@ -0,0 +1,42 @@
+"""Составные индексы для горячих запросов
+
+- drivers(status, current_zone, pending_order_id, online_since): выборки QueueManager
+- orders(customer_id, status, finished_at): история и активный заказ клиента
+- orders(assigned_driver_id, rating): пересчёт рейтинга и статистика водителя
+
+Проверка планов: python check_query_plans.py
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from database.schema import has_index
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ("ix_drivers_queue_lookup", "drivers", ["status", "current_zone", "pending_order_id", "online_since"]),
+    ("ix_orders_customer_status_finished", "orders", ["customer_id", "status", "finished_at"]),
+    ("ix_orders_driver_rating", "orders", ["assigned_driver_id", "rating"]),
+]
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    for name, table, columns in INDEXES:
+        # Индекс уже есть, если таблица создана по моделям (create_all)
+        if not has_index(bind, table, name):
+            op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    for name, table, _ in INDEXES:
+        op.drop_index(name, table_name=table)
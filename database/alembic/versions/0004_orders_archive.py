@@ -0,0 +1,72 @@
+"""Архив заказов orders_archive
+
+Старые завершённые и отменённые заказы переносятся из orders в orders_archive
+(OrderArchiveService), чтобы живая таблица оставалась маленькой.
+Колонки повторяют orders на момент этой ревизии, без внешних ключей.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from database.schema import has_table
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if has_table(bind, "orders_archive"):
+        return
+
+    op.create_table(
+        "orders_archive",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("customer_id", sa.Integer(), nullable=False),
+        sa.Column("driver_id", sa.Integer(), nullable=True),
+        sa.Column("zone", sa.String(11), nullable=True),
+        sa.Column("assigned_driver_id", sa.Integer(), nullable=True),
+        sa.Column("pickup_district", sa.String(), nullable=True),
+        sa.Column("pickup_address", sa.String(), nullable=False),
+        sa.Column("pickup_latitude", sa.Float(), nullable=True),
+        sa.Column("pickup_longitude", sa.Float(), nullable=True),
+        sa.Column("dropoff_address", sa.String(), nullable=False),
+        sa.Column("dropoff_latitude", sa.Float(), nullable=True),
+        sa.Column("dropoff_longitude", sa.Float(), nullable=True),
+        sa.Column("status", sa.String(19), nullable=False),
+        sa.Column("distance_km", sa.Float(), nullable=True),
+        sa.Column("price", sa.Float(), nullable=False),
+        sa.Column("tariff", sa.String(10), nullable=False),
+        sa.Column("is_intercity", sa.Boolean(), nullable=False),
+        sa.Column("from_zone", sa.String(11), nullable=True),
+        sa.Column("to_text", sa.Text(), nullable=True),
+        sa.Column("selected_driver_id", sa.Integer(), nullable=True),
+        sa.Column("is_broadcast", sa.Boolean(), nullable=False),
+        sa.Column("reserved_driver_id", sa.Integer(), nullable=True),
+        sa.Column("reserve_expires_at", sa.DateTime(), nullable=True),
+        sa.Column("customer_comment", sa.Text(), nullable=True),
+        sa.Column("rating", sa.Integer(), nullable=True),
+        sa.Column("feedback", sa.Text(), nullable=True),
+        sa.Column("rating_comment", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("accepted_at", sa.DateTime(), nullable=True),
+        sa.Column("arrived_at", sa.DateTime(), nullable=True),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+        sa.Column("completed_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_orders_archive_customer_finished", "orders_archive", ["customer_id", "finished_at"])
+    op.create_index("ix_orders_archive_driver_finished", "orders_archive", ["assigned_driver_id", "finished_at"])
+
+
+def downgrade() -> None:
+    op.drop_table("orders_archive")
@@ -0,0 +1,51 @@
+"""Индексы keyset-пагинации истории заказов
+
+История клиента и водителя листается по курсору (finished_at, id), поэтому
+индексам нужны ровно эти колонки после владельца заказа. Архивные индексы
+(customer_id, finished_at) заменяются на такие же с id.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from database.schema import has_index
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ("ix_orders_customer_history", "orders", ["customer_id", "finished_at", "id"]),
+    ("ix_orders_driver_history", "orders", ["assigned_driver_id", "finished_at", "id"]),
+    ("ix_orders_archive_customer_history", "orders_archive", ["customer_id", "finished_at", "id"]),
+    ("ix_orders_archive_driver_history", "orders_archive", ["assigned_driver_id", "finished_at", "id"]),
+]
+
+REPLACED = [
+    ("ix_orders_archive_customer_finished", "orders_archive", ["customer_id", "finished_at"]),
+    ("ix_orders_archive_driver_finished", "orders_archive", ["assigned_driver_id", "finished_at"]),
+]
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    for name, table, _ in REPLACED:
+        if has_index(bind, table, name):
+            op.drop_index(name, table_name=table)
+    for name, table, columns in INDEXES:
+        # Индекс уже есть, если таблица создана по моделям (create_all)
+        if not has_index(bind, table, name):
+            op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    for name, table, _ in INDEXES:
+        op.drop_index(name, table_name=table)
+    for name, table, columns in REPLACED:
+        op.create_index(name, table, columns)
@@ -0,0 +1,58 @@
+"""Сумма оценок водителя для инкрементального рейтинга
+
+drivers.rating_sum хранит сумму оценок, rating_avg = rating_sum / rating_count.
+Сумма и количество заполняются по оценкам в orders и orders_archive.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from database.schema import has_column
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if not has_column(bind, "drivers", "rating_sum"):
+        op.add_column("drivers", sa.Column("rating_sum", sa.Integer(), nullable=True, server_default=sa.text("0")))
+
+    rated = sa.union_all(*(
+        sa.select(sa.column("assigned_driver_id").label("driver_id"), sa.column("rating"))
+        .select_from(sa.table(table))
+        .where(sa.column("assigned_driver_id").isnot(None), sa.column("rating").isnot(None))
+        for table in ("orders", "orders_archive")
+    )).subquery()
+    totals = bind.execute(
+        sa.select(rated.c.driver_id, sa.func.sum(rated.c.rating), sa.func.count(rated.c.rating))
+        .group_by(rated.c.driver_id)
+    ).all()
+
+    drivers = sa.table(
+        "drivers", sa.column("id"), sa.column("rating_sum"), sa.column("rating_count"), sa.column("rating_avg")
+    )
+    bind.execute(drivers.update().values(rating_sum=0, rating_count=0, rating_avg=0.0))
+    for driver_id, rating_sum, rating_count in totals:
+        bind.execute(
+            drivers.update()
+            .where(drivers.c.id == driver_id)
+            .values(
+                rating_sum=int(rating_sum),
+                rating_count=rating_count,
+                rating_avg=round(int(rating_sum) / rating_count, 2),
+            )
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("drivers") as batch:
+        batch.drop_column("rating_sum")
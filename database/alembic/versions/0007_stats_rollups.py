@@ -0,0 +1,123 @@
+"""Свёрнутая статистика заказов stats_rollups
+
+Счётчики по часам, суткам и за всё время (в целом, по зонам и по водителям)
+обновляются событиями заказов; здесь таблица создаётся и заполняется по
+истории из orders и orders_archive. Правила пересчёта повторяют
+StatsService.rebuild на момент этой ревизии, но записаны здесь же, чтобы
+миграция не зависела от кода бота.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from bot.config import settings
+from database.schema import has_table
+
+# revision identifiers, used by Alembic.
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ALL_TIME_BUCKET = datetime(1970, 1, 1)
+COUNTERS = ("orders", "completed", "cancelled", "expired", "revenue")
+COMPLETED_STATUSES = ("finished", "completed")
+CANCELLED_STATUSES = ("cancelled", "cancelled_by_client", "cancelled_by_driver")
+
+
+def _history(bind, table_name: str):
+    table = sa.table(
+        table_name,
+        sa.column("zone", sa.String()),
+        sa.column("is_intercity", sa.Boolean()),
+        sa.column("assigned_driver_id", sa.Integer()),
+        sa.column("status", sa.String()),
+        sa.column("price", sa.Float()),
+        sa.column("created_at", sa.DateTime()),
+        sa.column("finished_at", sa.DateTime()),
+        sa.column("completed_at", sa.DateTime()),
+        sa.column("updated_at", sa.DateTime()),
+    )
+    return bind.execute(sa.select(*table.c).execution_options(yield_per=1000))
+
+
+def _backfill(bind) -> None:
+    offset = timedelta(hours=settings.stats_utc_offset_hours)
+    now = datetime.utcnow()
+    totals = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+
+    def _add(order, counter, at, driver_id, revenue=0.0):
+        local = (at or order.created_at or now) + offset
+        if order.zone:
+            zone = order.zone
+        else:
+            zone = "INTERCITY" if order.is_intercity else "NONE"
+        buckets = (
+            ("hour", local.replace(minute=0, second=0, microsecond=0)),
+            ("day", local.replace(hour=0, minute=0, second=0, microsecond=0)),
+            ("all", ALL_TIME_BUCKET),
+        )
+        for period, bucket in buckets:
+            keys = [(period, bucket, "total", ""), (period, bucket, "zone", zone)]
+            if driver_id:
+                keys.append((period, bucket, "driver", str(driver_id)))
+            for key in keys:
+                totals[key][counter] += 1
+                totals[key]["revenue"] += revenue
+
+    for table_name in ("orders", "orders_archive"):
+        for order in _history(bind, table_name):
+            _add(order, "orders", order.created_at, None)
+            if order.status in COMPLETED_STATUSES:
+                _add(
+                    order, "completed", order.finished_at or order.completed_at,
+                    order.assigned_driver_id, float(order.price or 0),
+                )
+            elif order.status in CANCELLED_STATUSES:
+                _add(order, "cancelled", order.updated_at, order.assigned_driver_id)
+            elif order.status == "expired":
+                _add(order, "expired", order.updated_at, order.assigned_driver_id)
+
+    rollups = sa.table(
+        "stats_rollups",
+        sa.column("period", sa.String()),
+        sa.column("bucket", sa.DateTime()),
+        sa.column("scope", sa.String()),
+        sa.column("key", sa.String()),
+        *(sa.column(name) for name in COUNTERS),
+    )
+    bind.execute(rollups.delete())
+    if totals:
+        bind.execute(rollups.insert(), [
+            {"period": period, "bucket": bucket, "scope": scope, "key": key, **counters}
+            for (period, bucket, scope, key), counters in totals.items()
+        ])
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if not has_table(bind, "stats_rollups"):
+        op.create_table(
+            "stats_rollups",
+            sa.Column("period", sa.String(8), primary_key=True),
+            sa.Column("bucket", sa.DateTime(), primary_key=True),
+            sa.Column("scope", sa.String(8), primary_key=True),
+            sa.Column("key", sa.String(32), primary_key=True),
+            sa.Column("orders", sa.Integer(), nullable=False),
+            sa.Column("completed", sa.Integer(), nullable=False),
+            sa.Column("cancelled", sa.Integer(), nullable=False),
+            sa.Column("expired", sa.Integer(), nullable=False),
+            sa.Column("revenue", sa.Float(), nullable=False),
+        )
+    _backfill(bind)
+
+
+def downgrade() -> None:
+    op.drop_table("stats_rollups")
@@ -0,0 +1,65 @@
+"""AUTOINCREMENT для orders.id
+
+Без AUTOINCREMENT SQLite выдаёт новому заказу max(id) + 1 по живой таблице,
+поэтому после архивации самых новых заказов их id достаются новым заказам,
+а в orders_archive уже лежат строки с теми же id. Таблица orders
+пересоздаётся с AUTOINCREMENT, счётчик ставится на максимум из orders
+и orders_archive. В PostgreSQL последовательность только подтягивается.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from database.schema import has_table
+
+# revision identifiers, used by Alembic.
+revision: str = "0008"
+down_revision: Union[str, None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _max_order_id(bind) -> int:
+    tables = ["orders"] + (["orders_archive"] if has_table(bind, "orders_archive") else [])
+    return max(
+        bind.execute(sa.text(f"SELECT COALESCE(MAX(id), 0) FROM {table}")).scalar() or 0
+        for table in tables
+    )
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    dialect = bind.dialect.name
+
+    if dialect == "sqlite":
+        table_sql = bind.execute(
+            sa.text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'orders'")
+        ).scalar() or ""
+        if "AUTOINCREMENT" not in table_sql.upper():
+            with op.batch_alter_table(
+                "orders", recreate="always", table_kwargs={"sqlite_autoincrement": True}
+            ):
+                pass
+        high_water = _max_order_id(bind)
+        bind.execute(sa.text("DELETE FROM sqlite_sequence WHERE name = 'orders'"))
+        bind.execute(
+            sa.text("INSERT INTO sqlite_sequence (name, seq) VALUES ('orders', :seq)"),
+            {"seq": high_water},
+        )
+    elif dialect == "postgresql":
+        high_water = _max_order_id(bind)
+        if high_water:
+            bind.execute(
+                sa.text("SELECT setval(pg_get_serial_sequence('orders', 'id'), :seq)"),
+                {"seq": high_water},
+            )
+
+
+def downgrade() -> None:
+    # Откат вернул бы переиспользование id — оставляем AUTOINCREMENT
+    pass
@@ -1,21 +1,129 @@
 """
 Настройка базы данных
 """
-from sqlalchemy import create_engine, text
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, Iterator, Optional, TypeVar
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from bot.config import settings
 
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+T = TypeVar("T")
+
+# Асинхронные драйверы для каждого диалекта
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def _split_drivername(url: str):
+    dialect, _, driver = make_url(url).drivername.partition("+")
+    return ("postgresql" if dialect == "postgres" else dialect), driver
+
+
+def is_async_url(url: str) -> bool:
+    """DATABASE_URL с асинхронным драйвером: sqlite+aiosqlite://, postgresql+asyncpg://"""
+    dialect, driver = _split_drivername(url)
+    return bool(driver) and driver == ASYNC_DRIVERS.get(dialect)
+
+
+def sync_database_url(url: str) -> str:
+    """URL для синхронного движка (асинхронный драйвер заменяется на стандартный)"""
+    if not is_async_url(url):
+        return url
+    dialect, _ = _split_drivername(url)
+    return make_url(url).set(drivername=dialect).render_as_string(hide_password=False)
+
+
+def async_database_url(url: str) -> str:
+    """URL для асинхронного движка: sqlite → aiosqlite, postgresql → asyncpg"""
+    dialect, _ = _split_drivername(url)
+    if dialect not in ASYNC_DRIVERS:
+        raise ValueError(f"Нет асинхронного драйвера для {dialect}")
+    return make_url(url).set(
+        drivername=f"{dialect}+{ASYNC_DRIVERS[dialect]}"
+    ).render_as_string(hide_password=False)
+
+
+# Асинхронный слой включается асинхронным драйвером в DATABASE_URL
+ASYNC_DB_ENABLED = is_async_url(settings.database_url)
+DATABASE_URL = sync_database_url(settings.database_url)
+
 # Создание движка БД
 engine = create_engine(
-    settings.database_url,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {},
+    DATABASE_URL,
+    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
     echo=settings.debug
 )
 
 # Создание сессии
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Счётчики пула соединений: сколько раз соединение выдано и возвращено
+_pool_stats: Dict[str, int] = {"checkouts": 0, "checkins": 0}
+
+
+@event.listens_for(engine, "checkout")
+def _on_pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    _pool_stats["checkouts"] += 1
+
+
+@event.listens_for(engine, "checkin")
+def _on_pool_checkin(dbapi_connection, connection_record):
+    _pool_stats["checkins"] += 1
+
+
+def get_pool_stats() -> Dict[str, int]:
+    """Статистика пула: выдачи, возвраты и соединения на руках"""
+    return {
+        "checkouts": _pool_stats["checkouts"],
+        "checkins": _pool_stats["checkins"],
+        "in_use": _pool_stats["checkouts"] - _pool_stats["checkins"],
+    }
+
+
+# Счётчик запросов текущей единицы работы (обновления Telegram), см. count_queries()
+_query_counter: ContextVar[Optional[Dict[str, float]]] = ContextVar("query_counter", default=None)
+
+
+def _on_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started_at = time.perf_counter()
+
+
+def _on_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    counter = _query_counter.get()
+    if counter is not None:
+        counter["queries"] += 1
+        counter["db_time"] += time.perf_counter() - context._query_started_at
+
+
+def _install_query_counter(sync_engine):
+    event.listen(sync_engine, "before_cursor_execute", _on_before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _on_after_cursor_execute)
+
+
+_install_query_counter(engine)
+
+
+@contextmanager
+def count_queries() -> Iterator[Dict[str, float]]:
+    """
+    Считать запросы и время в БД внутри блока (в том числе в вызванных корутинах)
+
+    Возвращает словарь {"queries": N, "db_time": секунды}, заполняемый по ходу работы.
+    """
+    counter = {"queries": 0, "db_time": 0.0}
+    token = _query_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_counter.reset(token)
+
 # Базовый класс для моделей
 Base = declarative_base()
 
@@ -29,25 +137,110 @@ def get_db() -> Session:
         db.close()
 
 
-def init_db():
-    """Инициализация базы данных"""
-    # Импортируем все модели
-    from bot.models import User, Driver, Order
-    
-    # Создаем таблицы
-    Base.metadata.create_all(bind=engine)
-    
-    # Нормализуем значения статусов заказов (поддержка старых данных)
-    with engine.begin() as connection:
-        connection.execute(
-            text(
-                """
-                UPDATE orders
-                SET status = lower(status)
-                WHERE status IS NOT NULL AND status != lower(status)
-                """
-            )
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    """
+    Короткоживущая сессия на одну единицу работы (например, срабатывание таймера)
+    Коммит при успехе, откат при ошибке, соединение возвращается в пул сразу
+    """
+    db = SessionLocal()
+    try:
+        yield db
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+# Асинхронный движок создаётся при первом обращении: драйвер (aiosqlite/asyncpg)
+# нужен только при включённом асинхронном слое
+_async_engine = None
+_async_session_factory = None
+
+
+def get_async_engine():
+    """Асинхронный движок для того же DATABASE_URL"""
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        _async_engine = create_async_engine(
+            async_database_url(settings.database_url),
+            echo=settings.debug,
         )
+        _install_query_counter(_async_engine.sync_engine)
+    return _async_engine
+
+
+def get_async_sessionmaker():
+    """Фабрика AsyncSession (объекты не протухают после commit)"""
+    global _async_session_factory
+    if _async_session_factory is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        _async_session_factory = async_sessionmaker(
+            get_async_engine(), autoflush=False, expire_on_commit=False
+        )
+    return _async_session_factory
+
+
+@asynccontextmanager
+async def async_session_scope() -> AsyncIterator["AsyncSession"]:
+    """Асинхронная сессия на одну единицу работы: коммит при успехе, откат при ошибке"""
+    session = get_async_sessionmaker()()
+    try:
+        yield session
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+
+async def run_in_session(fn: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Выполнить синхронную функцию fn(db, *args, **kwargs) в отдельной сессии
+
+    С асинхронным драйвером fn работает через AsyncSession.run_sync: код сервисов
+    остаётся прежним, а ожидание БД не блокирует event loop. Без него —
+    обычная session_scope() (поведение как раньше).
+    Объекты, возвращённые из fn, отсоединены от сессии: связи нужно загрузить внутри fn.
+    """
+    if not ASYNC_DB_ENABLED:
+        with session_scope() as db:
+            result = fn(db, *args, **kwargs)
+            db.expunge_all()
+            return result
     
-    print("✅ База данных инициализирована")
+    async with async_session_scope() as session:
+        result = await session.run_sync(fn, *args, **kwargs)
+        session.expunge_all()
+        return result
+
+
+async def dispose_async_engine():
+    """Закрыть соединения асинхронного движка (при остановке бота)"""
+    global _async_engine, _async_session_factory
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    _async_engine = None
+    _async_session_factory = None
 
+
+def init_db():
+    """
+    Инициализация базы данных
+
+    Проверяет версию схемы (одна строка alembic_version) и применяет только
+    недостающие миграции; пустая БД создаётся по моделям.
+    """
+    from database.schema import ensure_schema
+    
+    result = ensure_schema(engine)
+    if result == "created":
+        print("✅ База данных создана")
+    elif result == "upgraded":
+        print("✅ Схема базы данных обновлена")
+    else:
+        print("✅ База данных инициализирована")
@@ -0,0 +1,82 @@
+"""
+Версия схемы БД и применение миграций (Alembic)
+
+Версия хранится в таблице alembic_version. При запуске бота init_db() сравнивает
+её с последней миграцией в database/alembic/versions: совпадает — больше ничего
+не делается (одна выборка из одной строки, независимо от размера таблиц);
+отстаёт — применяются только недостающие миграции, каждая ровно один раз.
+"""
+from pathlib import Path
+from typing import Optional
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection, Engine
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+def alembic_config(connection: Optional[Connection] = None) -> Config:
+    """Конфигурация Alembic, не зависящая от текущего каталога"""
+    config = Config(str(ROOT_DIR / "alembic.ini"))
+    config.set_main_option("script_location", str(ROOT_DIR / "database" / "alembic"))
+    if connection is not None:
+        config.attributes["connection"] = connection
+    return config
+
+
+def get_head_revision() -> Optional[str]:
+    """Последняя миграция в репозитории"""
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+def get_current_revision(connection: Connection) -> Optional[str]:
+    """Версия схемы в БД (None — БД ещё не под управлением миграций)"""
+    return MigrationContext.configure(connection).get_current_revision()
+
+
+def ensure_schema(engine: Engine) -> str:
+    """
+    Привести схему БД к последней версии
+
+    Returns:
+        "current" — схема актуальна, "created" — пустая БД создана по моделям,
+        "upgraded" — применены недостающие миграции
+    """
+    head = get_head_revision()
+    with engine.connect() as connection:
+        current = get_current_revision(connection)
+    if current == head:
+        return "current"
+
+    from database.db import Base
+    import bot.models  # noqa: F401  регистрирует все таблицы в Base.metadata
+
+    with engine.begin() as connection:
+        config = alembic_config(connection)
+        if current is None and not inspect(connection).has_table("users"):
+            # Новая БД: схема по моделям уже соответствует последней миграции
+            Base.metadata.create_all(bind=connection)
+            command.stamp(config, "head")
+            return "created"
+        command.upgrade(config, "head")
+    return "upgraded"
+
+
+# ==================== ПОМОЩНИКИ ДЛЯ МИГРАЦИЙ ====================
+# Старые БД доводились разовыми скриптами по-разному, поэтому миграции
+# проверяют, что именно уже есть, вместо того чтобы глотать ошибки ALTER TABLE.
+
+def has_table(connection: Connection, table: str) -> bool:
+    return inspect(connection).has_table(table)
+
+
+def has_column(connection: Connection, table: str, column: str) -> bool:
+    return column in {c["name"] for c in inspect(connection).get_columns(table)}
+
+
+def has_index(connection: Connection, table: str, index: str) -> bool:
+    return index in {ix["name"] for ix in inspect(connection).get_indexes(table)}
@@ -49,7 +49,7 @@ def fix_stuck_pending_orders():
                     # Возвращаем в очередь
                     zone = driver.current_zone.value if hasattr(driver.current_zone, 'value') else driver.current_zone
                     if zone and zone != "NONE":
-                        queue_manager.add_driver(driver.id, zone, db)
+                        queue_manager.add_driver(driver.id, zone, db, online_since=driver.online_since)
                 fixed_count += 1
             else:
                 print(f"  Водитель {driver.id}: заказ {order_id} в статусе {order.status} - оставляем как есть")
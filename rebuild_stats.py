@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Пересчёт свёрнутой статистики заказов (stats_rollups) по истории
+
+Обычно статистика обновляется событиями заказов и пересчёт не нужен.
+Скрипт — для восстановления после ручных правок заказов в БД или смены
+STATS_UTC_OFFSET_HOURS.
+
+Использование:
+    python rebuild_stats.py
+"""
+import sys
+
+from database.db import session_scope
+from bot.services.stats_service import StatsService
+
+
+def main() -> int:
+    with session_scope() as db:
+        rows = StatsService.rebuild(db)
+    print(f"✅ Статистика пересчитана: {rows} строк")
+    return 0
+
+
+if __name__ == "__main__":
+    if sys.platform == 'win32':
+        sys.stdout.reconfigure(encoding='utf-8')
+    sys.exit(main())
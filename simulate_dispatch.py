@@ -0,0 +1,415 @@
+"""
+Симулятор распределения заказов
+
+Прогоняет OrderDispatcher, QueueManager, Scheduler и BroadcastService на SQLite
+в памяти с фейковым Bot и виртуальными часами: 30-секундные и 180-секундные
+таймауты отрабатываются без реального ожидания. Водители ведут себя по
+сценарию (вероятности принять / отклонить / промолчать по зонам).
+
+В конце печатается отчёт: p50/p95/p99 времени до принятия заказа,
+запросы к БД на заказ и число отправленных сообщений.
+
+Использование:
+    python simulate_dispatch.py --drivers 3 --orders-per-hour 40 --hours 2
+    python simulate_dispatch.py --cascade --profile profile.json --seed 7
+
+profile.json — вероятности по зонам, остаток до 1 — водитель молчит (таймаут):
+    {"DEMA": {"accept": 0.5, "decline": 0.2}, "*": {"accept": 0.7, "decline": 0.1}}
+"""
+import os
+
+# До импорта бота: БД в памяти, журнал очередей не нужен
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["QUEUE_JOURNAL_PATH"] = ""
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:simulator")
+
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import logging
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, func
+
+from database.db import Base, engine, session_scope
+from bot.config import settings
+from bot.constants import ZONES, ORDER_GLOBAL_TIMEOUT
+from bot.models import User, UserRole, Driver, DriverStatus, Order, OrderStatus
+from bot.services.broadcast_service import BroadcastService
+from bot.services.order_dispatcher import init_dispatcher, get_dispatcher
+from bot.services.queue_manager import queue_manager
+from bot.services.scheduler import scheduler
+from bot.utils.clock import set_clock
+
+# Условное начало смены в виртуальном времени
+SIM_EPOCH = datetime(2025, 1, 1, 8, 0, 0)
+
+DEFAULT_BEHAVIOR = {"accept": 0.7, "decline": 0.1}
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """
+    Цикл событий с виртуальным временем
+
+    Когда все задачи ждут таймеров, цикл не спит, а сдвигает часы сразу
+    к ближайшему таймеру. Работа с БД выполняется по-настоящему, но
+    виртуальное время на неё не тратится.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._virtual_now = 0.0
+        select = self._selector.select
+
+        def virtual_select(timeout=None):
+            if timeout is not None and timeout > 0:
+                self._virtual_now += timeout
+            return select(0)
+
+        self._selector.select = virtual_select
+
+    def time(self) -> float:
+        return self._virtual_now
+
+
+class SimBot:
+    """Фейковый Bot: считает сообщения и передаёт предложения заказов водителям-ботам"""
+
+    def __init__(self, sim: "DispatchSimulation"):
+        self.sim = sim
+        self._message_ids = itertools.count(1)
+        self.to_drivers = 0
+        self.to_customers = 0
+        self.edits = 0
+
+    async def send_message(self, chat_id, text=None, parse_mode=None, reply_markup=None, **kwargs):
+        message_id = next(self._message_ids)
+        if chat_id in self.sim.drivers_by_chat:
+            self.to_drivers += 1
+        else:
+            self.to_customers += 1
+
+        callback_data = None
+        if reply_markup is not None and hasattr(reply_markup, "inline_keyboard"):
+            for row in reply_markup.inline_keyboard:
+                for button in row:
+                    if button.callback_data:
+                        callback_data = button.callback_data
+                        break
+                if callback_data:
+                    break
+        if callback_data:
+            self.sim.on_offer(chat_id, message_id, callback_data)
+
+        return SimpleNamespace(chat_id=chat_id, message_id=message_id)
+
+    async def edit_message_text(self, text=None, chat_id=None, message_id=None, **kwargs):
+        self.edits += 1
+        self.sim.on_withdraw(chat_id, message_id)
+
+
+class DispatchSimulation:
+    """Сценарий смены: водители, поток заказов, поведение водителей"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.profile: Dict[str, Dict[str, float]] = {}
+        if args.profile:
+            with open(args.profile, "r", encoding="utf-8") as fp:
+                self.profile = json.load(fp)
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.bot = SimBot(self)
+        self.drivers_by_chat: Dict[int, Tuple[int, str]] = {}
+        self.customer_ids: List[int] = []
+
+        # {order_id: виртуальное время создания}
+        self.created_at: Dict[int, float] = {}
+        # {order_id: секунд до принятия}
+        self.time_to_accept: Dict[int, float] = {}
+        # Реакции водителей на ещё не отозванные предложения: {(chat_id, message_id): handle}
+        self.pending_reactions: Dict[Tuple[int, int], asyncio.TimerHandle] = {}
+        self.tasks = set()
+
+        self.queries = 0
+        self.orders_total = 0
+        self.broadcast_orders = 0
+
+    # --- Подготовка ---
+
+    def now(self) -> datetime:
+        return SIM_EPOCH + timedelta(seconds=self.loop.time())
+
+    def behavior(self, zone: Optional[str]) -> Dict[str, float]:
+        return self.profile.get(zone or "", self.profile.get("*", DEFAULT_BEHAVIOR))
+
+    def seed_database(self):
+        Base.metadata.create_all(bind=engine)
+        telegram_ids = itertools.count(100000)
+        with session_scope() as db:
+            for zone in ZONES:
+                for index in range(self.args.drivers):
+                    user = User(
+                        telegram_id=next(telegram_ids),
+                        first_name=f"Водитель {zone} {index + 1}",
+                        role=UserRole.DRIVER,
+                    )
+                    db.add(user)
+                    db.flush()
+                    driver = Driver(
+                        user_id=user.id,
+                        car_model="Sim",
+                        car_number=f"S{user.id:03d}",
+                        license_number="SIM",
+                        is_verified=True,
+                        status=DriverStatus.ONLINE,
+                        current_zone=zone,
+                        online_since=self.now() - timedelta(minutes=index + 1),
+                    )
+                    db.add(driver)
+                    db.flush()
+                    self.drivers_by_chat[user.telegram_id] = (driver.id, zone)
+
+            for index in range(self.args.customers):
+                customer = User(
+                    telegram_id=next(telegram_ids),
+                    first_name=f"Клиент {index + 1}",
+                    role=UserRole.CUSTOMER,
+                )
+                db.add(customer)
+                db.flush()
+                self.customer_ids.append(customer.id)
+
+        with session_scope() as db:
+            queue_manager.rebuild_from_db(db)
+
+    # --- Поток заказов ---
+
+    def spawn(self, coro):
+        task = self.loop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def generate_orders(self):
+        duration = self.args.hours * 3600
+        rate = self.args.orders_per_hour / 3600.0
+        while True:
+            await asyncio.sleep(self.rng.expovariate(rate))
+            if self.loop.time() >= duration:
+                return
+            self.spawn(self.create_order())
+
+    async def create_order(self):
+        is_broadcast = self.rng.random() < self.args.broadcast_share
+        zone = self.rng.choice(ZONES)
+        with session_scope() as db:
+            order = Order(
+                customer_id=self.rng.choice(self.customer_ids),
+                zone=None if is_broadcast else zone,
+                pickup_district="Аэропорт" if is_broadcast else zone,
+                pickup_address="Симуляция, 1",
+                dropoff_address="Симуляция, 2",
+                price=300.0,
+                status=OrderStatus.NEW,
+                is_broadcast=is_broadcast,
+                created_at=self.now(),
+            )
+            db.add(order)
+            db.commit()
+            self.orders_total += 1
+            self.created_at[order.id] = self.loop.time()
+
+            if is_broadcast:
+                self.broadcast_orders += 1
+                await BroadcastService.send_broadcast(db, order, self.bot, None)
+            else:
+                await get_dispatcher().create_and_dispatch_order(order.id, db)
+
+    # --- Поведение водителей ---
+
+    def on_offer(self, chat_id: int, message_id: int, callback_data: str):
+        if chat_id not in self.drivers_by_chat:
+            return
+        action, _, order_id = callback_data.partition(":")
+        if action not in ("order_accept", "broadcast_accept") or not order_id.isdigit():
+            return
+        driver_id, zone = self.drivers_by_chat[chat_id]
+
+        probabilities = self.behavior(zone)
+        roll = self.rng.random()
+        if roll < probabilities.get("accept", 0.0):
+            reaction = action
+        elif action == "order_accept" and roll < probabilities.get("accept", 0.0) + probabilities.get("decline", 0.0):
+            reaction = "order_decline"
+        else:
+            # Молчит — сработает таймаут
+            return
+
+        delay = self.rng.uniform(self.args.min_response, self.args.max_response)
+        handle = self.loop.call_later(
+            delay, lambda: self.spawn(self.react(chat_id, message_id, reaction, driver_id, int(order_id)))
+        )
+        self.pending_reactions[(chat_id, message_id)] = handle
+
+    def on_withdraw(self, chat_id: int, message_id: int):
+        # Предложение отозвано — кнопки больше нет, водитель не успел ответить
+        handle = self.pending_reactions.pop((chat_id, message_id), None)
+        if handle is not None:
+            handle.cancel()
+
+    async def react(self, chat_id: int, message_id: int, reaction: str, driver_id: int, order_id: int):
+        self.pending_reactions.pop((chat_id, message_id), None)
+        dispatcher = get_dispatcher()
+        accepted = False
+        with session_scope() as db:
+            if reaction == "order_accept":
+                accepted = await dispatcher.handle_driver_accept(driver_id, order_id, db)
+            elif reaction == "order_decline":
+                await dispatcher.handle_driver_decline(driver_id, order_id, db)
+            elif reaction == "broadcast_accept":
+                driver = db.query(Driver).filter(Driver.id == driver_id).first()
+                accepted, _ = await BroadcastService.accept_broadcast_order(db, order_id, driver, self.bot, None)
+
+        if accepted and order_id not in self.time_to_accept:
+            self.time_to_accept[order_id] = self.loop.time() - self.created_at[order_id]
+            trip_seconds = self.rng.expovariate(1.0 / (self.args.trip_minutes * 60))
+            self.loop.call_later(trip_seconds, lambda: self.spawn(self.finish_trip(driver_id, order_id)))
+
+    async def finish_trip(self, driver_id: int, order_id: int):
+        """Поездка завершена — водитель снова на линии в хвосте очереди своей зоны"""
+        with session_scope() as db:
+            order = db.query(Order).filter(Order.id == order_id).first()
+            order.status = OrderStatus.FINISHED
+            order.finished_at = self.now()
+
+            driver = db.query(Driver).filter(Driver.id == driver_id).first()
+            driver.status = DriverStatus.ONLINE
+            driver.online_since = self.now()
+            db.commit()
+
+            zone = driver.current_zone.value if hasattr(driver.current_zone, "value") else driver.current_zone
+            queue_manager.add_driver(driver_id, zone, db, online_since=driver.online_since)
+            # Как при выходе на линию в боте: ожидающие заказы зоны — сразу ему
+            await get_dispatcher().match_waiting_orders(zone, db)
+
+    # --- Прогон ---
+
+    def _count_query(self, *args, **kwargs):
+        self.queries += 1
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        set_clock(self.now)
+        init_dispatcher(self.bot)
+        self.seed_database()
+
+        event.listen(engine, "before_cursor_execute", self._count_query)
+        try:
+            await self.generate_orders()
+            # Даём догореть таймаутам и fallback последних заказов
+            await asyncio.sleep(ORDER_GLOBAL_TIMEOUT + self.args.max_response + 60)
+        finally:
+            event.remove(engine, "before_cursor_execute", self._count_query)
+            await scheduler.cancel_all()
+            for task in list(self.tasks):
+                task.cancel()
+            set_clock(None)
+
+    def report(self) -> str:
+        with session_scope() as db:
+            statuses = dict(
+                db.query(Order.status, func.count(Order.id)).group_by(Order.status).all()
+            )
+
+        samples = sorted(self.time_to_accept.values())
+        orders = max(1, self.orders_total)
+        messages = self.bot.to_drivers + self.bot.to_customers
+
+        lines = [
+            "=" * 60,
+            "РЕЗУЛЬТАТЫ СИМУЛЯЦИИ",
+            "=" * 60,
+            f"Режим: {'каскад' if settings.dispatch_cascade_enabled else 'по одному водителю'}, "
+            f"водителей в зоне: {self.args.drivers}, зон: {len(ZONES)}, "
+            f"заказов/час: {self.args.orders_per_hour}, часов: {self.args.hours}",
+            f"Заказов: {self.orders_total} (broadcast: {self.broadcast_orders}), "
+            f"принято: {len(samples)} ({len(samples) / orders:.0%})",
+            "Статусы: " + ", ".join(
+                f"{status.value if hasattr(status, 'value') else status}={count}"
+                for status, count in sorted(statuses.items(), key=lambda item: str(item[0]))
+            ),
+        ]
+        if samples:
+            lines.append(
+                "Время до принятия, с: "
+                f"p50={percentile(samples, 50):.1f} p95={percentile(samples, 95):.1f} "
+                f"p99={percentile(samples, 99):.1f} max={samples[-1]:.1f}"
+            )
+        else:
+            lines.append("Время до принятия: нет принятых заказов")
+        lines.extend([
+            f"Запросов к БД: {self.queries} ({self.queries / orders:.1f} на заказ)",
+            f"Сообщений: {messages} (водителям {self.bot.to_drivers}, клиентам {self.bot.to_customers}), "
+            f"правок {self.bot.edits}; {messages / orders:.1f} на заказ",
+            "=" * 60,
+        ])
+        return "\n".join(lines)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Перцентиль по методу ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values) + 0.4999)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Симулятор распределения заказов")
+    parser.add_argument("--drivers", type=int, default=3, help="водителей на линии в каждой зоне")
+    parser.add_argument("--customers", type=int, default=200, help="клиентов в базе")
+    parser.add_argument("--orders-per-hour", type=float, default=40.0, help="интенсивность заказов")
+    parser.add_argument("--hours", type=float, default=2.0, help="длительность смены")
+    parser.add_argument("--broadcast-share", type=float, default=0.0, help="доля broadcast-заказов (0..1)")
+    parser.add_argument("--trip-minutes", type=float, default=20.0, help="средняя длительность поездки")
+    parser.add_argument("--min-response", type=float, default=2.0, help="мин. время ответа водителя, с")
+    parser.add_argument("--max-response", type=float, default=20.0, help="макс. время ответа водителя, с")
+    parser.add_argument("--profile", help="JSON с вероятностями accept/decline по зонам")
+    parser.add_argument("--cascade", action="store_true", help="каскадная рассылка (DISPATCH_CASCADE_ENABLED)")
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора случайных чисел")
+    parser.add_argument("--verbose", action="store_true", help="не глушить логи и print сервисов")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.cascade:
+        settings.dispatch_cascade_enabled = True
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    simulation = DispatchSimulation(args)
+    loop = VirtualClockLoop()
+    asyncio.set_event_loop(loop)
+    try:
+        # Сервисы пишут print() на каждое сообщение — в отчёт это не нужно
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            loop.run_until_complete(simulation.run())
+    finally:
+        loop.close()
+
+    logging.disable(logging.NOTSET)
+    print(simulation.report())
+
+
+if __name__ == "__main__":
+    main()